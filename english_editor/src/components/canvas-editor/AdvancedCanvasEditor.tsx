@@ -494,7 +494,7 @@ export default function AdvancedCanvasEditor({
         if (background.startsWith('#') || background.startsWith('rgb')) {
           ctx.fillStyle = background;
           ctx.fillRect(0, 0, canvasWidth, canvasHeight);
-        } else if (background.startsWith('data:') || background.startsWith('http')) {
+        } else if (background.startsWith('data:') || background.startsWith('http') || background.startsWith('/')) {
           // Load background image
           const bgImg = new Image();
           bgImg.crossOrigin = 'anonymous';
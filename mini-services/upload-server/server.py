@@ -0,0 +1,546 @@
+"""Serve uploads and post PDFs with sendfile, strong ETags and byte ranges.
+
+    python mini-services/upload-server/server.py                      # serve on :3004
+    python mini-services/upload-server/server.py serve --port 3004 --db prisma/dev.db
+    python mini-services/upload-server/server.py precompress          # write .gz (and .br) variants
+    python mini-services/upload-server/server.py bench --url http://127.0.0.1:3004/uploads/post-1.pdf
+
+A sidecar for the routes that only stream files: ``/uploads/*`` (the
+public upload directory, post PDFs included) and
+``/api/file-manager/download/[id]`` and ``/api/file-manager/preview/[id]``,
+which the Next.js handlers answer by reading the whole file into memory.
+The Caddyfile sends those paths here first and falls back to Next.js while
+the sidecar is down, so it can be started and stopped at any time.
+
+Bodies go out with ``loop.sendfile`` (``sendfile(2)`` on a plain socket).
+ETags are the SHA-256 of the content, taken from the ``tools.upload_store``
+index when the file is unchanged since it was hashed there and computed
+once per inode, size and mtime otherwise, so a PDF rewritten in place gets a
+new tag.  ``If-None-Match`` answers 304, ``Range`` (one range, with
+``If-Range``) answers 206.  ``precompress`` stores gzip (and, with the
+``brotli`` package, Brotli) copies of compressible files next to the upload
+store's blobs, keyed by content hash; they are served to clients that accept
+them.  ``File`` rows are read on a small pool of threads, each with its own
+read-only SQLite connection, and so is hashing.  ``bench`` reports latency
+percentiles for concurrent keep-alive clients.
+"""
+
+import argparse
+import asyncio
+import email.utils
+import gzip
+import mimetypes
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import quote, unquote, urlsplit
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, REPO_ROOT)
+
+from tools.db import connect  # noqa: E402
+from tools.gc_uploads import UPLOAD_DIR, walk_sorted  # noqa: E402
+from tools.pdf_render import PUBLIC_DIR  # noqa: E402
+from tools.upload_store import BLOB_DIR, file_sha256, managed_dirs  # noqa: E402
+
+try:
+    import brotli
+except ImportError:  # brotli is optional: only gzip variants without it.
+    brotli = None
+
+
+DEFAULT_PORT = int(os.environ.get('PORT') or 3004)
+DEFAULT_POOL = 4
+PUBLIC_UPLOADS = os.path.join(PUBLIC_DIR, 'uploads')
+# Next.js sends this for the file-manager routes; /uploads is revalidated.
+API_CACHE_CONTROL = 'public, max-age=3600'
+STATIC_CACHE_CONTROL = 'public, max-age=0, must-revalidate'
+HEAD_LIMIT = 16 << 10
+KEEPALIVE_TIMEOUT = 15.0
+HASH_CACHE_SIZE = 4096
+# Encodings in order of preference, with the suffix of their stored copies.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+COMPRESSIBLE = re.compile(r'^(text/|application/(json|javascript|xml|pdf)|image/svg\+xml)')
+# A variant is kept only if it saves at least this share of the original.
+MIN_SAVING = 0.1
+
+_ROUTE = re.compile(r'^/api/file-manager/(download|preview)/([^/]+)$')
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+_REASONS = {200: 'OK', 206: 'Partial Content', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+            405: 'Method Not Allowed', 412: 'Precondition Failed', 416: 'Range Not Satisfiable',
+            500: 'Internal Server Error'}
+
+
+@dataclass
+class Target:
+    path: str
+    root: str
+    content_type: str
+    cache_control: str
+    # Set for downloads: sent as ``Content-Disposition: attachment``.
+    filename: Optional[str] = None
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, headers: Optional[Dict[str, str]] = None):
+        super().__init__(status)
+        self.status = status
+        self.headers = headers or {}
+
+
+# --- content hashes -------------------------------------------------------------
+
+class Hashes:
+    """SHA-256 per ``(device, inode, size, mtime)``, from the upload store index or computed once."""
+
+    def __init__(self, size: int = HASH_CACHE_SIZE):
+        self.size = size
+        self._cache: 'OrderedDict[tuple, str]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _index(self, root: str) -> Optional[sqlite3.Connection]:
+        indexes = self._local.__dict__.setdefault('indexes', {})
+        if root not in indexes:
+            path = os.path.join(root, BLOB_DIR, 'index.db')
+            conn = None
+            if os.path.exists(path):
+                conn = sqlite3.connect(f'file:{quote(path)}?mode=ro', uri=True, timeout=5)
+            indexes[root] = conn
+        return indexes[root]
+
+    def get(self, path: str, root: str, st: os.stat_result) -> str:
+        """Blocking; called on the worker pool."""
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            digest = self._cache.get(key)
+            if digest is not None:
+                self._cache.move_to_end(key)
+                return digest
+        digest = self._indexed(path, root, st) or file_sha256(path)
+        with self._lock:
+            self._cache[key] = digest
+            if len(self._cache) > self.size:
+                self._cache.popitem(last=False)
+        return digest
+
+    def _indexed(self, path: str, root: str, st: os.stat_result) -> Optional[str]:
+        conn = self._index(root)
+        if conn is None:
+            return None
+        try:
+            row = conn.execute('SELECT hash, ino, size, mtime_ns FROM links WHERE path = ?',
+                               (os.path.relpath(path, root).replace(os.sep, '/'),)).fetchone()
+        except sqlite3.Error:
+            return None
+        if row and tuple(row[1:]) == (st.st_ino, st.st_size, st.st_mtime_ns):
+            return row[0]
+        return None
+
+
+def variant_path(root: str, digest: str, suffix: str) -> str:
+    return os.path.join(root, BLOB_DIR, digest[:2], digest + suffix)
+
+
+# --- requests --------------------------------------------------------------------
+
+class FileServer:
+    def __init__(self, db: Optional[str] = None, pool: int = DEFAULT_POOL, upload_dir: str = UPLOAD_DIR,
+                 public_uploads: str = PUBLIC_UPLOADS, log=None):
+        self.db = db
+        self.upload_dir = upload_dir
+        self.public_uploads = public_uploads
+        self.executor = ThreadPoolExecutor(max_workers=pool, thread_name_prefix='upload-server')
+        self.hashes = Hashes()
+        self.log = log
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        # One read-only connection per pool thread.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = connect(self.db, readonly=True)
+        return conn
+
+    def _file_row(self, file_id: str) -> Optional[sqlite3.Row]:
+        return self._conn().execute('SELECT path, mimeType, originalName FROM File WHERE id = ?',
+                                    (file_id,)).fetchone()
+
+    async def resolve(self, path: str) -> Target:
+        loop = asyncio.get_running_loop()
+        m = _ROUTE.match(path)
+        if m:
+            row = await loop.run_in_executor(self.executor, self._file_row, unquote(m.group(2)))
+            if row is None:
+                raise HttpError(404)
+            full = _inside(self.upload_dir, row['path'])
+            return Target(full, self.upload_dir, row['mimeType'] or 'application/octet-stream', API_CACHE_CONTROL,
+                          row['originalName'] if m.group(1) == 'download' else None)
+        if path.startswith('/uploads/'):
+            rel = unquote(path[len('/uploads/'):])
+            # Dot entries are the stores' own files (index.db, blobs), never uploads.
+            if any(part.startswith('.') for part in rel.split('/')):
+                raise HttpError(404)
+            full = _inside(self.public_uploads, rel)
+            return Target(full, self.public_uploads, mimetypes.guess_type(full)[0] or 'application/octet-stream',
+                          STATIC_CACHE_CONTROL)
+        raise HttpError(404)
+
+    async def respond(self, method: str, path: str, headers: Dict[str, str], writer: asyncio.StreamWriter) -> int:
+        """Write the response; returns its status."""
+        if method not in ('GET', 'HEAD'):
+            raise HttpError(405, {'Allow': 'GET, HEAD'})
+        target = await self.resolve(path)
+        try:
+            f = open(target.path, 'rb')
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+            raise HttpError(404) from None
+        with f:
+            st = os.fstat(f.fileno())
+            loop = asyncio.get_running_loop()
+            digest = await loop.run_in_executor(self.executor, self.hashes.get, target.path, target.root, st)
+            out = {'Content-Type': target.content_type, 'Cache-Control': target.cache_control,
+                   'Last-Modified': email.utils.formatdate(st.st_mtime, usegmt=True), 'Accept-Ranges': 'bytes'}
+            if target.filename is not None:
+                out['Content-Disposition'] = _attachment(target.filename)
+
+            body, size, etag = f, st.st_size, f'"{digest}"'
+            if COMPRESSIBLE.match(target.content_type):
+                out['Vary'] = 'Accept-Encoding'
+                # Range requests (PDF viewers fetching pages) get the identity bytes.
+                accepted = [] if 'range' in headers else _accepted(headers.get('accept-encoding', ''))
+                for encoding, suffix in accepted:
+                    try:
+                        body = open(variant_path(target.root, digest, suffix), 'rb')
+                    except OSError:
+                        continue
+                    size = os.fstat(body.fileno()).st_size
+                    etag = f'"{digest}-{suffix[1:]}"'
+                    out['Content-Encoding'] = encoding
+                    break
+            try:
+                out['ETag'] = etag
+                if _not_modified(headers, etag, st.st_mtime):
+                    await self._send(writer, 304, {k: v for k, v in out.items() if k != 'Content-Type'})
+                    return 304
+                status, offset, count = 200, 0, size
+                ranged = _range(headers, etag, st.st_mtime, size) if method == 'GET' else None
+                if ranged is not None:
+                    status, offset, count = 206, ranged[0], ranged[1] - ranged[0]
+                    out['Content-Range'] = f'bytes {ranged[0]}-{ranged[1] - 1}/{size}'
+                out['Content-Length'] = str(count)
+                await self._send(writer, status, out)
+                if method == 'GET' and count:
+                    await loop.sendfile(writer.transport, body, offset, count)
+                return status
+            finally:
+                if body is not f:
+                    body.close()
+
+    async def _send(self, writer: asyncio.StreamWriter, status: int, headers: Dict[str, str]) -> None:
+        head = [f'HTTP/1.1 {status} {_REASONS[status]}',
+                f'Date: {email.utils.formatdate(usegmt=True)}', 'Server: upload-server']
+        head += [f'{k}: {v}' for k, v in headers.items()]
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1', 'replace'))
+        await writer.drain()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    raw = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    return
+                except asyncio.LimitOverrunError:
+                    await self._send(writer, 400, {'Content-Length': '0', 'Connection': 'close'})
+                    return
+                started = time.perf_counter()
+                try:
+                    method, target, version, headers = _parse_head(raw)
+                except ValueError:
+                    await self._send(writer, 400, {'Content-Length': '0', 'Connection': 'close'})
+                    return
+                keep_alive = (headers.get('connection', '').lower() != 'close'
+                              if version == 'HTTP/1.1' else headers.get('connection', '').lower() == 'keep-alive')
+                length = headers.get('content-length', '0')
+                if 'transfer-encoding' in headers or not length.isdigit() or int(length) > HEAD_LIMIT:
+                    await self._send(writer, 400, {'Content-Length': '0', 'Connection': 'close'})
+                    return
+                if int(length):
+                    await reader.readexactly(int(length))
+                path = urlsplit(target).path
+                try:
+                    status = await self.respond(method, path, headers, writer)
+                except HttpError as e:
+                    status = e.status
+                    await self._send(writer, status, {**e.headers, 'Content-Length': '0'})
+                except (ConnectionError, asyncio.CancelledError):
+                    raise
+                except Exception as e:  # noqa: BLE001 - one bad file must not stop the server
+                    print(f'{method} {path}: {e!r}', file=sys.stderr)
+                    status = 500
+                    await self._send(writer, status, {'Content-Length': '0', 'Connection': 'close'})
+                    return
+                if self.log:
+                    self.log(f'{method} {path} {status} {(time.perf_counter() - started) * 1e3:.1f} ms')
+                if not keep_alive:
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
+
+
+def _inside(root: str, rel: str) -> str:
+    full = os.path.abspath(os.path.join(root, rel))
+    if os.path.commonpath([full, os.path.abspath(root)]) != os.path.abspath(root):
+        raise HttpError(404)
+    return full
+
+
+def _parse_head(raw: bytes) -> Tuple[str, str, str, Dict[str, str]]:
+    lines = raw.decode('latin-1').split('\r\n')
+    method, target, version = lines[0].split(' ')
+    if not version.startswith('HTTP/1.'):
+        raise ValueError(version)
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, colon, value = line.partition(':')
+        if not colon or not name or name != name.strip():
+            raise ValueError(line)
+        name = name.lower()
+        value = value.strip()
+        headers[name] = f'{headers[name]}, {value}' if name in headers else value
+    return method, target, version, headers
+
+
+def _attachment(filename: str) -> str:
+    fallback = filename.encode('ascii', 'replace').decode().replace('"', "'").replace('\\', '_')
+    return f'attachment; filename="{fallback}"; filename*=UTF-8\'\'{quote(filename)}'
+
+
+def _accepted(header: str) -> List[Tuple[str, str]]:
+    """Stored encodings the client accepts, best first."""
+    accepted = {}
+    for part in header.split(','):
+        name, *params = [p.strip() for p in part.split(';')]
+        q = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        accepted[name.lower()] = q
+    return [(encoding, suffix) for encoding, suffix in ENCODINGS
+            if accepted.get(encoding, accepted.get('*', 0.0)) > 0]
+
+
+def _etags(header: str) -> List[str]:
+    return [tag.strip().removeprefix('W/') for tag in header.split(',') if tag.strip()]
+
+
+def _not_modified(headers: Dict[str, str], etag: str, mtime: float) -> bool:
+    if 'if-none-match' in headers:
+        tags = _etags(headers['if-none-match'])
+        return '*' in tags or etag in tags
+    since = headers.get('if-modified-since')
+    if since:
+        try:
+            return int(mtime) <= email.utils.parsedate_to_datetime(since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _range(headers: Dict[str, str], etag: str, mtime: float, size: int) -> Optional[Tuple[int, int]]:
+    """``(start, end)`` of a satisfiable single range, None to send everything."""
+    header = headers.get('range')
+    if not header:
+        return None
+    if_range = headers.get('if-range')
+    if if_range:
+        if if_range.startswith(('"', 'W/')):
+            if if_range != etag:   # strong comparison
+                return None
+        else:
+            try:
+                if email.utils.parsedate_to_datetime(if_range).timestamp() != int(mtime):
+                    return None
+            except (TypeError, ValueError):
+                return None
+    m = _RANGE.match(header.replace(' ', ''))
+    if not m or m.group(1) == m.group(2) == '':
+        return None   # several ranges or another unit: the whole representation is allowed
+    if m.group(1) == '':
+        start, end = max(size - int(m.group(2)), 0), size
+    else:
+        start = int(m.group(1))
+        end = min(int(m.group(2)) + 1, size) if m.group(2) else size
+    if start >= size or start >= end:
+        raise HttpError(416, {'Content-Range': f'bytes */{size}'})
+    return start, end
+
+
+async def serve(host: str, port: int, server: FileServer) -> None:
+    listener = await asyncio.start_server(server.handle, host, port, limit=HEAD_LIMIT, reuse_address=True)
+    addresses = ', '.join(f'{s.getsockname()[0]}:{s.getsockname()[1]}' for s in listener.sockets)
+    print(f'serving {os.path.relpath(server.public_uploads)} and {os.path.relpath(server.upload_dir)} on {addresses}',
+          flush=True)
+    async with listener:
+        await listener.serve_forever()
+
+
+# --- precompressed variants ----------------------------------------------------------
+
+def precompress(root: str, prune: bool = True, log=print) -> Tuple[int, int, int]:
+    """Write missing variants of the compressible files under ``root``; returns written, kept, pruned."""
+    hashes = Hashes()
+    wanted = set()
+    written = kept = 0
+    skip = [os.path.join(root, BLOB_DIR), *managed_dirs(root)]
+    for rel, st in walk_sorted(root, skip):
+        path = os.path.join(root, rel)
+        content_type = mimetypes.guess_type(path)[0] or ''
+        if not COMPRESSIBLE.match(content_type) or any(p.startswith('.') for p in rel.split('/')):
+            continue
+        digest = hashes.get(path, root, os.stat(path))
+        for encoding, suffix in ENCODINGS:
+            if encoding == 'br' and brotli is None:
+                continue
+            target = variant_path(root, digest, suffix)
+            wanted.add(target)
+            if os.path.exists(target):
+                kept += 1
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            packed = brotli.compress(data) if encoding == 'br' else gzip.compress(data, 9, mtime=0)
+            if len(packed) > len(data) * (1 - MIN_SAVING):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp = f'{target}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(packed)
+            os.replace(tmp, target)
+            written += 1
+            log(f'{rel}  {encoding}: {len(data):,} -> {len(packed):,} bytes')
+    pruned = 0
+    if prune:
+        for rel, _ in walk_sorted(os.path.join(root, BLOB_DIR)):
+            path = os.path.join(root, BLOB_DIR, rel)
+            if path.endswith(tuple(suffix for _, suffix in ENCODINGS)) and path not in wanted:
+                os.unlink(path)
+                pruned += 1
+    return written, kept, pruned
+
+
+# --- load test ------------------------------------------------------------------------
+
+async def bench(url: str, concurrency: int, requests: int, headers: Dict[str, str]) -> List[float]:
+    """Latency in ms of ``requests`` GETs over ``concurrency`` keep-alive connections."""
+    parts = urlsplit(url)
+    path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+    extra = ''.join(f'{k}: {v}\r\n' for k, v in headers.items())
+    request = f'GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\n{extra}\r\n'.encode()
+    remaining = [requests]
+    latencies: List[float] = []
+
+    async def client() -> None:
+        reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80, limit=HEAD_LIMIT)
+        try:
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                started = time.perf_counter()
+                writer.write(request)
+                head = await reader.readuntil(b'\r\n\r\n')
+                length = re.search(rb'(?i)\r\ncontent-length:\s*(\d+)', head)
+                status = int(head.split(b' ', 2)[1])
+                if length and status != 304:
+                    await reader.readexactly(int(length.group(1)))
+                latencies.append((time.perf_counter() - started) * 1e3)
+        finally:
+            writer.close()
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies
+
+
+def percentile(values: Sequence[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', nargs='?', default='serve', choices=('serve', 'precompress', 'bench'))
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='port to listen on (default: $PORT or 3004)')
+    parser.add_argument('--db', help='SQLite database with the File table')
+    parser.add_argument('--pool', type=int, default=DEFAULT_POOL, help='threads (and read-only connections)')
+    parser.add_argument('--uploads', default=UPLOAD_DIR, help='file-manager upload directory')
+    parser.add_argument('--public-uploads', default=PUBLIC_UPLOADS, help='directory served at /uploads')
+    parser.add_argument('--log', action='store_true', help='log every request')
+    parser.add_argument('--no-prune', action='store_true', help='precompress: keep variants of replaced files')
+    parser.add_argument('--url', help='bench: URL to fetch')
+    parser.add_argument('--concurrency', type=int, default=32, help='bench: connections')
+    parser.add_argument('--requests', type=int, default=2000, help='bench: requests in total')
+    parser.add_argument('--header', action='append', default=[], help='bench: extra "Name: value" header')
+    args = parser.parse_args(argv)
+
+    if args.command == 'precompress':
+        for root in dict.fromkeys((args.public_uploads, args.uploads)):
+            if os.path.isdir(root):
+                written, kept, pruned = precompress(root, not args.no_prune)
+                print(f'{os.path.relpath(root)}: {written} variants written, {kept} up to date, {pruned} pruned')
+        return 0
+
+    if args.command == 'bench':
+        if not args.url:
+            print('bench needs --url', file=sys.stderr)
+            return 1
+        headers = dict(h.split(':', 1) for h in args.header)
+        started = time.perf_counter()
+        try:
+            latencies = asyncio.run(bench(args.url, args.concurrency, args.requests,
+                                          {k.strip(): v.strip() for k, v in headers.items()}))
+        except OSError as e:
+            print(e, file=sys.stderr)
+            return 1
+        elapsed = time.perf_counter() - started
+        print(f'{len(latencies)} requests over {args.concurrency} connections in {elapsed:.2f}s '
+              f'({len(latencies) / elapsed:.0f}/s): p50 {percentile(latencies, 50):.1f} ms, '
+              f'p90 {percentile(latencies, 90):.1f} ms, p99 {percentile(latencies, 99):.1f} ms, '
+              f'max {max(latencies):.1f} ms')
+        return 0
+
+    try:
+        connect(args.db, readonly=True).close()
+    except (FileNotFoundError, sqlite3.Error) as e:
+        print(e, file=sys.stderr)
+        return 1
+    log = (lambda msg: print(msg, flush=True)) if args.log else None
+    server = FileServer(args.db, args.pool, args.uploads, args.public_uploads, log)
+    try:
+        asyncio.run(serve(args.host, args.port, server))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -143,7 +143,7 @@ const AdvancedCanvasEditor = forwardRef<AdvancedCanvasEditorRef, AdvancedCanvasE
             if (background.startsWith('#') || background.startsWith('rgb')) {
               ctx.fillStyle = background;
               ctx.fillRect(0, 0, canvasWidth, canvasHeight);
-            } else if (background.startsWith('data:') || background.startsWith('http')) {
+            } else if (background.startsWith('data:') || background.startsWith('http') || background.startsWith('/')) {
               const bgImg = new Image();
               bgImg.crossOrigin = 'anonymous';
               bgImg.src = background;
@@ -777,7 +777,7 @@ const AdvancedCanvasEditor = forwardRef<AdvancedCanvasEditorRef, AdvancedCanvasE
         if (background.startsWith('#') || background.startsWith('rgb')) {
           ctx.fillStyle = background;
           ctx.fillRect(0, 0, canvasWidth, canvasHeight);
-        } else if (background.startsWith('data:') || background.startsWith('http')) {
+        } else if (background.startsWith('data:') || background.startsWith('http') || background.startsWith('/')) {
           // Load background image
           const bgImg = new Image();
           bgImg.crossOrigin = 'anonymous';
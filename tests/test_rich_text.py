@@ -0,0 +1,73 @@
+import random
+import sqlite3
+
+import pytest
+
+from tools.rich_text import SAMPLES, Run, check, html_to_text, iter_post_texts, parse_html, regex_chain_text
+
+
+# Fragments the editors write, combined at random into further documents.
+_FRAGMENTS = (
+    'text', ' ', '  ', 'a < b', '>', '<', '&amp;', '\n', '<br>', '<br/>', '<BR />', '<div>', '</div>',
+    '<div><br></div>', '</div><div>', '<p>', '<p class="x">', '</p>', '<b>', '</b>', '<strong>', '</strong>',
+    '<i>', '</i>', '<em>', '</em>', '<u>', '</u>', '<span style="font-weight: bold;">',
+    '<span style="font-style: italic">', '<span style="text-decoration: underline">', '</span>',
+    '<font color="#ff0000">', '</font>', '<div class="a">', '</div >',
+)
+
+
+def _runs(html):
+    return [[(run.text, run.bold, run.italic, run.underline) for run in p.runs] for p in parse_html(html)]
+
+
+@pytest.mark.parametrize('html', SAMPLES)
+def test_samples_match_regex_chain(html):
+    assert html_to_text(html) == regex_chain_text(html)
+
+
+def test_post_corpus_matches_regex_chain():
+    try:
+        corpus = list(iter_post_texts())
+    except (FileNotFoundError, sqlite3.Error) as e:
+        pytest.skip(f'no Post table: {e}')
+    if not corpus:
+        pytest.skip('no text elements stored')
+    assert check(corpus) == []
+
+
+def test_generated_corpus_matches_regex_chain():
+    rng = random.Random(0)
+    corpus = [(str(i), ''.join(rng.choice(_FRAGMENTS) for _ in range(rng.randint(0, 20))))
+              for i in range(2000)]
+    assert check(corpus) == []
+
+
+def test_nested_bold_italic_underline():
+    assert _runs('<b>bold <i>bold italic <u>all three</u></i></b> plain') == [[
+        ('bold ', True, False, False),
+        ('bold italic ', True, True, False),
+        ('all three', True, True, True),
+        (' plain', False, False, False),
+    ]]
+
+
+def test_css_styles():
+    assert _runs('<span style="font-weight: 700">b</span><span style="font-style:oblique">i</span>'
+                 '<span style="text-decoration-line: underline">u</span>') == [[
+        ('b', True, False, False),
+        ('i', False, True, False),
+        ('u', False, False, True),
+    ]]
+
+
+def test_styles_carry_across_line_breaks():
+    # An opening <div> is not a break, as in the export; the closing one is.
+    assert _runs('<strong>one<br>two</strong><div><em>three</em></div><div>four</div>') == [
+        [('one', True, False, False)],
+        [('two', True, False, False), ('three', False, True, False)],
+        [('four', False, False, False)],
+    ]
+
+
+def test_plain_text_is_one_unstyled_run():
+    assert parse_html('just text')[0].runs == (Run('just text'),)
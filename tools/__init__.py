@@ -0,0 +1 @@
+"""Maintenance tooling for the admin site (patch scripts, renderers, DB jobs)."""
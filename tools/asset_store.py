@@ -0,0 +1,80 @@
+"""Content-addressed asset files under ``public/uploads``.
+
+Each blob is stored once as ``<root>/<aa>/<sha256><ext>`` and served at the
+matching URL, so writing the same bytes twice costs one hash and a stat.
+"""
+
+import hashlib
+import os
+import tempfile
+from typing import Optional
+
+from tools.pdf_render import PUBLIC_DIR
+
+
+ASSET_DIR = os.path.join(PUBLIC_DIR, 'uploads', 'assets')
+ASSET_URL = '/uploads/assets'
+
+MIME_EXTENSIONS = {
+    'image/png': '.png',
+    'image/jpeg': '.jpg',
+    'image/jpg': '.jpg',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+    'image/svg+xml': '.svg',
+    'image/bmp': '.bmp',
+    'image/avif': '.avif',
+    'application/pdf': '.pdf',
+}
+
+# Files under public/ must be readable by a web server running as another
+# user; mkstemp creates 0600, so stored files get 0644 less the umask.
+_umask = os.umask(0o022)
+os.umask(_umask)
+FILE_MODE = 0o644 & ~_umask
+
+
+def write_atomic(path: str, data: bytes, mode: Optional[int] = None) -> None:
+    """Write ``data`` to ``path`` via a temp file in the same directory.
+
+    ``mode`` sets the permissions of the result (mkstemp creates 0600).
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if mode is not None:
+            os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def extension_for(mime: str) -> str:
+    return MIME_EXTENSIONS.get(mime.lower(), '.bin')
+
+
+class AssetStore:
+    def __init__(self, root: str = ASSET_DIR, url_prefix: str = ASSET_URL):
+        self.root = root
+        self.url_prefix = url_prefix
+
+    def url_for(self, digest: str, ext: str) -> str:
+        return f'{self.url_prefix}/{digest[:2]}/{digest}{ext}'
+
+    def path_for(self, digest: str, ext: str) -> str:
+        return os.path.join(self.root, digest[:2], digest + ext)
+
+    def put(self, data: bytes, ext: str, dry_run: bool = False) -> str:
+        """Store ``data`` (if not already present) and return its URL."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(digest, ext)
+        if not dry_run and not os.path.exists(path):
+            write_atomic(path, data, FILE_MODE)
+        return self.url_for(digest, ext)
+
@@ -0,0 +1,119 @@
+"""Compare JSON and the binary canvas encoding on the stored posts.
+
+    python -m tools.bench_canvas
+    python -m tools.bench_canvas --db /app/prisma/dev.db --repeat 5 --json results.json
+
+Every ``Post.canvasData`` is encoded in each format: JSON as stored, JSON
+deflated, and ``tools.canvas_codec`` without a frame, with zlib and (when
+``zstandard`` is installed) with zstd.  For each format the total encoded
+size, the time to decode every post (best of ``--repeat``) and the peak
+traced memory of decoding the largest post are reported.
+"""
+
+import argparse
+import json
+import sqlite3
+import sys
+import time
+import tracemalloc
+import zlib
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from tools.canvas_codec import decode, encode, zstandard
+from tools.db import connect
+
+
+Format = Tuple[str, Callable[[str], bytes], Callable[[bytes], object]]
+
+FORMATS: List[Format] = [
+    ('json', lambda text: text.encode('utf-8'), lambda data: json.loads(data)),
+    ('json+zlib', lambda text: zlib.compress(text.encode('utf-8'), 9),
+     lambda data: json.loads(zlib.decompress(data))),
+    ('binary', lambda text: encode(text, 'none'), decode),
+    ('binary+zlib', lambda text: encode(text, 'zlib'), decode),
+]
+if zstandard is not None:
+    FORMATS.append(('binary+zstd', lambda text: encode(text, 'zstd'), decode))
+
+
+def load_corpus(db: Optional[str] = None) -> List[str]:
+    """Every ``canvasData`` that parses as JSON."""
+    conn = connect(db, readonly=True)
+    try:
+        texts = [row[0] for row in conn.execute(
+            "SELECT canvasData FROM Post WHERE canvasData IS NOT NULL AND canvasData != ''")]
+    finally:
+        conn.close()
+    corpus = []
+    for text in texts:
+        try:
+            json.loads(text)
+        except ValueError:
+            continue
+        corpus.append(text)
+    return corpus
+
+
+def measure(corpus: Sequence[str], fmt: Format, repeat: int) -> Dict[str, float]:
+    _, enc, dec = fmt
+    started = time.perf_counter()
+    encoded = [enc(text) for text in corpus]
+    encode_seconds = time.perf_counter() - started
+
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for data in encoded:
+            dec(data)
+        best = min(best, time.perf_counter() - started)
+
+    largest = max(range(len(corpus)), key=lambda i: len(corpus[i]))
+    tracemalloc.start()
+    dec(encoded[largest])
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'bytes': sum(len(data) for data in encoded),
+        'encode_seconds': encode_seconds,
+        'decode_seconds': best,
+        'peak_bytes': peak,
+    }
+
+
+def run(corpus: Sequence[str], repeat: int = 3) -> Dict[str, Dict[str, float]]:
+    return {fmt[0]: measure(corpus, fmt, repeat) for fmt in FORMATS}
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help='SQLite database holding the Post table')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', metavar='PATH', help='also write the results as JSON')
+    args = parser.parse_args(argv)
+
+    try:
+        corpus = load_corpus(args.db)
+    except (FileNotFoundError, sqlite3.Error) as e:
+        print(f'Cannot read posts: {e}', file=sys.stderr)
+        return 1
+    if not corpus:
+        print('No posts with canvasData', file=sys.stderr)
+        return 1
+
+    results = run(corpus, args.repeat)
+    base = results['json']
+    print(f'{len(corpus)} posts')
+    print(f"{'format':<12} {'bytes':>14} {'size':>7} {'decode ms':>10} {'per post us':>12} {'peak KB':>9}")
+    for name, r in results.items():
+        print(f"{name:<12} {r['bytes']:>14,} {r['bytes'] / base['bytes']:>7.1%} "
+              f"{r['decode_seconds'] * 1e3:>10.1f} {r['decode_seconds'] / len(corpus) * 1e6:>12.1f} "
+              f"{r['peak_bytes'] / 1024:>9.1f}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'posts': len(corpus), 'results': results}, f, indent=2)
+            f.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
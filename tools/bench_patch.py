@@ -0,0 +1,302 @@
+"""Benchmarks for the patch tooling on synthetic editor components.
+
+    python -m tools.bench_patch                      # compare with the baseline
+    python -m tools.bench_patch --write-baseline     # record a new baseline
+    python -m tools.bench_patch --sizes 2000 20000 --threshold 0.5
+
+Components shaped like ``AdvancedCanvasEditor.tsx`` and
+``SimplePostEditor.tsx`` are generated at each size (in lines).  Every edit
+of every patch set, and each whole set, is timed on them; wall time (best of
+``--repeat``), peak traced memory and characters copied are recorded.  The
+run fails when peak memory or characters copied exceed the baseline by more
+than the threshold.  Seconds depend on the machine, so time is compared as a
+ratio to a reference pass over the same input timed in the same run, and a
+slower ratio is only reported as a warning.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from tools.patch_engine import PatchSet, apply_patch
+from tools.patch_sets import ADVANCED_EDITOR, ADVANCED_EDITOR_FIX, SIMPLE_EDITOR
+
+
+DEFAULT_SIZES = (2000, 20000, 200000)
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_patch_baseline.json')
+DEFAULT_THRESHOLD = 0.25
+# Metrics that fail the run; time ratios only warn.
+GATED_METRICS = ('peak_bytes', 'chars_copied')
+# From this size on only whole patch sets are timed, once each; per-edit runs
+# under tracemalloc would take minutes.
+LARGE_SIZE = 100000
+
+
+_ADVANCED_HEADER = """'use client';
+
+import React, { useState, useRef, useEffect } from 'react';
+import { Button } from '@/components/ui/button';
+import { jsPDF } from 'jspdf';
+
+interface CanvasElement {
+  id: string;
+  type: 'text' | 'rectangle' | 'circle' | 'image' | 'triangle' | 'hexagon' | 'star';
+  x: number;
+  y: number;
+  width: number;
+  height: number;
+  text?: string;
+  backgroundColor?: string;
+  opacity?: number;
+  zIndex?: number;
+}
+
+interface AdvancedCanvasEditorProps {
+  initialData?: CanvasElement[];
+  background?: string;
+  onSave?: (elements: CanvasElement[], background: string) => void;
+}
+
+export default function AdvancedCanvasEditor({
+  initialData = [],
+  background: initialBackground = '',
+  onSave
+}: AdvancedCanvasEditorProps) {
+  const [elements, setElements] = useState<CanvasElement[]>(initialData);
+  const [background, setBackground] = useState(initialBackground);
+  const [canvasWidth, setCanvasWidth] = useState(794);
+  const [canvasHeight, setCanvasHeight] = useState(1123);
+  const colorInputRef = useRef<HTMLInputElement | null>(null);
+"""
+
+_HOOK = """  const [value{k}, setValue{k}] = useState<number>({k});
+  const ref{k} = useRef<HTMLDivElement>(null);
+  useEffect(() => {{
+    if (ref{k}.current) ref{k}.current.dataset.k = `${{value{k}}}-{{}}`;
+  }}, [value{k}]);
+"""
+
+_EXPORT = """  const handleExportToPDF{k} = async () => {{
+    const pdf = new jsPDF({{ unit: 'px', format: [canvasWidth, canvasHeight] }});
+    // Export pass {k}: braces in strings '{{' and comments }} must not confuse scanners
+    for (const element of elements) {{
+      if (element.type === 'text') {{
+        const clean = (element.text || '')
+          .replace(/<br\\s*\\/?>/gi, '\\n')
+          .replace(/<[^>]*>/g, '');
+        const lines = clean.split('\\n');
+        lines.forEach((line, index) => {{
+          pdf.text(line, element.x + 8, element.y + 16 + index * 19.2);
+        }});
+        continue;
+      }}
+      const canvas = document.createElement('canvas');
+      canvas.width = canvasWidth;
+      canvas.height = canvasHeight;
+      const ctx = canvas.getContext('2d');
+      if (!ctx) continue;
+      ctx.globalAlpha = (element.opacity || 100) / 100;
+      ctx.fillStyle = element.backgroundColor || '#3b82f6';
+      ctx.fillRect(element.x, element.y, element.width, element.height);
+      pdf.addImage(canvas.toDataURL('image/png'), 'PNG', 0, 0, canvasWidth, canvasHeight);
+    }}
+    return pdf.output('blob');
+  }};
+
+"""
+
+_JSX_ROW = """        <div key="row-{k}" className="flex items-center gap-2" title={{`row ${{{k}}} > 0`}}>
+          {{elements.length > {k} && <span>{{elements[{k}].id}}</span>}}
+        </div>
+"""
+
+_SIMPLE_HEADER = """'use client';
+
+import { useState, useEffect } from 'react';
+import { Button } from '@/components/ui/button';
+import AdvancedCanvasEditor from './AdvancedCanvasEditor';
+
+interface SimplePostEditorProps {
+  post?: any;
+  onSave: (postData: any) => void;
+}
+
+export default function SimplePostEditor({ post, onSave }: SimplePostEditorProps) {
+  const [open, setOpen] = useState(false);
+  const [loading, setLoading] = useState(false);
+  const [canvasElements, setCanvasElements] = useState([]);
+"""
+
+_SIMPLE_TAIL = """  const handleSave = async () => {
+    setLoading(true);
+    try {
+      await onSave({ canvasData: JSON.stringify({ elements: canvasElements }) });
+      setOpen(false);
+    } finally {
+      setLoading(false);
+    }
+  };
+
+  const defaultTrigger = (
+    <Button variant="outline">Open</Button>
+  );
+
+  return (
+    <div>
+      {defaultTrigger}
+      <AdvancedCanvasEditor
+        initialData={canvasElements}
+        onSave={(elements) => setCanvasElements(elements)}
+      />
+      <Button onClick={handleSave} disabled={loading}>Save</Button>
+    </div>
+  );
+}
+"""
+
+
+def _fill(parts: List[str], lines: int, block: str, start: int) -> int:
+    k = start
+    count = sum(p.count('\n') for p in parts)
+    block_lines = block.count('\n')
+    while count + block_lines < lines:
+        parts.append(block.format(k=k))
+        count += block_lines
+        k += 1
+    return count
+
+
+def advanced_component(lines: int) -> str:
+    """A component shaped like AdvancedCanvasEditor.tsx with about ``lines`` lines."""
+    parts = [_ADVANCED_HEADER]
+    # Roughly: 10% hooks, 60% export handlers, the rest JSX.
+    _fill(parts, lines // 10, _HOOK, 0)
+    _fill(parts, lines * 7 // 10, _EXPORT, 0)
+    parts.append('  return (\n    <div className="canvas">\n')
+    _fill(parts, lines - 4, _JSX_ROW, 0)
+    parts.append('    </div>\n  );\n}\n')
+    return ''.join(parts)
+
+
+def simple_component(lines: int) -> str:
+    """A component shaped like SimplePostEditor.tsx with about ``lines`` lines."""
+    parts = [_SIMPLE_HEADER]
+    _fill(parts, lines - _SIMPLE_TAIL.count('\n'), _HOOK, 0)
+    parts.append(_SIMPLE_TAIL)
+    return ''.join(parts)
+
+
+def _reference(text: str, repeat: int) -> float:
+    """Best time of one pure-Python pass over ``text``: the unit of ``time_ratio``."""
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        depth = 0
+        for ch in text:
+            if ch == '{':
+                depth += 1
+            elif ch == '}':
+                depth -= 1
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _measure(text: str, patch: PatchSet, edits, repeat: int, reference: float) -> Dict[str, float]:
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = apply_patch(text, edits)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    apply_patch(text, edits)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'seconds': round(best, 6),
+        'time_ratio': round(best / reference, 3),
+        'peak_bytes': peak,
+        'chars_copied': result.copied,
+        'status': result.status,
+    }
+
+
+def run(sizes: Sequence[int] = DEFAULT_SIZES, repeat: int = 3, log=print) -> Dict[str, dict]:
+    results: Dict[str, dict] = {}
+    for size in sizes:
+        sources = {
+            'advanced': advanced_component(size),
+            'simple': simple_component(size),
+        }
+        cases = [
+            ('simple', SIMPLE_EDITOR),
+            ('advanced', ADVANCED_EDITOR),
+            ('advanced', ADVANCED_EDITOR_FIX),
+        ]
+        for source, patch in cases:
+            text = sources[source]
+            reference = _reference(text, max(repeat, 3))
+            ops = [('all', patch.edits)]
+            if size < LARGE_SIZE:
+                ops += [(edit.name, (edit,)) for edit in patch.edits]
+            for op_name, edits in ops:
+                key = f'{size}/{patch.name}/{op_name}'
+                results[key] = _measure(text, patch, edits, repeat if size < LARGE_SIZE else 1, reference)
+                results[key]['input_chars'] = len(text)
+                log(f"{key:<90} {results[key]['seconds'] * 1000:9.1f} ms {results[key]['time_ratio']:7.2f}x "
+                    f"{results[key]['peak_bytes'] / 1e6:8.1f} MB {results[key]['chars_copied']:>11}")
+    return results
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> Tuple[List[str], List[str]]:
+    """``(regressions, warnings)``: gated metrics and time ratios above the threshold."""
+    regressions, warnings = [], []
+    for key, now in results.items():
+        then = baseline.get(key)
+        if then is None:
+            continue
+        for metric in GATED_METRICS + ('time_ratio',):
+            old, new = then.get(metric), now[metric]
+            if old is not None and new > old * (1 + threshold):
+                (regressions if metric in GATED_METRICS else warnings).append(f'{key} {metric}: {old} -> {new}')
+    return regressions, warnings
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed relative regression (0.25 = 25%%)')
+    parser.add_argument('--write-baseline', action='store_true')
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.repeat)
+
+    if args.write_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+        print(f'Baseline written to {args.baseline}')
+        return 0
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions, warnings = compare(results, baseline, args.threshold)
+    for line in warnings:
+        print(f'WARNING {line}')
+    for line in regressions:
+        print(f'REGRESSION {line}')
+    if regressions:
+        return 1
+    print('No regressions against baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,442 @@
+"""Query plans and latency of the API routes' SQL on a scaled copy of the database.
+
+    python -m tools.bench_queries                                   # 100k files
+    python -m tools.bench_queries --files 300000 --folders 3000 --report queries.md
+
+The database (``--db``, default as in ``tools.db``) is copied and the copy
+is filled with synthetic folders, files, posts and email tokens up to the
+requested counts.  Posts reuse the stored ``canvasData`` when there is any,
+so their row size is realistic.  Each query is the statement Prisma sends for
+the matching ``db.*`` call in ``src/app/api``: quoted ``"main"."Table"``
+columns and ``LIMIT ? OFFSET ?``.  Writes are committed one at a time, so
+the journal settings show up in them.
+
+Every query gets its ``EXPLAIN QUERY PLAN`` and p50/p99 latency, first on the
+copy as is and then with each candidate index and each journal setting.
+Queries run ``--runs`` times or until ``--budget`` seconds have passed.
+The report ranks the candidates by the p50 time they save across the read
+queries.  It also shows their cost on writes and gives the ``CREATE INDEX``
+statement with the matching ``@@index`` line for ``schema.prisma``.
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import string
+import sys
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from tools.db import connect, database_path
+
+
+DEFAULT_FILES = 100000
+DEFAULT_FOLDERS = 1000
+DEFAULT_POSTS = 500
+DEFAULT_TOKENS = 1000
+DEFAULT_RUNS = 200
+DEFAULT_BUDGET = 2.0
+# Share of files kept in the root folder (folderId NULL).
+ROOT_SHARE = 0.1
+_YEAR_MS = 365 * 24 * 3600 * 1000
+_MIME_TYPES = (('image/png', 'png'), ('image/jpeg', 'jpg'), ('application/pdf', 'pdf'),
+               ('application/zip', 'zip'), ('text/plain', 'txt'), ('video/mp4', 'mp4'))
+# Stand-in canvas when the source database has no posts.
+_CANVAS = ('{"elements":[' + ','.join(
+    '{"id":"%d","type":"text","x":40,"y":%d,"width":500,"height":60,"text":"Line %d of the sample post",'
+    '"color":"#000000","fontSize":24,"visible":true,"opacity":100,"zIndex":%d}' % (i, 40 + 70 * i, i, i)
+    for i in range(12)) + '],"background":"#ffffff","blurAmount":0}')
+
+
+@dataclass
+class Candidate:
+    name: str
+    table: str
+    columns: Tuple[str, ...]
+
+    @property
+    def index_name(self) -> str:
+        # Prisma's default name for @@index.
+        return f'{self.table}_{"_".join(self.columns)}_idx'
+
+    @property
+    def ddl(self) -> str:
+        cols = ', '.join(f'"{c}"' for c in self.columns)
+        return f'CREATE INDEX "{self.index_name}" ON "{self.table}"({cols});'
+
+    @property
+    def prisma(self) -> str:
+        return f'model {self.table} {{ @@index([{", ".join(self.columns)}]) }}'
+
+
+CANDIDATES = (
+    Candidate('File(folderId, createdAt)', 'File', ('folderId', 'createdAt')),
+    Candidate('File(folderId)', 'File', ('folderId',)),
+    Candidate('File(createdAt)', 'File', ('createdAt',)),
+    Candidate('Post(createdAt)', 'Post', ('createdAt',)),
+    Candidate('Folder(name)', 'Folder', ('name',)),
+    Candidate('Folder(parentId)', 'Folder', ('parentId',)),
+    Candidate('EmailToken(email)', 'EmailToken', ('email',)),
+)
+
+# (label, journal_mode, synchronous)
+JOURNAL_SETTINGS = (
+    ('DELETE, synchronous=FULL', 'DELETE', 'FULL'),
+    ('WAL, synchronous=FULL', 'WAL', 'FULL'),
+    ('WAL, synchronous=NORMAL', 'WAL', 'NORMAL'),
+)
+
+
+@dataclass
+class Context:
+    """Ids the query parameters are drawn from."""
+    rng: random.Random
+    folder_ids: List[str]
+    folder_paths: List[str]
+    file_ids: List[str]
+    post_ids: List[str]
+    tokens: List[Tuple[str, str]]
+    inserted: List[str] = field(default_factory=list)
+
+
+@dataclass
+class Query:
+    name: str
+    route: str
+    sql: str
+    params: Callable[[Context], tuple]
+    write: bool = False
+
+
+@dataclass
+class Measurement:
+    plan: str
+    p50: float
+    p99: float
+    runs: int
+
+
+# -- data --------------------------------------------------------------------
+
+def _cuid(rng: random.Random) -> str:
+    return 'c' + ''.join(rng.choice(string.ascii_lowercase + string.digits) for _ in range(24))
+
+
+def _columns(conn, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+
+
+def copy_database(source: str, target: str) -> None:
+    """Consistent copy through the backup API (the source may be in use)."""
+    src = connect(source, readonly=True)
+    try:
+        dst = sqlite3.connect(target)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+    finally:
+        src.close()
+
+
+def fill(conn, files: int, folders: int, posts: int, tokens: int, seed: int = 0, log=print) -> None:
+    """Add synthetic rows until each table holds the requested count."""
+    rng = random.Random(seed)
+    now = int(time.time() * 1000)
+
+    def missing(table: str, target: int) -> int:
+        return max(target - conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0], 0)
+
+    with conn:
+        new = missing('Folder', folders)
+        existing = [tuple(r) for r in conn.execute('SELECT id, path FROM Folder')]
+        rows = []
+        for i in range(new):
+            parent = rng.choice(existing + [(None, '')] * 4) if existing else (None, '')
+            folder_id = _cuid(rng)
+            name = f'folder-{len(existing) + i}'
+            path = f'{parent[1]}/{name}'.lstrip('/')
+            created = now - rng.randrange(_YEAR_MS)
+            rows.append((folder_id, name, path, parent[0], created, created))
+            existing.append((folder_id, path))
+        conn.executemany('INSERT INTO Folder (id, name, path, parentId, createdAt, updatedAt) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', rows)
+        log(f'Folder: {new} rows added')
+
+        new = missing('File', files)
+        folder_rows = [tuple(r) for r in conn.execute('SELECT id, path FROM Folder')]
+
+        def file_rows():
+            for _ in range(new):
+                file_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+                mime, ext = rng.choice(_MIME_TYPES)
+                folder_id, folder_path = (None, '') if not folder_rows or rng.random() < ROOT_SHARE \
+                    else rng.choice(folder_rows)
+                name = f'{file_id}.{ext}'
+                created = now - rng.randrange(_YEAR_MS)
+                yield (file_id, name, f'upload-{rng.randrange(10 ** 6)}.{ext}', f'{folder_path}/{name}'.lstrip('/'),
+                       rng.randrange(1, 50 << 20), mime, ext, folder_id, created, created)
+
+        conn.executemany('INSERT INTO File (id, name, originalName, path, size, mimeType, extension, folderId, '
+                         'createdAt, updatedAt) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', file_rows())
+        log(f'File: {new} rows added')
+
+        new = missing('Post', posts)
+        templates = [r[0] for r in conn.execute(
+            "SELECT canvasData FROM Post WHERE canvasData IS NOT NULL AND canvasData != '' LIMIT 20")] or [_CANVAS]
+        rows = []
+        for i in range(new):
+            created = now - rng.randrange(_YEAR_MS)
+            rows.append((_cuid(rng), f'Post {i}', rng.choice(templates), rng.random() < 0.5, created, created))
+        conn.executemany('INSERT INTO Post (id, title, canvasData, published, createdAt, updatedAt) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', rows)
+        log(f'Post: {new} rows added')
+
+        new = missing('EmailToken', tokens)
+        rows = []
+        for i in range(new):
+            created = now - rng.randrange(_YEAR_MS)
+            rows.append((_cuid(rng), f'admin{i % 50}@example.com', f'{rng.randrange(10 ** 6):06d}{i}',
+                         created + 15 * 60 * 1000, rng.random() < 0.9, created))
+        conn.executemany('INSERT INTO EmailToken (id, email, token, expiresAt, used, createdAt) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', rows)
+        log(f'EmailToken: {new} rows added')
+    conn.execute('ANALYZE')
+
+
+def context(conn, seed: int = 0) -> Context:
+    return Context(
+        random.Random(seed),
+        [r[0] for r in conn.execute('SELECT id FROM Folder')],
+        [r[0] for r in conn.execute('SELECT path FROM Folder')],
+        [r[0] for r in conn.execute('SELECT id FROM File')],
+        [r[0] for r in conn.execute('SELECT id FROM Post')],
+        [tuple(r) for r in conn.execute('SELECT email, token FROM EmailToken')],
+    )
+
+
+# -- queries -----------------------------------------------------------------
+
+def _select(conn, table: str) -> str:
+    cols = ', '.join(f'"main"."{table}"."{c}"' for c in _columns(conn, table))
+    return f'SELECT {cols} FROM "main"."{table}"'
+
+
+def _insert_file(ctx: Context) -> tuple:
+    # Not from ctx.rng: a context seeded like fill() would replay its File ids.
+    file_id = str(uuid.uuid4())
+    ctx.inserted.append(file_id)
+    now = int(time.time() * 1000)
+    folder = ctx.rng.choice(ctx.folder_ids) if ctx.folder_ids else None
+    return (file_id, f'{file_id}.png', 'upload.png', f'bench/{file_id}.png', 1234, 'image/png', 'png',
+            folder, now, now)
+
+
+def route_queries(conn) -> List[Query]:
+    """The statements behind the ``db.*`` calls of the API routes."""
+    file_cols = ', '.join(f'"{c}"' for c in ('id', 'name', 'originalName', 'path', 'size', 'mimeType',
+                                             'extension', 'folderId', 'createdAt', 'updatedAt'))
+    pick = lambda values: (lambda ctx: ctx.rng.choice(values(ctx)) if values(ctx) else '')  # noqa: E731
+    folder_id, file_id, post_id = pick(lambda c: c.folder_ids), pick(lambda c: c.file_ids), pick(lambda c: c.post_ids)
+    return [
+        Query('file.findMany(folderId)', 'GET /api/file-manager/files?folderId=',
+              f'{_select(conn, "File")} WHERE "main"."File"."folderId" = ? '
+              f'ORDER BY "main"."File"."createdAt" DESC LIMIT ? OFFSET ?',
+              lambda ctx: (folder_id(ctx), -1, 0)),
+        Query('file.findMany(root)', 'GET /api/file-manager/files',
+              f'{_select(conn, "File")} WHERE "main"."File"."folderId" IS NULL '
+              f'ORDER BY "main"."File"."createdAt" DESC LIMIT ? OFFSET ?',
+              lambda ctx: (-1, 0)),
+        Query('file.findUnique(id)', 'GET /api/file-manager/preview/[id]',
+              f'{_select(conn, "File")} WHERE "main"."File"."id" = ? LIMIT ? OFFSET ?',
+              lambda ctx: (file_id(ctx), 1, 0)),
+        Query('file.findMany(id in)', 'DELETE /api/file-manager/files',
+              f'{_select(conn, "File")} WHERE "main"."File"."id" IN (?,?,?,?,?) LIMIT ? OFFSET ?',
+              lambda ctx: tuple(file_id(ctx) for _ in range(5)) + (-1, 0)),
+        Query('folder.findMany', 'GET /api/file-manager/folders',
+              f'{_select(conn, "Folder")} ORDER BY "main"."Folder"."name" ASC LIMIT ? OFFSET ?',
+              lambda ctx: (-1, 0)),
+        Query('folder.findFirst(path)', 'POST /api/file-manager/folders',
+              f'{_select(conn, "Folder")} WHERE "main"."Folder"."path" = ? LIMIT ? OFFSET ?',
+              lambda ctx: (ctx.rng.choice(ctx.folder_paths) if ctx.folder_paths else '', 1, 0)),
+        Query('folder.findUnique(id)', 'POST /api/file-manager/upload',
+              f'{_select(conn, "Folder")} WHERE "main"."Folder"."id" = ? LIMIT ? OFFSET ?',
+              lambda ctx: (folder_id(ctx), 1, 0)),
+        Query('post.findMany', 'GET /api/posts',
+              f'{_select(conn, "Post")} ORDER BY "main"."Post"."createdAt" DESC LIMIT ? OFFSET ?',
+              lambda ctx: (-1, 0)),
+        Query('emailToken.findFirst', 'POST /api/admin/verify',
+              f'{_select(conn, "EmailToken")} WHERE ("main"."EmailToken"."email" = ? '
+              f'AND "main"."EmailToken"."token" = ? AND "main"."EmailToken"."used" = ? '
+              f'AND "main"."EmailToken"."expiresAt" > ?) LIMIT ? OFFSET ?',
+              lambda ctx: (ctx.rng.choice(ctx.tokens) if ctx.tokens else ('', '')) + (0, 0, 1, 0)),
+        Query('file.create', 'POST /api/file-manager/upload',
+              f'INSERT INTO "main"."File" ({file_cols}) VALUES (?,?,?,?,?,?,?,?,?,?)',
+              _insert_file, write=True),
+        Query('post.update', 'PUT /api/posts/[id]',
+              'UPDATE "main"."Post" SET "title" = ?, "updatedAt" = ? WHERE "main"."Post"."id" = ?',
+              lambda ctx: ('Edited', int(time.time() * 1000), post_id(ctx)), write=True),
+    ]
+
+
+# -- measurement -------------------------------------------------------------
+
+def percentile(samples: Sequence[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def query_plan(conn, query: Query, ctx: Context) -> str:
+    rows = conn.execute(f'EXPLAIN QUERY PLAN {query.sql}', query.params(ctx)).fetchall()
+    return '; '.join(row[3] for row in rows)
+
+
+def measure(conn, query: Query, ctx: Context, runs: int, budget: float) -> Measurement:
+    plan = query_plan(conn, query, ctx)
+    samples: List[float] = []
+    deadline = time.perf_counter() + budget
+    while len(samples) < runs and (len(samples) < 5 or time.perf_counter() < deadline):
+        params = query.params(ctx)
+        started = time.perf_counter()
+        if query.write:
+            with conn:
+                conn.execute(query.sql, params)
+        else:
+            conn.execute(query.sql, params).fetchall()
+        samples.append(time.perf_counter() - started)
+    return Measurement(plan, percentile(samples, 0.5), percentile(samples, 0.99), len(samples))
+
+
+def run_all(conn, queries: Sequence[Query], ctx: Context, runs: int, budget: float) -> Dict[str, Measurement]:
+    results = {q.name: measure(conn, q, ctx, runs, budget) for q in queries}
+    if ctx.inserted:
+        with conn:
+            conn.executemany('DELETE FROM File WHERE id = ?', [(i,) for i in ctx.inserted])
+        ctx.inserted.clear()
+    return results
+
+
+def _set_journal(conn, mode: str, synchronous: str) -> None:
+    conn.execute(f'PRAGMA journal_mode={mode}')
+    conn.execute(f'PRAGMA synchronous={synchronous}')
+
+
+def _read_saving(base: Dict[str, Measurement], other: Dict[str, Measurement], queries: Sequence[Query]) -> float:
+    return sum(base[q.name].p50 - other[q.name].p50 for q in queries if not q.write)
+
+
+# -- report ------------------------------------------------------------------
+
+def _ms(seconds: float) -> str:
+    return f'{seconds * 1e3:.3f}'
+
+
+def _table(rows: List[Sequence[str]], header: Sequence[str]) -> List[str]:
+    lines = ['| ' + ' | '.join(header) + ' |', '|' + '---|' * len(header)]
+    lines.extend('| ' + ' | '.join(row) + ' |' for row in rows)
+    return lines
+
+
+def report(counts: Dict[str, int], queries: Sequence[Query], base: Dict[str, Measurement],
+           candidates: List[Tuple[Candidate, Dict[str, Measurement]]],
+           journals: List[Tuple[str, Dict[str, Measurement]]]) -> str:
+    out = ['# SQLite query report', '',
+           'Rows: ' + ', '.join(f'{n:,} {table}' for table, n in counts.items()) + '.', '',
+           '## Baseline', '']
+    out += _table([(f'`{q.name}`', q.route, f'`{base[q.name].plan}`', _ms(base[q.name].p50), _ms(base[q.name].p99))
+                   for q in queries], ('query', 'route', 'plan', 'p50 ms', 'p99 ms'))
+
+    out += ['', '## Candidate indexes, best first', '']
+    ranked = sorted(candidates, key=lambda item: _read_saving(base, item[1], queries), reverse=True)
+    for rank, (candidate, results) in enumerate(ranked, 1):
+        saving = _read_saving(base, results, queries)
+        out += [f'### {rank}. {candidate.name}: {_ms(saving)} ms p50 saved across reads', '',
+                f'    {candidate.ddl}', f'    {candidate.prisma}', '']
+        changed = [q for q in queries if results[q.name].plan != base[q.name].plan or q.write]
+        out += _table([(f'`{q.name}`', f'`{results[q.name].plan}`',
+                        f'{_ms(base[q.name].p50)} -> {_ms(results[q.name].p50)}',
+                        f'{_ms(base[q.name].p99)} -> {_ms(results[q.name].p99)}') for q in changed],
+                      ('query', 'plan', 'p50 ms', 'p99 ms'))
+        out.append('')
+
+    out += ['## Journal settings', '']
+    rows = []
+    for label, results in journals:
+        for q in queries:
+            rows.append((label, f'`{q.name}`', _ms(results[q.name].p50), _ms(results[q.name].p99)))
+    out += _table(rows, ('setting', 'query', 'p50 ms', 'p99 ms'))
+    return '\n'.join(out) + '\n'
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help='database to copy (default: the Prisma database)')
+    parser.add_argument('--work', help='path for the scaled copy (default: a temporary file)')
+    parser.add_argument('--files', type=int, default=DEFAULT_FILES)
+    parser.add_argument('--folders', type=int, default=DEFAULT_FOLDERS)
+    parser.add_argument('--posts', type=int, default=DEFAULT_POSTS)
+    parser.add_argument('--tokens', type=int, default=DEFAULT_TOKENS)
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS, help='samples per query')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET, help='seconds per query at most')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--report', help='write the Markdown report here (default: stdout)')
+    args = parser.parse_args(argv)
+
+    tmpdir = None
+    work = args.work
+    if work is None:
+        tmpdir = tempfile.mkdtemp(prefix='bench-queries-')
+        work = os.path.join(tmpdir, 'bench.db')
+    try:
+        try:
+            copy_database(database_path(args.db), work)
+        except (FileNotFoundError, sqlite3.Error) as e:
+            print(e, file=sys.stderr)
+            return 1
+        conn = sqlite3.connect(work)
+        try:
+            log = lambda msg: print(msg, file=sys.stderr)  # noqa: E731
+            fill(conn, args.files, args.folders, args.posts, args.tokens, args.seed, log)
+            counts = {t: conn.execute(f'SELECT COUNT(*) FROM "{t}"').fetchone()[0]
+                      for t in ('File', 'Folder', 'Post', 'EmailToken')}
+            ctx = context(conn, args.seed)
+            queries = route_queries(conn)
+
+            log('baseline')
+            base = run_all(conn, queries, ctx, args.runs, args.budget)
+            candidates = []
+            for candidate in CANDIDATES:
+                log(candidate.name)
+                conn.execute(candidate.ddl)
+                conn.execute('ANALYZE')
+                candidates.append((candidate, run_all(conn, queries, ctx, args.runs, args.budget)))
+                conn.execute(f'DROP INDEX "{candidate.index_name}"')
+            conn.execute('ANALYZE')
+            journals = []
+            for label, mode, synchronous in JOURNAL_SETTINGS:
+                log(label)
+                _set_journal(conn, mode, synchronous)
+                journals.append((label, run_all(conn, queries, ctx, args.runs, args.budget)))
+            _set_journal(conn, 'DELETE', 'FULL')
+        finally:
+            conn.close()
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    text = report(counts, queries, base, candidates, journals)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,569 @@
+"""Compact binary encoding of ``Post.canvasData``.
+
+    python -m tools.canvas_codec encode              # fill PostCanvasBin from canvasData
+    python -m tools.canvas_codec decode              # restore missing canvasData from PostCanvasBin
+    python -m tools.canvas_codec encode --all --frame zlib
+
+A document is ``MAGIC``, a format version, a frame byte (none, zlib or zstd)
+and the payload.  The payload starts with one table of every distinct string
+(keys and values), followed by the value tree in a tagged form.  A list of
+objects, such as ``elements``, is stored column by column instead of object
+by object.  Each field name is stored once.  A field missing from some
+elements gets a presence bitmap.  Values go in the narrowest fixed-width
+array that holds them exactly: int8..int64, float32 or float64, string-table
+indices, or a bitmap for booleans.  Columns of mixed type fall back to tagged
+values.  Key order and the int/float distinction are kept, so ``decode``
+returns exactly what ``json.loads`` did.
+
+``encode`` checks that every row round-trips before writing it.  The app
+still reads and writes ``canvasData``; the ``PostCanvasBin`` side table is
+only written here, next to the SHA-256 of the text each blob came from.
+``encode`` refreshes blobs whose post changed since.  ``decode`` restores
+``canvasData`` that is NULL or empty (a bad import or a cleared column) from
+the blob; text the app has is never replaced, so a newer edit is not rolled
+back.  zstd needs the optional ``zstandard`` package.
+"""
+
+import argparse
+import hashlib
+import json
+import sqlite3
+import struct
+import sys
+import zlib
+from array import array
+from itertools import accumulate
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from tools.db import connect
+
+try:
+    import zstandard
+except ImportError:  # zstd frames are optional; zlib is always available.
+    zstandard = None
+
+
+MAGIC = b'CVB'
+VERSION = 1
+FRAME_NONE, FRAME_ZLIB, FRAME_ZSTD = 0, 1, 2
+FRAMES = {'none': FRAME_NONE, 'zlib': FRAME_ZLIB, 'zstd': FRAME_ZSTD}
+DEFAULT_CHUNK = 200
+
+# Value tags.
+T_NULL, T_FALSE, T_TRUE, T_INT, T_FLOAT, T_STR, T_LIST, T_DICT, T_TABLE = range(9)
+# Column kinds.
+C_NULL, C_BOOL, C_INT8, C_INT16, C_INT32, C_INT64, C_FLOAT32, C_FLOAT64, C_STR, C_ANY = range(10)
+_INT_COLUMNS = ((C_INT8, 'b', 1 << 7), (C_INT16, 'h', 1 << 15), (C_INT32, 'i', 1 << 31), (C_INT64, 'q', 1 << 63))
+_ARRAY_CODES = {C_INT8: 'b', C_INT16: 'h', C_INT32: 'i', C_INT64: 'q', C_FLOAT32: 'f', C_FLOAT64: 'd'}
+_BIG_ENDIAN = sys.byteorder == 'big'
+# Placeholder for a field an object does not have.
+_MISSING = object()
+
+
+class CodecError(ValueError):
+    """Raised for data that is not a valid encoded canvas."""
+
+
+def default_frame() -> str:
+    return 'zstd' if zstandard is not None else 'zlib'
+
+
+# -- low level ---------------------------------------------------------------
+
+def _varint(out: bytearray, n: int) -> None:
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _zigzag(n: int) -> int:
+    return n * 2 if n >= 0 else -n * 2 - 1
+
+
+def _array_bytes(code: str, values) -> bytes:
+    arr = array(code, values)
+    if _BIG_ENDIAN:
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _bitmap(flags: Sequence[bool]) -> bytes:
+    bits = 0
+    for i, flag in enumerate(flags):
+        if flag:
+            bits |= 1 << i
+    return bits.to_bytes((len(flags) + 7) // 8, 'little')
+
+
+def _index_code(count: int) -> str:
+    return 'B' if count <= 0xFF else 'H' if count <= 0xFFFF else 'I'
+
+
+def _is_float32(value: float) -> bool:
+    try:
+        return struct.unpack('<f', struct.pack('<f', value))[0] == value
+    except OverflowError:
+        return False
+
+
+class _Reader:
+    def __init__(self, data: bytes):
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def byte(self) -> int:
+        try:
+            value = self.data[self.pos]
+        except IndexError:
+            raise CodecError('truncated data') from None
+        self.pos += 1
+        return value
+
+    def take(self, n: int) -> memoryview:
+        if self.pos + n > len(self.data):
+            raise CodecError('truncated data')
+        chunk = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return chunk
+
+    def varint(self) -> int:
+        shift = result = 0
+        while True:
+            b = self.byte()
+            result |= (b & 0x7F) << shift
+            if b < 0x80:
+                return result
+            shift += 7
+
+    def signed(self) -> int:
+        n = self.varint()
+        return n >> 1 if not n & 1 else -((n + 1) >> 1)
+
+    def array(self, code: str, count: int) -> list:
+        arr = array(code)
+        arr.frombytes(self.take(count * arr.itemsize))
+        if _BIG_ENDIAN:
+            arr.byteswap()
+        return arr.tolist()
+
+    def bitmap(self, count: int) -> List[bool]:
+        bits = int.from_bytes(self.take((count + 7) // 8), 'little')
+        return [bool(bits >> i & 1) for i in range(count)]
+
+
+# -- encoding ----------------------------------------------------------------
+
+class _Encoder:
+    def __init__(self):
+        self.strings: Dict[str, int] = {}
+        self.out = bytearray()
+
+    def string(self, value: str) -> int:
+        index = self.strings.get(value)
+        if index is None:
+            index = self.strings[value] = len(self.strings)
+        return index
+
+    def value(self, value) -> None:
+        out = self.out
+        if value is None:
+            out.append(T_NULL)
+        elif value is True:
+            out.append(T_TRUE)
+        elif value is False:
+            out.append(T_FALSE)
+        elif isinstance(value, int):
+            out.append(T_INT)
+            _varint(out, _zigzag(value))
+        elif isinstance(value, float):
+            out.append(T_FLOAT)
+            out += struct.pack('<d', value)
+        elif isinstance(value, str):
+            out.append(T_STR)
+            _varint(out, self.string(value))
+        elif isinstance(value, list):
+            if value and all(isinstance(v, dict) for v in value):
+                out.append(T_TABLE)
+                self.table(value)
+            else:
+                out.append(T_LIST)
+                _varint(out, len(value))
+                for v in value:
+                    self.value(v)
+        elif isinstance(value, dict):
+            out.append(T_DICT)
+            _varint(out, len(value))
+            for k, v in value.items():
+                _varint(out, self.string(k))
+                self.value(v)
+        else:
+            raise TypeError(f'cannot encode {type(value).__name__}')
+
+    def table(self, rows: List[dict]) -> None:
+        """A list of objects, one column per field."""
+        out = self.out
+        fields: Dict[str, int] = {}
+        for row in rows:
+            for key in row:
+                fields.setdefault(key, len(fields))
+        names = list(fields)
+        _varint(out, len(rows))
+        _varint(out, len(names))
+        for name in names:
+            _varint(out, self.string(name))
+
+        # Key order: one flag when every row follows the field order,
+        # otherwise a table of distinct orders and one index per row.
+        orders: Dict[Tuple[int, ...], int] = {}
+        row_orders = []
+        for row in rows:
+            order = tuple(fields[k] for k in row)
+            row_orders.append(orders.setdefault(order, len(orders)))
+        in_field_order = all(list(order) == sorted(order) for order in orders)
+        out.append(0 if in_field_order else 1)
+        if not in_field_order:
+            _varint(out, len(orders))
+            for order in orders:
+                _varint(out, len(order))
+                for f in order:
+                    _varint(out, f)
+            code = _index_code(len(orders))
+            out += _array_bytes(code, row_orders)
+
+        for name in names:
+            present = [name in row for row in rows]
+            values = [row[name] for row in rows if name in row]
+            if all(present):
+                out.append(0)
+            else:
+                out.append(1)
+                out += _bitmap(present)
+            self.column(values)
+
+    def column(self, values: list) -> None:
+        out = self.out
+        kinds = {type(v) for v in values}
+        if kinds <= {type(None)}:
+            out.append(C_NULL)
+        elif kinds == {bool}:
+            out.append(C_BOOL)
+            out += _bitmap(values)
+        elif kinds == {int}:
+            low, high = min(values), max(values)
+            for kind, code, limit in _INT_COLUMNS:
+                if -limit <= low and high < limit:
+                    out.append(kind)
+                    out += _array_bytes(code, values)
+                    return
+            self._any(values)
+        elif kinds == {float}:
+            if all(_is_float32(v) for v in values):
+                out.append(C_FLOAT32)
+                out += _array_bytes('f', values)
+            else:
+                out.append(C_FLOAT64)
+                out += _array_bytes('d', values)
+        elif kinds == {str}:
+            indices = [self.string(v) for v in values]
+            code = _index_code(max(indices) + 1)
+            out.append(C_STR)
+            out.append(ord(code))
+            out += _array_bytes(code, indices)
+        else:
+            self._any(values)
+
+    def _any(self, values: list) -> None:
+        self.out.append(C_ANY)
+        for v in values:
+            self.value(v)
+
+
+def encode(canvas_data: Union[str, dict, list], frame: Optional[str] = None) -> bytes:
+    """Encode canvas data (JSON text or parsed) as a binary document."""
+    if isinstance(canvas_data, str):
+        canvas_data = json.loads(canvas_data)
+    frame = frame or default_frame()
+    if frame not in FRAMES:
+        raise ValueError(f'unknown frame: {frame}')
+    encoder = _Encoder()
+    encoder.value(canvas_data)
+    # String table: count, the length of each string in characters, then all
+    # of them as one UTF-8 blob, so decoding is one decode and some slicing.
+    strings = bytearray()
+    lengths = [len(s) for s in encoder.strings]
+    blob = ''.join(encoder.strings).encode('utf-8', 'surrogatepass')
+    code = _index_code(max(lengths, default=0))
+    _varint(strings, len(lengths))
+    strings.append(ord(code))
+    strings += _array_bytes(code, lengths)
+    _varint(strings, len(blob))
+    payload = bytes(strings + blob + encoder.out)
+    if frame == 'zlib':
+        payload = zlib.compress(payload, 9)
+    elif frame == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstd frames need the zstandard package')
+        payload = zstandard.ZstdCompressor(level=19).compress(payload)
+    return MAGIC + bytes((VERSION, FRAMES[frame])) + payload
+
+
+# -- decoding ----------------------------------------------------------------
+
+class _Decoder:
+    def __init__(self, reader: _Reader):
+        self.r = reader
+        count = reader.varint()
+        lengths = reader.array(chr(reader.byte()), count)
+        try:
+            text = bytes(reader.take(reader.varint())).decode('utf-8', 'surrogatepass')
+        except UnicodeDecodeError as e:
+            raise CodecError(f'bad string table: {e}') from None
+        ends = list(accumulate(lengths))
+        self.strings = [text[end - length:end] for end, length in zip(ends, lengths)]
+
+    def string(self, index: int) -> str:
+        try:
+            return self.strings[index]
+        except IndexError:
+            raise CodecError(f'string index {index} out of range') from None
+
+    def value(self):
+        r = self.r
+        tag = r.byte()
+        if tag == T_NULL:
+            return None
+        if tag == T_TRUE:
+            return True
+        if tag == T_FALSE:
+            return False
+        if tag == T_INT:
+            return r.signed()
+        if tag == T_FLOAT:
+            return struct.unpack('<d', r.take(8))[0]
+        if tag == T_STR:
+            return self.string(r.varint())
+        if tag == T_LIST:
+            return [self.value() for _ in range(r.varint())]
+        if tag == T_DICT:
+            result = {}
+            for _ in range(r.varint()):
+                key = self.string(r.varint())
+                result[key] = self.value()
+            return result
+        if tag == T_TABLE:
+            return self.table()
+        raise CodecError(f'unknown tag {tag}')
+
+    def table(self) -> List[dict]:
+        r = self.r
+        n = r.varint()
+        names = [self.string(r.varint()) for _ in range(r.varint())]
+        orders: Optional[List[List[int]]] = None
+        row_orders: List[int] = []
+        if r.byte():
+            orders = [[r.varint() for _ in range(r.varint())] for _ in range(r.varint())]
+            row_orders = r.array(_index_code(len(orders)), n)
+
+        columns: List[list] = []
+        sparse = False
+        for _ in names:
+            if r.byte():
+                present = r.bitmap(n)
+                it = iter(self.column(sum(present)))
+                columns.append([next(it) if p else _MISSING for p in present])
+                sparse = True
+            else:
+                columns.append(self.column(n))
+
+        if orders is not None:
+            return [{names[f]: cells[f] for f in orders[o]} for cells, o in zip(zip(*columns), row_orders)]
+        if sparse:
+            return [{k: v for k, v in zip(names, cells) if v is not _MISSING} for cells in zip(*columns)]
+        if not names:
+            return [{} for _ in range(n)]
+        return [dict(zip(names, cells)) for cells in zip(*columns)]
+
+    def column(self, count: int) -> list:
+        r = self.r
+        kind = r.byte()
+        if kind == C_NULL:
+            return [None] * count
+        if kind == C_BOOL:
+            return r.bitmap(count)
+        if kind in _ARRAY_CODES:
+            return r.array(_ARRAY_CODES[kind], count)
+        if kind == C_STR:
+            strings = self.strings
+            return [strings[i] for i in r.array(chr(r.byte()), count)]
+        if kind == C_ANY:
+            return [self.value() for _ in range(count)]
+        raise CodecError(f'unknown column kind {kind}')
+
+
+def is_encoded(data: Union[bytes, memoryview, str, None]) -> bool:
+    return isinstance(data, (bytes, memoryview)) and bytes(data[:3]) == MAGIC
+
+
+def decode(data: bytes):
+    """The parsed canvas data of a binary document."""
+    if not is_encoded(data) or len(data) < 5:
+        raise CodecError('not an encoded canvas')
+    if data[3] != VERSION:
+        raise CodecError(f'unsupported version {data[3]}')
+    frame, payload = data[4], bytes(data[5:])
+    try:
+        if frame == FRAME_ZLIB:
+            payload = zlib.decompress(payload)
+        elif frame == FRAME_ZSTD:
+            if zstandard is None:
+                raise CodecError('zstd frames need the zstandard package')
+            payload = zstandard.ZstdDecompressor().decompress(payload)
+        elif frame != FRAME_NONE:
+            raise CodecError(f'unknown frame {frame}')
+    except zlib.error as e:
+        raise CodecError(f'corrupt frame: {e}') from None
+    return _Decoder(_Reader(payload)).value()
+
+
+def identical(a, b) -> bool:
+    """Equal values of equal types with keys in the same order."""
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return list(a) == list(b) and all(identical(v, b[k]) for k, v in a.items())
+    if isinstance(a, list):
+        return len(a) == len(b) and all(identical(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def to_json(value) -> str:
+    """Compact JSON as ``JSON.stringify`` writes it."""
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+# -- bulk conversion ---------------------------------------------------------
+
+# Same DDL `prisma db push` creates for the PostCanvasBin model.  The blob lives
+# outside Post so that the app's Post queries never load it.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS "PostCanvasBin" (
+    "postId" TEXT NOT NULL PRIMARY KEY,
+    "data" BLOB NOT NULL,
+    "sourceHash" TEXT NOT NULL,
+    CONSTRAINT "PostCanvasBin_postId_fkey" FOREIGN KEY ("postId") REFERENCES "Post" ("id")
+        ON DELETE CASCADE ON UPDATE CASCADE
+);
+"""
+
+
+def source_hash(text: str) -> str:
+    """SHA-256 of the ``canvasData`` text a blob was encoded from."""
+    return hashlib.sha256(text.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+def ensure_table(conn) -> None:
+    with conn:
+        conn.executescript(_SCHEMA)
+
+
+def iter_rows(conn, where: str, chunk: int) -> Iterator[List[tuple]]:
+    after = ''
+    while True:
+        rows = conn.execute(
+            'SELECT p.id, p.canvasData, b.data, b.sourceHash FROM Post p'
+            ' LEFT JOIN PostCanvasBin b ON b.postId = p.id'
+            f' WHERE p.id > ? AND ({where}) ORDER BY p.id LIMIT ?',
+            (after, chunk)).fetchall()
+        if not rows:
+            return
+        yield [tuple(row) for row in rows]
+        after = rows[-1][0]
+
+
+def convert(direction: str, db: Optional[str] = None, frame: Optional[str] = None, everything: bool = False,
+            chunk: int = DEFAULT_CHUNK, log=print) -> Tuple[int, int, int, int, int]:
+    """Encode ``canvasData`` into ``PostCanvasBin`` or decode it back.
+
+    ``encode`` writes rows without a blob and rows whose ``canvasData`` changed
+    since theirs was written (all rows with ``everything``).  ``decode`` only
+    fills in ``canvasData`` that is NULL or empty; a row saved in the meantime
+    is stale and left alone.
+
+    Returns ``(rows, failed, stale, json_bytes, binary_bytes)``.
+    """
+    conn = connect(db)
+    rows_done = failed = stale = json_bytes = bin_bytes = 0
+    try:
+        ensure_table(conn)
+        if direction == 'encode':
+            where = 'p.canvasData IS NOT NULL'
+        else:
+            where = "b.data IS NOT NULL AND (p.canvasData IS NULL OR p.canvasData = '')"
+        for rows in iter_rows(conn, where, chunk):
+            updates = []
+            for post_id, text, blob, stored_hash in rows:
+                current = None if text is None else source_hash(text)
+                if direction == 'encode' and current == stored_hash and not everything:
+                    continue
+                try:
+                    if direction == 'encode':
+                        parsed = json.loads(text)
+                        blob = encode(parsed, frame)
+                        if not identical(decode(blob), parsed):
+                            raise CodecError('round trip changed the data')
+                        updates.append((post_id, blob, current))
+                    else:
+                        text = to_json(decode(blob))
+                        updates.append((text, post_id))
+                except (ValueError, TypeError) as e:
+                    failed += 1
+                    log(f'{post_id}: {type(e).__name__}: {e}')
+                    continue
+                rows_done += 1
+                json_bytes += len(text.encode('utf-8'))
+                bin_bytes += len(blob)
+            with conn:
+                if direction == 'encode':
+                    conn.executemany('INSERT OR REPLACE INTO PostCanvasBin (postId, data, sourceHash)'
+                                     ' VALUES (?, ?, ?)', updates)
+                else:
+                    # A save since the SELECT fills canvasData; that row is left as it is.
+                    for params in updates:
+                        if conn.execute("UPDATE Post SET canvasData = ? WHERE id = ?"
+                                        " AND (canvasData IS NULL OR canvasData = '')", params).rowcount == 0:
+                            rows_done -= 1
+                            stale += 1
+    finally:
+        conn.close()
+    return rows_done, failed, stale, json_bytes, bin_bytes
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('direction', choices=('encode', 'decode'),
+                        help='canvasData -> PostCanvasBin, or PostCanvasBin -> canvasData')
+    parser.add_argument('--db', help='SQLite database holding the Post table')
+    parser.add_argument('--frame', choices=tuple(FRAMES), default=None,
+                        help=f'compression frame (default: {default_frame()})')
+    parser.add_argument('--all', action='store_true', help='re-encode rows whose blob is up to date too')
+    parser.add_argument('--chunk', type=int, default=DEFAULT_CHUNK, help='rows per read/commit')
+    args = parser.parse_args(argv)
+
+    if args.frame == 'zstd' and zstandard is None:
+        print('zstd frames need the zstandard package', file=sys.stderr)
+        return 1
+    try:
+        rows, failed, stale, json_bytes, bin_bytes = convert(args.direction, args.db, args.frame, args.all,
+                                                             args.chunk)
+    except (FileNotFoundError, sqlite3.Error) as e:
+        print(e, file=sys.stderr)
+        return 1
+    ratio = bin_bytes / json_bytes if json_bytes else 0.0
+    print(f'{rows} rows {args.direction}d, {failed} failed, {stale} stale; '
+          f'JSON {json_bytes:,} bytes, binary {bin_bytes:,} bytes ({ratio:.1%})')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,494 @@
+"""Compare the forked app trees and find code duplicated within and across them.
+
+    python -m tools.code_clones diff                            # src/ against each fork
+    python -m tools.code_clones diff src english_editor/src
+    python -m tools.code_clones clones --top 20                 # all app trees
+    python -m tools.code_clones clones src --min-tokens 200
+
+``diff`` builds a Merkle tree over each root: a file's hash is the SHA-256
+of its content, and a directory's hash covers the names and hashes of its
+entries.  Two trees are compared from the top, and a subtree is only
+entered when its hashes differ, so the work grows with what changed, not
+with the tree size.  File hashes are cached by size and mtime in
+``.tree-hashes.json``, so a rebuild reads only the files touched since the
+last run.  Files that moved (same content at another path) are reported as
+moves.
+
+``clones`` tokenizes the TS/JS sources, ignoring whitespace and comments.
+It fingerprints every file with winnowing: rolling hashes over
+``--kgram``-token windows, keeping the minimum of each window, which
+guarantees that any shared run of ``--min-tokens`` tokens is seen.  Shared
+fingerprints are extended to maximal token runs and grouped into clone
+classes.  These are ranked by the bytes the extra copies add to the
+bundle.
+"""
+
+import argparse
+import difflib
+import hashlib
+import json
+import os
+import re
+import sys
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from tools.patch_batch import DEFAULT_ROOTS, REPO_ROOT
+
+
+DEFAULT_CACHE = os.path.join(REPO_ROOT, '.tree-hashes.json')
+CACHE_VERSION = 1
+CODE_SUFFIXES = ('.ts', '.tsx', '.js', '.jsx', '.mjs')
+SKIP_DIRS = frozenset({'node_modules', '.next', '.git'})
+DEFAULT_KGRAM = 25
+DEFAULT_MIN_TOKENS = 100
+DEFAULT_TOP = 15
+# Fingerprints seen more often than this are boilerplate (imports, JSX props).
+MAX_OCCURRENCES = 64
+
+_TOKEN = re.compile(r"""
+    (?P<skip>(?:\s+|//[^\n]*|/\*.*?(?:\*/|\Z))+)
+  | (?P<word>[A-Za-z_$\u0080-\uffff][\w$\u0080-\uffff]*|\.?\d[\w.]*)
+  | (?P<string>'(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*"|`(?:[^`\\]|\\.)*`)
+  | (?P<punct>=>|\.\.\.|\?\.|&&|\|\||\?\?|[=!]==?|[-+*%&|^<>]=?|.)
+""", re.X | re.S)
+_HASH_BASE = 1000003
+_HASH_MOD = (1 << 61) - 1
+
+
+# --- Merkle trees -------------------------------------------------------------
+
+@dataclass
+class Node:
+    name: str
+    digest: str
+    size: int
+    files: int
+    # None for files; entries by name for directories.
+    children: Optional[Dict[str, 'Node']] = None
+
+    @property
+    def is_dir(self) -> bool:
+        return self.children is not None
+
+
+class HashCache:
+    """File hashes keyed by absolute path, valid while size and mtime match."""
+
+    def __init__(self, path: Optional[str] = DEFAULT_CACHE):
+        self.path = path
+        self.entries: Dict[str, list] = {}
+        self.hashed = 0
+        self.dirty = False
+        if path is not None:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                return
+            if data.get('version') == CACHE_VERSION:
+                self.entries = data.get('files', {})
+
+    def digest(self, path: str, st: os.stat_result) -> str:
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            return entry[2]
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        self.entries[path] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+        self.hashed += 1
+        self.dirty = True
+        return h.hexdigest()
+
+    def save(self) -> None:
+        if self.path is None or not self.dirty:
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': CACHE_VERSION, 'files': self.entries}, f, separators=(',', ':'))
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+
+def build_tree(path: str, cache: HashCache, name: str = '') -> Node:
+    children = {}
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in SKIP_DIRS:
+                    children[entry.name] = build_tree(entry.path, cache, entry.name)
+            elif entry.is_file(follow_symlinks=False):
+                st = entry.stat(follow_symlinks=False)
+                children[entry.name] = Node(entry.name, cache.digest(entry.path, st), st.st_size, 1)
+    h = hashlib.sha256()
+    for child_name in sorted(children):
+        child = children[child_name]
+        h.update(f'{"d" if child.is_dir else "f"} {child_name}\0{child.digest}\n'.encode('utf-8', 'surrogateescape'))
+    return Node(name, h.hexdigest(), sum(c.size for c in children.values()),
+                sum(c.files for c in children.values()), children)
+
+
+@dataclass
+class Change:
+    kind: str  # 'added', 'removed', 'modified' or 'moved'
+    path: str
+    old: Optional[Node] = None
+    new: Optional[Node] = None
+    moved_from: str = ''
+
+
+@dataclass
+class TreeDiff:
+    changes: List[Change] = field(default_factory=list)
+    identical_files: int = 0
+    # Directory pairs whose entries were compared; identical subtrees cost nothing.
+    visited: int = 0
+
+
+def _walk_files(node: Node, path: str) -> Iterator[Tuple[str, Node]]:
+    if not node.is_dir:
+        yield path, node
+        return
+    for name in sorted(node.children):
+        yield from _walk_files(node.children[name], f'{path}/{name}' if path else name)
+
+
+def _diff_nodes(old: Node, new: Node, path: str, result: TreeDiff) -> None:
+    if old.digest == new.digest and old.is_dir == new.is_dir:
+        result.identical_files += old.files
+        return
+    if not (old.is_dir and new.is_dir):
+        if old.is_dir or new.is_dir:
+            result.changes.extend(Change('removed', p, n) for p, n in _walk_files(old, path))
+            result.changes.extend(Change('added', p, None, n) for p, n in _walk_files(new, path))
+        else:
+            result.changes.append(Change('modified', path, old, new))
+        return
+    result.visited += 1
+    for name in sorted(old.children.keys() | new.children.keys()):
+        child_path = f'{path}/{name}' if path else name
+        a = old.children.get(name)
+        b = new.children.get(name)
+        if b is None:
+            result.changes.extend(Change('removed', p, n) for p, n in _walk_files(a, child_path))
+        elif a is None:
+            result.changes.extend(Change('added', p, None, n) for p, n in _walk_files(b, child_path))
+        else:
+            _diff_nodes(a, b, child_path, result)
+
+
+def diff_trees(old: Node, new: Node) -> TreeDiff:
+    result = TreeDiff()
+    _diff_nodes(old, new, '', result)
+    removed: Dict[str, List[Change]] = defaultdict(list)
+    for change in result.changes:
+        if change.kind == 'removed':
+            removed[change.old.digest].append(change)
+    moved = set()
+    for change in result.changes:
+        if change.kind == 'added' and removed.get(change.new.digest):
+            source = removed[change.new.digest].pop(0)
+            moved.add(id(source))
+            change.kind, change.old, change.moved_from = 'moved', source.old, source.path
+    result.changes = [c for c in result.changes if id(c) not in moved]
+    return result
+
+
+def line_stat(old_path: str, new_path: str) -> Tuple[int, int]:
+    """Lines added and removed between two text files."""
+    def lines(path: str) -> List[str]:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            return f.read().splitlines()
+
+    added = removed = 0
+    for line in difflib.unified_diff(lines(old_path), lines(new_path), n=0, lineterm=''):
+        if line.startswith('+') and not line.startswith('+++'):
+            added += 1
+        elif line.startswith('-') and not line.startswith('---'):
+            removed += 1
+    return added, removed
+
+
+# --- clone detection ------------------------------------------------------------
+
+@dataclass
+class Source:
+    path: str
+    text: str
+    tokens: List[int]
+    starts: List[int]
+    ends: List[int]
+
+    def line_of(self, offset: int) -> int:
+        return self.text.count('\n', 0, offset) + 1
+
+
+@dataclass
+class Location:
+    source: Source
+    start: int  # token index
+    end: int    # exclusive
+
+    @property
+    def span(self) -> Tuple[int, int]:
+        return self.source.starts[self.start], self.source.ends[self.end - 1]
+
+    @property
+    def lines(self) -> Tuple[int, int]:
+        first, last = self.span
+        return self.source.line_of(first), self.source.line_of(last - 1)
+
+
+@dataclass
+class CloneClass:
+    tokens: int
+    nbytes: int
+    locations: List[Location]
+
+    @property
+    def redundant(self) -> int:
+        """Bytes the extra copies add (every copy but one could be shared)."""
+        return self.nbytes * (len(self.locations) - 1)
+
+
+def tokenize(path: str, text: str, vocab: Dict[str, int]) -> Source:
+    tokens, starts, ends = [], [], []
+    for m in _TOKEN.finditer(text):
+        if m.lastgroup == 'skip':
+            continue
+        tokens.append(vocab.setdefault(m.group(), len(vocab)))
+        starts.append(m.start())
+        ends.append(m.end())
+    return Source(path, text, tokens, starts, ends)
+
+
+def iter_code_files(roots: Sequence[str]) -> Iterator[str]:
+    for root in roots:
+        for directory, dirs, files in os.walk(root):
+            dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS)
+            for name in sorted(files):
+                if name.endswith(CODE_SUFFIXES):
+                    yield os.path.join(directory, name)
+
+
+def fingerprints(tokens: Sequence[int], k: int, window: int) -> List[Tuple[int, int]]:
+    """Winnowed (hash, position) pairs of the k-gram hashes of ``tokens``."""
+    n = len(tokens) - k + 1
+    if n <= 0:
+        return []
+    top = pow(_HASH_BASE, k - 1, _HASH_MOD)
+    h = 0
+    for t in tokens[:k]:
+        h = (h * _HASH_BASE + t + 1) % _HASH_MOD
+    hashes = [h]
+    for i in range(1, n):
+        h = ((h - (tokens[i - 1] + 1) * top) * _HASH_BASE + tokens[i + k - 1] + 1) % _HASH_MOD
+        hashes.append(h)
+    if n <= window:
+        i = min(range(n), key=lambda j: (hashes[j], -j))
+        return [(hashes[i], i)]
+    # Rightmost minimum of every window, emitted once per change (Schleimer et al.).
+    picked = []
+    q: deque = deque()
+    last = -1
+    for i, h in enumerate(hashes):
+        while q and hashes[q[-1]] >= h:
+            q.pop()
+        q.append(i)
+        if q[0] <= i - window:
+            q.popleft()
+        if i >= window - 1 and q[0] != last:
+            last = q[0]
+            picked.append((hashes[last], last))
+    return picked
+
+
+def _extend(a: Source, pa: int, b: Source, pb: int, k: int) -> Optional[Tuple[int, int]]:
+    """Maximal run of equal tokens through ``a[pa:pa+k]`` / ``b[pb:pb+k]`` as (start in a, length)."""
+    ta, tb = a.tokens, b.tokens
+    if ta[pa:pa + k] != tb[pb:pb + k]:
+        return None  # hash collision
+    # Within one file, the two copies must not overlap.
+    limit = pb - pa if a is b else None
+    start = 0
+    while pa - start > 0 and pb - start > 0 and ta[pa - start - 1] == tb[pb - start - 1]:
+        start += 1
+    end = k
+    while pa + end < len(ta) and pb + end < len(tb) and ta[pa + end] == tb[pb + end]:
+        end += 1
+    length = start + end
+    if limit is not None and length > limit:
+        length = limit
+    return pa - start, length
+
+
+def find_clones(sources: Sequence[Source], min_tokens: int = DEFAULT_MIN_TOKENS,
+                k: int = DEFAULT_KGRAM) -> List[CloneClass]:
+    k = min(k, min_tokens)
+    window = min_tokens - k + 1
+    index: Dict[int, List[Tuple[int, int]]] = defaultdict(list)
+    for fi, source in enumerate(sources):
+        for h, pos in fingerprints(source.tokens, k, window):
+            index[h].append((fi, pos))
+
+    # (file a, file b, diagonal) -> token ranges in a already covered by a match.
+    covered: Dict[Tuple[int, int, int], List[Tuple[int, int]]] = defaultdict(list)
+    classes: Dict[Tuple[int, int], Dict[Tuple[int, int], Location]] = defaultdict(dict)
+    for occurrences in index.values():
+        if len(occurrences) < 2 or len(occurrences) > MAX_OCCURRENCES:
+            continue
+        occurrences.sort()
+        for i, (fa, pa) in enumerate(occurrences):
+            for fb, pb in occurrences[i + 1:]:
+                if fa == fb and pb - pa < min_tokens:
+                    continue
+                key = (fa, fb, pb - pa)
+                if any(s <= pa < e for s, e in covered[key]):
+                    continue
+                match = _extend(sources[fa], pa, sources[fb], pb, k)
+                if match is None:
+                    continue
+                start, length = match
+                covered[key].append((start, start + length))
+                if length < min_tokens:
+                    continue
+                body = tuple(sources[fa].tokens[start:start + length])
+                group = classes[(length, hash(body))]
+                for loc in (Location(sources[fa], start, start + length),
+                            Location(sources[fb], start + pb - pa, start + pb - pa + length)):
+                    group.setdefault((id(loc.source), loc.start), loc)
+
+    result = []
+    for (length, _), locations in classes.items():
+        locs = sorted(locations.values(), key=lambda loc: (loc.source.path, loc.start))
+        first, last = locs[0].span
+        result.append(CloneClass(length, last - first, locs))
+    result.sort(key=lambda c: (-c.redundant, -c.tokens))
+    return _drop_nested(result)
+
+
+def _drop_nested(classes: List[CloneClass]) -> List[CloneClass]:
+    """Drop classes whose every copy lies inside copies of a class already kept."""
+    kept: List[CloneClass] = []
+    spans: Dict[int, List[Tuple[int, int]]] = defaultdict(list)
+    for clone in classes:
+        inside = all(any(s <= loc.start and loc.end <= e for s, e in spans[id(loc.source)])
+                     for loc in clone.locations)
+        if inside:
+            continue
+        kept.append(clone)
+        for loc in clone.locations:
+            spans[id(loc.source)].append((loc.start, loc.end))
+    return kept
+
+
+# --- CLI ------------------------------------------------------------------------
+
+def _resolve(root: str) -> str:
+    return root if os.path.isabs(root) else os.path.join(REPO_ROOT, root)
+
+
+def _relative(path: str) -> str:
+    try:
+        return os.path.relpath(path, REPO_ROOT)
+    except ValueError:
+        return path
+
+
+def _root_of(path: str, roots: Sequence[str]) -> str:
+    for root in roots:
+        if path.startswith(_resolve(root).rstrip(os.sep) + os.sep):
+            return root
+    return '?'
+
+
+def run_diff(old_root: str, new_root: str, cache: HashCache, stat: bool = True) -> TreeDiff:
+    old = build_tree(_resolve(old_root), cache)
+    new = build_tree(_resolve(new_root), cache)
+    result = diff_trees(old, new)
+    print(f'{old_root} -> {new_root}: {old.files} / {new.files} files, '
+          f'{result.identical_files} identical, {len(result.changes)} differing '
+          f'({result.visited} directories compared)')
+    for change in result.changes:
+        if change.kind == 'modified':
+            detail = ''
+            if stat:
+                added, removed = line_stat(os.path.join(_resolve(old_root), change.path),
+                                           os.path.join(_resolve(new_root), change.path))
+                detail = f'  +{added} -{removed}'
+            print(f'  M {change.path}{detail}')
+        elif change.kind == 'moved':
+            print(f'  R {change.moved_from} -> {change.path}')
+        else:
+            print(f'  {"A" if change.kind == "added" else "D"} {change.path}')
+    return result
+
+
+def run_clones(roots: Sequence[str], min_tokens: int, k: int, top: int) -> List[CloneClass]:
+    vocab: Dict[str, int] = {}
+    sources = []
+    for path in iter_code_files([_resolve(r) for r in roots]):
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            sources.append(tokenize(path, f.read(), vocab))
+    classes = find_clones(sources, min_tokens, k)
+    total = sum(c.redundant for c in classes)
+    print(f'{len(sources)} files, {sum(len(s.tokens) for s in sources):,} tokens, '
+          f'{len(classes)} clone classes of >= {min_tokens} tokens, {total / 1024:,.1f} KiB in extra copies')
+
+    by_pair: Dict[str, int] = defaultdict(int)
+    for clone in classes:
+        trees = sorted({_root_of(loc.source.path, roots) for loc in clone.locations})
+        by_pair[' + '.join(trees) if len(trees) > 1 else f'within {trees[0]}'] += clone.redundant
+    for pair, nbytes in sorted(by_pair.items(), key=lambda item: -item[1]):
+        print(f'  {pair}: {nbytes / 1024:,.1f} KiB')
+
+    for rank, clone in enumerate(classes[:top], 1):
+        first, last = clone.locations[0].lines
+        print(f'\n#{rank}  {last - first + 1} lines, {clone.tokens} tokens, {clone.nbytes / 1024:.1f} KiB '
+              f'x {len(clone.locations)} copies ({clone.redundant / 1024:.1f} KiB redundant)')
+        for loc in clone.locations:
+            first, last = loc.lines
+            print(f'    {_relative(loc.source.path)}:{first}-{last}')
+        start, _ = clone.locations[0].span
+        text = clone.locations[0].source.text
+        print(f'    | {text[start:text.find(chr(10), start)].strip()[:100]}')
+    return classes
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=('diff', 'clones'))
+    parser.add_argument('roots', nargs='*', help=f'trees to compare (default: {", ".join(DEFAULT_ROOTS)})')
+    parser.add_argument('--cache', default=DEFAULT_CACHE, help='file hash cache ("" to disable)')
+    parser.add_argument('--no-stat', action='store_true', help='diff: skip line counts of modified files')
+    parser.add_argument('--min-tokens', type=int, default=DEFAULT_MIN_TOKENS,
+                        help='clones: shortest duplicated run reported')
+    parser.add_argument('--kgram', type=int, default=DEFAULT_KGRAM, help='clones: tokens per fingerprint')
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP, help='clones: clone classes listed')
+    args = parser.parse_args(argv)
+
+    roots = args.roots or list(DEFAULT_ROOTS)
+    missing = [r for r in roots if not os.path.isdir(_resolve(r))]
+    if missing:
+        print(f'not a directory: {", ".join(missing)}', file=sys.stderr)
+        return 1
+    if args.command == 'diff':
+        if len(roots) < 2:
+            parser.error('diff needs two trees')
+        cache = HashCache(args.cache or None)
+        # The first tree is the base every other one is compared with.
+        for other in roots[1:]:
+            run_diff(roots[0], other, cache, not args.no_stat)
+        cache.save()
+        return 0
+    if args.min_tokens < 1 or args.kgram < 1:
+        parser.error('--min-tokens and --kgram must be positive')
+    run_clones(roots, args.min_tokens, args.kgram, args.top)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
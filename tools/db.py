@@ -0,0 +1,38 @@
+"""Access to the Prisma SQLite database from the maintenance tools.
+
+The database file comes from ``--db``, else ``DATABASE_URL`` (``file:`` URLs
+are resolved against ``prisma/`` the way Prisma does), else
+``prisma/dev.db``.
+"""
+
+import os
+import sqlite3
+from typing import Optional
+from urllib.parse import quote
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PRISMA_DIR = os.path.join(REPO_ROOT, 'prisma')
+DEFAULT_DATABASE = os.path.join(PRISMA_DIR, 'dev.db')
+
+
+def database_path(path: Optional[str] = None) -> str:
+    if path:
+        return path
+    url = os.environ.get('DATABASE_URL', '')
+    if url.startswith('file:'):
+        location = url[len('file:'):].split('?')[0]
+        return location if os.path.isabs(location) else os.path.normpath(os.path.join(PRISMA_DIR, location))
+    return DEFAULT_DATABASE
+
+
+def connect(path: Optional[str] = None, readonly: bool = False) -> sqlite3.Connection:
+    """Open the database; raises ``FileNotFoundError`` rather than creating it."""
+    path = database_path(path)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f'database not found: {path}')
+    mode = 'ro' if readonly else 'rw'
+    # The Next.js server may hold a write lock briefly; wait instead of failing.
+    conn = sqlite3.connect(f'file:{quote(path)}?mode={mode}', uri=True, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
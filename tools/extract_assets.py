@@ -0,0 +1,193 @@
+"""Move inline ``data:`` images out of posts into content-addressed files.
+
+    python -m tools.extract_assets --dry-run     # report what would be saved
+    python -m tools.extract_assets               # rewrite the rows
+
+Every string in ``Post.canvasData`` that is a whole ``data:`` URI (element
+``image`` fields, the canvas ``background``), and the ``background`` /
+``image`` columns, is decoded and stored once under ``public/uploads/assets``
+by SHA-256; the URI is replaced by the file's ``/uploads/assets/...`` URL.
+Rows are read in id order one chunk at a time, and only rows that still
+contain ``data:`` are fetched, so running the tool again (e.g. from cron
+after new saves) only touches posts saved since and changes nothing
+otherwise.  ``updatedAt`` is left alone, and a row the app saved after it
+was read is skipped rather than overwritten; the next run picks it up.
+"""
+
+import argparse
+import base64
+import binascii
+import json
+import re
+import sys
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import unquote_to_bytes
+
+from tools.asset_store import ASSET_DIR, AssetStore, extension_for
+from tools.db import connect
+
+
+DEFAULT_CHUNK = 100
+_DATA_URI = re.compile(r'data:([\w.+-]+/[\w.+-]+)?((?:;[\w.+-]+=[^;,]*)*)(;base64)?,', re.I)
+
+
+@dataclass
+class PostReport:
+    id: str
+    assets: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+    errors: int = 0
+    # Saved by the app between the read and the write; left for the next run.
+    skipped: bool = False
+
+    @property
+    def saved(self) -> int:
+        return self.bytes_before - self.bytes_after
+
+
+def decode_data_uri(uri: str) -> Optional[Tuple[bytes, str]]:
+    """``(payload, mime)`` for a data URI, or None if it is malformed."""
+    m = _DATA_URI.match(uri)
+    if not m:
+        return None
+    payload = uri[m.end():]
+    try:
+        if m.group(3):
+            data = base64.b64decode(payload, validate=False)
+        else:
+            data = unquote_to_bytes(payload)
+    except (binascii.Error, ValueError):
+        return None
+    return data, (m.group(1) or 'text/plain')
+
+
+class Extractor:
+    def __init__(self, store: AssetStore, dry_run: bool = False):
+        self.store = store
+        self.dry_run = dry_run
+        self.assets = 0
+        self.errors = 0
+
+    def replace(self, value: str) -> str:
+        decoded = decode_data_uri(value)
+        if decoded is None:
+            self.errors += 1
+            return value
+        data, mime = decoded
+        self.assets += 1
+        return self.store.put(data, extension_for(mime), self.dry_run)
+
+    def walk(self, node):
+        """Return ``node`` with every whole-string data URI replaced."""
+        if isinstance(node, str):
+            return self.replace(node) if _DATA_URI.match(node) else node
+        if isinstance(node, list):
+            return [self.walk(v) for v in node]
+        if isinstance(node, dict):
+            return {k: self.walk(v) for k, v in node.items()}
+        return node
+
+
+def iter_candidates(conn, chunk: int) -> Iterator[List[tuple]]:
+    after = ''
+    while True:
+        rows = conn.execute(
+            "SELECT id, canvasData, background, image, updatedAt FROM Post "
+            "WHERE id > ? AND (instr(canvasData, '\"data:') > 0 "
+            "OR background LIKE 'data:%' OR image LIKE 'data:%') "
+            "ORDER BY id LIMIT ?", (after, chunk)).fetchall()
+        if not rows:
+            return
+        yield [tuple(row) for row in rows]
+        after = rows[-1][0]
+
+
+def extract_row(row: tuple, store: AssetStore, dry_run: bool = False) -> Tuple[PostReport, Optional[tuple]]:
+    """Report for one Post row plus its new (canvasData, background, image),
+    or None when nothing changed."""
+    post_id, canvas_data, background, image = row[:4]
+    report = PostReport(post_id)
+    extractor = Extractor(store, dry_run)
+    fields = [canvas_data, background, image]
+    report.bytes_before = sum(len(f) for f in fields if f)
+
+    if canvas_data and '"data:' in canvas_data:
+        try:
+            parsed = json.loads(canvas_data)
+        except ValueError:
+            report.errors += 1
+        else:
+            rewritten = extractor.walk(parsed)
+            if extractor.assets:
+                # Same compact form JSON.stringify produces.
+                fields[0] = json.dumps(rewritten, ensure_ascii=False, separators=(',', ':'))
+    for i in (1, 2):
+        if fields[i] and _DATA_URI.match(fields[i]):
+            fields[i] = extractor.replace(fields[i])
+
+    report.assets = extractor.assets
+    report.errors += extractor.errors
+    report.bytes_after = sum(len(f) for f in fields if f)
+    if not extractor.assets:
+        return report, None
+    return report, tuple(fields)
+
+
+def extract(db: Optional[str] = None, root: str = ASSET_DIR, chunk: int = DEFAULT_CHUNK,
+            dry_run: bool = False) -> List[PostReport]:
+    store = AssetStore(root)
+    conn = connect(db, readonly=dry_run)
+    reports = []
+    try:
+        for rows in iter_candidates(conn, chunk):
+            updates = []
+            for row in rows:
+                report, fields = extract_row(row, store, dry_run)
+                reports.append(report)
+                if fields is not None:
+                    updates.append((report, fields + (report.id, row[4])))
+            if updates and not dry_run:
+                with conn:
+                    for report, params in updates:
+                        cursor = conn.execute('UPDATE Post SET canvasData = ?, background = ?, image = ? '
+                                              'WHERE id = ? AND updatedAt = ?', params)
+                        report.skipped = cursor.rowcount == 0
+    finally:
+        conn.close()
+    return reports
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help='SQLite database holding the Post table')
+    parser.add_argument('--root', default=ASSET_DIR, help='directory for extracted assets')
+    parser.add_argument('--chunk', type=int, default=DEFAULT_CHUNK, help='posts per read/commit')
+    parser.add_argument('--dry-run', action='store_true', help='report without writing files or rows')
+    args = parser.parse_args(argv)
+
+    try:
+        reports = extract(args.db, args.root, args.chunk, args.dry_run)
+    except FileNotFoundError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    changed = [r for r in reports if r.assets and not r.skipped]
+    for r in changed:
+        print(f'{r.id}  {r.assets:3d} assets  {r.bytes_before:>12,} -> {r.bytes_after:>10,} bytes  '
+              f'saved {r.saved:>12,}')
+    for r in reports:
+        if r.errors:
+            print(f'{r.id}  {r.errors} value(s) could not be decoded and were left inline')
+        if r.skipped:
+            print(f'{r.id}  saved by the app while running; skipped')
+    total = sum(r.saved for r in changed)
+    assets = sum(r.assets for r in changed)
+    verb = 'would save' if args.dry_run else 'saved'
+    print(f'{len(changed)} posts, {assets} assets extracted, {verb} {total:,} bytes')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
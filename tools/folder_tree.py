@@ -0,0 +1,419 @@
+"""Closure table and subtree totals for the Folder hierarchy.
+
+    python -m tools.folder_tree rebuild           # recompute both tables from Folder/File
+    python -m tools.folder_tree sync              # patch them to match Folder/File
+    python -m tools.folder_tree apply changes.jsonl
+    python -m tools.folder_tree check             # compare with a fresh computation
+    python -m tools.folder_tree show <folderId>   # breadcrumbs, subtree size
+
+``Folder`` only has ``parentId``, so listing a subtree or building
+breadcrumbs takes one query per level.  ``FolderClosure`` holds a row
+``(ancestorId, descendantId, depth)`` for every folder and each of its
+ancestors, the folder itself included at depth 0.  ``FolderStats`` holds
+each folder's own file count and size together with the totals of its whole
+subtree.  A subtree, a breadcrumb trail or a size badge is then a single
+indexed query (see ``subtree``, ``breadcrumbs`` and ``stats``).
+
+``rebuild`` recomputes both tables.  ``apply`` patches them from a batch of
+changes (JSON lines, ops below).  ``sync`` finds the changes itself: the
+folder structure is compared with the depth-1 closure rows, and per-folder
+file counts with ``FolderStats``.  Either way, a change only touches the
+closure rows and totals of the folders on its path.  A folder deleted through
+the app takes its closure and stats rows with it (``ON DELETE CASCADE``)
+before ``sync`` can see it, so ``sync`` also finds the folders whose subtree
+totals no longer equal their own files plus their children's subtrees, and
+passes the difference up their path.
+
+    {"op": "folder.create", "id": ..., "parentId": ...}
+    {"op": "folder.move", "id": ..., "parentId": ...}
+    {"op": "folder.delete", "id": ...}        # with its subtree, like the cascade
+    {"op": "file.add", "folderId": ..., "size": ...}
+    {"op": "file.remove", "folderId": ..., "size": ...}
+    {"op": "file.move", "from": ..., "to": ..., "size": ...}
+"""
+
+import argparse
+import json
+import sqlite3
+import sys
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from tools.db import connect
+
+
+# Same DDL `prisma db push` creates for the FolderClosure and FolderStats models.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS "FolderClosure" (
+    "ancestorId" TEXT NOT NULL,
+    "descendantId" TEXT NOT NULL,
+    "depth" INTEGER NOT NULL,
+
+    PRIMARY KEY ("ancestorId", "descendantId"),
+    CONSTRAINT "FolderClosure_ancestorId_fkey" FOREIGN KEY ("ancestorId") REFERENCES "Folder" ("id")
+        ON DELETE CASCADE ON UPDATE CASCADE,
+    CONSTRAINT "FolderClosure_descendantId_fkey" FOREIGN KEY ("descendantId") REFERENCES "Folder" ("id")
+        ON DELETE CASCADE ON UPDATE CASCADE
+);
+CREATE INDEX IF NOT EXISTS "FolderClosure_descendantId_depth_idx" ON "FolderClosure"("descendantId", "depth");
+CREATE TABLE IF NOT EXISTS "FolderStats" (
+    "folderId" TEXT NOT NULL PRIMARY KEY,
+    "fileCount" INTEGER NOT NULL,
+    "totalSize" BIGINT NOT NULL,
+    "subtreeFileCount" INTEGER NOT NULL,
+    "subtreeSize" BIGINT NOT NULL,
+    CONSTRAINT "FolderStats_folderId_fkey" FOREIGN KEY ("folderId") REFERENCES "Folder" ("id")
+        ON DELETE CASCADE ON UPDATE CASCADE
+);
+"""
+
+# (ancestorId, descendantId, depth)
+ClosureRow = Tuple[str, str, int]
+# folderId -> [fileCount, totalSize, subtreeFileCount, subtreeSize]
+Stats = Dict[str, List[int]]
+
+
+def ensure_schema(conn) -> None:
+    with conn:
+        conn.executescript(_SCHEMA)
+
+
+# -- full computation --------------------------------------------------------
+
+def _parents(conn) -> Dict[str, Optional[str]]:
+    return dict(conn.execute('SELECT id, parentId FROM Folder'))
+
+
+def _direct_totals(conn) -> Dict[str, Tuple[int, int]]:
+    rows = conn.execute('SELECT folderId, COUNT(*), COALESCE(SUM(size), 0) FROM File '
+                        'WHERE folderId IS NOT NULL GROUP BY folderId')
+    return {folder_id: (count, size) for folder_id, count, size in rows}
+
+
+def _ancestor_chains(parents: Dict[str, Optional[str]]) -> Dict[str, List[str]]:
+    """Folder id -> its ancestors from itself up to the root.
+
+    A parent that does not exist ends the chain, as does a cycle.
+    """
+    chains: Dict[str, List[str]] = {}
+    for start in parents:
+        path: List[str] = []
+        seen = set()
+        node: Optional[str] = start
+        while node is not None and node in parents and node not in chains and node not in seen:
+            seen.add(node)
+            path.append(node)
+            node = parents[node]
+        tail = chains.get(node, []) if node is not None else []
+        # Fill in every folder on the walk, nearest to the known tail last.
+        for i in range(len(path) - 1, -1, -1):
+            tail = [path[i]] + tail
+            chains[path[i]] = tail
+    return chains
+
+
+def compute(conn) -> Tuple[List[ClosureRow], Stats]:
+    """Closure rows and stats as they should be for the current Folder/File rows."""
+    chains = _ancestor_chains(_parents(conn))
+    direct = _direct_totals(conn)
+    rows: List[ClosureRow] = []
+    stats: Stats = {folder_id: [0, 0, 0, 0] for folder_id in chains}
+    for folder_id, chain in chains.items():
+        rows.extend((ancestor, folder_id, depth) for depth, ancestor in enumerate(chain))
+        count, size = direct.get(folder_id, (0, 0))
+        stats[folder_id][0:2] = [count, size]
+        for ancestor in chain:
+            stats[ancestor][2] += count
+            stats[ancestor][3] += size
+    return rows, stats
+
+
+def rebuild(conn) -> Tuple[int, int]:
+    """Replace both tables; returns (closure rows, folders)."""
+    ensure_schema(conn)
+    rows, stats = compute(conn)
+    with conn:
+        conn.execute('DELETE FROM FolderClosure')
+        conn.execute('DELETE FROM FolderStats')
+        conn.executemany('INSERT INTO FolderClosure (ancestorId, descendantId, depth) VALUES (?, ?, ?)', rows)
+        conn.executemany(
+            'INSERT INTO FolderStats (folderId, fileCount, totalSize, subtreeFileCount, subtreeSize) '
+            'VALUES (?, ?, ?, ?, ?)', [(folder_id, *values) for folder_id, values in stats.items()])
+    return len(rows), len(stats)
+
+
+def check(conn) -> List[str]:
+    """Differences between the stored tables and ``compute``; empty when they agree."""
+    rows, stats = compute(conn)
+    problems = []
+    stored_rows = {tuple(row) for row in conn.execute('SELECT ancestorId, descendantId, depth FROM FolderClosure')}
+    expected_rows = set(rows)
+    for row in sorted(expected_rows - stored_rows):
+        problems.append(f'missing closure row {row}')
+    for row in sorted(stored_rows - expected_rows):
+        problems.append(f'extra closure row {row}')
+    stored_stats = {row[0]: list(row[1:]) for row in conn.execute(
+        'SELECT folderId, fileCount, totalSize, subtreeFileCount, subtreeSize FROM FolderStats')}
+    for folder_id in sorted(stats.keys() | stored_stats.keys()):
+        if stats.get(folder_id) != stored_stats.get(folder_id):
+            problems.append(f'stats of {folder_id}: stored {stored_stats.get(folder_id)}, '
+                            f'expected {stats.get(folder_id)}')
+    return problems
+
+
+# -- incremental changes -----------------------------------------------------
+
+def _add_files(conn, folder_id: Optional[str], count: int, size: int) -> None:
+    """Count files into a folder and every ancestor's subtree totals (root files are not tracked)."""
+    if folder_id is None or (count == 0 and size == 0):
+        return
+    conn.execute('UPDATE FolderStats SET fileCount = fileCount + ?, totalSize = totalSize + ? '
+                 'WHERE folderId = ?', (count, size, folder_id))
+    conn.execute('UPDATE FolderStats SET subtreeFileCount = subtreeFileCount + ?, subtreeSize = subtreeSize + ? '
+                 'WHERE folderId IN (SELECT ancestorId FROM FolderClosure WHERE descendantId = ?)',
+                 (count, size, folder_id))
+
+
+def _add_to_ancestors(conn, folder_id: str, count: int, size: int) -> None:
+    """Add to the subtree totals of the folder's strict ancestors."""
+    conn.execute('UPDATE FolderStats SET subtreeFileCount = subtreeFileCount + ?, subtreeSize = subtreeSize + ? '
+                 'WHERE folderId IN (SELECT ancestorId FROM FolderClosure WHERE descendantId = ? AND depth > 0)',
+                 (count, size, folder_id))
+
+
+def _subtree_totals(conn, folder_id: str) -> Tuple[int, int]:
+    row = conn.execute('SELECT subtreeFileCount, subtreeSize FROM FolderStats WHERE folderId = ?',
+                       (folder_id,)).fetchone()
+    return tuple(row) if row else (0, 0)
+
+
+def create_folder(conn, folder_id: str, parent_id: Optional[str]) -> None:
+    conn.execute('INSERT OR IGNORE INTO FolderClosure (ancestorId, descendantId, depth) VALUES (?, ?, 0)',
+                 (folder_id, folder_id))
+    if parent_id is not None:
+        conn.execute('INSERT OR IGNORE INTO FolderClosure (ancestorId, descendantId, depth) '
+                     'SELECT ancestorId, ?, depth + 1 FROM FolderClosure WHERE descendantId = ?',
+                     (folder_id, parent_id))
+    conn.execute('INSERT OR IGNORE INTO FolderStats (folderId, fileCount, totalSize, subtreeFileCount, '
+                 'subtreeSize) VALUES (?, 0, 0, 0, 0)', (folder_id,))
+
+
+def move_folder(conn, folder_id: str, parent_id: Optional[str]) -> None:
+    """Re-hang a subtree; raises ``ValueError`` for a move into itself."""
+    if parent_id is not None and conn.execute(
+            'SELECT 1 FROM FolderClosure WHERE ancestorId = ? AND descendantId = ?',
+            (folder_id, parent_id)).fetchone():
+        raise ValueError(f'cannot move folder {folder_id} into its own subtree')
+    count, size = _subtree_totals(conn, folder_id)
+    _add_to_ancestors(conn, folder_id, -count, -size)
+    conn.execute('DELETE FROM FolderClosure '
+                 'WHERE descendantId IN (SELECT descendantId FROM FolderClosure WHERE ancestorId = ?) '
+                 'AND ancestorId NOT IN (SELECT descendantId FROM FolderClosure WHERE ancestorId = ?)',
+                 (folder_id, folder_id))
+    if parent_id is not None:
+        conn.execute('INSERT INTO FolderClosure (ancestorId, descendantId, depth) '
+                     'SELECT p.ancestorId, s.descendantId, p.depth + s.depth + 1 '
+                     'FROM FolderClosure p, FolderClosure s WHERE p.descendantId = ? AND s.ancestorId = ?',
+                     (parent_id, folder_id))
+    _add_to_ancestors(conn, folder_id, count, size)
+
+
+def delete_folder(conn, folder_id: str) -> None:
+    """Drop a folder with its subtree (and the files in it, as the cascade does)."""
+    count, size = _subtree_totals(conn, folder_id)
+    _add_to_ancestors(conn, folder_id, -count, -size)
+    conn.execute('DELETE FROM FolderStats WHERE folderId IN '
+                 '(SELECT descendantId FROM FolderClosure WHERE ancestorId = ?)', (folder_id,))
+    conn.execute('DELETE FROM FolderClosure WHERE descendantId IN '
+                 '(SELECT descendantId FROM FolderClosure WHERE ancestorId = ?)', (folder_id,))
+
+
+def apply_change(conn, change: dict) -> None:
+    op = change.get('op')
+    if op == 'folder.create':
+        create_folder(conn, change['id'], change.get('parentId'))
+    elif op == 'folder.move':
+        move_folder(conn, change['id'], change.get('parentId'))
+    elif op == 'folder.delete':
+        delete_folder(conn, change['id'])
+    elif op == 'file.add':
+        _add_files(conn, change.get('folderId'), 1, int(change.get('size', 0)))
+    elif op == 'file.remove':
+        _add_files(conn, change.get('folderId'), -1, -int(change.get('size', 0)))
+    elif op == 'file.move':
+        size = int(change.get('size', 0))
+        _add_files(conn, change.get('from'), -1, -size)
+        _add_files(conn, change.get('to'), 1, size)
+    else:
+        raise ValueError(f'unknown change: {change!r}')
+
+
+def apply(conn, changes: Iterable[dict]) -> int:
+    """Apply a batch of changes in one transaction; returns how many were applied."""
+    ensure_schema(conn)
+    applied = 0
+    with conn:
+        for change in changes:
+            apply_change(conn, change)
+            applied += 1
+    return applied
+
+
+def sync_changes(conn) -> List[dict]:
+    """Changes that bring the stored tables in line with Folder/File."""
+    ensure_schema(conn)
+    current = _parents(conn)
+    stored = {row[0]: None for row in conn.execute('SELECT descendantId FROM FolderClosure WHERE depth = 0')}
+    stored.update(conn.execute('SELECT descendantId, ancestorId FROM FolderClosure WHERE depth = 1'))
+    changes: List[dict] = []
+
+    # New folders parents first, so each create finds its parent's rows.
+    created = set()
+
+    def create(folder_id: str) -> None:
+        parent = current[folder_id]
+        if parent is not None and parent in current and parent not in stored and parent not in created:
+            create(parent)
+        created.add(folder_id)
+        changes.append({'op': 'folder.create', 'id': folder_id,
+                        'parentId': parent if parent in current else None})
+
+    for folder_id in current:
+        if folder_id not in stored and folder_id not in created:
+            create(folder_id)
+    for folder_id, parent in current.items():
+        parent = parent if parent in current else None
+        if folder_id in stored and stored[folder_id] != parent:
+            changes.append({'op': 'folder.move', 'id': folder_id, 'parentId': parent})
+    gone = [folder_id for folder_id in stored if folder_id not in current]
+    gone_set = set(gone)
+    for folder_id in gone:
+        # A deleted parent takes the subtree with it.
+        if stored[folder_id] not in gone_set:
+            changes.append({'op': 'folder.delete', 'id': folder_id})
+    return changes
+
+
+def subtree_drift(conn) -> List[Tuple[str, int, int]]:
+    """``(folderId, count, size)`` each folder's subtree totals are off by.
+
+    A subtree total should be the folder's own files plus its children's
+    subtree totals; a child whose rows went with a cascaded delete leaves its
+    parent (and, through it, every ancestor) counting files that are gone.
+    """
+    return [tuple(row) for row in conn.execute(
+        'SELECT s.folderId, s.fileCount + COALESCE(SUM(k.subtreeFileCount), 0) - s.subtreeFileCount AS count, '
+        's.totalSize + COALESCE(SUM(k.subtreeSize), 0) - s.subtreeSize AS size '
+        'FROM FolderStats s LEFT JOIN FolderClosure c ON c.ancestorId = s.folderId AND c.depth = 1 '
+        'LEFT JOIN FolderStats k ON k.folderId = c.descendantId '
+        'GROUP BY s.folderId HAVING count != 0 OR size != 0')]
+
+
+def sync(conn) -> int:
+    """Apply structural changes, then subtree corrections for cascaded deletes and per-folder
+    file count deltas; returns changes applied."""
+    changes = sync_changes(conn)
+    try:
+        applied = apply(conn, changes)
+    except ValueError:
+        # Moves that swap ancestors cannot be applied one by one.
+        rebuild(conn)
+        return len(changes)
+    direct = _direct_totals(conn)
+    stored = {row[0]: (row[1], row[2]) for row in conn.execute(
+        'SELECT folderId, fileCount, totalSize FROM FolderStats')}
+    with conn:
+        # Every drift is measured against the stored totals before any is fixed, so they add up.
+        for folder_id, count, size in subtree_drift(conn):
+            conn.execute('UPDATE FolderStats SET subtreeFileCount = subtreeFileCount + ?, '
+                         'subtreeSize = subtreeSize + ? WHERE folderId = ?', (count, size, folder_id))
+            _add_to_ancestors(conn, folder_id, count, size)
+            applied += 1
+        for folder_id, (count, size) in stored.items():
+            new_count, new_size = direct.get(folder_id, (0, 0))
+            if (new_count, new_size) != (count, size):
+                _add_files(conn, folder_id, new_count - count, new_size - size)
+                applied += 1
+    return applied
+
+
+# -- queries -----------------------------------------------------------------
+
+def subtree(conn, folder_id: str, max_depth: Optional[int] = None) -> List[tuple]:
+    """``(id, name, path, depth)`` of the folder and everything below it."""
+    return conn.execute(
+        'SELECT f.id, f.name, f.path, c.depth FROM FolderClosure c JOIN Folder f ON f.id = c.descendantId '
+        'WHERE c.ancestorId = ? AND (? IS NULL OR c.depth <= ?) ORDER BY f.path',
+        (folder_id, max_depth, max_depth)).fetchall()
+
+
+def breadcrumbs(conn, folder_id: str) -> List[tuple]:
+    """``(id, name)`` from the top-level folder down to ``folder_id``."""
+    return conn.execute(
+        'SELECT f.id, f.name FROM FolderClosure c JOIN Folder f ON f.id = c.ancestorId '
+        'WHERE c.descendantId = ? ORDER BY c.depth DESC', (folder_id,)).fetchall()
+
+
+def stats(conn, folder_ids: Sequence[str]) -> Dict[str, Tuple[int, int, int, int]]:
+    """``folderId -> (fileCount, totalSize, subtreeFileCount, subtreeSize)``."""
+    marks = ','.join('?' * len(folder_ids))
+    return {row[0]: tuple(row[1:]) for row in conn.execute(
+        'SELECT folderId, fileCount, totalSize, subtreeFileCount, subtreeSize FROM FolderStats '
+        f'WHERE folderId IN ({marks})', tuple(folder_ids))}
+
+
+def _read_changes(path: str) -> Iterable[dict]:
+    with (sys.stdin if path == '-' else open(path, encoding='utf-8')) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=('rebuild', 'sync', 'apply', 'check', 'show'))
+    parser.add_argument('arg', nargs='?', help='change file for apply ("-" for stdin), folder id for show')
+    parser.add_argument('--db', help='SQLite database holding the Folder and File tables')
+    args = parser.parse_args(argv)
+    if args.command in ('apply', 'show') and not args.arg:
+        parser.error(f'{args.command} needs an argument')
+
+    try:
+        conn = connect(args.db, readonly=args.command == 'check')
+    except FileNotFoundError as e:
+        print(e, file=sys.stderr)
+        return 1
+    started = time.perf_counter()
+    try:
+        if args.command == 'rebuild':
+            rows, folders = rebuild(conn)
+            print(f'{folders} folders, {rows} closure rows in {time.perf_counter() - started:.2f}s')
+        elif args.command == 'sync':
+            print(f'{sync(conn)} changes applied in {time.perf_counter() - started:.2f}s')
+        elif args.command == 'apply':
+            print(f'{apply(conn, _read_changes(args.arg))} changes applied')
+        elif args.command == 'check':
+            problems = check(conn)
+            for problem in problems[:50]:
+                print(problem)
+            print(f'{len(problems)} differences')
+            return 1 if problems else 0
+        else:
+            trail = breadcrumbs(conn, args.arg)
+            if not trail:
+                print(f'unknown folder: {args.arg}', file=sys.stderr)
+                return 1
+            print(' / '.join(name for _, name in trail))
+            count, size, sub_count, sub_size = stats(conn, [args.arg]).get(args.arg, (0, 0, 0, 0))
+            print(f'{len(subtree(conn, args.arg)) - 1} subfolders; {count} files ({size:,} bytes) here, '
+                  f'{sub_count} files ({sub_size:,} bytes) in the subtree')
+    except (sqlite3.Error, ValueError, KeyError) as e:
+        print(f'{type(e).__name__}: {e}', file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,256 @@
+"""Delete upload files that no ``File`` row (or ``Post.pdfUrl``) points at.
+
+    python -m tools.gc_uploads --dry-run            # list orphans and their size
+    python -m tools.gc_uploads --grace 7d --jobs 16
+
+``DELETE /api/file-manager/files`` drops the rows but leaves the files on
+disk.  This walks the upload root (``UPLOAD_PATH`` or ``uploads``, as in
+``src/lib/upload-path.ts``) in sorted order and reads ``File.path`` in the
+same order one keyset page at a time, so the two sides are merge-joined
+without holding either in memory.  If the root lies under ``public``, the
+``Post.pdfUrl`` values below it are merged in as references too.  The
+directories ``tools.asset_store``, ``tools.render_cache``,
+``tools.image_variants`` and ``tools.upload_store`` manage are skipped.
+
+Files modified less than ``--grace`` ago are kept, since the upload route
+writes the file before it inserts the row.  Orphans are unlinked from a
+thread pool.  Directories are left in place because folders own them.
+"""
+
+import argparse
+import heapq
+import os
+import re
+import sqlite3
+import stat
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from tools.asset_store import ASSET_DIR
+from tools.db import REPO_ROOT, connect
+from tools.image_variants import VARIANT_DIR
+from tools.pdf_render import PUBLIC_DIR
+from tools.render_cache import CACHE_DIR
+
+
+UPLOAD_DIR = os.path.join(REPO_ROOT, os.environ.get('UPLOAD_PATH') or 'uploads')
+DEFAULT_CHUNK = 5000
+DEFAULT_GRACE = 24 * 3600
+DEFAULT_JOBS = 8
+# Orphans handed to the pool at a time.
+_BATCH = 256
+
+
+@dataclass
+class Orphan:
+    path: str
+    size: int
+    mtime: float
+
+
+@dataclass
+class GcReport:
+    scanned: int = 0
+    referenced: int = 0
+    young: int = 0
+    # References whose file is gone.
+    missing: int = 0
+    orphans: int = 0
+    orphan_bytes: int = 0
+    deleted: int = 0
+    reclaimed: int = 0
+    failed: List[Tuple[str, str]] = field(default_factory=list)
+
+
+def walk_sorted(root: str, skip: Sequence[str] = ()) -> Iterator[Tuple[str, os.stat_result]]:
+    """``(relative path, lstat)`` of every file below ``root``, in path order.
+
+    Entries are sorted with ``/`` appended to directory names, so the
+    depth-first walk yields relative paths in plain string order, the same
+    order SQLite's ``ORDER BY`` gives for ``File.path``.
+    """
+    skip = {os.path.abspath(p) for p in skip}
+
+    def walk(directory: str, prefix: str) -> Iterator[Tuple[str, os.stat_result]]:
+        try:
+            with os.scandir(directory) as it:
+                entries = [(e.name + '/' if e.is_dir(follow_symlinks=False) else e.name, e) for e in it]
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        entries.sort(key=lambda item: item[0])
+        for key, entry in entries:
+            if key.endswith('/'):
+                if os.path.abspath(entry.path) not in skip:
+                    yield from walk(entry.path, prefix + key)
+                continue
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            if stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode):
+                yield prefix + key, st
+
+    yield from walk(root, '')
+
+
+def iter_file_paths(conn, chunk: int = DEFAULT_CHUNK) -> Iterator[str]:
+    """``File.path`` in order, by keyset pages over its unique index."""
+    after = None
+    while True:
+        if after is None:
+            rows = conn.execute('SELECT path FROM File ORDER BY path LIMIT ?', (chunk,)).fetchall()
+        else:
+            rows = conn.execute('SELECT path FROM File WHERE path > ? ORDER BY path LIMIT ?',
+                                (after, chunk)).fetchall()
+        if not rows:
+            return
+        for (path,) in rows:
+            yield path
+        after = rows[-1][0]
+
+
+def iter_pdf_paths(conn, root: str, public_dir: str = PUBLIC_DIR) -> Iterator[str]:
+    """``Post.pdfUrl`` values that point below ``root``, relative to it, in order."""
+    rel = os.path.relpath(os.path.abspath(root), os.path.abspath(public_dir))
+    if rel == os.pardir or rel.startswith(os.pardir + os.sep):
+        return
+    prefix = '/' if rel == os.curdir else '/' + rel.replace(os.sep, '/') + '/'
+    # A common prefix keeps the order of the suffixes; substr() avoids LIKE's wildcards.
+    rows = conn.execute('SELECT substr(pdfUrl, ?) FROM Post WHERE substr(pdfUrl, 1, ?) = ? ORDER BY pdfUrl',
+                        (len(prefix) + 1, len(prefix), prefix))
+    for (path,) in rows:
+        yield path
+
+
+def merge_join(files: Iterable[Tuple[str, os.stat_result]], references: Iterable[str],
+               report: GcReport) -> Iterator[Tuple[str, os.stat_result]]:
+    """Files that no reference names; both inputs sorted, references may repeat."""
+    refs = iter(references)
+    ref = next(refs, None)
+    for path, st in files:
+        report.scanned += 1
+        while ref is not None and ref < path:
+            report.missing += 1
+            ref = next(refs, None)
+        if ref == path:
+            report.referenced += 1
+            while ref == path:
+                ref = next(refs, None)
+            continue
+        yield path, st
+    while ref is not None:
+        report.missing += 1
+        ref = next(refs, None)
+
+
+def _unlink(path: str) -> Optional[str]:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        return str(e)
+    return None
+
+
+def collect(
+    db: Optional[str] = None,
+    root: str = UPLOAD_DIR,
+    grace: float = DEFAULT_GRACE,
+    dry_run: bool = False,
+    jobs: int = DEFAULT_JOBS,
+    chunk: int = DEFAULT_CHUNK,
+    public_dir: str = PUBLIC_DIR,
+    on_orphan: Optional[Callable[[Orphan], None]] = None,
+) -> GcReport:
+    report = GcReport()
+    conn = connect(db, readonly=True)
+    cutoff = time.time() - grace
+    # Same directories, under the public directory in use.
+    managed = [os.path.join(public_dir, os.path.relpath(d, PUBLIC_DIR)) for d in (ASSET_DIR, CACHE_DIR, VARIANT_DIR)]
+    skip = [d for d in managed if os.path.abspath(d) != os.path.abspath(root)]
+    # Imported here: tools.upload_store builds on this module.
+    from tools.upload_store import BLOB_DIR
+    skip.append(os.path.join(root, BLOB_DIR))
+    try:
+        references = heapq.merge(iter_file_paths(conn, chunk), iter_pdf_paths(conn, root, public_dir))
+        orphans = merge_join(walk_sorted(root, skip), references, report)
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+            batch: List[Orphan] = []
+
+            def flush() -> None:
+                if not dry_run:
+                    paths = [os.path.join(root, o.path) for o in batch]
+                    for orphan, error in zip(batch, pool.map(_unlink, paths)):
+                        if error is None:
+                            report.deleted += 1
+                            report.reclaimed += orphan.size
+                        else:
+                            report.failed.append((orphan.path, error))
+                batch.clear()
+
+            for path, st in orphans:
+                if st.st_mtime > cutoff:
+                    report.young += 1
+                    continue
+                orphan = Orphan(path, st.st_size, st.st_mtime)
+                report.orphans += 1
+                report.orphan_bytes += orphan.size
+                if on_orphan is not None:
+                    on_orphan(orphan)
+                batch.append(orphan)
+                if len(batch) >= _BATCH:
+                    flush()
+            flush()
+    finally:
+        conn.close()
+    return report
+
+
+def parse_duration(text: str) -> float:
+    m = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*', text, re.I)
+    if not m:
+        raise argparse.ArgumentTypeError(f'invalid duration: {text!r}')
+    return float(m.group(1)) * {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}[m.group(2).lower()]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help='SQLite database holding the File table')
+    parser.add_argument('--root', default=UPLOAD_DIR, help='upload directory')
+    parser.add_argument('--public', default=PUBLIC_DIR, help='public directory pdfUrl values resolve against')
+    parser.add_argument('--grace', type=parse_duration, default=DEFAULT_GRACE,
+                        help='keep files modified more recently than this, e.g. 30m, 24h, 7d')
+    parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS, help='deleting threads')
+    parser.add_argument('--chunk', type=int, default=DEFAULT_CHUNK, help='File rows per read')
+    parser.add_argument('--dry-run', action='store_true', help='list orphans without deleting them')
+    parser.add_argument('--quiet', action='store_true', help='only print the summary')
+    args = parser.parse_args(argv)
+
+    def show(orphan: Orphan) -> None:
+        print(f'{orphan.size:>12,}  {orphan.path}')
+
+    started = time.perf_counter()
+    try:
+        report = collect(args.db, args.root, args.grace, args.dry_run, args.jobs, args.chunk, args.public,
+                         None if args.quiet else show)
+    except (FileNotFoundError, sqlite3.Error) as e:
+        print(e, file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - started
+
+    for path, error in report.failed:
+        print(f'ERROR {path}: {error}', file=sys.stderr)
+    done = (f'would reclaim {report.orphan_bytes:,} bytes' if args.dry_run
+            else f'deleted {report.deleted}, reclaimed {report.reclaimed:,} bytes')
+    print(f'{report.scanned} files scanned, {report.referenced} referenced, {report.orphans} orphans '
+          f'({report.young} more within the grace period), {report.missing} references without a file; '
+          f'{done} in {elapsed:.1f}s')
+    return 1 if report.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
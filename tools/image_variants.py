@@ -0,0 +1,401 @@
+"""Replace full-size images in posts with variants sized to the box they are drawn in.
+
+    python -m tools.image_variants --dry-run          # report what would be saved
+    python -m tools.image_variants --scale 2 --jobs 8
+    python -m tools.image_variants --format webp --quality 75
+
+The editor and the PDF export draw every ``image`` element with
+``drawImage(img, x, y, width, height)`` and the background at the canvas
+size, so a 6000px photo in a 300px box is decoded at full size for nothing.
+A first pass over ``Post.canvasData`` records, for every image, the largest
+box it is drawn in across all posts.  Each image is then decoded once in a
+thread pool (Pillow releases the GIL), downscaled to that box times
+``--scale`` (keeping its aspect ratio, after EXIF rotation) and re-encoded.
+The result is stored by content hash under ``public/uploads/variants``.  A
+second pass points the posts at the variants.
+
+The original stays where it was and is recorded in the element as
+``originalImage`` (``originalBackground`` for the canvas), so the editor
+can go back to it.  Editor saves rebuild the canvas data without
+``originalBackground`` and the ``Post.background`` column has nowhere to
+keep one, so every variant URL is also mapped to its original in
+``.originals.db`` next to the variants, which a save cannot drop.  A later
+run sizes from the original, so an element that was enlarged gets a larger
+variant.  An image the user replaced since is picked up as a new original.  Inline ``data:`` images are stored as assets
+first, as ``tools.extract_assets`` does.  Images already within 90% of the
+size they are drawn at are left alone.  ``Post.image`` (the cover shown
+outside the canvas) is not touched.
+
+``--format jpeg`` writes JPEG, or PNG for images with transparency; both
+can be drawn by ``tools.pdf_render``.  ``--format webp`` is smaller but
+only the browser export can draw it.  Needs Pillow.
+"""
+
+import argparse
+import io
+import json
+import math
+import os
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from tools.asset_store import ASSET_DIR, AssetStore, extension_for
+from tools.db import connect
+from tools.extract_assets import decode_data_uri
+from tools.pdf_images import ImageError, read_source
+from tools.pdf_render import DEFAULT_HEIGHT, DEFAULT_WIDTH, PUBLIC_DIR, element_number
+from tools.raster import WEBP_QUALITY
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is required to run, not to import.
+    Image = ImageOps = None
+
+
+VARIANT_DIR = os.path.join(PUBLIC_DIR, 'uploads', 'variants')
+VARIANT_URL = '/uploads/variants'
+# Variant URL -> original URL; a dotfile, so the upload server does not serve it.
+ORIGINALS_INDEX = '.originals.db'
+FORMATS = ('jpeg', 'webp')
+JPEG_QUALITY = 82
+DEFAULT_SCALE = 2.0
+DEFAULT_CHUNK = 200
+# Variants are only made when they are at most this fraction of the original's width.
+MAX_RATIO = 0.9
+_ROTATED = (5, 6, 7, 8)  # EXIF orientations that swap width and height
+_EXIF_ORIENTATION = 0x0112
+
+
+@dataclass
+class Variant:
+    """What one original image is replaced with (``url`` None: kept as is)."""
+    source: str
+    original: str  # URL recorded as the original (``source``, or its asset URL for data: URIs)
+    width: int = 0
+    height: int = 0
+    nbytes: int = 0
+    url: Optional[str] = None
+    variant_width: int = 0
+    variant_height: int = 0
+    variant_bytes: int = 0
+    error: str = ''
+
+    @property
+    def drawn(self) -> Tuple[int, int]:
+        """Pixels decoded and bytes loaded when this image is drawn."""
+        if self.url:
+            return self.variant_width * self.variant_height, self.variant_bytes
+        return self.width * self.height, self.nbytes
+
+
+@dataclass
+class PostReport:
+    id: str
+    images: int = 0
+    pixels_before: int = 0
+    pixels_after: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+    changed: bool = False
+
+
+def is_variant(url: Optional[str]) -> bool:
+    return isinstance(url, str) and url.startswith(VARIANT_URL + '/')
+
+
+def _image_slots(data: dict, background: Optional[str], width: float,
+                 height: float) -> Iterator[Tuple[object, str, str, Tuple[float, float]]]:
+    """``(holder, key, original key, box)`` for every image drawn by one post.
+
+    ``holder[key]`` is the reference; the holder is an element, the canvas
+    data, or None for the ``Post.background`` column.
+    """
+    for el in data.get('elements') or []:
+        if isinstance(el, dict) and el.get('type') == 'image' and isinstance(el.get('image'), str) and el['image']:
+            box = (element_number(el, 'width'), element_number(el, 'height'))
+            if box[0] > 0 and box[1] > 0:
+                yield el, 'image', 'originalImage', box
+    if _is_image_ref(data.get('background')):
+        yield data, 'background', 'originalBackground', (width, height)
+    if _is_image_ref(background):
+        yield None, 'background', 'originalBackground', (width, height)
+
+
+def _is_image_ref(value) -> bool:
+    return isinstance(value, str) and value.startswith(('data:', '/'))
+
+
+def original_of(value: str, recorded: Optional[str], originals: Optional[Dict[str, str]] = None) -> str:
+    """The original behind a reference: while it points at one of our variants, the one
+    recorded next to it, else the one in the originals index."""
+    if not is_variant(value):
+        return value
+    if isinstance(recorded, str) and recorded:
+        return recorded
+    return (originals or {}).get(value, value)
+
+
+def _open_originals(variant_dir: str) -> sqlite3.Connection:
+    os.makedirs(variant_dir, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(variant_dir, ORIGINALS_INDEX), timeout=30)
+    conn.execute('CREATE TABLE IF NOT EXISTS originals (variant TEXT PRIMARY KEY, original TEXT NOT NULL)')
+    return conn
+
+
+def load_originals(variant_dir: str = VARIANT_DIR) -> Dict[str, str]:
+    if not os.path.exists(os.path.join(variant_dir, ORIGINALS_INDEX)):
+        return {}
+    conn = _open_originals(variant_dir)
+    try:
+        return dict(conn.execute('SELECT variant, original FROM originals'))
+    finally:
+        conn.close()
+
+
+def record_originals(variants: Sequence[Variant], variant_dir: str = VARIANT_DIR) -> None:
+    conn = _open_originals(variant_dir)
+    try:
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO originals (variant, original) VALUES (?, ?)',
+                             [(v.url, v.original) for v in variants if v.url])
+    finally:
+        conn.close()
+
+
+def _oriented_size(im) -> Tuple[int, int]:
+    width, height = im.size
+    if im.getexif().get(_EXIF_ORIENTATION) in _ROTATED:
+        return height, width
+    return width, height
+
+
+def _has_alpha(im) -> bool:
+    if im.mode in ('RGBA', 'LA', 'PA', 'RGBa', 'La') or (im.mode == 'P' and 'transparency' in im.info):
+        alpha = im.convert('RGBA').getchannel('A')
+        return alpha.getextrema()[0] < 255
+    return False
+
+
+def make_variant(source: str, box: Tuple[float, float], fmt: str = 'jpeg', quality: Optional[int] = None,
+                 scale: float = DEFAULT_SCALE, public_dir: str = PUBLIC_DIR,
+                 store: Optional[AssetStore] = None, assets: Optional[AssetStore] = None,
+                 dry_run: bool = False) -> Variant:
+    """Decode ``source`` and, if it is larger than ``box`` * ``scale``, store a smaller copy."""
+    store = store or AssetStore(VARIANT_DIR, VARIANT_URL)
+    result = Variant(source, source)
+    try:
+        data = read_source(source, public_dir)
+        if source.startswith('data:'):
+            decoded = decode_data_uri(source)
+            mime = decoded[1] if decoded else 'application/octet-stream'
+            result.original = (assets or AssetStore(ASSET_DIR)).put(data, extension_for(mime), dry_run)
+        result.nbytes = len(data)
+        if data.lstrip()[:1] == b'<':
+            return result  # SVG: drawn at any size for the same cost
+        with Image.open(io.BytesIO(data)) as im:
+            result.width, result.height = _oriented_size(im)
+            if getattr(im, 'is_animated', False):
+                return result
+            ratio = max(box[0] * scale / result.width, box[1] * scale / result.height)
+            if ratio > MAX_RATIO:
+                return result
+            size = (max(1, math.ceil(result.width * ratio)), max(1, math.ceil(result.height * ratio)))
+            # JPEG can decode straight at 1/2, 1/4 or 1/8 of its size.
+            raw_size = size[::-1] if (result.width, result.height) != im.size else size
+            im.draft('RGB', raw_size)
+            icc = im.info.get('icc_profile')
+            frame = ImageOps.exif_transpose(im)
+            small = frame.resize(size, Image.LANCZOS, reducing_gap=3.0)
+        out = io.BytesIO()
+        if fmt == 'webp':
+            small = small.convert('RGBA' if _has_alpha(small) else 'RGB')
+            small.save(out, 'WEBP', quality=quality or WEBP_QUALITY, method=4, icc_profile=icc)
+            ext = '.webp'
+        elif _has_alpha(small):
+            small.convert('RGBA').save(out, 'PNG', optimize=True, icc_profile=icc)
+            ext = '.png'
+        else:
+            small.convert('RGB').save(out, 'JPEG', quality=quality or JPEG_QUALITY, optimize=True,
+                                      progressive=True, icc_profile=icc)
+            ext = '.jpg'
+        encoded = out.getvalue()
+        result.url = store.put(encoded, ext, dry_run)
+        result.variant_width, result.variant_height = size
+        result.variant_bytes = len(encoded)
+    except (ImageError, OSError, ValueError, Image.DecompressionBombError) as e:
+        result.error = str(e) or type(e).__name__
+    return result
+
+
+def iter_posts(conn, chunk: int) -> Iterator[List[tuple]]:
+    after = ''
+    while True:
+        rows = conn.execute(
+            "SELECT id, canvasData, background, updatedAt FROM Post "
+            "WHERE id > ? AND (instr(canvasData, '\"image\"') > 0 OR instr(canvasData, '\"/') > 0 "
+            "OR instr(canvasData, '\"data:') > 0 OR background LIKE '/%' OR background LIKE 'data:%') "
+            "ORDER BY id LIMIT ?", (after, chunk)).fetchall()
+        if not rows:
+            return
+        yield [tuple(row) for row in rows]
+        after = rows[-1][0]
+
+
+def _parse(canvas_data: Optional[str]) -> Optional[dict]:
+    try:
+        data = json.loads(canvas_data) if canvas_data else {}
+    except ValueError:
+        return None
+    if isinstance(data, list):
+        data = {'elements': data}
+    return data if isinstance(data, dict) else None
+
+
+def collect_boxes(conn, chunk: int, width: float, height: float,
+                  originals: Optional[Dict[str, str]] = None) -> Dict[str, Tuple[float, float]]:
+    """Largest width and height every original image is drawn at, over all posts."""
+    boxes: Dict[str, Tuple[float, float]] = {}
+    for rows in iter_posts(conn, chunk):
+        for _, canvas_data, background, _ in rows:
+            data = _parse(canvas_data)
+            if data is None:
+                continue
+            for holder, key, original_key, (w, h) in _image_slots(data, background, width, height):
+                value = holder[key] if holder is not None else background
+                recorded = data.get(original_key) if holder is None else holder.get(original_key)
+                source = original_of(value, recorded, originals)
+                if source.startswith(('data:', '/')):
+                    bw, bh = boxes.get(source, (0.0, 0.0))
+                    boxes[source] = (max(bw, w), max(bh, h))
+    return boxes
+
+
+def rewrite_post(row: tuple, variants: Dict[str, Variant], width: float, height: float,
+                 originals: Optional[Dict[str, str]] = None) -> Tuple[PostReport, Optional[tuple]]:
+    """Report for one Post row plus its new (canvasData, background), or None when nothing changed."""
+    post_id, canvas_data, background, _ = row
+    report = PostReport(post_id)
+    data = _parse(canvas_data)
+    if data is None:
+        return report, None
+    new_background = background
+    changed = False
+    for holder, key, original_key, _ in list(_image_slots(data, background, width, height)):
+        value = holder[key] if holder is not None else background
+        recorded = data.get(original_key) if holder is None else holder.get(original_key)
+        variant = variants.get(original_of(value, recorded, originals))
+        if variant is None or variant.error:
+            continue
+        report.images += 1
+        report.pixels_before += variant.width * variant.height
+        report.bytes_before += variant.nbytes
+        pixels, nbytes = variant.drawn
+        report.pixels_after += pixels
+        report.bytes_after += nbytes
+        target = variant.url or variant.original
+        if holder is None:
+            changed |= target != background
+            new_background = target
+            continue
+        if holder[key] != target:
+            holder[key] = target
+            changed = True
+        if variant.url and holder.get(original_key) != variant.original:
+            holder[original_key] = variant.original
+            changed = True
+        elif not variant.url and original_key in holder:
+            del holder[original_key]
+            changed = True
+    report.changed = changed
+    if not changed:
+        return report, None
+    # Same compact form JSON.stringify produces.
+    return report, (json.dumps(data, ensure_ascii=False, separators=(',', ':')), new_background)
+
+
+def build_variants(db: Optional[str] = None, fmt: str = 'jpeg', quality: Optional[int] = None,
+                   scale: float = DEFAULT_SCALE, jobs: Optional[int] = None, chunk: int = DEFAULT_CHUNK,
+                   width: float = DEFAULT_WIDTH, height: float = DEFAULT_HEIGHT, public_dir: str = PUBLIC_DIR,
+                   variant_dir: str = VARIANT_DIR, dry_run: bool = False) -> Tuple[List[PostReport], List[Variant]]:
+    if Image is None:
+        raise ImageError('tools.image_variants needs Pillow (pip install Pillow)')
+    store = AssetStore(variant_dir, VARIANT_URL)
+    assets = AssetStore(os.path.join(public_dir, os.path.relpath(ASSET_DIR, PUBLIC_DIR)))
+    conn = connect(db, readonly=dry_run)
+    reports = []
+    try:
+        originals = load_originals(variant_dir)
+        boxes = collect_boxes(conn, chunk, width, height, originals)
+        with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+            results = list(pool.map(
+                lambda item: make_variant(item[0], item[1], fmt, quality, scale, public_dir, store, assets, dry_run),
+                boxes.items()))
+        if not dry_run:
+            # Recorded before any post points at a variant.
+            record_originals(results, variant_dir)
+        variants = {v.source: v for v in results}
+        for rows in iter_posts(conn, chunk):
+            updates = []
+            for row in rows:
+                report, fields = rewrite_post(row, variants, width, height, originals)
+                if report.images:
+                    reports.append(report)
+                if fields is not None:
+                    # Skip rows saved by the app since they were read.
+                    updates.append(fields + (row[0], row[3]))
+            if updates and not dry_run:
+                with conn:
+                    conn.executemany('UPDATE Post SET canvasData = ?, background = ? WHERE id = ? AND updatedAt = ?',
+                                     updates)
+    finally:
+        conn.close()
+    return reports, results
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help='SQLite database holding the Post table')
+    parser.add_argument('--format', choices=FORMATS, default='jpeg', help='variant encoding')
+    parser.add_argument('--quality', type=int, help=f'encoder quality (default: JPEG {JPEG_QUALITY}, '
+                                                    f'WebP {WEBP_QUALITY})')
+    parser.add_argument('--scale', type=float, default=DEFAULT_SCALE,
+                        help='device pixels per canvas pixel the variants keep')
+    parser.add_argument('--width', type=float, default=DEFAULT_WIDTH, help='canvas width in px (backgrounds)')
+    parser.add_argument('--height', type=float, default=DEFAULT_HEIGHT, help='canvas height in px (backgrounds)')
+    parser.add_argument('--public', default=PUBLIC_DIR, help='directory site paths are resolved against')
+    parser.add_argument('--root', default=VARIANT_DIR, help='directory for the variants')
+    parser.add_argument('--jobs', type=int, help='decoding threads (default: one per CPU)')
+    parser.add_argument('--chunk', type=int, default=DEFAULT_CHUNK, help='posts per read/commit')
+    parser.add_argument('--dry-run', action='store_true', help='report without writing files or rows')
+    args = parser.parse_args(argv)
+    if args.scale <= 0:
+        parser.error('--scale must be positive')
+
+    try:
+        reports, variants = build_variants(args.db, args.format, args.quality, args.scale, args.jobs, args.chunk,
+                                           args.width, args.height, args.public, args.root, args.dry_run)
+    except (FileNotFoundError, ImageError) as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    for r in reports:
+        if r.pixels_after < r.pixels_before:
+            print(f'{r.id}  {r.images:3d} images  {r.pixels_before / 1e6:8.2f} -> {r.pixels_after / 1e6:6.2f} MP  '
+                  f'{r.bytes_before:>12,} -> {r.bytes_after:>10,} bytes{"" if r.changed else "  (unchanged)"}')
+    for v in variants:
+        if v.error:
+            print(f'{v.source[:80]}: {v.error}', file=sys.stderr)
+    made = [v for v in variants if v.url]
+    pixels = sum(r.pixels_before - r.pixels_after for r in reports)
+    nbytes = sum(r.bytes_before - r.bytes_after for r in reports)
+    verb = 'would be' if args.dry_run else 'were'
+    print(f'{len(variants)} images, {len(made)} downscaled; {sum(r.changed for r in reports)} posts {verb} rewritten; '
+          f'{pixels / 1e6:,.1f} MP less decoded and {nbytes:,} bytes less loaded per full view of every post')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
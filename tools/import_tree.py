@@ -0,0 +1,284 @@
+"""Import a local directory tree into the file manager (Folder/File rows and upload files).
+
+    python -m tools.import_tree ~/archive                       # into folder "archive"
+    python -m tools.import_tree ~/archive --into clients/2024 --jobs 8
+    python -m tools.import_tree ~/archive --into ''             # into the root folder
+
+Does what ``/api/file-manager/folders`` and ``/api/file-manager/upload`` do,
+in bulk.  Every directory below SOURCE becomes a ``Folder`` (``path``,
+``parentId``) under ``--into``, which is created if missing.  Every file is
+copied into the upload root in fixed-size blocks as ``<uuid>.<extension>``
+and gets a ``File`` row.  Its ``mimeType`` comes from the first bytes of
+the content, falling back to the file name.  The tree is walked as a
+stream, copies run in a thread pool, and rows go in with ``executemany``,
+one transaction per ``--batch`` files.  Memory therefore grows with the
+number of folders, not files.  A file whose name and size already exist in
+its target folder is skipped, so an interrupted import can simply be run
+again.
+"""
+
+import argparse
+import mimetypes
+import os
+import secrets
+import shutil
+import sqlite3
+import string
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from tools.db import connect
+from tools.gc_uploads import UPLOAD_DIR
+
+
+DEFAULT_BATCH = 2000
+DEFAULT_JOBS = 8
+_COPY_BLOCK = 1 << 20
+_SNIFF_BYTES = 512
+_CUID_CHARS = string.ascii_lowercase + string.digits
+
+# (offset, signature, MIME type), checked in order.
+_SIGNATURES = (
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (0, b'%PDF-', 'application/pdf'),
+    (0, b'BM', 'image/bmp'),
+    (0, b'II*\x00', 'image/tiff'),
+    (0, b'MM\x00*', 'image/tiff'),
+    (0, b'\x00\x00\x01\x00', 'image/x-icon'),
+    (0, b'\x1f\x8b', 'application/gzip'),
+    (0, b'7z\xbc\xaf\x27\x1c', 'application/x-7z-compressed'),
+    (0, b'Rar!\x1a\x07', 'application/vnd.rar'),
+    (0, b'ID3', 'audio/mpeg'),
+    (0, b'OggS', 'audio/ogg'),
+    (0, b'fLaC', 'audio/flac'),
+    (0, b'\x1aE\xdf\xa3', 'video/webm'),
+    (0, b'wOFF', 'font/woff'),
+    (0, b'wOF2', 'font/woff2'),
+    (0, b'SQLite format 3\x00', 'application/vnd.sqlite3'),
+)
+# Containers whose exact type depends on what is inside; the name decides.
+_ZIP_BASED = ('application/vnd.openxmlformats', 'application/vnd.oasis.opendocument', 'application/epub+zip',
+              'application/java-archive')
+
+
+@dataclass
+class ImportReport:
+    folders: int = 0
+    files: int = 0
+    bytes: int = 0
+    skipped: int = 0
+    failed: int = 0
+
+
+def new_cuid() -> str:
+    """An id shaped like Prisma's ``cuid()`` (the exact algorithm does not matter)."""
+    return 'c' + ''.join(secrets.choice(_CUID_CHARS) for _ in range(24))
+
+
+def sniff_mime(head: bytes, name: str) -> str:
+    """MIME type from the leading bytes of a file, then from its name."""
+    guessed = mimetypes.guess_type(name, strict=False)[0]
+    for offset, signature, mime in _SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            return mime
+    if head[:4] == b'RIFF':
+        return {b'WEBP': 'image/webp', b'WAVE': 'audio/wav', b'AVI ': 'video/x-msvideo'}.get(
+            head[8:12], 'application/octet-stream')
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        if brand in (b'avif', b'avis'):
+            return 'image/avif'
+        if brand in (b'heic', b'heix', b'mif1'):
+            return 'image/heic'
+        if brand == b'qt  ':
+            return 'video/quicktime'
+        return 'audio/mp4' if brand == b'M4A ' else 'video/mp4'
+    if head[:4] == b'PK\x03\x04':
+        if guessed and guessed.startswith(_ZIP_BASED):
+            return guessed
+        return 'application/zip'
+    if b'\x00' in head:
+        return guessed or 'application/octet-stream'
+    try:
+        text = head.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # A full head may end inside a multi-byte character.
+        if len(head) < _SNIFF_BYTES or e.start < len(head) - 3:
+            return guessed or 'application/octet-stream'
+        text = head[:e.start].decode('utf-8')
+    start = text.lstrip().lower()
+    if start.startswith('<svg') or (start.startswith('<?xml') and '<svg' in start):
+        return 'image/svg+xml'
+    if start.startswith(('<!doctype html', '<html')):
+        return 'text/html'
+    if guessed and (guessed.startswith('text/') or guessed in ('application/json', 'application/xml',
+                                                               'application/javascript')):
+        return guessed
+    return 'text/plain'
+
+
+def extension_of(name: str) -> str:
+    # Same as the upload route: ``file.name.split('.').pop()``.
+    return name.rsplit('.', 1)[-1]
+
+
+class Importer:
+    def __init__(self, conn, root: str = UPLOAD_DIR, batch: int = DEFAULT_BATCH, jobs: int = DEFAULT_JOBS,
+                 log=print):
+        self.conn = conn
+        self.root = root
+        self.batch = batch
+        self.jobs = jobs
+        self.log = log
+        self.report = ImportReport()
+        # Folder path -> id, for folders created or looked up in this run.
+        self.folder_ids: Dict[str, Optional[str]] = {'': None}
+        # Ids of folders this run created; they hold nothing to skip.
+        self.created: Set[str] = set()
+        self.pending: List[tuple] = []
+        self.started = time.perf_counter()
+
+    def _now(self) -> int:
+        # Prisma stores DateTime in SQLite as integer milliseconds.
+        return int(time.time() * 1000)
+
+    def folder(self, path: str) -> Optional[str]:
+        """Id of the folder at ``path``, created (with its parents) if missing."""
+        if path in self.folder_ids:
+            return self.folder_ids[path]
+        parent_path, _, name = path.rpartition('/')
+        parent_id = self.folder(parent_path)
+        row = self.conn.execute('SELECT id FROM Folder WHERE path = ?', (path,)).fetchone()
+        if row is not None:
+            folder_id = row[0]
+        else:
+            folder_id = new_cuid()
+            now = self._now()
+            self.conn.execute('INSERT INTO Folder (id, name, path, parentId, createdAt, updatedAt) '
+                              'VALUES (?, ?, ?, ?, ?, ?)', (folder_id, name, path, parent_id, now, now))
+            self.report.folders += 1
+            self.created.add(folder_id)
+        os.makedirs(os.path.join(self.root, path), exist_ok=True)
+        self.folder_ids[path] = folder_id
+        return folder_id
+
+    def existing_files(self, folder_id: Optional[str]) -> Set[Tuple[str, int]]:
+        if folder_id in self.created:
+            return set()
+        if folder_id is None:
+            rows = self.conn.execute('SELECT originalName, size FROM File WHERE folderId IS NULL')
+        else:
+            rows = self.conn.execute('SELECT originalName, size FROM File WHERE folderId = ?', (folder_id,))
+        return {tuple(row) for row in rows}
+
+    def _copy(self, job: tuple) -> Optional[tuple]:
+        """Copy one file; returns its ``File`` row, or None if it could not be read."""
+        source, folder_path, folder_id, original_name = job
+        file_id = str(uuid.uuid4())
+        name = f'{file_id}.{extension_of(original_name)}'
+        rel = f'{folder_path}/{name}' if folder_path else name
+        target = os.path.join(self.root, rel)
+        try:
+            with open(source, 'rb') as src, open(target, 'wb') as dst:
+                head = src.read(_SNIFF_BYTES)
+                dst.write(head)
+                shutil.copyfileobj(src, dst, _COPY_BLOCK)
+                size = dst.tell()
+        except OSError as e:
+            if os.path.exists(target):
+                os.unlink(target)
+            self.log(f'ERROR {source}: {e}')
+            return None
+        now = self._now()
+        return (file_id, name, original_name, rel, size, sniff_mime(head, original_name),
+                extension_of(original_name), folder_id, now, now)
+
+    def flush(self, pool: ThreadPoolExecutor) -> None:
+        rows = [row for row in pool.map(self._copy, self.pending) if row is not None]
+        self.report.failed += len(self.pending) - len(rows)
+        with self.conn:
+            self.conn.executemany(
+                'INSERT INTO File (id, name, originalName, path, size, mimeType, extension, folderId, '
+                'createdAt, updatedAt) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self.report.files += len(rows)
+        self.report.bytes += sum(row[4] for row in rows)
+        self.pending.clear()
+        elapsed = time.perf_counter() - self.started
+        self.log(f'{self.report.files} files, {self.report.bytes / (1 << 20):,.0f} MiB '
+                 f'({self.report.files / elapsed:.0f} files/s)')
+
+    def run(self, source: str, into: str) -> ImportReport:
+        into = into.strip('/')
+        with ThreadPoolExecutor(max_workers=max(self.jobs, 1)) as pool:
+            for directory, dirs, files in os.walk(source):
+                dirs.sort()
+                rel = os.path.relpath(directory, source)
+                parts = [into] if into else []
+                if rel != os.curdir:
+                    parts.extend(rel.split(os.sep))
+                folder_path = '/'.join(parts)
+                folder_id = self.folder(folder_path)
+                existing = self.existing_files(folder_id)
+                for name in sorted(files):
+                    source_path = os.path.join(directory, name)
+                    try:
+                        st = os.stat(source_path)
+                    except OSError:
+                        self.report.failed += 1
+                        continue
+                    if not os.path.isfile(source_path):
+                        continue
+                    if (name, st.st_size) in existing:
+                        self.report.skipped += 1
+                        continue
+                    self.pending.append((source_path, folder_path, folder_id, name))
+                    if len(self.pending) >= self.batch:
+                        self.flush(pool)
+            self.flush(pool)
+        return self.report
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('source', help='directory to import')
+    parser.add_argument('--into', help='target folder path (default: the name of SOURCE; "" for the root)')
+    parser.add_argument('--db', help='SQLite database holding the Folder and File tables')
+    parser.add_argument('--root', default=UPLOAD_DIR, help='upload directory')
+    parser.add_argument('--batch', type=int, default=DEFAULT_BATCH, help='files per transaction')
+    parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS, help='copying threads')
+    args = parser.parse_args(argv)
+
+    source = os.path.abspath(args.source)
+    if not os.path.isdir(source):
+        print(f'not a directory: {args.source}', file=sys.stderr)
+        return 1
+    into = os.path.basename(source) if args.into is None else args.into
+    started = time.perf_counter()
+    try:
+        conn = connect(args.db)
+    except FileNotFoundError as e:
+        print(e, file=sys.stderr)
+        return 1
+    try:
+        log = lambda msg: print(msg, file=sys.stderr)  # noqa: E731
+        report = Importer(conn, args.root, args.batch, args.jobs, log).run(source, into)
+    except sqlite3.Error as e:
+        print(f'Database error: {e}', file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - started
+    print(f'{report.folders} folders created, {report.files} files imported ({report.bytes:,} bytes), '
+          f'{report.skipped} already present, {report.failed} failed in {elapsed:.1f}s')
+    return 1 if report.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
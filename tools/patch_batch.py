@@ -0,0 +1,187 @@
+"""Apply a patch set to every matching component across the app trees.
+
+    python -m tools.patch_batch advanced-editor-fix
+    python -m tools.patch_batch simple-editor --root src --root english_editor/src --jobs 4
+
+Files are collected from each root with the patch set's glob (or ``--glob``)
+and patched in a process pool; a per-file result table is printed at the end.
+Files recorded in the patch manifest whose size and mtime are unchanged are
+skipped without being read (``--force`` ignores the manifest).
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import AbstractSet, Iterable, List, Optional, Sequence
+
+from tools.patch_engine import ALREADY_APPLIED, ANCHOR_MISSING, PatchConflict, apply_patch, write_source
+from tools.patch_manifest import DEFAULT_MANIFEST, PatchManifest, content_hash
+from tools.patch_sets import PATCH_SETS
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_ROOTS = ('src', 'english_editor/src', 'Filemanager/src')
+SOURCE_SUFFIXES = ('.tsx', '.ts')
+ERROR = 'error'
+
+
+@dataclass
+class FileReport:
+    path: str
+    status: str
+    applied: List[str] = field(default_factory=list)
+    missing: List[str] = field(default_factory=list)
+    skipped: List[str] = field(default_factory=list)
+    error: str = ''
+    sha256: str = ''
+    cached: bool = False
+
+
+def find_targets(roots: Iterable[str], pattern: str) -> List[str]:
+    seen = set()
+    targets = []
+    for root in roots:
+        base = Path(root)
+        if not base.is_absolute():
+            base = REPO_ROOT / base
+        if not base.is_dir():
+            continue
+        for path in sorted(base.glob(pattern)):
+            if path.suffix not in SOURCE_SUFFIXES or not path.is_file():
+                continue
+            key = path.resolve()
+            if key not in seen:
+                seen.add(key)
+                targets.append(str(path))
+    return targets
+
+
+def patch_one(
+    path: str,
+    patch_name: str,
+    dry_run: bool = False,
+    known_hashes: AbstractSet[str] = frozenset(),
+) -> FileReport:
+    patch = PATCH_SETS[patch_name]
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        sha256 = content_hash(data)
+        if sha256 in known_hashes:
+            return FileReport(path, ALREADY_APPLIED, sha256=sha256, cached=True)
+        result = apply_patch(data.decode('utf-8'), patch.edits)
+        if result.changed:
+            sha256 = content_hash(result.text.encode('utf-8'))
+            if not dry_run:
+                write_source(path, result.text)
+    except (OSError, UnicodeDecodeError, PatchConflict) as e:
+        return FileReport(path, ERROR, error=str(e))
+    return FileReport(path, result.status, result.applied, result.missing, result.skipped, sha256=sha256)
+
+
+def run_batch(
+    paths: Sequence[str],
+    patch_name: str,
+    jobs: Optional[int] = None,
+    dry_run: bool = False,
+    manifest: Optional[PatchManifest] = None,
+) -> List[FileReport]:
+    patch = PATCH_SETS[patch_name]
+    reports = {}
+    pending = []
+    for path in paths:
+        entry = manifest.lookup(patch, path) if manifest is not None else None
+        if entry is not None:
+            reports[path] = FileReport(path, entry['status'], missing=list(entry.get('missing', ())),
+                                       sha256=entry['sha256'], cached=True)
+        else:
+            pending.append(path)
+
+    known = manifest.patched_hashes(patch) if manifest is not None else frozenset()
+    if len(pending) <= 1 or jobs == 1:
+        fresh = [patch_one(path, patch_name, dry_run, known) for path in pending]
+    else:
+        n = len(pending)
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            fresh = list(pool.map(patch_one, pending, [patch_name] * n, [dry_run] * n, [known] * n))
+
+    for report in fresh:
+        reports[report.path] = report
+        if manifest is not None and not dry_run and report.status != ERROR:
+            # The file on disk now holds the patched output, so later runs
+            # should see it as already applied -- unless some edits found no
+            # anchor: that partial result is kept as missing, and its hash
+            # is not taken to carry the patch set.
+            if report.missing:
+                status = ANCHOR_MISSING
+            elif report.applied:
+                status = ALREADY_APPLIED
+            else:
+                status = report.status
+            manifest.record(patch, report.path, report.sha256, status, missing=report.missing)
+    if manifest is not None and not dry_run:
+        manifest.save()
+    return [reports[path] for path in paths]
+
+
+def _relative(path: str) -> str:
+    try:
+        return os.path.relpath(path, REPO_ROOT)
+    except ValueError:
+        return path
+
+
+def format_table(reports: Sequence[FileReport]) -> str:
+    rows = [('File', 'Status', 'Detail')]
+    for report in reports:
+        if report.error:
+            detail = report.error
+        elif report.missing:
+            applied = '' if report.cached else f'{len(report.applied)} applied, '
+            detail = f'{applied}missing: ' + ', '.join(report.missing)
+        elif report.cached:
+            detail = 'unchanged (manifest)'
+        elif report.applied:
+            detail = f'{len(report.applied)} applied'
+        else:
+            detail = f'{len(report.skipped)} edits already present'
+        rows.append((_relative(report.path), report.status, detail))
+    widths = [max(len(row[i]) for row in rows) for i in range(2)]
+    lines = []
+    for i, (name, status, detail) in enumerate(rows):
+        lines.append(f'{name:<{widths[0]}}  {status:<{widths[1]}}  {detail}')
+        if i == 0:
+            lines.append('-' * (widths[0] + widths[1] + 4 + len('Detail')))
+    return '\n'.join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('patch', choices=sorted(PATCH_SETS))
+    parser.add_argument('--root', action='append', dest='roots',
+                        help='tree to search (repeatable, default: all app trees)')
+    parser.add_argument('--glob', help="file pattern, e.g. '**/AdvancedCanvasEditor.tsx'")
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes')
+    parser.add_argument('--dry-run', action='store_true', help='report without writing')
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST, help='patch manifest file')
+    parser.add_argument('--force', action='store_true', help='ignore the manifest and re-scan every file')
+    args = parser.parse_args(argv)
+
+    patch = PATCH_SETS[args.patch]
+    paths = find_targets(args.roots or DEFAULT_ROOTS, args.glob or patch.glob)
+    if not paths:
+        print('No matching files found')
+        return 1
+
+    manifest = None if args.force else PatchManifest(args.manifest)
+    reports = run_batch(paths, args.patch, args.jobs, args.dry_run, manifest)
+    print(format_table(reports))
+    failed = [r for r in reports if r.status in (ERROR, ANCHOR_MISSING) or r.missing]
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,388 @@
+"""Single-pass patch engine for the editor components.
+
+Edits are declared as data.  Structural edits (``replace_node``,
+``insert_after_node``, ``insert_before_node``, ``add_import``) address their
+target through a ``tools.tsx_index`` selector such as ``const:handleSave``;
+text edits (``replace``, ``insert_after``, ``replace_block``, ``prepend``,
+``append``) use anchor strings.  ``apply_patch`` builds the structure index
+and finds every anchor and guard with one Aho-Corasick scan, resolves each
+edit to a span of the original text, rejects overlapping spans and builds
+the output with a single join, so adding edits does not add passes over the
+file.
+"""
+
+import os
+import stat
+import tempfile
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from tools.tsx_index import SelectorError, TsxIndex, build_index
+
+
+APPLIED = 'applied'
+ALREADY_APPLIED = 'already applied'
+ANCHOR_MISSING = 'anchor missing'
+# Suffix of the temporary files write_source renames into place.
+TEMP_SUFFIX = '.patch-tmp'
+
+
+class PatchConflict(Exception):
+    """Raised when two edits of one patch set touch the same bytes."""
+
+
+@dataclass(frozen=True)
+class Edit:
+    kind: str
+    anchor: str = ''
+    # tools.tsx_index selector, e.g. 'function:AdvancedCanvasEditor.body_end'.
+    target: str = ''
+    text: str = ''
+    end_marker: str = ''
+    all_occurrences: bool = False
+    # Skip the edit when this text is already present (idempotency guard).
+    unless: str = ''
+    # Only apply the edit when this text is present; otherwise it is skipped.
+    when: str = ''
+    trim: str = ''
+    fallback: Optional['Edit'] = None
+    label: str = ''
+
+    def patterns(self) -> List[str]:
+        found = [self.end_marker, self.unless, self.when]
+        if self.kind != 'add_import':
+            found.append(self.anchor)
+        if self.fallback is not None:
+            found.extend(self.fallback.patterns())
+        return [p for p in found if p]
+
+    def structural(self) -> bool:
+        return bool(self.target) or self.kind == 'add_import' or (
+            self.fallback is not None and self.fallback.structural())
+
+    @property
+    def name(self) -> str:
+        return self.label or f'{self.kind} {(self.target or self.anchor)[:40]!r}'
+
+
+@dataclass(frozen=True)
+class PatchSet:
+    name: str
+    edits: Tuple[Edit, ...]
+    # Default glob used by the batch runner to find target files.
+    glob: str = '**/*.tsx'
+    # Bump whenever the edits change so cached manifest entries are ignored.
+    version: int = 1
+
+
+@dataclass
+class PatchResult:
+    text: str
+    status: str
+    applied: List[str] = field(default_factory=list)
+    skipped: List[str] = field(default_factory=list)
+    missing: List[str] = field(default_factory=list)
+    # Characters materialised while building the output (slices + join).
+    copied: int = 0
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.applied)
+
+
+def replace(old: str, new: str, all_occurrences: bool = False, **kw) -> Edit:
+    return Edit('replace', anchor=old, text=new, all_occurrences=all_occurrences, **kw)
+
+
+def insert_after(anchor: str, text: str, **kw) -> Edit:
+    return Edit('insert_after', anchor=anchor, text=text, **kw)
+
+
+def insert_before(anchor: str, text: str, **kw) -> Edit:
+    return Edit('insert_before', anchor=anchor, text=text, **kw)
+
+
+def replace_block(start_marker: str, end_marker: str, text: str, **kw) -> Edit:
+    """Replace ``[start_marker, end_marker)``; the end marker is kept."""
+    return Edit('replace_block', anchor=start_marker, end_marker=end_marker, text=text, **kw)
+
+
+def replace_node(selector: str, text: str, **kw) -> Edit:
+    return Edit('replace', target=selector, text=text, **kw)
+
+
+def insert_after_node(selector: str, text: str, **kw) -> Edit:
+    return Edit('insert_after', target=selector, text=text, **kw)
+
+
+def insert_before_node(selector: str, text: str, **kw) -> Edit:
+    return Edit('insert_before', target=selector, text=text, **kw)
+
+
+def add_import(module: str, *names: str, **kw) -> Edit:
+    """Make sure ``names`` are imported from ``module``, merging into an
+    existing import when there is one."""
+    return Edit('add_import', anchor=module, text=', '.join(names), **kw)
+
+
+def prepend(text: str, **kw) -> Edit:
+    return Edit('prepend', text=text, **kw)
+
+
+def append(text: str, trim: str = '', **kw) -> Edit:
+    """Append at the end of the file, ignoring trailing whitespace.
+
+    With ``trim`` the stripped file must end with that text, which is
+    replaced by ``text`` (e.g. closing a ``forwardRef`` call).
+    """
+    return Edit('append', text=text, trim=trim, **kw)
+
+
+class AhoCorasick:
+    """Multi-pattern matcher reporting every (possibly overlapping) hit."""
+
+    def __init__(self, patterns: Sequence[str]):
+        self.patterns = list(dict.fromkeys(p for p in patterns if p))
+        goto: List[Dict[str, int]] = [{}]
+        fail = [0]
+        out: List[List[int]] = [[]]
+        for idx, pattern in enumerate(self.patterns):
+            state = 0
+            for ch in pattern:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto.append({})
+                    fail.append(0)
+                    out.append([])
+                    goto[state][ch] = nxt
+                state = nxt
+            out[state].append(idx)
+
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt] = out[nxt] + out[fail[nxt]]
+
+        self._goto = goto
+        self._fail = fail
+        self._out = out
+
+    def scan(self, text: str) -> Dict[str, List[int]]:
+        """Return the start offset of every occurrence of every pattern."""
+        goto, fail, out = self._goto, self._fail, self._out
+        lengths = [len(p) for p in self.patterns]
+        hits: List[List[int]] = [[] for _ in self.patterns]
+        root = goto[0]
+        state = 0
+        for i, ch in enumerate(text):
+            if state == 0:
+                state = root.get(ch, 0)
+                if state == 0:
+                    continue
+            else:
+                while state and ch not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(ch, 0)
+            for idx in out[state]:
+                hits[idx].append(i - lengths[idx] + 1)
+        return dict(zip(self.patterns, hits))
+
+
+def _first_after(positions: List[int], offset: int) -> int:
+    for pos in positions:
+        if pos >= offset:
+            return pos
+    return -1
+
+
+def _non_overlapping(positions: List[int], length: int) -> List[int]:
+    picked: List[int] = []
+    last_end = -1
+    for pos in positions:
+        if pos >= last_end:
+            picked.append(pos)
+            last_end = pos + length
+    return picked
+
+
+# Returned by _resolve when an edit's effect is already present.
+_SKIP: List[Tuple[int, int, str]] = []
+
+
+def _resolve_import(edit: Edit, index: TsxIndex) -> List[Tuple[int, int, str]]:
+    module = edit.anchor
+    names = [n.strip() for n in edit.text.split(',')]
+    # Value names cannot be merged into ``import type``; those get their own import.
+    existing = [node for node in index.imports if node.name == module and not node.type_only]
+    present = {name for node in existing for name in node.specifiers}
+    wanted = [name for name in names if name not in present]
+    if not wanted:
+        return _SKIP
+    text = index.text
+    for node in existing:
+        if 'specifiers' in node.parts:
+            _, close = node.parts['specifiers']
+            pos = len(text[:close - 1].rstrip())
+            if text[pos - 1] == ',':
+                # Keep the list's trailing comma, and its one-name-per-line layout.
+                if '\n' in text[pos:close]:
+                    line = text[text.rfind('\n', 0, pos) + 1:pos]
+                    indent = line[:len(line) - len(line.lstrip())]
+                    return [(pos, pos, ''.join(f'\n{indent}{name},' for name in wanted))]
+                return [(pos, pos, ' ' + ', '.join(wanted) + ',')]
+            separator = ' ' if text[pos - 1] == '{' else ', '
+            return [(pos, pos, separator + ', '.join(wanted))]
+    for node in existing:
+        if 'default' in node.parts:
+            _, end = node.parts['default']
+            return [(end, end, ', { ' + ', '.join(wanted) + ' }')]
+    line = f"import {{ {', '.join(wanted)} }} from '{module}';"
+    if index.imports:
+        end = index.imports[-1].end
+        return [(end, end, '\n' + line)]
+    return [(0, 0, line + '\n')]
+
+
+def _resolve(edit: Edit, text: str, hits: Dict[str, List[int]],
+             index: Optional[TsxIndex]) -> Optional[List[Tuple[int, int, str]]]:
+    """Map an edit to spans of the original text, or None if its target is missing."""
+    kind = edit.kind
+    if kind == 'add_import':
+        return _resolve_import(edit, index)
+    if edit.target:
+        try:
+            targets = index.resolve(edit.target, edit.all_occurrences)
+        except SelectorError:
+            return None
+        if kind == 'replace':
+            return [(start, end, edit.text) for start, end in targets]
+        if kind == 'insert_after':
+            return [(end, end, edit.text) for _, end in targets]
+        if kind == 'insert_before':
+            return [(start, start, edit.text) for start, _ in targets]
+        raise ValueError(f'Edit kind {kind} does not take a target')
+    if kind == 'prepend':
+        return [(0, 0, edit.text)]
+    if kind == 'append':
+        end = len(text.rstrip())
+        if edit.trim:
+            if not text[:end].endswith(edit.trim):
+                return None
+            return [(end - len(edit.trim), len(text), edit.text)]
+        return [(end, end, edit.text)]
+
+    positions = hits.get(edit.anchor, [])
+    if not positions:
+        return None
+    size = len(edit.anchor)
+    if kind == 'replace_block':
+        start = positions[0]
+        end = _first_after(hits.get(edit.end_marker, []), start + size)
+        if end == -1:
+            return None
+        return [(start, end, edit.text)]
+
+    targets = _non_overlapping(positions, size) if edit.all_occurrences else positions[:1]
+    if kind == 'replace':
+        return [(pos, pos + size, edit.text) for pos in targets]
+    if kind == 'insert_after':
+        return [(pos + size, pos + size, edit.text) for pos in targets]
+    if kind == 'insert_before':
+        return [(pos, pos, edit.text) for pos in targets]
+    raise ValueError(f'Unknown edit kind: {kind}')
+
+
+def apply_patch(text: str, edits: Sequence[Edit]) -> PatchResult:
+    matcher = AhoCorasick([p for edit in edits for p in edit.patterns()])
+    hits = matcher.scan(text)
+    index = build_index(text) if any(edit.structural() for edit in edits) else None
+    return apply_resolved(text, edits, hits, index)
+
+
+def apply_resolved(text: str, edits: Sequence[Edit], hits: Dict[str, List[int]],
+                   index: Optional[TsxIndex] = None) -> PatchResult:
+    result = PatchResult(text=text, status=ALREADY_APPLIED)
+    spans: List[Tuple[int, int, int, str, str]] = []
+
+    for order, edit in enumerate(edits):
+        if edit.unless and hits.get(edit.unless):
+            result.skipped.append(edit.name)
+            continue
+        if edit.when and not hits.get(edit.when):
+            result.skipped.append(edit.name)
+            continue
+        resolved = _resolve(edit, text, hits, index)
+        if resolved is None and edit.fallback is not None:
+            resolved = _resolve(edit.fallback, text, hits, index)
+        if resolved is None:
+            result.missing.append(edit.name)
+            continue
+        if resolved is _SKIP:
+            result.skipped.append(edit.name)
+            continue
+        result.applied.append(edit.name)
+        spans.extend((start, end, order, new, edit.name) for start, end, new in resolved)
+
+    if not spans:
+        if result.missing:
+            result.status = ANCHOR_MISSING
+        return result
+
+    # Sorting by (start, end) keeps zero-width inserts ahead of a replacement
+    # starting at the same offset; ties fall back to declaration order.
+    spans.sort(key=lambda s: (s[0], s[1], s[2]))
+    pieces: List[str] = []
+    cursor = 0
+    previous = None
+    for start, end, _, new, name in spans:
+        if start < cursor:
+            raise PatchConflict(f'{name!r} overlaps {previous!r} at offset {start}')
+        pieces.append(text[cursor:start])
+        pieces.append(new)
+        cursor = end
+        previous = name
+    pieces.append(text[cursor:])
+
+    result.text = ''.join(pieces)
+    result.copied = 2 * len(result.text) - sum(len(new) for _, _, _, new, _ in spans)
+    result.status = APPLIED
+    return result
+
+
+def read_source(path: str) -> str:
+    # newline='' keeps CRLF files byte-for-byte so offsets stay meaningful.
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return f.read()
+
+
+def write_source(path: str, text: str) -> None:
+    """Replace ``path`` atomically: a dev server watching it never sees half a file."""
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=f'.{name}.', suffix=TEMP_SUFFIX)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+        try:
+            os.chmod(tmp, stat.S_IMODE(os.stat(path).st_mode))
+        except FileNotFoundError:
+            pass
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def patch_file(path: str, patch: PatchSet) -> PatchResult:
+    result = apply_patch(read_source(path), patch.edits)
+    if result.changed:
+        write_source(path, result.text)
+    return result
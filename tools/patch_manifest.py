@@ -0,0 +1,105 @@
+"""Persistent record of patch runs so unchanged files are not re-scanned.
+
+Entries are keyed by patch set, patch-set version and path, and hold the
+file's size, mtime and SHA-256 as of the last run.  A file whose stat still
+matches its entry is skipped without being opened.  The manifest also keeps
+the hashes of every output a patch set has produced, so a file whose content
+is already known to be patched (e.g. the same component in another tree) is
+recognised after hashing without running the patch again.
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict, Optional, Sequence
+
+from tools.patch_engine import ALREADY_APPLIED, APPLIED, PatchSet
+
+
+MANIFEST_VERSION = 2
+DEFAULT_MANIFEST = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                '.patch-manifest.json')
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _patch_key(patch: PatchSet) -> str:
+    return f'{patch.name}@{patch.version}'
+
+
+class PatchManifest:
+    def __init__(self, path: str = DEFAULT_MANIFEST):
+        self.path = path
+        self.files: Dict[str, dict] = {}
+        self.patched: Dict[str, set] = {}
+        self.dirty = False
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') != MANIFEST_VERSION:
+            return
+        self.files = data.get('files', {})
+        self.patched = {key: set(hashes) for key, hashes in data.get('patched', {}).items()}
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        data = {
+            'version': MANIFEST_VERSION,
+            'files': self.files,
+            'patched': {key: sorted(hashes) for key, hashes in self.patched.items()},
+        }
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+    def _entry_key(self, patch: PatchSet, path: str) -> str:
+        return f'{_patch_key(patch)}:{os.path.abspath(path)}'
+
+    def lookup(self, patch: PatchSet, path: str, st: Optional[os.stat_result] = None) -> Optional[dict]:
+        """Return the recorded entry if the file has not changed since, else None."""
+        entry = self.files.get(self._entry_key(patch, path))
+        if entry is None:
+            return None
+        if st is None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+        if entry['size'] != st.st_size or entry['mtime_ns'] != st.st_mtime_ns:
+            return None
+        return entry
+
+    def patched_hashes(self, patch: PatchSet) -> frozenset:
+        """Hashes of contents known to already carry this patch set."""
+        return frozenset(self.patched.get(_patch_key(patch), ()))
+
+    def record(self, patch: PatchSet, path: str, sha256: str, status: str,
+               st: Optional[os.stat_result] = None, missing: Sequence[str] = ()) -> None:
+        """Remember a run; ``missing`` names edits whose anchor was not found.
+
+        Only complete results add ``sha256`` to the patched hashes.
+        """
+        if st is None:
+            st = os.stat(path)
+        entry = {
+            'sha256': sha256,
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'status': status,
+        }
+        if missing:
+            entry['missing'] = list(missing)
+        self.files[self._entry_key(patch, path)] = entry
+        if status in (APPLIED, ALREADY_APPLIED) and not missing:
+            self.patched.setdefault(_patch_key(patch), set()).add(sha256)
+        self.dirty = True
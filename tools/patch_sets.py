@@ -0,0 +1,662 @@
+"""Patch sets applied by the editor patch scripts.
+
+Each set reproduces one of the original hand-written scripts as data for
+``tools.patch_engine``.  Targets are ``tools.tsx_index`` selectors rather
+than anchor strings, so they survive reformatting and cannot land on a
+second copy of the same text.
+"""
+
+from tools.patch_engine import (
+    PatchSet,
+    add_import,
+    insert_after_node,
+    insert_before_node,
+    replace,
+    replace_node,
+)
+
+
+# Markers left behind by the patches; each edit is skipped when its marker is
+# already in the file so re-running a patch set is a no-op.
+PDF_BLOB_HANDLE = "useImperativeHandle(ref, () => ({"
+FORWARD_REF_DECL = "forwardRef<AdvancedCanvasEditorRef, AdvancedCanvasEditorProps>("
+# Version 4 lets getPDFBlob draw site-path backgrounds ('/uploads/...').
+# Files patched by an earlier version already carry PDF_BLOB_HANDLE, so the
+# insert is skipped for them; this edit upgrades their copy on its own.
+OLD_BACKGROUND_CHECK = "background.startsWith('data:') || background.startsWith('http')) {"
+BACKGROUND_CHECK = "background.startsWith('data:') || background.startsWith('http') || background.startsWith('/')) {"
+UPGRADE_BACKGROUND_CHECK = replace(OLD_BACKGROUND_CHECK, BACKGROUND_CHECK, all_occurrences=True,
+                                   when=PDF_BLOB_HANDLE, unless=BACKGROUND_CHECK,
+                                   label='upgrade getPDFBlob background check')
+
+
+# --- SimplePostEditor.tsx: save a generated PDF alongside the post ----------
+
+SIMPLE_HANDLE_SAVE = """const handleSave = async () => {
+    if (!formData.title.trim()) {
+      alert('عنوان پست الزامی است');
+      return;
+    }
+
+    setLoading(true);
+    
+    try {
+      let pdfUrl = null;
+      
+      // Generate PDF if editor ref is available
+      if (editorRef.current) {
+        try {
+          const pdfBlob = await editorRef.current.getPDFBlob();
+          
+          // Upload PDF
+          const uploadFormData = new FormData();
+          uploadFormData.append('file', pdfBlob, `post-${Date.now()}.pdf`);
+          
+          const uploadResponse = await fetch('/api/upload', {
+            method: 'POST',
+            body: uploadFormData
+          });
+          
+          if (uploadResponse.ok) {
+            const uploadData = await uploadResponse.json();
+            pdfUrl = uploadData.url;
+            console.log('PDF uploaded successfully:', pdfUrl);
+          } else {
+            console.error('Failed to upload PDF');
+          }
+        } catch (pdfError) {
+          console.error('Error generating PDF:', pdfError);
+        }
+      }
+
+      const canvasDataString = JSON.stringify({
+        elements: canvasElements,
+        background: canvasBackground,
+        blurAmount: canvasBlur
+      });
+
+      const postData = {
+        title: formData.title,
+        content: formData.content,
+        published: formData.published,
+        canvasData: canvasDataString,
+        background: canvasBackground,
+        blurAmount: canvasBlur,
+        pdfUrl: pdfUrl,
+        authorId
+      };
+
+      if (post?.id) {
+        postData.id = post.id;
+      }
+
+      console.log('Submitting post data:', postData);
+      await onSave(postData);
+      setOpen(false);
+      
+      alert('پست با موفقیت ذخیره شد');
+    } catch (error) {
+      console.error('Error saving post:', error);
+      alert('خطا در ذخیره پست');
+    } finally {
+      setLoading(false);
+    }
+  };"""
+
+SIMPLE_EDITOR = PatchSet('simple-editor', (
+    add_import('react', 'useRef'),
+    add_import('./AdvancedCanvasEditor', 'AdvancedCanvasEditorRef'),
+    insert_after_node(
+        'const:loading',
+        "\n  const editorRef = useRef<AdvancedCanvasEditorRef>(null);",
+        unless="const editorRef = useRef<AdvancedCanvasEditorRef>(null);",
+    ),
+    replace_node('const:handleSave', SIMPLE_HANDLE_SAVE, unless="editorRef.current.getPDFBlob()"),
+    insert_after_node(
+        'jsx:AdvancedCanvasEditor.name',
+        "\n                  ref={editorRef}",
+        all_occurrences=True,
+        unless="ref={editorRef}",
+    ),
+), glob='**/SimplePostEditor.tsx', version=3)
+
+
+# --- AdvancedCanvasEditor.tsx: expose getPDFBlob through forwardRef ---------
+
+ADVANCED_PDF_LOGIC = """
+    useImperativeHandle(ref, () => ({
+      getPDFBlob: async () => {
+        return new Promise<Blob>(async (resolve, reject) => {
+          try {
+            const pdf = new jsPDF({
+              orientation: canvasWidth > canvasHeight ? 'landscape' : 'portrait',
+              unit: 'px',
+              format: [canvasWidth, canvasHeight]
+            });
+
+            const tempCanvas = document.createElement('canvas');
+            tempCanvas.width = canvasWidth;
+            tempCanvas.height = canvasHeight;
+            const ctx = tempCanvas.getContext('2d');
+
+            if (!ctx) throw new Error('Failed to get canvas context');
+
+            // Draw background
+            if (background) {
+              if (background.startsWith('#') || background.startsWith('rgb')) {
+                ctx.fillStyle = background;
+                ctx.fillRect(0, 0, canvasWidth, canvasHeight);
+              } else if (background.startsWith('data:') || background.startsWith('http') || background.startsWith('/')) {
+                const bgImg = new Image();
+                bgImg.crossOrigin = 'anonymous';
+                bgImg.src = background;
+                await new Promise((resolveImg) => {
+                  bgImg.onload = () => {
+                    ctx.drawImage(bgImg, 0, 0, canvasWidth, canvasHeight);
+                    resolveImg(true);
+                  };
+                  bgImg.onerror = () => {
+                    ctx.fillStyle = '#ffffff';
+                    ctx.fillRect(0, 0, canvasWidth, canvasHeight);
+                    resolveImg(false);
+                  };
+                });
+              }
+            } else {
+              ctx.fillStyle = '#ffffff';
+              ctx.fillRect(0, 0, canvasWidth, canvasHeight);
+            }
+
+            const sortedElements = [...elements].sort((a, b) => (a.zIndex || 0) - (b.zIndex || 0));
+            const allElements = sortedElements.filter(element => element.visible);
+
+            for (let i = 0; i < allElements.length; i++) {
+              const element = allElements[i];
+              const opacity = (element.opacity || 100) / 100;
+
+              if (element.type === 'text') {
+                if (!element.text) continue;
+                
+                if (element.backgroundColor && element.backgroundColor !== 'transparent') {
+                  const [r, g, b] = hexToRgb(element.backgroundColor);
+                  pdf.setFillColor(r, g, b);
+                  pdf.setGState(new (pdf as any).GState({ opacity }));
+                  pdf.rect(element.x, element.y, element.width, element.height, 'F');
+                }
+
+                if (element.borderColor && element.borderWidth) {
+                  const [r, g, b] = hexToRgb(element.borderColor);
+                  pdf.setDrawColor(r, g, b);
+                  pdf.setLineWidth(element.borderWidth);
+                  pdf.setGState(new (pdf as any).GState({ opacity }));
+                  pdf.rect(element.x, element.y, element.width, element.height, 'S');
+                }
+
+                const fontSize = element.fontSize || 16;
+                pdf.setFontSize(fontSize);
+                
+                const textColor = element.color || '#000000';
+                const [r, g, b] = hexToRgb(textColor);
+                pdf.setTextColor(r, g, b);
+                pdf.setGState(new (pdf as any).GState({ opacity }));
+                
+                let fontStyle = 'normal';
+                if (element.fontWeight === 'bold' && element.fontStyle === 'italic') {
+                  fontStyle = 'bolditalic';
+                } else if (element.fontWeight === 'bold') {
+                  fontStyle = 'bold';
+                } else if (element.fontStyle === 'italic') {
+                  fontStyle = 'italic';
+                }
+                pdf.setFont('helvetica', fontStyle);
+
+                let cleanText = element.text || '';
+                cleanText = cleanText
+                  .replace(/<\/div><div>/gi, '\\n')
+                  .replace(/<br\s*\/?>/gi, '\\n')
+                  .replace(/<div>/gi, '')
+                  .replace(/<\/div>/gi, '\\n')
+                  .replace(/<\/p>/gi, '\\n')
+                  .replace(/<p[^>]*>/gi, '')
+                  .replace(/<[^>]*>/g, '')
+                  .replace(/^\\n+/, '')
+                  .replace(/\\n+$/, '');
+                
+                const lines = cleanText.split('\\n');
+                const lineHeight = fontSize * 1.2;
+                const wrappedLines: string[] = [];
+                const maxWidth = element.width - 16;
+                
+                lines.forEach(line => {
+                  if (!line) {
+                    wrappedLines.push('');
+                    return;
+                  }
+                  const words = line.split(' ');
+                  let currentLine = '';
+                  words.forEach((word, index) => {
+                    const testLine = currentLine ? `${currentLine} ${word}` : word;
+                    const textWidth = pdf.getTextWidth(testLine);
+                    if (textWidth > maxWidth && currentLine) {
+                      wrappedLines.push(currentLine);
+                      currentLine = word;
+                    } else {
+                      currentLine = testLine;
+                    }
+                    if (index === words.length - 1) {
+                      wrappedLines.push(currentLine);
+                    }
+                  });
+                });
+                
+                wrappedLines.forEach((line, index) => {
+                  const y = element.y + fontSize + 8 + (index * lineHeight);
+                  let x = element.x + 8;
+                  if (element.textAlign === 'center') {
+                    x = element.x + element.width / 2;
+                    pdf.text(line, x, y, { align: 'center' });
+                  } else if (element.textAlign === 'right') {
+                    x = element.x + element.width - 8;
+                    pdf.text(line, x, y, { align: 'right' });
+                  } else {
+                    pdf.text(line, x, y);
+                  }
+                });
+                continue;
+              }
+
+              // Non-text elements
+              const tempCanvas = document.createElement('canvas');
+              tempCanvas.width = canvasWidth;
+              tempCanvas.height = canvasHeight;
+              const ctx = tempCanvas.getContext('2d');
+              if (!ctx) continue;
+
+              ctx.globalAlpha = opacity;
+
+              if (element.type === 'rectangle') {
+                if (element.backgroundColor) {
+                  ctx.fillStyle = element.backgroundColor;
+                  if (element.borderRadius) {
+                     // Simplified rect for blob generation to save space/complexity in this script
+                     // Ideally we duplicate the full logic, but for now let's trust simple fillRect/strokeRect
+                     // or copy the path logic if critical.
+                     // Let's copy the path logic for rounded rects as it was in the original file.
+                    const radius = element.borderRadius;
+                    ctx.beginPath();
+                    ctx.moveTo(element.x + radius, element.y);
+                    ctx.lineTo(element.x + element.width - radius, element.y);
+                    ctx.quadraticCurveTo(element.x + element.width, element.y, element.x + element.width, element.y + radius);
+                    ctx.lineTo(element.x + element.width, element.y + element.height - radius);
+                    ctx.quadraticCurveTo(element.x + element.width, element.y + element.height, element.x + element.width - radius, element.y + element.height);
+                    ctx.lineTo(element.x + radius, element.y + element.height);
+                    ctx.quadraticCurveTo(element.x, element.y + element.height, element.x, element.y + element.height - radius);
+                    ctx.lineTo(element.x, element.y + radius);
+                    ctx.quadraticCurveTo(element.x, element.y, element.x + radius, element.y);
+                    ctx.closePath();
+                    ctx.fill();
+                  } else {
+                    ctx.fillRect(element.x, element.y, element.width, element.height);
+                  }
+                }
+                if (element.borderColor && element.borderWidth) {
+                  ctx.strokeStyle = element.borderColor;
+                  ctx.lineWidth = element.borderWidth;
+                  if (element.borderRadius) {
+                     // Same path logic for stroke
+                    const radius = element.borderRadius;
+                    ctx.beginPath();
+                    ctx.moveTo(element.x + radius, element.y);
+                    ctx.lineTo(element.x + element.width - radius, element.y);
+                    ctx.quadraticCurveTo(element.x + element.width, element.y, element.x + element.width, element.y + radius);
+                    ctx.lineTo(element.x + element.width, element.y + element.height - radius);
+                    ctx.quadraticCurveTo(element.x + element.width, element.y + element.height, element.x + element.width - radius, element.y + element.height);
+                    ctx.lineTo(element.x + radius, element.y + element.height);
+                    ctx.quadraticCurveTo(element.x, element.y + element.height, element.x, element.y + element.height - radius);
+                    ctx.lineTo(element.x, element.y + radius);
+                    ctx.quadraticCurveTo(element.x, element.y, element.x + radius, element.y);
+                    ctx.closePath();
+                    ctx.stroke();
+                  } else {
+                    ctx.strokeRect(element.x, element.y, element.width, element.height);
+                  }
+                }
+              }
+              else if (element.type === 'circle') {
+                ctx.beginPath();
+                ctx.ellipse(element.x + element.width / 2, element.y + element.height / 2, element.width / 2, element.height / 2, 0, 0, 2 * Math.PI);
+                if (element.backgroundColor) { ctx.fillStyle = element.backgroundColor; ctx.fill(); }
+                if (element.borderColor && element.borderWidth) { ctx.strokeStyle = element.borderColor; ctx.lineWidth = element.borderWidth; ctx.stroke(); }
+              }
+              else if (element.type === 'triangle') {
+                ctx.beginPath();
+                ctx.moveTo(element.x + element.width / 2, element.y);
+                ctx.lineTo(element.x + element.width, element.y + element.height);
+                ctx.lineTo(element.x, element.y + element.height);
+                ctx.closePath();
+                if (element.backgroundColor) { ctx.fillStyle = element.backgroundColor; ctx.fill(); }
+                if (element.borderColor && element.borderWidth) { ctx.strokeStyle = element.borderColor; ctx.lineWidth = element.borderWidth; ctx.stroke(); }
+              }
+              // ... (skip other shapes for brevity in this script, or add them if needed)
+              // For now, let's assume basic shapes are enough or user uses images.
+              // Actually, let's include image logic as it's important.
+              else if (element.type === 'image' && element.image) {
+                const img = new Image();
+                img.crossOrigin = 'anonymous';
+                img.src = element.image;
+                await new Promise((resolveImg) => {
+                  img.onload = () => {
+                    ctx.drawImage(img, element.x, element.y, element.width, element.height);
+                    if (element.borderColor && element.borderWidth) {
+                      ctx.strokeStyle = element.borderColor;
+                      ctx.lineWidth = element.borderWidth;
+                      ctx.strokeRect(element.x, element.y, element.width, element.height);
+                    }
+                    resolveImg(true);
+                  };
+                  img.onerror = () => resolveImg(false);
+                });
+              }
+
+              ctx.globalAlpha = 1;
+              const elementCanvas = tempCanvas.toDataURL('image/png');
+              pdf.addImage(elementCanvas, 'PNG', 0, 0, canvasWidth, canvasHeight);
+            }
+
+            const blob = pdf.output('blob');
+            resolve(blob);
+          } catch (error) {
+            reject(error);
+          }
+        });
+      }
+    }));
+    """
+
+ADVANCED_EDITOR = PatchSet('advanced-editor', (
+    add_import('react', 'useImperativeHandle', 'forwardRef'),
+    insert_before_node(
+        'interface:AdvancedCanvasEditorProps',
+        "export interface AdvancedCanvasEditorRef {\n  getPDFBlob: () => Promise<Blob>;\n}\n\n",
+        unless="export interface AdvancedCanvasEditorRef {",
+    ),
+    # export default function X(props) { ... }
+    #   -> const X = forwardRef<Ref, Props>((props, ref) => { ... });
+    replace_node(
+        'function:AdvancedCanvasEditor.head',
+        "const AdvancedCanvasEditor = " + FORWARD_REF_DECL,
+        unless=FORWARD_REF_DECL,
+    ),
+    insert_before_node('function:AdvancedCanvasEditor.params_end', ", ref", unless=FORWARD_REF_DECL),
+    insert_after_node('function:AdvancedCanvasEditor.params_end', " =>", unless=FORWARD_REF_DECL),
+    insert_after_node(
+        'function:AdvancedCanvasEditor.body_end',
+        ");\n\nexport default AdvancedCanvasEditor;",
+        unless=FORWARD_REF_DECL,
+    ),
+    insert_after_node('const:elements', "\n" + ADVANCED_PDF_LOGIC, unless=PDF_BLOB_HANDLE),
+    UPGRADE_BACKGROUND_CHECK,
+), glob='**/AdvancedCanvasEditor.tsx', version=5)
+
+
+# --- AdvancedCanvasEditor.tsx: getPDFBlob with its own hexToRgb helper ------
+
+FIX_PDF_LOGIC = """
+  useImperativeHandle(ref, () => ({
+    getPDFBlob: async () => {
+      return new Promise<Blob>(async (resolve, reject) => {
+        try {
+          const hexToRgb = (hex: string): [number, number, number] => {
+            hex = hex.replace('#', '');
+            if (hex.length === 3) {
+              hex = hex[0] + hex[0] + hex[1] + hex[1] + hex[2] + hex[2];
+            }
+            const r = parseInt(hex.substring(0, 2), 16);
+            const g = parseInt(hex.substring(2, 4), 16);
+            const b = parseInt(hex.substring(4, 6), 16);
+            return [r, g, b];
+          };
+
+          const pdf = new jsPDF({
+            orientation: canvasWidth > canvasHeight ? 'landscape' : 'portrait',
+            unit: 'px',
+            format: [canvasWidth, canvasHeight]
+          });
+
+          const tempCanvas = document.createElement('canvas');
+          tempCanvas.width = canvasWidth;
+          tempCanvas.height = canvasHeight;
+          const ctx = tempCanvas.getContext('2d');
+
+          if (!ctx) throw new Error('Failed to get canvas context');
+
+          // Draw background
+          if (background) {
+            if (background.startsWith('#') || background.startsWith('rgb')) {
+              ctx.fillStyle = background;
+              ctx.fillRect(0, 0, canvasWidth, canvasHeight);
+            } else if (background.startsWith('data:') || background.startsWith('http') || background.startsWith('/')) {
+              const bgImg = new Image();
+              bgImg.crossOrigin = 'anonymous';
+              bgImg.src = background;
+              await new Promise((resolveImg) => {
+                bgImg.onload = () => {
+                  ctx.drawImage(bgImg, 0, 0, canvasWidth, canvasHeight);
+                  resolveImg(true);
+                };
+                bgImg.onerror = () => {
+                  ctx.fillStyle = '#ffffff';
+                  ctx.fillRect(0, 0, canvasWidth, canvasHeight);
+                  resolveImg(false);
+                };
+              });
+            }
+          } else {
+            ctx.fillStyle = '#ffffff';
+            ctx.fillRect(0, 0, canvasWidth, canvasHeight);
+          }
+
+          const sortedElements = [...elements].sort((a, b) => (a.zIndex || 0) - (b.zIndex || 0));
+          const allElements = sortedElements.filter(element => element.visible);
+
+          for (let i = 0; i < allElements.length; i++) {
+            const element = allElements[i];
+            const opacity = (element.opacity || 100) / 100;
+
+            if (element.type === 'text') {
+              if (!element.text) continue;
+              
+              if (element.backgroundColor && element.backgroundColor !== 'transparent') {
+                const [r, g, b] = hexToRgb(element.backgroundColor);
+                pdf.setFillColor(r, g, b);
+                pdf.setGState(new (pdf as any).GState({ opacity }));
+                pdf.rect(element.x, element.y, element.width, element.height, 'F');
+              }
+
+              if (element.borderColor && element.borderWidth) {
+                const [r, g, b] = hexToRgb(element.borderColor);
+                pdf.setDrawColor(r, g, b);
+                pdf.setLineWidth(element.borderWidth);
+                pdf.setGState(new (pdf as any).GState({ opacity }));
+                pdf.rect(element.x, element.y, element.width, element.height, 'S');
+              }
+
+              const fontSize = element.fontSize || 16;
+              pdf.setFontSize(fontSize);
+              
+              const textColor = element.color || '#000000';
+              const [r, g, b] = hexToRgb(textColor);
+              pdf.setTextColor(r, g, b);
+              pdf.setGState(new (pdf as any).GState({ opacity }));
+              
+              let fontStyle = 'normal';
+              if (element.fontWeight === 'bold' && element.fontStyle === 'italic') {
+                fontStyle = 'bolditalic';
+              } else if (element.fontWeight === 'bold') {
+                fontStyle = 'bold';
+              } else if (element.fontStyle === 'italic') {
+                fontStyle = 'italic';
+              }
+              pdf.setFont('helvetica', fontStyle);
+
+              let cleanText = element.text || '';
+              cleanText = cleanText
+                .replace(/<\/div><div>/gi, '\\n')
+                .replace(/<br\s*\/?>/gi, '\\n')
+                .replace(/<div>/gi, '')
+                .replace(/<\/div>/gi, '\\n')
+                .replace(/<\/p>/gi, '\\n')
+                .replace(/<p[^>]*>/gi, '')
+                .replace(/<[^>]*>/g, '')
+                .replace(/^\\n+/, '')
+                .replace(/\\n+$/, '');
+              
+              const lines = cleanText.split('\\n');
+              const lineHeight = fontSize * 1.2;
+              const wrappedLines: string[] = [];
+              const maxWidth = element.width - 16;
+              
+              lines.forEach(line => {
+                if (!line) {
+                  wrappedLines.push('');
+                  return;
+                }
+                const words = line.split(' ');
+                let currentLine = '';
+                words.forEach((word, index) => {
+                  const testLine = currentLine ? `${currentLine} ${word}` : word;
+                  const textWidth = pdf.getTextWidth(testLine);
+                  if (textWidth > maxWidth && currentLine) {
+                    wrappedLines.push(currentLine);
+                    currentLine = word;
+                  } else {
+                    currentLine = testLine;
+                  }
+                  if (index === words.length - 1) {
+                    wrappedLines.push(currentLine);
+                  }
+                });
+              });
+              
+              wrappedLines.forEach((line, index) => {
+                const y = element.y + fontSize + 8 + (index * lineHeight);
+                let x = element.x + 8;
+                if (element.textAlign === 'center') {
+                  x = element.x + element.width / 2;
+                  pdf.text(line, x, y, { align: 'center' });
+                } else if (element.textAlign === 'right') {
+                  x = element.x + element.width - 8;
+                  pdf.text(line, x, y, { align: 'right' });
+                } else {
+                  pdf.text(line, x, y);
+                }
+              });
+              continue;
+            }
+
+            // Non-text elements
+            const tempCanvas = document.createElement('canvas');
+            tempCanvas.width = canvasWidth;
+            tempCanvas.height = canvasHeight;
+            const ctx = tempCanvas.getContext('2d');
+            if (!ctx) continue;
+
+            ctx.globalAlpha = opacity;
+
+            if (element.type === 'rectangle') {
+              if (element.backgroundColor) {
+                ctx.fillStyle = element.backgroundColor;
+                if (element.borderRadius) {
+                  const radius = element.borderRadius;
+                  ctx.beginPath();
+                  ctx.moveTo(element.x + radius, element.y);
+                  ctx.lineTo(element.x + element.width - radius, element.y);
+                  ctx.quadraticCurveTo(element.x + element.width, element.y, element.x + element.width, element.y + radius);
+                  ctx.lineTo(element.x + element.width, element.y + element.height - radius);
+                  ctx.quadraticCurveTo(element.x + element.width, element.y + element.height, element.x + element.width - radius, element.y + element.height);
+                  ctx.lineTo(element.x + radius, element.y + element.height);
+                  ctx.quadraticCurveTo(element.x, element.y + element.height, element.x, element.y + element.height - radius);
+                  ctx.lineTo(element.x, element.y + radius);
+                  ctx.quadraticCurveTo(element.x, element.y, element.x + radius, element.y);
+                  ctx.closePath();
+                  ctx.fill();
+                } else {
+                  ctx.fillRect(element.x, element.y, element.width, element.height);
+                }
+              }
+              if (element.borderColor && element.borderWidth) {
+                ctx.strokeStyle = element.borderColor;
+                ctx.lineWidth = element.borderWidth;
+                if (element.borderRadius) {
+                  const radius = element.borderRadius;
+                  ctx.beginPath();
+                  ctx.moveTo(element.x + radius, element.y);
+                  ctx.lineTo(element.x + element.width - radius, element.y);
+                  ctx.quadraticCurveTo(element.x + element.width, element.y, element.x + element.width, element.y + radius);
+                  ctx.lineTo(element.x + element.width, element.y + element.height - radius);
+                  ctx.quadraticCurveTo(element.x + element.width, element.y + element.height, element.x + element.width - radius, element.y + element.height);
+                  ctx.lineTo(element.x + radius, element.y + element.height);
+                  ctx.quadraticCurveTo(element.x, element.y + element.height, element.x, element.y + element.height - radius);
+                  ctx.lineTo(element.x, element.y + radius);
+                  ctx.quadraticCurveTo(element.x, element.y, element.x + radius, element.y);
+                  ctx.closePath();
+                  ctx.stroke();
+                } else {
+                  ctx.strokeRect(element.x, element.y, element.width, element.height);
+                }
+              }
+            }
+            else if (element.type === 'circle') {
+              ctx.beginPath();
+              ctx.ellipse(element.x + element.width / 2, element.y + element.height / 2, element.width / 2, element.height / 2, 0, 0, 2 * Math.PI);
+              if (element.backgroundColor) { ctx.fillStyle = element.backgroundColor; ctx.fill(); }
+              if (element.borderColor && element.borderWidth) { ctx.strokeStyle = element.borderColor; ctx.lineWidth = element.borderWidth; ctx.stroke(); }
+            }
+            else if (element.type === 'triangle') {
+              ctx.beginPath();
+              ctx.moveTo(element.x + element.width / 2, element.y);
+              ctx.lineTo(element.x + element.width, element.y + element.height);
+              ctx.lineTo(element.x, element.y + element.height);
+              ctx.closePath();
+              if (element.backgroundColor) { ctx.fillStyle = element.backgroundColor; ctx.fill(); }
+              if (element.borderColor && element.borderWidth) { ctx.strokeStyle = element.borderColor; ctx.lineWidth = element.borderWidth; ctx.stroke(); }
+            }
+            else if (element.type === 'image' && element.image) {
+              const img = new Image();
+              img.crossOrigin = 'anonymous';
+              img.src = element.image;
+              await new Promise((resolveImg) => {
+                img.onload = () => {
+                  ctx.drawImage(img, element.x, element.y, element.width, element.height);
+                  if (element.borderColor && element.borderWidth) {
+                    ctx.strokeStyle = element.borderColor;
+                    ctx.lineWidth = element.borderWidth;
+                    ctx.strokeRect(element.x, element.y, element.width, element.height);
+                  }
+                  resolveImg(true);
+                };
+                img.onerror = () => resolveImg(false);
+              });
+            }
+
+            ctx.globalAlpha = 1;
+            const elementCanvas = tempCanvas.toDataURL('image/png');
+            pdf.addImage(elementCanvas, 'PNG', 0, 0, canvasWidth, canvasHeight);
+          }
+
+          const blob = pdf.output('blob');
+          resolve(blob);
+        } catch (error) {
+          reject(error);
+        }
+      });
+    }
+  }));
+"""
+
+ADVANCED_EDITOR_FIX = PatchSet('advanced-editor-fix', (
+    insert_after_node('const:colorInputRef', "\n" + FIX_PDF_LOGIC, unless=PDF_BLOB_HANDLE),
+    UPGRADE_BACKGROUND_CHECK,
+), glob='**/AdvancedCanvasEditor.tsx', version=5)
+
+PATCH_SETS = {patch.name: patch for patch in (SIMPLE_EDITOR, ADVANCED_EDITOR, ADVANCED_EDITOR_FIX)}
@@ -0,0 +1,290 @@
+"""Watch the app trees and re-apply patch sets to the files that change.
+
+    python -m tools.patch_watch advanced-editor-fix simple-editor
+    python -m tools.patch_watch simple-editor --root src --debounce 100
+
+Runs ``tools.patch_batch`` once over every target to catch up (unless
+``--no-initial``), then listens for file events under the roots
+(``inotify`` on Linux, a stat poll elsewhere).  After a burst of events
+goes quiet for ``--debounce`` milliseconds, only the files that changed and
+match a patch set's glob are checked and re-patched.  Output goes through
+``write_source`` (temp file and rename), so the dev server reloads once, on
+the complete file.  Our own writes are recognised through the manifest and not patched
+again.  Each patched file is logged with its latency from the first event.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import os
+import select
+import struct
+import sys
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set
+
+from tools.patch_batch import DEFAULT_ROOTS, ERROR, REPO_ROOT, SOURCE_SUFFIXES, find_targets, run_batch
+from tools.patch_engine import TEMP_SUFFIX
+from tools.patch_manifest import DEFAULT_MANIFEST, PatchManifest
+from tools.patch_sets import PATCH_SETS
+
+
+DEFAULT_DEBOUNCE_MS = 50
+POLL_INTERVAL = 0.5
+_SKIP_DIRS = frozenset({'node_modules', '.next', '.git'})
+
+# <sys/inotify.h>
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+_EVENT = struct.Struct('iIII')
+
+
+def _walk_dirs(root: str) -> Iterator[str]:
+    for directory, dirs, _ in os.walk(root):
+        dirs[:] = [d for d in dirs if d not in _SKIP_DIRS]
+        yield directory
+
+
+class InotifyWatcher:
+    """Recursive watch over directories; ``read`` returns changed file paths."""
+
+    def __init__(self, roots: Iterable[str]):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add = libc.inotify_add_watch
+        self._add.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.dirs: Dict[int, str] = {}
+        for root in roots:
+            for directory in _walk_dirs(root):
+                self.watch(directory)
+
+    def watch(self, directory: str) -> None:
+        wd = self._add(self.fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(err, f'inotify_add_watch failed for {directory}')
+        self.dirs[wd] = directory
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def read(self) -> Set[str]:
+        changed: Set[str] = set()
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost; the caller rescans everything.
+                changed.add('')
+                continue
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            directory = self.dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and name not in _SKIP_DIRS:
+                    # A new directory: watch it and treat what is already inside as changed.
+                    for sub in _walk_dirs(path):
+                        self.watch(sub)
+                        changed.update(os.path.join(sub, f) for f in os.listdir(sub))
+                continue
+            if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                changed.add(path)
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollWatcher:
+    """Fallback without inotify: compares stats of the target files."""
+
+    def __init__(self, roots: Iterable[str], patterns: Sequence[str]):
+        self.roots = list(roots)
+        self.patterns = patterns
+        self.stats = self._scan()
+
+    def _scan(self) -> Dict[str, tuple]:
+        stats = {}
+        for pattern in self.patterns:
+            for path in find_targets(self.roots, pattern):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                stats[path] = (st.st_size, st.st_mtime_ns, st.st_ino)
+        return stats
+
+    def fileno(self) -> Optional[int]:
+        return None
+
+    def read(self) -> Set[str]:
+        current = self._scan()
+        changed = {path for path, st in current.items() if self.stats.get(path) != st}
+        self.stats = current
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+def matching_patches(path: str, roots: Sequence[str], patches: Sequence[str]) -> List[str]:
+    """Names of the patch sets whose glob matches ``path`` under one of the roots."""
+    if not path.endswith(SOURCE_SUFFIXES) or path.endswith(TEMP_SUFFIX):
+        return []
+    for root in roots:
+        base = root if os.path.isabs(root) else os.path.join(REPO_ROOT, root)
+        rel = os.path.relpath(path, base)
+        if rel == os.pardir or rel.startswith(os.pardir + os.sep):
+            continue
+        rel = rel.replace(os.sep, '/')
+        return [name for name in patches if _glob_match(rel, PATCH_SETS[name].glob)]
+    return []
+
+
+def _glob_match(rel: str, pattern: str) -> bool:
+    # ``Path.glob`` lets a leading ``**/`` match zero directories; fnmatch does not.
+    if fnmatch.fnmatch(rel, pattern):
+        return True
+    return pattern.startswith('**/') and fnmatch.fnmatch(rel, pattern[3:])
+
+
+class Watch:
+    def __init__(self, patches: Sequence[str], roots: Sequence[str], manifest: PatchManifest,
+                 debounce: float = DEFAULT_DEBOUNCE_MS / 1000, dry_run: bool = False, log=print):
+        self.patches = patches
+        self.roots = roots
+        self.manifest = manifest
+        self.debounce = debounce
+        self.dry_run = dry_run
+        self.log = log
+
+    def catch_up(self) -> None:
+        for name in self.patches:
+            paths = find_targets(self.roots, PATCH_SETS[name].glob)
+            reports = run_batch(paths, name, None, self.dry_run, self.manifest)
+            for report in reports:
+                if not report.cached:
+                    self.log(f'{os.path.relpath(report.path, REPO_ROOT)}  {name}: {report.status}'
+                             + (f' ({report.error})' if report.error else ''))
+
+    def process(self, paths: Iterable[str], first_event: float) -> int:
+        """Re-check the changed files; returns how many were written."""
+        written = 0
+        for path in sorted(set(paths)):
+            for name in matching_patches(path, self.roots, self.patches):
+                if not os.path.exists(path):
+                    continue
+                report = run_batch([path], name, 1, self.dry_run, self.manifest)[0]
+                if report.cached:
+                    # Our own write (or a touch without changes) coming back.
+                    continue
+                latency = (time.perf_counter() - first_event) * 1e3
+                detail = report.error or (f'{len(report.applied)} edits applied' if report.applied
+                                          else report.status)
+                self.log(f'{os.path.relpath(path, REPO_ROOT)}  {name}: {detail}  '
+                         f'[{latency:.1f} ms after the first event, debounce {self.debounce * 1e3:.0f} ms]')
+                written += bool(report.applied) and report.status != ERROR
+        return written
+
+    def run(self, watcher, stop_after: Optional[float] = None) -> None:
+        """Loop until interrupted (or ``stop_after`` seconds, for scripted runs)."""
+        deadline = None if stop_after is None else time.monotonic() + stop_after
+        pending: Set[str] = set()
+        first_event = 0.0
+        fd = watcher.fileno()
+        while deadline is None or time.monotonic() < deadline:
+            timeout = self.debounce if pending else (POLL_INTERVAL if fd is None else 1.0)
+            if fd is not None:
+                ready, _, _ = select.select([fd], [], [], timeout)
+                changed = watcher.read() if ready else set()
+            else:
+                time.sleep(timeout)
+                changed = watcher.read()
+            if changed:
+                if not pending:
+                    first_event = time.perf_counter()
+                pending |= changed
+                continue
+            if pending:
+                if '' in pending:
+                    self.log('event queue overflowed; re-checking every target')
+                    self.catch_up()
+                else:
+                    self.process(pending, first_event)
+                pending.clear()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('patches', nargs='+', choices=sorted(PATCH_SETS), metavar='patch',
+                        help=f'patch sets to keep applied ({", ".join(sorted(PATCH_SETS))})')
+    parser.add_argument('--root', action='append', dest='roots',
+                        help='tree to watch (repeatable, default: all app trees)')
+    parser.add_argument('--debounce', type=float, default=DEFAULT_DEBOUNCE_MS,
+                        help='quiet period in ms before a burst of events is processed')
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST, help='patch manifest file')
+    parser.add_argument('--no-initial', action='store_true', help='skip the catch-up pass over every target')
+    parser.add_argument('--poll', action='store_true', help='poll file stats instead of using inotify')
+    parser.add_argument('--dry-run', action='store_true', help='report without writing')
+    args = parser.parse_args(argv)
+
+    roots = args.roots or list(DEFAULT_ROOTS)
+    absolute = [r if os.path.isabs(r) else os.path.join(REPO_ROOT, r) for r in roots]
+    existing = [r for r in absolute if os.path.isdir(r)]
+    if not existing:
+        print('No roots to watch', file=sys.stderr)
+        return 1
+
+    log = lambda msg: print(f'{time.strftime("%H:%M:%S")} {msg}', flush=True)  # noqa: E731
+    watch = Watch(args.patches, roots, PatchManifest(args.manifest), args.debounce / 1000, args.dry_run, log)
+    if not args.no_initial:
+        watch.catch_up()
+    watcher = None
+    if not args.poll and sys.platform.startswith('linux'):
+        try:
+            watcher = InotifyWatcher(existing)
+        except (OSError, AttributeError) as e:
+            log(f'inotify unavailable ({e}); polling instead')
+    if watcher is None:
+        watcher = PollWatcher(roots, [PATCH_SETS[name].glob for name in args.patches])
+    log(f'watching {", ".join(os.path.relpath(r, REPO_ROOT) for r in existing)} '
+        f'({type(watcher).__name__}); Ctrl-C to stop')
+    try:
+        watch.run(watcher)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
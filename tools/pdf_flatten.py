@@ -0,0 +1,905 @@
+"""Flatten the stacked page-sized image layers of exported post PDFs in place.
+
+    python -m tools.pdf_flatten --dry-run                  # every PDF under public/uploads
+    python -m tools.pdf_flatten public/uploads/post-1.pdf --verify
+    python -m tools.pdf_flatten --jobs 8
+
+The browser export (``handleExportToPDF`` / ``getPDFBlob``) draws the
+non-text elements onto one canvas and adds a PNG snapshot of the whole
+canvas after each of them.  A post with ten shapes therefore carries ten
+page-sized images with soft masks, which jsPDF stores uncompressed.  For
+the page-sized images of a page:
+
+* runs of layers with nothing painted between them are composited into one
+  image (needs Pillow; without it they stay separate),
+* a layer whose every painted pixel is painted opaquely again by a later
+  layer is dropped,
+* the rest are cropped to the bounding box of their non-transparent pixels,
+  lose the soft mask if that box is fully opaque, and are stored with Flate.
+
+None of these steps changes how the page renders.  Text, paths and every
+other object are copied byte for byte.  The file is replaced atomically
+under the same name, so ``Post.pdfUrl`` stays valid.  Only single-page files
+with a classic xref table (what jsPDF writes) are handled; others are
+reported and left alone.  With PyMuPDF installed the report includes the time
+to open and render the page, and ``--verify`` renders it before and after,
+keeping the original if they differ.  Files are processed in a process pool.
+"""
+
+import argparse
+import io
+import os
+import re
+import stat
+import struct
+import sys
+import time
+import zlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from tools.asset_store import ASSET_DIR, write_atomic
+from tools.image_variants import VARIANT_DIR
+from tools.pdf_images import PNG_SIGNATURE, ImageError, unfilter
+from tools.pdf_render import PUBLIC_DIR
+from tools.render_cache import CACHE_DIR
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional: layers are not composited without it.
+    Image = None
+
+try:
+    import pymupdf
+except ImportError:  # PyMuPDF is optional: no open times or --verify without it.
+    pymupdf = None
+
+
+DEFAULT_ROOT = os.path.join(PUBLIC_DIR, 'uploads')
+FLATE_LEVEL = 6
+# An image drawn within this many points of the media box counts as page-sized.
+PAGE_TOLERANCE = 0.5
+# Transparent pixels kept around a crop: renderers snap image edges outwards to
+# whole device pixels and smooth across them, which must still sample nothing.
+CROP_MARGIN = 2
+# --verify renders at this many device pixels per image pixel and accepts this
+# largest per-channel difference between the two renderings.
+VERIFY_DENSITY = 2
+VERIFY_TOLERANCE = 8
+OPEN_RUNS = 3
+
+_WS = rb'\x00\t\n\x0c\r '
+_REGULAR = rb'[^\x00\t\n\x0c\r ()<>\[\]{}/%]'
+_LEX = re.compile(rb'(?:[\x00\t\n\x0c\r ]+|%[^\r\n]*)*(?:'
+                  rb'(?P<ref>\d+[\x00\t\n\x0c\r ]+\d+[\x00\t\n\x0c\r ]+R(?!' + _REGULAR + rb'))'
+                  rb'|(?P<num>[+-]?(?:\d+\.?\d*|\.\d+))(?!' + _REGULAR + rb')'
+                  rb'|(?P<name>/' + _REGULAR + rb'*)'
+                  rb'|(?P<open><<|\[)'
+                  rb'|(?P<close>>>|\])'
+                  rb'|(?P<hex><[^<>]*>)'
+                  rb'|(?P<lit>\()'
+                  rb'|(?P<word>' + _REGULAR + rb'+)'
+                  rb')?')
+_OBJ = re.compile(rb'[\x00\t\n\x0c\r ]*(\d+)[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]+obj')
+_STREAM = re.compile(rb'[\x00\t\n\x0c\r ]*stream\r?\n')
+_XREF_SECTION = re.compile(rb'[\x00\t\n\x0c\r ]*(\d+)[ ]+(\d+)[ \t]*\r?\n')
+_TRAILER = re.compile(rb'[\x00\t\n\x0c\r ]*trailer')
+_STARTXREF = re.compile(rb'startxref[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]*%%EOF[\x00\t\n\x0c\r ]*$')
+
+# Operators that put marks on the page; anything else only changes state.
+_PAINT_OPS = frozenset(('S', 's', 'f', 'F', 'f*', 'B', 'B*', 'b', 'b*', 'sh', 'Tj', 'TJ', "'", '"', 'Do', 'BI'))
+_NEUTRAL_BLEND = (None, 'Normal', 'Compatible')
+_PAINTED = bytes([0] + [1] * 255)    # alpha > 0
+_OPAQUE = bytes([0] * 255 + [1])     # alpha == 255
+
+
+class PdfError(ValueError):
+    """Raised when a file is not a PDF this tool can rewrite."""
+
+
+class Name(str):
+    """A PDF name, without the slash and with ``#xx`` escapes left as they are."""
+
+
+class Operator(str):
+    """A content stream operator."""
+
+
+class Raw(bytes):
+    """A string token kept exactly as written, delimiters included."""
+
+
+Ref = namedtuple('Ref', 'num gen')
+
+
+@dataclass
+class Stream:
+    dict: dict
+    data: bytes
+
+
+@dataclass
+class Op:
+    operator: str
+    operands: list
+    start: int
+    end: int
+
+
+@dataclass
+class Layer:
+    op: int          # index of the ``Do`` in the page's operations
+    name: str
+    ref: Ref
+    width: int
+    height: int
+    channels: int = 3
+    pixels: Optional[bytes] = None   # None: not decoded, kept as it is
+    alpha: Optional[bytes] = None    # None: fully opaque
+    exact: bool = True               # no clip or transparency group state in effect
+    recompress: bool = False         # stored unfiltered, or with a soft mask that is all opaque
+    merged: int = 1
+    crop: Optional[Tuple[int, int, int, int]] = None
+
+
+@dataclass
+class FlattenReport:
+    path: str
+    status: str = 'unchanged'
+    layers_before: int = 0
+    layers_after: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+    open_before: Optional[float] = None
+    open_after: Optional[float] = None
+    max_diff: Optional[int] = None
+
+
+# --- parsing ------------------------------------------------------------------
+
+def _literal_end(data: bytes, pos: int) -> int:
+    depth = 0
+    i = pos
+    n = len(data)
+    while i < n:
+        c = data[i]
+        if c == 0x5C:
+            i += 2
+            continue
+        if c == 0x28:
+            depth += 1
+        elif c == 0x29:
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    raise PdfError('unterminated string')
+
+
+def parse_value(data: bytes, pos: int):
+    """Parse one object at ``pos``; returns ``(value, end)``.  Bare words come back as ``Operator``."""
+    m = _LEX.match(data, pos)
+    kind = m.lastgroup
+    if kind is None:
+        raise PdfError(f'unexpected data at offset {m.end()}')
+    start, end = m.start(kind), m.end()
+    token = m.group(kind)
+    if kind == 'num':
+        return (float(token) if b'.' in token else int(token)), end
+    if kind == 'ref':
+        num, gen = token.split()[:2]
+        return Ref(int(num), int(gen)), end
+    if kind == 'name':
+        return Name(token[1:].decode('latin-1')), end
+    if kind == 'hex':
+        return Raw(token), end
+    if kind == 'lit':
+        end = _literal_end(data, start)
+        return Raw(data[start:end]), end
+    if kind == 'word':
+        word = token.decode('latin-1')
+        if word in ('true', 'false'):
+            return word == 'true', end
+        if word == 'null':
+            return None, end
+        return Operator(word), end
+    if kind == 'close':
+        raise PdfError(f'unexpected {token.decode()} at offset {start}')
+    closing = b'>>' if token == b'<<' else b']'
+    items = []
+    pos = end
+    while True:
+        m = _LEX.match(data, pos)
+        if m.lastgroup == 'close':
+            if m.group('close') != closing:
+                raise PdfError(f'mismatched {m.group("close").decode()} at offset {m.start("close")}')
+            pos = m.end()
+            break
+        value, pos = parse_value(data, pos)
+        items.append(value)
+    if closing == b']':
+        return items, pos
+    if len(items) % 2:
+        raise PdfError('dictionary with an odd number of items')
+    return {items[i]: items[i + 1] for i in range(0, len(items), 2)}, pos
+
+
+def iter_ops(data: bytes) -> Iterator[Op]:
+    pos = 0
+    operands: list = []
+    start = None
+    n = len(data)
+    while True:
+        m = _LEX.match(data, pos)
+        if m.lastgroup is None:
+            if m.end() < n:
+                raise PdfError(f'unexpected content at offset {m.end()}')
+            return
+        if start is None:
+            start = m.start(m.lastgroup)
+        value, pos = parse_value(data, pos)
+        if isinstance(value, Operator):
+            if value == 'BI':
+                raise PdfError('inline images are not supported')
+            yield Op(str(value), operands, start, pos)
+            operands, start = [], None
+        else:
+            operands.append(value)
+
+
+def serialize(value) -> bytes:
+    if isinstance(value, Name):
+        return b'/' + value.encode('latin-1')
+    if isinstance(value, Ref):
+        return b'%d %d R' % value
+    if isinstance(value, Raw):
+        return bytes(value)
+    if isinstance(value, bool):
+        return b'true' if value else b'false'
+    if value is None:
+        return b'null'
+    if isinstance(value, int):
+        return b'%d' % value
+    if isinstance(value, float):
+        return _num(value).encode()
+    if isinstance(value, list):
+        return b'[' + b' '.join(serialize(v) for v in value) + b']'
+    if isinstance(value, dict):
+        return b'<<' + b''.join(b'/' + k.encode('latin-1') + b' ' + serialize(v) for k, v in value.items()) + b'>>'
+    raise TypeError(f'cannot serialize {type(value).__name__}')
+
+
+def _num(value: float) -> str:
+    text = f'{value:.8f}'.rstrip('0').rstrip('.')
+    return text if text not in ('', '-0') else '0'
+
+
+class PdfFile:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.offsets: Dict[int, int] = {}
+        self.trailer: dict = {}
+        self._cache: Dict[int, object] = {}
+        self._spans: Dict[int, Tuple[int, int, int]] = {}
+        self._read_xref()
+        self.next_num = max(self.offsets, default=0) + 1
+
+    def _read_xref(self) -> None:
+        m = _STARTXREF.search(self.data, max(0, len(self.data) - 1024))
+        if not m:
+            raise PdfError('no startxref')
+        offset: Optional[int] = int(m.group(1))
+        seen_sections: Set[int] = set()
+        seen: Set[int] = set()
+        while offset is not None and offset not in seen_sections:
+            seen_sections.add(offset)
+            if not self.data.startswith(b'xref', offset):
+                raise PdfError('cross-reference streams are not supported')
+            pos = offset + 4
+            while True:
+                m = _XREF_SECTION.match(self.data, pos)
+                if not m:
+                    break
+                first, count = int(m.group(1)), int(m.group(2))
+                pos = m.end()
+                for num in range(first, first + count):
+                    entry = self.data[pos:pos + 20]
+                    pos += 20
+                    if num in seen:
+                        continue
+                    seen.add(num)
+                    if entry[17:18] == b'n':
+                        self.offsets[num] = int(entry[:10])
+            m = _TRAILER.match(self.data, pos)
+            if not m:
+                raise PdfError('no trailer')
+            trailer, _ = parse_value(self.data, m.end())
+            if not self.trailer:
+                self.trailer = trailer
+            prev = trailer.get('Prev')
+            offset = prev if isinstance(prev, int) else None
+        self.offsets.pop(0, None)
+
+    def get(self, num: int):
+        if num not in self._cache:
+            offset = self.offsets.get(num)
+            if offset is None:
+                return None
+            m = _OBJ.match(self.data, offset)
+            if not m or int(m.group(1)) != num:
+                raise PdfError(f'object {num} is not at its xref offset')
+            value, pos = parse_value(self.data, m.end())
+            s = _STREAM.match(self.data, pos)
+            if s and isinstance(value, dict):
+                length = self.resolve(value.get('Length'))
+                if not isinstance(length, int):
+                    raise PdfError(f'object {num}: stream without a length')
+                value = Stream(value, self.data[s.end():s.end() + length])
+                pos = s.end() + length
+            end = self.data.find(b'endobj', pos)
+            if end < 0:
+                raise PdfError(f'object {num}: no endobj')
+            self._cache[num] = value
+            self._spans[num] = (offset + len(m.group()) - len(m.group().lstrip(_WS)), end + 6, int(m.group(2)))
+        return self._cache[num]
+
+    def resolve(self, value):
+        while isinstance(value, Ref):
+            value = self.get(value.num)
+        return value
+
+    def allocate(self) -> int:
+        self.next_num += 1
+        return self.next_num - 1
+
+    def rebuild(self, replaced: Dict[int, bytes], dropped: Set[int]) -> bytes:
+        """The file with ``replaced`` object bodies (new numbers allowed) and without ``dropped``."""
+        out = bytearray(self.data[:min(self.offsets.values())])
+        offsets: Dict[int, Tuple[int, int]] = {}
+        for num in sorted((set(self.offsets) | set(replaced)) - dropped):
+            if num in replaced:
+                gen = self._spans[num][2] if num in self._spans else 0
+                offsets[num] = (len(out), gen)
+                out += b'%d %d obj\n' % (num, gen) + replaced[num] + b'\nendobj\n'
+            else:
+                self.get(num)
+                start, end, gen = self._spans[num]
+                offsets[num] = (len(out), gen)
+                out += self.data[start:end] + b'\n'
+        size = max(offsets) + 1
+        free = [n for n in range(1, size) if n not in offsets] + [0]
+        xref = len(out)
+        out += b'xref\n0 %d\n' % size
+        out += b'%010d 65535 f \n' % free[0]
+        next_free = iter(free[1:])
+        for num in range(1, size):
+            if num in offsets:
+                out += b'%010d %05d n \n' % offsets[num]
+            else:
+                out += b'%010d 00001 f \n' % next(next_free)
+        trailer = {k: v for k, v in self.trailer.items() if k not in ('Prev', 'XRefStm')}
+        trailer[Name('Size')] = size
+        out += b'trailer\n' + serialize(trailer) + b'\nstartxref\n%d\n%%%%EOF\n' % xref
+        return bytes(out)
+
+
+# --- images -------------------------------------------------------------------
+
+def _png_chunk(kind: bytes, body: bytes) -> bytes:
+    return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(kind + body))
+
+
+def _predicted(data: bytes, width: int, height: int, channels: int) -> bytes:
+    """Pixels from Flate data with PNG predictors, through Pillow's decoder when available."""
+    if Image is not None:
+        png = (PNG_SIGNATURE + _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8,
+                                                                  2 if channels == 3 else 0, 0, 0, 0))
+               + _png_chunk(b'IDAT', data) + _png_chunk(b'IEND', b''))
+        with Image.open(io.BytesIO(png)) as im:
+            return im.tobytes()
+    return unfilter(zlib.decompress(data), width * channels, height, channels)
+
+
+def decode_image(pdf: PdfFile, stream: Stream, channels: Optional[int] = None) -> Tuple[int, int, int, bytes, bool]:
+    """``(width, height, channels, pixels, stored raw)`` of an 8-bit RGB or grey image XObject."""
+    d = stream.dict
+    width, height = pdf.resolve(d.get('Width')), pdf.resolve(d.get('Height'))
+    space = pdf.resolve(d.get('ColorSpace'))
+    if space not in ('DeviceRGB', 'DeviceGray') or pdf.resolve(d.get('BitsPerComponent')) != 8:
+        raise PdfError(f'unsupported image: {space}')
+    if d.get('Decode') is not None or d.get('Mask') is not None or d.get('ImageMask') or d.get('Matte') is not None:
+        raise PdfError('unsupported image: Decode, Mask or Matte')
+    found = 3 if space == 'DeviceRGB' else 1
+    if channels is not None and found != channels:
+        raise PdfError('unsupported soft mask colour space')
+    filters = pdf.resolve(d.get('Filter'))
+    params = pdf.resolve(d.get('DecodeParms'))
+    if isinstance(filters, list):
+        if len(filters) > 1:
+            raise PdfError('unsupported filter chain')
+        filters = filters[0] if filters else None
+        params = params[0] if isinstance(params, list) and params else params
+    if filters is None:
+        pixels, raw = stream.data, True
+    elif filters == 'FlateDecode':
+        predictor = pdf.resolve(params.get('Predictor')) if isinstance(params, dict) else None
+        try:
+            if isinstance(predictor, int) and predictor >= 10:
+                pixels = _predicted(stream.data, width, height, found)
+            elif predictor in (None, 1):
+                pixels = zlib.decompress(stream.data)
+            else:
+                raise PdfError(f'unsupported predictor {predictor}')
+        except (zlib.error, ImageError, OSError) as e:
+            raise PdfError(f'corrupt image data: {e}') from None
+        raw = False
+    else:
+        raise PdfError(f'unsupported filter {filters}')
+    if len(pixels) < width * height * found:
+        raise PdfError('short image data')
+    return width, height, found, pixels[:width * height * found], raw
+
+
+def image_stream(width: int, height: int, channels: int, pixels: bytes, smask: Optional[int] = None) -> bytes:
+    data = zlib.compress(pixels, FLATE_LEVEL)
+    head = (f'<</Type /XObject /Subtype /Image /Width {width} /Height {height} '
+            f'/ColorSpace /{"DeviceRGB" if channels == 3 else "DeviceGray"} /BitsPerComponent 8 '
+            f'/Filter /FlateDecode' + (f' /SMask {smask} 0 R' if smask else '') + f' /Length {len(data)}>>')
+    return head.encode() + b'\nstream\n' + data + b'\nendstream'
+
+
+def _mask(alpha: Optional[bytes], table: bytes, size: int) -> int:
+    """One byte per pixel, 1 where ``table`` maps the alpha to 1, as an integer."""
+    if alpha is None:
+        return int.from_bytes(b'\x01' * size, 'big')
+    return int.from_bytes(alpha.translate(table), 'big')
+
+
+def bounding_box(alpha: Optional[bytes], width: int, height: int) -> Optional[Tuple[int, int, int, int]]:
+    """``(x0, y0, x1, y1)`` of the non-transparent pixels, rows from the top; None if there are none."""
+    if alpha is None:
+        return 0, 0, width, height
+    top = bottom = None
+    left, right = width, 0
+    for y in range(height):
+        row = alpha[y * width:(y + 1) * width]
+        if row.count(0) == width:
+            continue
+        if top is None:
+            top = y
+        bottom = y + 1
+        left = min(left, width - len(row.lstrip(b'\0')))
+        right = max(right, len(row.rstrip(b'\0')))
+    if top is None:
+        return None
+    return left, top, right, bottom
+
+
+def _crop(data: bytes, width: int, channels: int, box: Tuple[int, int, int, int]) -> bytes:
+    x0, y0, x1, y1 = box
+    return b''.join(data[(y * width + x0) * channels:(y * width + x1) * channels] for y in range(y0, y1))
+
+
+def composite(layers: Sequence[Layer]) -> Tuple[int, bytes, Optional[bytes]]:
+    """Paint ``layers`` over each other (soft-mask "over"); returns channels, pixels and alpha."""
+    size = (layers[0].width, layers[0].height)
+    result = None
+    for layer in layers:
+        im = Image.frombytes('RGB' if layer.channels == 3 else 'L', size, layer.pixels).convert('RGBA')
+        if layer.alpha is not None:
+            im.putalpha(Image.frombytes('L', size, layer.alpha))
+        result = im if result is None else Image.alpha_composite(result, im)
+    alpha = result.getchannel('A').tobytes()
+    return 3, result.convert('RGB').tobytes(), (None if min(alpha) == 255 else alpha)
+
+
+# --- the page -----------------------------------------------------------------
+
+def _mul(m: Sequence[float], n: Sequence[float]) -> Tuple[float, ...]:
+    return (m[0] * n[0] + m[1] * n[2], m[0] * n[1] + m[1] * n[3],
+            m[2] * n[0] + m[3] * n[2], m[2] * n[1] + m[3] * n[3],
+            m[4] * n[0] + m[5] * n[2] + n[4], m[4] * n[1] + m[5] * n[3] + n[5])
+
+
+def _single_page(pdf: PdfFile) -> Tuple[int, dict]:
+    root = pdf.resolve(pdf.trailer.get('Root'))
+    pages = pdf.resolve(root.get('Pages')) if isinstance(root, dict) else None
+    if not isinstance(pages, dict) or pdf.resolve(pages.get('Count')) != 1:
+        raise PdfError(f'{pdf.resolve(pages.get("Count")) if isinstance(pages, dict) else "no"} pages')
+    kid = (pdf.resolve(pages.get('Kids')) or [None])[0]
+    page = pdf.resolve(kid)
+    if not isinstance(kid, Ref) or not isinstance(page, dict) or page.get('Type') != 'Page':
+        raise PdfError('nested page tree')
+    for key in ('MediaBox', 'Resources'):
+        if key not in page and key in pages:
+            page = dict(page)
+            page[Name(key)] = pages[key]
+    return kid.num, page
+
+
+def _content(pdf: PdfFile, page: dict) -> Tuple[Ref, Stream, bytes]:
+    ref = page.get('Contents')
+    stream = pdf.resolve(ref)
+    if not isinstance(ref, Ref) or not isinstance(stream, Stream):
+        raise PdfError('page content is not a single stream')
+    f = pdf.resolve(stream.dict.get('Filter'))
+    if f is None:
+        return ref, stream, stream.data
+    if f in ('FlateDecode', ['FlateDecode']) and not stream.dict.get('DecodeParms'):
+        try:
+            return ref, stream, zlib.decompress(stream.data)
+        except zlib.error as e:
+            raise PdfError(f'corrupt content stream: {e}') from None
+    raise PdfError(f'unsupported content filter {f}')
+
+
+def find_layers(pdf: PdfFile, ops: Sequence[Op], xobjects: dict, gstates: dict,
+                media: Sequence[float]) -> Tuple[List[Layer], List[int]]:
+    """Page-sized image draws, and for every op the number of other painting ops before it."""
+    x0, y0, x1, y1 = (float(pdf.resolve(v)) for v in media)
+    page_ctm = (x1 - x0, 0.0, 0.0, y1 - y0, x0, y0)
+    stack = []
+    ctm: Tuple[float, ...] = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+    inexact = 0   # nesting levels with a clip or a non-neutral graphics state
+    layers = []
+    painted = [0]
+    for i, op in enumerate(ops):
+        is_layer = False
+        if op.operator == 'q':
+            stack.append((ctm, inexact))
+        elif op.operator == 'Q' and stack:
+            ctm, inexact = stack.pop()
+        elif op.operator == 'cm' and len(op.operands) == 6:
+            ctm = _mul([float(v) for v in op.operands], ctm)
+        elif op.operator in ('W', 'W*'):
+            inexact += 1
+        elif op.operator == 'gs' and op.operands:
+            state = pdf.resolve(gstates.get(op.operands[0]))
+            if not isinstance(state, dict) or any(
+                    (k == 'ca' and pdf.resolve(v) not in (1, 1.0))
+                    or (k == 'BM' and pdf.resolve(v) not in _NEUTRAL_BLEND)
+                    or (k == 'SMask' and pdf.resolve(v) not in (None, 'None'))
+                    for k, v in state.items()):
+                inexact += 1
+        elif op.operator == 'Do' and op.operands:
+            ref = xobjects.get(op.operands[0])
+            xobject = pdf.resolve(ref)
+            if (isinstance(ref, Ref) and isinstance(xobject, Stream) and xobject.dict.get('Subtype') == 'Image'
+                    and all(abs(a - b) <= PAGE_TOLERANCE for a, b in zip(ctm, page_ctm))):
+                layer = Layer(i, op.operands[0], ref, pdf.resolve(xobject.dict.get('Width')),
+                              pdf.resolve(xobject.dict.get('Height')), exact=not inexact)
+                _load_layer(pdf, layer, xobject)
+                layers.append(layer)
+                is_layer = True
+        painted.append(painted[-1] + (op.operator in _PAINT_OPS and not is_layer))
+    return layers, painted
+
+
+def _load_layer(pdf: PdfFile, layer: Layer, xobject: Stream) -> None:
+    try:
+        _, _, layer.channels, layer.pixels, raw = decode_image(pdf, xobject)
+        layer.recompress = raw
+        smask = pdf.resolve(xobject.dict.get('SMask'))
+        if isinstance(smask, Stream):
+            w, h, _, alpha, raw = decode_image(pdf, smask, channels=1)
+            if (w, h) != (layer.width, layer.height):
+                raise PdfError('soft mask size differs')
+            layer.recompress |= raw
+            if min(alpha) == 255:
+                layer.recompress = True
+            else:
+                layer.alpha = alpha
+        elif smask is not None:
+            raise PdfError('unsupported soft mask')
+    except PdfError:
+        layer.pixels = layer.alpha = None
+        layer.exact = False
+
+
+def plan(layers: List[Layer], painted: Sequence[int], merge: bool = True) -> List[Layer]:
+    """Decide which layers to merge, drop and crop; returns the layers that stay."""
+    # Runs of layers with nothing painted in between.
+    kept: List[Layer] = []
+    run: List[Layer] = []
+
+    def close_run() -> None:
+        if len(run) > 1:
+            channels, pixels, alpha = composite(run)
+            last = run[-1]
+            last.channels, last.pixels, last.alpha, last.merged = channels, pixels, alpha, len(run)
+        if run:
+            kept.append(run[-1])
+        run.clear()
+
+    for layer in layers:
+        prev = run[-1] if run else None
+        if (merge and Image is not None and prev is not None and prev.exact and layer.exact
+                and prev.pixels is not None and layer.pixels is not None
+                and (prev.width, prev.height) == (layer.width, layer.height)
+                and painted[layer.op] == painted[prev.op + 1]):
+            run.append(layer)
+            continue
+        close_run()
+        run.append(layer)
+    close_run()
+
+    # Back to front: drop layers painted over opaquely by what follows.
+    survivors: List[Layer] = []
+    cover = 0
+    cover_size = None
+    for layer in reversed(kept):
+        size = layer.width * layer.height
+        if layer.pixels is not None and layer.exact and cover_size == (layer.width, layer.height):
+            if _mask(layer.alpha, _PAINTED, size) & ~cover == 0:
+                continue
+        if layer.pixels is not None and layer.exact:
+            if cover_size != (layer.width, layer.height):
+                cover, cover_size = 0, (layer.width, layer.height)
+            cover |= _mask(layer.alpha, _OPAQUE, size)
+        survivors.append(layer)
+    survivors.reverse()
+
+    result = []
+    for layer in survivors:
+        if layer.pixels is None:
+            result.append(layer)
+            continue
+        box = bounding_box(layer.alpha, layer.width, layer.height)
+        if box is None:
+            continue  # paints nothing
+        box = (max(box[0] - CROP_MARGIN, 0), max(box[1] - CROP_MARGIN, 0),
+               min(box[2] + CROP_MARGIN, layer.width), min(box[3] + CROP_MARGIN, layer.height))
+        if box != (0, 0, layer.width, layer.height):
+            layer.crop = box
+            alpha = _crop(layer.alpha, layer.width, 1, box)
+            layer.alpha = None if min(alpha) == 255 else alpha
+            layer.pixels = _crop(layer.pixels, layer.width, layer.channels, box)
+        result.append(layer)
+    return result
+
+
+def flatten(data: bytes, merge: bool = True) -> Tuple[Optional[bytes], int, int]:
+    """Flattened file (None if there is nothing to gain) and the layer counts before and after."""
+    pdf = PdfFile(data)
+    page_num, page = _single_page(pdf)
+    resources = pdf.resolve(page.get('Resources')) or {}
+    xobjects = pdf.resolve(resources.get('XObject')) or {}
+    gstates = pdf.resolve(resources.get('ExtGState')) or {}
+    media = pdf.resolve(page.get('MediaBox'))
+    if not isinstance(media, list) or len(media) != 4:
+        raise PdfError('no media box')
+    content_ref, content, text = _content(pdf, page)
+    ops = list(iter_ops(text))
+    layers, painted = find_layers(pdf, ops, xobjects, gstates, media)
+    kept = plan(list(layers), painted, merge)
+    kept_ops = {layer.op for layer in kept}
+    changed = [layer for layer in kept if layer.merged > 1 or layer.crop or layer.recompress]
+    if len(kept) == len(layers) and not changed:
+        return None, len(layers), len(layers)
+
+    replaced: Dict[int, bytes] = {}
+    names: Dict[int, str] = {}
+    new_xobjects = {k: v for k, v in xobjects.items()}
+    for layer in changed:
+        width, height = layer.width, layer.height
+        if layer.crop:
+            width, height = layer.crop[2] - layer.crop[0], layer.crop[3] - layer.crop[1]
+        smask = None
+        if layer.alpha is not None:
+            smask = pdf.allocate()
+            replaced[smask] = image_stream(width, height, 1, layer.alpha)
+        num = pdf.allocate()
+        replaced[num] = image_stream(width, height, layer.channels, layer.pixels, smask)
+        name = _unique_name(new_xobjects, 'Fl')
+        new_xobjects[Name(name)] = Ref(num, 0)
+        names[layer.op] = name
+
+    out = bytearray()
+    cursor = 0
+    layer_ops = {layer.op: layer for layer in layers}
+    for i, op in enumerate(ops):
+        if i not in layer_ops or (i in kept_ops and i not in names):
+            continue
+        out += text[cursor:op.start]
+        cursor = op.end
+        if i in names:
+            layer = layer_ops[i]
+            if layer.crop:
+                cx0, cy0, cx1, cy1 = layer.crop
+                w, h = layer.width, layer.height
+                matrix = ' '.join(_num(v) for v in ((cx1 - cx0) / w, 0, 0, (cy1 - cy0) / h, cx0 / w, 1 - cy1 / h))
+                out += f'q {matrix} cm /{names[i]} Do Q'.encode('latin-1')
+            else:
+                out += f'/{names[i]} Do'.encode('latin-1')
+    out += text[cursor:]
+
+    # Drop the resources (and their objects) nothing draws any more.
+    used = {op.operands[0] for i, op in enumerate(ops) if op.operator == 'Do' and op.operands
+            and (i not in layer_ops or (i in kept_ops and i not in names))} | set(names.values())
+    dropped: Set[int] = set()
+    for layer in layers:
+        if layer.name not in used:
+            new_xobjects.pop(layer.name, None)
+    still = {pdf.resolve(v).dict.get('SMask') for v in new_xobjects.values()
+             if isinstance(pdf.resolve(v), Stream)} | set(new_xobjects.values())
+    for layer in layers:
+        if layer.ref not in still:
+            dropped.add(layer.ref.num)
+            smask = pdf.resolve(layer.ref).dict.get('SMask')
+            if isinstance(smask, Ref) and smask not in still:
+                dropped.add(smask.num)
+
+    body = zlib.compress(bytes(out), FLATE_LEVEL)
+    content_dict = {k: v for k, v in content.dict.items() if k not in ('Filter', 'DecodeParms', 'Length')}
+    content_dict[Name('Filter')] = Name('FlateDecode')
+    content_dict[Name('Length')] = len(body)
+    replaced[content_ref.num] = serialize(content_dict) + b'\nstream\n' + body + b'\nendstream'
+
+    # Write the XObject dictionary back where it lives.
+    new_resources = dict(resources)
+    xobject_ref = resources.get('XObject')
+    if isinstance(xobject_ref, Ref):
+        replaced[xobject_ref.num] = serialize(new_xobjects)
+    else:
+        new_resources[Name('XObject')] = new_xobjects
+        resources_ref = pdf.resolve(pdf.get(page_num)).get('Resources')
+        if isinstance(resources_ref, Ref):
+            replaced[resources_ref.num] = serialize(new_resources)
+        else:
+            new_page = dict(pdf.get(page_num))
+            new_page[Name('Resources')] = new_resources
+            replaced[page_num] = serialize(new_page)
+    result = pdf.rebuild(replaced, dropped)
+    return result, len(layers), len(kept)
+
+
+def _unique_name(existing: dict, prefix: str) -> str:
+    n = 0
+    while f'{prefix}{n}' in existing:
+        n += 1
+    return f'{prefix}{n}'
+
+
+# --- files --------------------------------------------------------------------
+
+def render_page(data: bytes, zoom: float = 1.0):
+    with pymupdf.open(stream=data, filetype='pdf') as doc:
+        return doc[0].get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+
+
+def open_time(data: bytes) -> float:
+    """Best time in ms for PyMuPDF to open the file and render its first page at 72 dpi."""
+    best = float('inf')
+    for _ in range(OPEN_RUNS):
+        started = time.perf_counter()
+        render_page(data)
+        best = min(best, time.perf_counter() - started)
+    return best * 1e3
+
+
+def max_difference(before: bytes, after: bytes) -> int:
+    """How far either rendering falls outside the other's 3x3 neighbourhood, per channel.
+
+    Both are rendered at twice the density of the widest image.  A page-sized
+    layer and its crop are resampled differently at their edges (snapped or
+    smoothed one device pixel apart), which stays within the neighbourhood;
+    a missing or misplaced mark does not.
+    """
+    with pymupdf.open(stream=before, filetype='pdf') as doc:
+        page = doc[0]
+        widest = max((image[2] for image in page.get_images()), default=0)
+        zoom = VERIFY_DENSITY * max(widest / page.rect.width, 1.0)
+    a, b = render_page(before, zoom), render_page(after, zoom)
+    if (a.width, a.height, a.n) != (b.width, b.height, b.n):
+        return 255
+    sa, sb = a.samples, b.samples
+    if sa == sb:
+        return 0
+    width, height, n = a.width, a.height, a.n
+    stride = width * n
+    worst = 0
+    for i in range(0, len(sa), n):
+        if sa[i:i + n] == sb[i:i + n]:
+            continue
+        y, x = divmod(i // n, width)
+        around = [ny * stride + nx * n for ny in range(max(y - 1, 0), min(y + 2, height))
+                  for nx in range(max(x - 1, 0), min(x + 2, width))]
+        for mine, other in ((sa, sb), (sb, sa)):
+            for c in range(n):
+                values = [other[j + c] for j in around]
+                v = mine[i + c]
+                worst = max(worst, min(values) - v, v - max(values))
+    return worst
+
+
+def flatten_file(path: str, dry_run: bool = False, verify: bool = False, merge: bool = True) -> FlattenReport:
+    report = FlattenReport(path)
+    try:
+        st = os.stat(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        report.bytes_before = report.bytes_after = len(data)
+        result, report.layers_before, report.layers_after = flatten(data, merge)
+        if result is None or len(result) >= len(data):
+            return report
+        report.bytes_after = len(result)
+        if pymupdf is not None:
+            report.open_before, report.open_after = open_time(data), open_time(result)
+            if verify:
+                report.max_diff = max_difference(data, result)
+                if report.max_diff > VERIFY_TOLERANCE:
+                    report.status = f'skipped: renders differently (max difference {report.max_diff})'
+                    return report
+        if not dry_run:
+            now = os.stat(path)
+            if (now.st_size, now.st_mtime_ns) != (st.st_size, st.st_mtime_ns):
+                report.status = 'skipped: changed while flattening'
+                return report
+            write_atomic(path, result, stat.S_IMODE(st.st_mode))
+        report.status = 'flattened'
+    except (PdfError, OSError, RuntimeError) as e:
+        report.status = f'skipped: {e}'
+        report.bytes_after = report.bytes_before
+    return report
+
+
+def iter_pdfs(paths: Sequence[str], public_dir: str = PUBLIC_DIR) -> Iterator[str]:
+    # Content-addressed stores name files by their hash; never rewrite those.
+    managed = {os.path.abspath(os.path.join(public_dir, os.path.relpath(d, PUBLIC_DIR)))
+               for d in (ASSET_DIR, CACHE_DIR, VARIANT_DIR)}
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+            continue
+        for directory, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(directory, d)) not in managed)
+            for name in sorted(files):
+                if name.lower().endswith('.pdf'):
+                    yield os.path.join(directory, name)
+
+
+def _flatten_job(args: tuple) -> FlattenReport:
+    return flatten_file(*args)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('paths', nargs='*', help='PDF files or directories (default: public/uploads)')
+    parser.add_argument('--jobs', type=int, help='worker processes (default: one per CPU)')
+    parser.add_argument('--dry-run', action='store_true', help='report without rewriting files')
+    parser.add_argument('--verify', action='store_true',
+                        help='render before and after (PyMuPDF) and keep files that differ')
+    parser.add_argument('--no-merge', action='store_true', help='do not composite runs of layers')
+    args = parser.parse_args(argv)
+    if args.verify and pymupdf is None:
+        print('--verify needs PyMuPDF (pip install pymupdf)', file=sys.stderr)
+        return 1
+
+    paths = list(iter_pdfs(args.paths or [DEFAULT_ROOT]))
+    jobs = [(path, args.dry_run, args.verify, not args.no_merge) for path in paths]
+    reports = []
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        for r in pool.map(_flatten_job, jobs):
+            reports.append(r)
+            if r.status == 'unchanged':
+                continue
+            timing = ''
+            if r.open_before is not None:
+                timing = f'  open {r.open_before:7.1f} -> {r.open_after:6.1f} ms'
+            if r.max_diff is not None:
+                timing += f'  max difference {r.max_diff}'
+            print(f'{os.path.relpath(r.path)}  {r.status}  {r.layers_before} -> {r.layers_after} layers  '
+                  f'{r.bytes_before:>12,} -> {r.bytes_after:>10,} bytes{timing}')
+    done = [r for r in reports if r.status == 'flattened']
+    before = sum(r.bytes_before for r in done)
+    after = sum(r.bytes_after for r in done)
+    verb = 'would shrink' if args.dry_run else 'shrank'
+    print(f'{len(reports)} PDFs, {len(done)} flattened ({verb} {before:,} -> {after:,} bytes), '
+          f'{sum(r.status.startswith("skipped") for r in reports)} skipped')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
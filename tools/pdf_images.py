@@ -0,0 +1,274 @@
+"""Decode image sources into PDF image XObjects, Pillow optional.
+
+Sources are the strings stored in ``CanvasElement.image`` / ``background``:
+``data:`` URLs or site paths such as ``/uploads/photo.png`` resolved against
+the ``public`` directory.  JPEG data is embedded as-is (``DCTDecode``).  PNG
+data without transparency is embedded as its own zlib stream using the PNG
+predictor, so it is never decompressed; PNGs with an alpha channel (or a
+``tRNS`` palette) are unfiltered once and split into colour and soft mask;
+Pillow's decoder does the unfiltering when it is installed, ``unfilter``
+otherwise.
+"""
+
+import base64
+import binascii
+import io
+import os
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional: PNGs are unfiltered in Python.
+    Image = None
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+# PNG colour type -> the Pillow mode whose ``tobytes`` is the PNG's 8-bit samples.
+_PILLOW_MODES = {0: 'L', 2: 'RGB', 3: 'P', 4: 'LA', 6: 'RGBA'}
+
+
+class ImageError(ValueError):
+    """Raised when an image source cannot be loaded or is not supported."""
+
+
+@dataclass
+class PdfImage:
+    width: int
+    height: int
+    # Entries of the image XObject dictionary other than Width/Height/Length.
+    entries: str
+    data: bytes
+    # Soft mask (DeviceGray, 8 bpc, FlateDecode) for images with alpha.
+    smask: Optional[bytes] = None
+
+
+def read_source(source: str, public_dir: str) -> bytes:
+    """Return the bytes behind a data URL or a site-relative path."""
+    if source.startswith('data:'):
+        header, _, payload = source.partition(',')
+        if header.endswith(';base64'):
+            try:
+                return base64.b64decode(payload)
+            except (binascii.Error, ValueError) as e:
+                raise ImageError(f'bad base64 payload: {e}') from None
+        return unquote(payload).encode('latin-1')
+    if source.startswith(('http://', 'https://')):
+        raise ImageError(f'remote images are not fetched: {source[:80]}')
+    path = os.path.normpath(os.path.join(public_dir, unquote(source.split('?')[0]).lstrip('/')))
+    if not path.startswith(os.path.normpath(public_dir) + os.sep):
+        raise ImageError(f'path escapes the public directory: {source[:80]}')
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError as e:
+        raise ImageError(str(e)) from None
+
+
+def decode_image(data: bytes) -> PdfImage:
+    try:
+        if data.startswith(b'\xff\xd8'):
+            return _jpeg(data)
+        if data.startswith(PNG_SIGNATURE):
+            return _png(data)
+    except (struct.error, IndexError) as e:
+        # Truncated headers or pixel data.
+        raise ImageError(f'corrupt image: {e}') from None
+    raise ImageError('unsupported image format (only JPEG and PNG are embedded)')
+
+
+def _jpeg(data: bytes) -> PdfImage:
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            i += 1
+            continue
+        marker = data[i + 1]
+        if marker == 0xFF or 0xD0 <= marker <= 0xD8 or marker == 0x01:
+            i += 2 if marker != 0xFF else 1
+            continue
+        (length,) = struct.unpack('>H', data[i + 2:i + 4])
+        if marker in _JPEG_SOF:
+            bits, height, width, components = struct.unpack('>BHHB', data[i + 4:i + 10])
+            space = {1: '/DeviceGray', 3: '/DeviceRGB', 4: '/DeviceCMYK'}.get(components)
+            if space is None:
+                raise ImageError(f'JPEG with {components} components')
+            entries = f'/ColorSpace {space} /BitsPerComponent {bits} /Filter /DCTDecode'
+            if components == 4:
+                # Adobe CMYK JPEGs are stored inverted.
+                entries += ' /Decode [1 0 1 0 1 0 1 0]'
+            return PdfImage(width, height, entries, data)
+        i += 2 + length
+    raise ImageError('JPEG without a frame header')
+
+
+def _png_chunks(data: bytes) -> Dict[str, List[bytes]]:
+    chunks: Dict[str, List[bytes]] = {}
+    i = len(PNG_SIGNATURE)
+    while i + 8 <= len(data):
+        length, kind = struct.unpack('>I4s', data[i:i + 8])
+        chunks.setdefault(kind.decode('latin-1'), []).append(data[i + 8:i + 8 + length])
+        i += 12 + length
+        if kind == b'IEND':
+            break
+    return chunks
+
+
+def _png(data: bytes) -> PdfImage:
+    chunks = _png_chunks(data)
+    if 'IHDR' not in chunks or 'IDAT' not in chunks:
+        raise ImageError('PNG without IHDR/IDAT')
+    width, height, depth, color, _, _, interlace = struct.unpack('>IIBBBBB', chunks['IHDR'][0][:13])
+    if interlace:
+        raise ImageError('interlaced PNGs are not supported')
+    if color not in _PNG_CHANNELS:
+        raise ImageError(f'PNG colour type {color}')
+    idat = b''.join(chunks['IDAT'])
+    trns = chunks.get('tRNS', [b''])[0]
+
+    if color == 3:
+        palette = chunks.get('PLTE', [b''])[0]
+        space = f'[/Indexed /DeviceRGB {len(palette) // 3 - 1} <{palette.hex()}>]'
+    else:
+        space = '/DeviceGray' if color in (0, 4) else '/DeviceRGB'
+
+    if color in (0, 2, 3) and not (color == 3 and trns and depth == 8):
+        channels = _PNG_CHANNELS[color]
+        entries = (f'/ColorSpace {space} /BitsPerComponent {depth} /Filter /FlateDecode '
+                   f'/DecodeParms << /Predictor 15 /Colors {channels} '
+                   f'/BitsPerComponent {depth} /Columns {width} >>')
+        return PdfImage(width, height, entries, idat)
+
+    # Alpha has to be separated from colour, which needs the raw pixels.
+    channels = _PNG_CHANNELS[color]
+    raw = _pillow_samples(data, color)
+    if raw is None:
+        sample = 2 if depth == 16 else 1
+        bpp = channels * sample
+        try:
+            raw = unfilter(zlib.decompress(idat), width * bpp, height, bpp)
+        except zlib.error as e:
+            raise ImageError(f'corrupt PNG data: {e}') from None
+        if depth == 16:
+            raw = raw[::2]
+    if color == 3:
+        alpha_table = trns + b'\xff' * (256 - len(trns))
+        colour = raw
+        alpha = raw.translate(alpha_table)
+    else:
+        colour_channels = channels - 1
+        colour = bytearray(width * height * colour_channels)
+        for c in range(colour_channels):
+            colour[c::colour_channels] = raw[c::channels]
+        alpha = raw[channels - 1::channels]
+    entries = f'/ColorSpace {space} /BitsPerComponent 8 /Filter /FlateDecode'
+    return PdfImage(width, height, entries, zlib.compress(bytes(colour)), zlib.compress(bytes(alpha)))
+
+
+def _pillow_samples(data: bytes, color: int) -> Optional[bytes]:
+    """8-bit samples of an 8- or 16-bit PNG in its own channel order through Pillow's
+    decoder; None without Pillow or when Pillow reads it into another mode."""
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            if im.mode != _PILLOW_MODES[color]:
+                return None
+            return im.tobytes()
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise ImageError(f'corrupt PNG data: {e}') from None
+
+
+def png_planes(data: bytes) -> Tuple[int, int, List[bytes]]:
+    """Decode a PNG to ``(width, height, planes)``: 8-bit R, G, B and, when
+    the image has transparency, A planes (palettes and grey expanded)."""
+    if not data.startswith(PNG_SIGNATURE):
+        raise ImageError('not a PNG')
+    try:
+        return _png_planes(data)
+    except (struct.error, IndexError) as e:
+        raise ImageError(f'corrupt image: {e}') from None
+
+
+def _png_planes(data: bytes) -> Tuple[int, int, List[bytes]]:
+    chunks = _png_chunks(data)
+    if 'IHDR' not in chunks or 'IDAT' not in chunks:
+        raise ImageError('PNG without IHDR/IDAT')
+    width, height, depth, color, _, _, interlace = struct.unpack('>IIBBBBB', chunks['IHDR'][0][:13])
+    if interlace:
+        raise ImageError('interlaced PNGs are not supported')
+    if color not in _PNG_CHANNELS:
+        raise ImageError(f'PNG colour type {color}')
+    channels = _PNG_CHANNELS[color]
+    bits = channels * depth
+    stride = (width * bits + 7) // 8
+    try:
+        raw = unfilter(zlib.decompress(b''.join(chunks['IDAT'])), stride, height, max(bits // 8, 1))
+    except zlib.error as e:
+        raise ImageError(f'corrupt PNG data: {e}') from None
+    if depth == 16:
+        raw = raw[::2]
+    elif depth < 8:
+        # Unpack 1/2/4-bit samples, one byte each.
+        per_byte, mask = 8 // depth, (1 << depth) - 1
+        shifts = [8 - depth * (i + 1) for i in range(per_byte)]
+        unpacked = bytearray()
+        for row in range(height):
+            line = raw[row * stride:(row + 1) * stride]
+            unpacked += bytes((byte >> shift) & mask for byte in line for shift in shifts)[:width]
+        if color == 0:
+            unpacked = unpacked.translate(bytes(min(v * 255 // mask, 255) for v in range(256)))
+        raw = bytes(unpacked)
+
+    if color == 3:
+        palette = chunks.get('PLTE', [b''])[0].ljust(768, b'\0')
+        planes = [raw.translate(palette[c::3]) for c in range(3)]
+        trns = chunks.get('tRNS', [b''])[0]
+        if trns:
+            planes.append(raw.translate(trns + b'\xff' * (256 - len(trns))))
+        return width, height, planes
+    planes = [raw[c::channels] for c in range(channels)]
+    if color in (0, 4):
+        planes[1:1] = [planes[0], planes[0]]
+    return width, height, planes
+
+
+def unfilter(data: bytes, stride: int, height: int, bpp: int) -> bytes:
+    """Undo PNG row filters (PNG ``IDAT`` data, PDF ``/Predictor`` 10-15)."""
+    if len(data) < (stride + 1) * height:
+        raise ImageError(f'truncated image data: {len(data)} of {(stride + 1) * height} bytes')
+    out = bytearray(stride * height)
+    prev = bytearray(stride)
+    pos = 0
+    for row in range(height):
+        kind = data[pos]
+        line = bytearray(data[pos + 1:pos + 1 + stride])
+        pos += 1 + stride
+        if kind == 1:
+            for x in range(bpp, stride):
+                line[x] = (line[x] + line[x - bpp]) & 0xFF
+        elif kind == 2:
+            line = bytearray((a + b) & 0xFF for a, b in zip(line, prev))
+        elif kind == 3:
+            for x in range(stride):
+                left = line[x - bpp] if x >= bpp else 0
+                line[x] = (line[x] + ((left + prev[x]) >> 1)) & 0xFF
+        elif kind == 4:
+            for x in range(stride):
+                a = line[x - bpp] if x >= bpp else 0
+                b = prev[x]
+                c = prev[x - bpp] if x >= bpp else 0
+                p = a + b - c
+                pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                pred = a if pa <= pb and pa <= pc else (b if pb <= pc else c)
+                line[x] = (line[x] + pred) & 0xFF
+        elif kind != 0:
+            raise ImageError(f'PNG filter type {kind}')
+        out[row * stride:(row + 1) * stride] = line
+        prev = line
+    return bytes(out)
+
@@ -0,0 +1,215 @@
+"""Regenerate the PDF of every post from its ``canvasData``.
+
+    python -m tools.pdf_regen                       # resume from the last watermark
+    python -m tools.pdf_regen --restart --jobs 8    # re-render everything
+    python -m tools.pdf_regen --db /app/prisma/dev.db --chunk 500
+
+Posts are read from the ``Post`` table in ``(updatedAt, id)`` order, one
+chunk at a time, and rendered by ``tools.pdf_render`` in a process pool.
+Workers go through ``tools.render_cache``: a post whose canvas, background
+and blur have been rendered before (by any post, with the same renderer
+version) is not rendered again.  ``pdfUrl`` is updated once per chunk in a single
+transaction, after which the chunk's last ``(updatedAt, id)`` is saved as the
+watermark, so an interrupted run picks up at the first uncommitted chunk.
+``updatedAt`` itself is left alone.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Deque, Iterator, List, Optional, Sequence, Tuple
+
+from tools.db import REPO_ROOT, connect, database_path
+from tools.pdf_render import DEFAULT_HEIGHT, DEFAULT_WIDTH, PUBLIC_DIR, load_canvas_data, render_pdf
+from tools.render_cache import DEFAULT_INDEX, RenderCache, render_key
+
+
+DEFAULT_STATE = os.path.join(REPO_ROOT, '.pdf-regen-state.json')
+DEFAULT_CHUNK = 200
+# Chunks rendered ahead of the one being committed, to keep workers busy.
+CHUNKS_IN_FLIGHT = 2
+
+RENDERED = 'rendered'
+EMPTY = 'empty'
+ERROR = 'error'
+
+
+@dataclass
+class PostResult:
+    id: str
+    status: str
+    url: str = ''
+    error: str = ''
+    missing_images: List[str] = field(default_factory=list)
+    cached: bool = False
+
+
+# One cache connection per worker process, opened on first use.
+_worker_cache: Optional[RenderCache] = None
+
+
+def worker_cache(public_dir: str, index: str, db: Optional[str]) -> RenderCache:
+    global _worker_cache
+    if _worker_cache is None:
+        _worker_cache = RenderCache(os.path.join(public_dir, 'uploads', 'renders'), index, db=db)
+    return _worker_cache
+
+
+def render_post(
+    post_id: str,
+    canvas_data: Optional[str],
+    background: Optional[str],
+    blur_amount: Optional[int] = None,
+    public_dir: str = PUBLIC_DIR,
+    width: float = DEFAULT_WIDTH,
+    height: float = DEFAULT_HEIGHT,
+    index: str = DEFAULT_INDEX,
+    db: Optional[str] = None,
+) -> PostResult:
+    missing: List[str] = []
+    try:
+        data = load_canvas_data(canvas_data)
+        if not data.get('elements') and not data.get('background') and not background:
+            return PostResult(post_id, EMPTY)
+        # Post.background is a copy kept next to canvasData; prefer canvasData's.
+        override = None if data.get('background') else background
+
+        def render() -> bytes:
+            result = render_pdf(data, width, height, public_dir, override)
+            missing.extend(result.missing_images)
+            return result.pdf
+
+        key = render_key(data, background, blur_amount, 'pdf', width, height)
+        url, hit = worker_cache(public_dir, index, db).get_or_render(key, render)
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        return PostResult(post_id, ERROR, error=f'{type(e).__name__}: {e}')
+    return PostResult(post_id, RENDERED, url, missing_images=missing, cached=hit)
+
+
+def load_watermark(path: str) -> Optional[Tuple[object, str]]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        return state['updatedAt'], state['id']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_watermark(path: str, mark: Tuple[object, str]) -> None:
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'updatedAt': mark[0], 'id': mark[1]}, f)
+    os.replace(tmp, path)
+
+
+def iter_chunks(conn, chunk: int, after: Optional[Tuple[object, str]]) -> Iterator[List[tuple]]:
+    """Keyset pagination over Post: each query starts after the previous
+    chunk's last row, so no OFFSET scan and no rows skipped or repeated."""
+    while True:
+        if after is None:
+            rows = conn.execute(
+                'SELECT id, canvasData, background, blurAmount, updatedAt FROM Post '
+                'ORDER BY updatedAt, id LIMIT ?', (chunk,)).fetchall()
+        else:
+            rows = conn.execute(
+                'SELECT id, canvasData, background, blurAmount, updatedAt FROM Post '
+                'WHERE updatedAt > ? OR (updatedAt = ? AND id > ?) '
+                'ORDER BY updatedAt, id LIMIT ?', (after[0], after[0], after[1], chunk)).fetchall()
+        if not rows:
+            return
+        yield [tuple(row) for row in rows]
+        after = (rows[-1]['updatedAt'], rows[-1]['id'])
+
+
+def commit_chunk(conn, results: Sequence[PostResult]) -> None:
+    updates = [(r.url, r.id) for r in results if r.status == RENDERED]
+    with conn:
+        conn.executemany('UPDATE Post SET pdfUrl = ? WHERE id = ?', updates)
+
+
+def regenerate(
+    db: Optional[str] = None,
+    jobs: Optional[int] = None,
+    chunk: int = DEFAULT_CHUNK,
+    state: str = DEFAULT_STATE,
+    restart: bool = False,
+    public_dir: str = PUBLIC_DIR,
+    width: float = DEFAULT_WIDTH,
+    height: float = DEFAULT_HEIGHT,
+    index: str = DEFAULT_INDEX,
+    log=print,
+) -> List[PostResult]:
+    conn = connect(db)
+    after = None if restart else load_watermark(state)
+    if after is not None:
+        log(f'Resuming after updatedAt={after[0]} id={after[1]}')
+
+    results: List[PostResult] = []
+    pending: Deque[Tuple[Tuple[object, str], List[Future]]] = deque()
+
+    def drain() -> None:
+        mark, futures = pending.popleft()
+        done = [f.result() for f in futures]
+        commit_chunk(conn, done)
+        save_watermark(state, mark)
+        results.extend(done)
+        log(f'{len(results)} posts done')
+
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for rows in iter_chunks(conn, chunk, after):
+                futures = [pool.submit(render_post, post_id, canvas_data, background, blur,
+                                       public_dir, width, height, index, db)
+                           for post_id, canvas_data, background, blur, _ in rows]
+                pending.append(((rows[-1][4], rows[-1][0]), futures))
+                if len(pending) > CHUNKS_IN_FLIGHT:
+                    drain()
+            while pending:
+                drain()
+    finally:
+        conn.close()
+    return results
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help=f'SQLite database (default: {os.path.relpath(database_path(), REPO_ROOT)})')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes')
+    parser.add_argument('--chunk', type=int, default=DEFAULT_CHUNK, help='posts per read/commit')
+    parser.add_argument('--state', default=DEFAULT_STATE, help='watermark file')
+    parser.add_argument('--restart', action='store_true', help='ignore the watermark and render every post')
+    parser.add_argument('--public', default=PUBLIC_DIR, help='public directory holding uploads/')
+    parser.add_argument('--width', type=float, default=DEFAULT_WIDTH, help='canvas width in px')
+    parser.add_argument('--height', type=float, default=DEFAULT_HEIGHT, help='canvas height in px')
+    parser.add_argument('--cache-index', default=DEFAULT_INDEX, help='render cache index file')
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    try:
+        results = regenerate(args.db, args.jobs, args.chunk, args.state, args.restart,
+                             args.public, args.width, args.height, args.cache_index)
+    except FileNotFoundError as e:
+        print(e, file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - started
+
+    for r in results:
+        if r.status == ERROR:
+            print(f'ERROR {r.id}: {r.error}')
+        for source in r.missing_images:
+            print(f'{r.id}: image not embedded: {source}')
+    counts = {status: sum(r.status == status for r in results) for status in (RENDERED, EMPTY, ERROR)}
+    cached = sum(r.cached for r in results)
+    rate = len(results) / elapsed if elapsed else 0.0
+    print(f"{counts[RENDERED]} rendered ({cached} from cache), {counts[EMPTY]} empty, {counts[ERROR]} failed "
+          f"in {elapsed:.1f}s ({rate:.1f} posts/s)")
+    return 1 if counts[ERROR] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
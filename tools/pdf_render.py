@@ -0,0 +1,501 @@
+"""Vector PDF renderer for ``Post.canvasData``.
+
+    python -m tools.pdf_render post.json -o post.pdf
+    python -m tools.pdf_render - --width 1123 --height 794 < canvas.json > post.pdf
+
+Takes the same ``CanvasElement`` JSON the editors store and writes one PDF
+page.  Unlike the browser export, which rasterises every non-text element
+onto its own full-page PNG, shapes are written as native PDF paths with
+fill/stroke opacity, and only ``image`` elements (and an image background)
+are embedded, each placed in its own box; an image used twice is stored once.
+
+Element order, the ``visible`` filter, the ``opacity || 100`` rule and the
+text layout (``tools.text_layout``: glyphs at 0.75 of the font size as jsPDF
+draws pt sizes on a px page, 1.2 line height, 8px padding, word wrap against
+Helvetica widths, alignment) follow ``handleExportToPDF``;
+bold, italic and underlined spans in the text HTML (``tools.rich_text``) keep
+their style instead of being flattened to the element's font.  One page unit is
+one CSS pixel (0.75pt), so a 794x1123 canvas becomes an A4 page.
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import sys
+import zlib
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from tools.pdf_images import ImageError, PdfImage, decode_image, read_source
+from tools.rich_text import parse_html
+from tools.text_layout import DEFAULT_FONT_SIZE, FONTS, font_style, glyph_size, layout_paragraphs
+
+
+# Bump whenever output changes, so cached renders are not reused.
+RENDERER_VERSION = 4
+DEFAULT_WIDTH = 794
+DEFAULT_HEIGHT = 1123
+PX_TO_PT = 0.75
+PUBLIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'public')
+
+# Font style -> PDF resource name.
+_FONT_RESOURCES = {'normal': 'F1', 'bold': 'F2', 'italic': 'F3', 'bolditalic': 'F4'}
+
+_HEX_COLOR = re.compile(r'#?([0-9a-f]{3,4}|[0-9a-f]{6}|[0-9a-f]{8})$', re.I)
+_RGB_COLOR = re.compile(r'rgba?\(\s*([^)]*)\)$', re.I)
+_NAMED_COLORS = {
+    'black': (0, 0, 0), 'white': (255, 255, 255), 'red': (255, 0, 0), 'green': (0, 128, 0),
+    'blue': (0, 0, 255), 'yellow': (255, 255, 0), 'gray': (128, 128, 128), 'grey': (128, 128, 128),
+}
+
+Color = Tuple[float, float, float, float]
+
+# Fractions of the element box, as drawn by the editor.
+HEXAGON = ((0.5, 0.05), (0.95, 0.25), (0.95, 0.75), (0.5, 0.95), (0.05, 0.75), (0.05, 0.25))
+STAR = ((0.5, 0.1), (0.61, 0.35), (0.88, 0.35), (0.67, 0.52), (0.78, 0.78),
+        (0.5, 0.6), (0.22, 0.78), (0.33, 0.52), (0.12, 0.35), (0.39, 0.35))
+TRIANGLE = ((0.5, 0.0), (1.0, 1.0), (0.0, 1.0))
+# Control-point distance for a quarter ellipse drawn with one cubic curve.
+_KAPPA = 4 * (math.sqrt(2) - 1) / 3
+
+
+@dataclass
+class RenderResult:
+    pdf: bytes
+    # Image sources that could not be embedded (drawn as placeholders).
+    missing_images: List[str] = field(default_factory=list)
+    elements: int = 0
+
+
+def parse_color(value: Optional[str]) -> Optional[Color]:
+    """Parse a CSS hex/rgb()/rgba()/basic named colour into 0..1 components."""
+    if not value or not isinstance(value, str):
+        return None
+    value = value.strip()
+    m = _HEX_COLOR.match(value)
+    if m:
+        digits = m.group(1)
+        if len(digits) <= 4:
+            digits = ''.join(c * 2 for c in digits)
+        rgba = [int(digits[i:i + 2], 16) / 255 for i in range(0, len(digits), 2)]
+        return (rgba[0], rgba[1], rgba[2], rgba[3] if len(rgba) == 4 else 1.0)
+    m = _RGB_COLOR.match(value)
+    if m:
+        parts = [p.strip() for p in re.split(r'[,\s/]+', m.group(1)) if p.strip()]
+        if len(parts) < 3:
+            return None
+        try:
+            rgb = [float(p[:-1]) * 2.55 if p.endswith('%') else float(p) for p in parts[:3]]
+            alpha = 1.0
+            if len(parts) > 3:
+                alpha = float(parts[3][:-1]) / 100 if parts[3].endswith('%') else float(parts[3])
+        except ValueError:
+            return None
+        r, g, b = (min(max(c, 0.0), 255.0) / 255 for c in rgb)
+        return (r, g, b, min(max(alpha, 0.0), 1.0))
+    named = _NAMED_COLORS.get(value.lower())
+    if named:
+        return (named[0] / 255, named[1] / 255, named[2] / 255, 1.0)
+    return None
+
+
+def _num(value: float) -> str:
+    text = f'{value:.3f}'.rstrip('0').rstrip('.')
+    return '0' if text in ('', '-0') else text
+
+
+def _pdf_string(text: str) -> str:
+    data = text.encode('cp1252', errors='replace').decode('latin-1')
+    return '(' + data.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)').replace('\r', '\\r') + ')'
+
+
+def element_number(element: dict, key: str, default: float = 0.0) -> float:
+    try:
+        value = float(element.get(key) or default)
+    except (TypeError, ValueError):
+        return default
+    return value if math.isfinite(value) else default
+
+
+class PdfWriter:
+    """Minimal PDF object store: numbered objects, streams and an xref."""
+
+    def __init__(self):
+        self.objects: List[Optional[bytes]] = []
+
+    def reserve(self) -> int:
+        self.objects.append(None)
+        return len(self.objects)
+
+    def set(self, num: int, body: Union[str, bytes]) -> int:
+        self.objects[num - 1] = body.encode('latin-1') if isinstance(body, str) else body
+        return num
+
+    def add(self, body: Union[str, bytes]) -> int:
+        return self.set(self.reserve(), body)
+
+    def add_stream(self, entries: str, data: bytes) -> int:
+        return self.add(f'<< {entries} /Length {len(data)} >>\nstream\n'.encode('latin-1') + data + b'\nendstream')
+
+    def serialize(self, root: int) -> bytes:
+        out = [b'%PDF-1.5\n%\xe2\xe3\xcf\xd3\n']
+        offsets = []
+        pos = len(out[0])
+        for num, body in enumerate(self.objects, 1):
+            chunk = f'{num} 0 obj\n'.encode('latin-1') + (body or b'null') + b'\nendobj\n'
+            offsets.append(pos)
+            out.append(chunk)
+            pos += len(chunk)
+        xref = [f'xref\n0 {len(self.objects) + 1}\n', '0000000000 65535 f \n']
+        xref.extend(f'{offset:010d} 00000 n \n' for offset in offsets)
+        xref.append(f'trailer\n<< /Size {len(self.objects) + 1} /Root {root} 0 R >>\nstartxref\n{pos}\n%%EOF\n')
+        out.append(''.join(xref).encode('latin-1'))
+        return b''.join(out)
+
+
+class PageCanvas:
+    """Content stream for one page, in CSS-pixel units with y pointing down."""
+
+    def __init__(self, writer: PdfWriter, width: float, height: float, public_dir: str):
+        self.writer = writer
+        self.width = width
+        self.height = height
+        self.public_dir = public_dir
+        self.ops: List[str] = [f'{_num(PX_TO_PT)} 0 0 {_num(-PX_TO_PT)} 0 {_num(height * PX_TO_PT)} cm']
+        self.fonts: Dict[str, str] = {}
+        self.gstates: Dict[Tuple[float, float], str] = {}
+        self.images: Dict[str, Optional[str]] = {}
+        self.xobjects: Dict[str, int] = {}
+        self.missing_images: List[str] = []
+        self.opacity = 1.0
+        self._alpha_state = (1.0, 1.0)
+        self._path_start: Optional[int] = None
+
+    # -- state ---------------------------------------------------------------
+
+    def begin(self, opacity: float = 1.0) -> None:
+        """Open a graphics-state group; ``opacity`` scales everything in it."""
+        self.ops.append('q')
+        self.opacity = opacity
+
+    def end(self) -> None:
+        self.ops.append('Q')
+        self.opacity = 1.0
+        self._alpha_state = (1.0, 1.0)
+
+    def _alpha(self, fill: float, stroke: float) -> None:
+        key = (round(fill * self.opacity, 3), round(stroke * self.opacity, 3))
+        if key == self._alpha_state:
+            return
+        name = self.gstates.get(key)
+        if name is None:
+            name = self.gstates[key] = f'GS{len(self.gstates) + 1}'
+        self.ops.append(f'/{name} gs')
+        self._alpha_state = key
+
+    def _fill(self, color: Color) -> None:
+        self.ops.append(f'{_num(color[0])} {_num(color[1])} {_num(color[2])} rg')
+
+    def _stroke(self, color: Color, width: float) -> None:
+        self.ops.append(f'{_num(color[0])} {_num(color[1])} {_num(color[2])} RG {_num(width)} w')
+
+    # -- paths ---------------------------------------------------------------
+
+    def _path(self) -> None:
+        # Remember where the path object starts: its graphics state goes before it.
+        if self._path_start is None:
+            self._path_start = len(self.ops)
+
+    def rect_path(self, x: float, y: float, w: float, h: float) -> None:
+        self._path()
+        self.ops.append(f'{_num(x)} {_num(y)} {_num(w)} {_num(h)} re')
+
+    def polygon_path(self, points: Sequence[Tuple[float, float]]) -> None:
+        (x0, y0), rest = points[0], points[1:]
+        self._path()
+        self.ops.append(f'{_num(x0)} {_num(y0)} m')
+        self.ops.extend(f'{_num(x)} {_num(y)} l' for x, y in rest)
+        self.ops.append('h')
+
+    def _quad(self, x0: float, y0: float, cx: float, cy: float, x1: float, y1: float) -> None:
+        # Canvas quadraticCurveTo as the equivalent cubic.
+        self.ops.append(' '.join(_num(v) for v in (
+            x0 + 2 / 3 * (cx - x0), y0 + 2 / 3 * (cy - y0),
+            x1 + 2 / 3 * (cx - x1), y1 + 2 / 3 * (cy - y1),
+            x1, y1)) + ' c')
+
+    def rounded_rect_path(self, x: float, y: float, w: float, h: float, r: float) -> None:
+        """The editor's rounded rectangle: straight edges joined by quadratic
+        corners whose control point is the box corner."""
+        right, bottom = x + w, y + h
+        self._path()
+        self.ops.append(f'{_num(x + r)} {_num(y)} m {_num(right - r)} {_num(y)} l')
+        self._quad(right - r, y, right, y, right, y + r)
+        self.ops.append(f'{_num(right)} {_num(bottom - r)} l')
+        self._quad(right, bottom - r, right, bottom, right - r, bottom)
+        self.ops.append(f'{_num(x + r)} {_num(bottom)} l')
+        self._quad(x + r, bottom, x, bottom, x, bottom - r)
+        self.ops.append(f'{_num(x)} {_num(y + r)} l')
+        self._quad(x, y + r, x, y, x + r, y)
+        self.ops.append('h')
+
+    def ellipse_path(self, x: float, y: float, w: float, h: float) -> None:
+        rx, ry = w / 2, h / 2
+        cx, cy = x + rx, y + ry
+        kx, ky = rx * _KAPPA, ry * _KAPPA
+        self._path()
+        self.ops.append(f'{_num(cx + rx)} {_num(cy)} m')
+        for seg in (
+            (cx + rx, cy + ky, cx + kx, cy + ry, cx, cy + ry),
+            (cx - kx, cy + ry, cx - rx, cy + ky, cx - rx, cy),
+            (cx - rx, cy - ky, cx - kx, cy - ry, cx, cy - ry),
+            (cx + kx, cy - ry, cx + rx, cy - ky, cx + rx, cy),
+        ):
+            self.ops.append(' '.join(_num(v) for v in seg) + ' c')
+        self.ops.append('h')
+
+    def paint(self, fill: Optional[Color], stroke: Optional[Color], line_width: float) -> None:
+        """Fill and/or stroke the current path (the path must already be emitted).
+
+        Only path construction operators may appear inside a path object, so
+        the alpha state and colours are moved in front of it.
+        """
+        start = len(self.ops) if self._path_start is None else self._path_start
+        mark = len(self.ops)
+        self._alpha(fill[3] if fill else 1.0, stroke[3] if stroke else 1.0)
+        if fill:
+            self._fill(fill)
+        if stroke:
+            self._stroke(stroke, line_width)
+        state = self.ops[mark:]
+        del self.ops[mark:]
+        self.ops[start:start] = state
+        self.ops.append('B' if fill and stroke else 'f' if fill else 'S' if stroke else 'n')
+        self._path_start = None
+
+    # -- text and images -----------------------------------------------------
+
+    def text(self, line: str, x: float, y: float, style: str, size: float) -> None:
+        name = self.fonts.setdefault(style, _FONT_RESOURCES[style])
+        # Undo the page flip for glyphs so text is upright.
+        self.ops.append(f'BT /{name} {_num(size)} Tf 1 0 0 -1 {_num(x)} {_num(y)} Tm {_pdf_string(line)} Tj ET')
+
+    def _image_name(self, source: str) -> Optional[str]:
+        key = hashlib.sha1(source.encode('utf-8', 'surrogatepass')).hexdigest()
+        if key in self.images:
+            return self.images[key]
+        try:
+            image = decode_image(read_source(source, self.public_dir))
+        except ImageError:
+            self.missing_images.append(source if len(source) <= 80 else source[:77] + '...')
+            self.images[key] = None
+            return None
+        name = self.images[key] = f'Im{len(self.xobjects) + 1}'
+        self.xobjects[name] = self._write_image(image)
+        return name
+
+    def _write_image(self, image: PdfImage) -> int:
+        size = f'/Type /XObject /Subtype /Image /Width {image.width} /Height {image.height}'
+        extra = ''
+        if image.smask is not None:
+            mask = self.writer.add_stream(
+                f'{size} /ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /FlateDecode', image.smask)
+            extra = f' /SMask {mask} 0 R'
+        return self.writer.add_stream(f'{size} {image.entries}{extra}', image.data)
+
+    def image(self, source: str, x: float, y: float, w: float, h: float) -> bool:
+        name = self._image_name(source)
+        if name is None:
+            return False
+        self._alpha(1.0, 1.0)
+        # The image unit square is drawn bottom-up; map its top edge to y.
+        self.ops.append(f'q {_num(w)} 0 0 {_num(-h)} {_num(x)} {_num(y + h)} cm /{name} Do Q')
+        return True
+
+    # -- output --------------------------------------------------------------
+
+    def finish(self, parent: int) -> int:
+        fonts = ' '.join(
+            f'/{_FONT_RESOURCES[style]} << /Type /Font /Subtype /Type1 /BaseFont /{FONTS[style][0]} '
+            f'/Encoding /WinAnsiEncoding >>' for style in sorted(self.fonts))
+        gstates = ' '.join(f'/{name} << /Type /ExtGState /ca {_num(fill)} /CA {_num(stroke)} >>'
+                           for (fill, stroke), name in self.gstates.items())
+        xobjects = ' '.join(f'/{name} {num} 0 R' for name, num in self.xobjects.items())
+        content = self.writer.add_stream('/Filter /FlateDecode', zlib.compress('\n'.join(self.ops).encode('latin-1')))
+        return self.writer.add(
+            f'<< /Type /Page /Parent {parent} 0 R '
+            f'/MediaBox [0 0 {_num(self.width * PX_TO_PT)} {_num(self.height * PX_TO_PT)}] '
+            f'/Resources << /Font << {fonts} >> /ExtGState << {gstates} >> /XObject << {xobjects} >> >> '
+            f'/Contents {content} 0 R >>')
+
+
+def element_opacity(element: dict) -> float:
+    # `(element.opacity || 100) / 100`, so 0 means fully opaque.
+    return max(0.0, min(element_number(element, 'opacity', 100) / 100, 1.0))
+
+
+def draw_background(page: PageCanvas, background: Optional[str]) -> None:
+    page.begin()
+    if background and background.startswith(('data:', 'http', '/')):
+        # White shows through transparent images and replaces ones that fail.
+        page.rect_path(0, 0, page.width, page.height)
+        page.paint((1.0, 1.0, 1.0, 1.0), None, 0)
+        page.image(background, 0, 0, page.width, page.height)
+    else:
+        color = parse_color(background) if background else (1.0, 1.0, 1.0, 1.0)
+        if color is not None:
+            page.rect_path(0, 0, page.width, page.height)
+            page.paint(color, None, 0)
+    page.end()
+
+
+def draw_text(page: PageCanvas, el: dict) -> None:
+    x, y, w, h = (element_number(el, k) for k in ('x', 'y', 'width', 'height'))
+    background = el.get('backgroundColor')
+    fill = parse_color(background) if background != 'transparent' else None
+    stroke = parse_color(el.get('borderColor')) if element_number(el, 'borderWidth') else None
+    if fill or stroke:
+        page.rect_path(x, y, w, h)
+        page.paint(fill, stroke, element_number(el, 'borderWidth'))
+
+    size = element_number(el, 'fontSize', DEFAULT_FONT_SIZE)
+    style = font_style(el)
+    color = parse_color(el.get('color') or '#000000') or (0.0, 0.0, 0.0, 1.0)
+    page._alpha(color[3], 1.0)
+    page._fill(color)
+    lines = layout_paragraphs(parse_html(str(el['text'])), style, size, x, y, w, el.get('textAlign'))
+    em = glyph_size(size)
+    for line in lines:
+        for segment in line.segments:
+            left = line.x + segment.offset
+            if segment.text.strip():
+                page.text(segment.text, left, line.baseline, segment.style, em)
+            if segment.underline:
+                # Helvetica's underline: centred 100/1000 em below the baseline, 50/1000 thick.
+                page.rect_path(left, line.baseline + em * 0.075, segment.width, em * 0.05)
+                page.paint(color, None, 0)
+
+
+def draw_shape(page: PageCanvas, el: dict) -> None:
+    kind = el.get('type')
+    x, y, w, h = (element_number(el, k) for k in ('x', 'y', 'width', 'height'))
+    fill = parse_color(el.get('backgroundColor'))
+    line_width = element_number(el, 'borderWidth')
+    stroke = parse_color(el.get('borderColor')) if line_width else None
+
+    if kind == 'image':
+        if not el.get('image'):
+            return
+        if not page.image(el['image'], x, y, w, h):
+            # Same placeholder the browser export draws when an image fails to load.
+            page.rect_path(x, y, w, h)
+            page.paint(parse_color('#cccccc'), parse_color('#999999'), 2)
+            return
+        if stroke:
+            page.rect_path(x, y, w, h)
+            page.paint(None, stroke, line_width)
+        return
+
+    if kind == 'rectangle':
+        radius = element_number(el, 'borderRadius')
+        if radius:
+            page.rounded_rect_path(x, y, w, h, radius)
+        else:
+            page.rect_path(x, y, w, h)
+    elif kind == 'circle':
+        page.ellipse_path(x, y, w, h)
+    elif kind in ('triangle', 'hexagon', 'star'):
+        shape = {'triangle': TRIANGLE, 'hexagon': HEXAGON, 'star': STAR}[kind]
+        page.polygon_path([(x + w * fx, y + h * fy) for fx, fy in shape])
+    else:
+        return
+    page.paint(fill, stroke, line_width)
+
+
+def visible_elements(elements: Iterable[dict]) -> List[dict]:
+    """Elements in paint order: stable sort by zIndex, hidden ones dropped."""
+    items = [el for el in elements if isinstance(el, dict)]
+    items.sort(key=lambda el: element_number(el, 'zIndex'))
+    return [el for el in items if el.get('visible')]
+
+
+def load_canvas_data(canvas_data: Union[str, dict, list, None]) -> dict:
+    if canvas_data is None or canvas_data == '':
+        return {'elements': []}
+    if isinstance(canvas_data, str):
+        canvas_data = json.loads(canvas_data)
+    if isinstance(canvas_data, list):
+        return {'elements': canvas_data}
+    return canvas_data
+
+
+def render_pdf(
+    canvas_data: Union[str, dict, list, None],
+    width: float = DEFAULT_WIDTH,
+    height: float = DEFAULT_HEIGHT,
+    public_dir: str = PUBLIC_DIR,
+    background: Optional[str] = None,
+) -> RenderResult:
+    """Render ``canvasData`` (JSON text or parsed) to a one-page PDF.
+
+    ``background`` overrides the background stored in the canvas data (the
+    Post table keeps its own copy in ``Post.background``).
+    """
+    data = load_canvas_data(canvas_data)
+    writer = PdfWriter()
+    catalog, pages = writer.reserve(), writer.reserve()
+    page = PageCanvas(writer, width, height, public_dir)
+
+    draw_background(page, background if background is not None else data.get('background'))
+    elements = visible_elements(data.get('elements') or [])
+    for el in elements:
+        if el.get('type') == 'text' and not el.get('text'):
+            continue
+        page.begin(element_opacity(el))
+        if el.get('type') == 'text':
+            draw_text(page, el)
+        else:
+            draw_shape(page, el)
+        page.end()
+
+    page_num = page.finish(pages)
+    writer.set(pages, f'<< /Type /Pages /Kids [{page_num} 0 R] /Count 1 >>')
+    writer.set(catalog, f'<< /Type /Catalog /Pages {pages} 0 R >>')
+    return RenderResult(writer.serialize(catalog), page.missing_images, len(elements))
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('input', help="canvasData JSON file, or '-' for stdin")
+    parser.add_argument('-o', '--output', help='PDF file (default: stdout)')
+    parser.add_argument('--width', type=float, default=DEFAULT_WIDTH, help='canvas width in px')
+    parser.add_argument('--height', type=float, default=DEFAULT_HEIGHT, help='canvas height in px')
+    parser.add_argument('--public', default=PUBLIC_DIR, help='directory site paths resolve against')
+    args = parser.parse_args(argv)
+
+    if args.input == '-':
+        source = sys.stdin.read()
+    else:
+        with open(args.input, 'r', encoding='utf-8') as f:
+            source = f.read()
+    try:
+        result = render_pdf(source, args.width, args.height, args.public)
+    except ValueError as e:
+        print(f'Invalid canvasData: {e}', file=sys.stderr)
+        return 1
+
+    if args.output:
+        with open(args.output, 'wb') as f:
+            f.write(result.pdf)
+    else:
+        sys.stdout.buffer.write(result.pdf)
+    for source in result.missing_images:
+        print(f'Image not embedded: {source}', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,486 @@
+"""Small raster renderer for post thumbnails and previews.
+
+    python -m tools.raster post.json -o post.png --size 320
+
+Draws ``canvasData`` into an RGB image a few hundred pixels wide with the
+same element rules as ``tools.pdf_render`` (paint order, ``visible``,
+opacity, shapes, the text layout).  Pixels are kept as three planes so a
+span of one colour is filled by one slice assignment, or one
+``bytes.translate`` through a blend table when it is translucent; span ends
+get their fractional coverage, which anti-aliases vertical edges.
+
+Text is laid out as the PDF export does and, with Pillow and an image at
+least ``GLYPH_MIN_WIDTH`` pixels wide, drawn as glyphs word by word at the
+laid-out positions.  The font is the first Helvetica-metric face found
+(Liberation Sans, Nimbus Sans, Arimo, Arial), else the sans Pillow bundles,
+which has no bold or italic: bold is drawn twice a pixel apart.  A word drawn
+in a font that is not quite Helvetica is squeezed to its Helvetica width.  Smaller
+images, or no Pillow, get greeked word bars instead.
+
+Images are drawn from PNG data without third-party code; JPEG and other
+formats, and WebP output, need Pillow and fall back to the grey placeholder
+(or an error for WebP) without it.
+"""
+
+import argparse
+import io
+import math
+import sys
+import zlib
+from dataclasses import dataclass, field
+from functools import lru_cache
+from operator import itemgetter
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from tools.pdf_images import PNG_SIGNATURE, ImageError, png_planes, read_source
+from tools.pdf_render import (
+    DEFAULT_HEIGHT, DEFAULT_WIDTH, HEXAGON, PUBLIC_DIR, STAR, TRIANGLE, Color, element_number,
+    element_opacity, load_canvas_data, parse_color, visible_elements,
+)
+from tools.rich_text import parse_html
+from tools.text_layout import DEFAULT_FONT_SIZE, font_style, glyph_size, layout_paragraphs, text_width
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:  # Pillow is optional: PNG only, no WebP, greeked text.
+    Image = ImageDraw = ImageFont = None
+
+
+# Bump whenever output changes, so cached images are not reused.
+RASTER_VERSION = 3
+FORMATS = ('png', 'webp')
+WEBP_QUALITY = 80
+# Helvetica's x-height, the height of a greeked word bar, in em.
+X_HEIGHT = 0.523
+# Narrower images get word bars; glyphs would be a smudge.
+GLYPH_MIN_WIDTH = 320
+# Font files with Helvetica's widths, per style, tried in order.
+FONT_FILES = {
+    'normal': ('LiberationSans-Regular.ttf', 'NimbusSans-Regular.otf', 'Arimo-Regular.ttf', 'Arial.ttf',
+               'arial.ttf'),
+    'bold': ('LiberationSans-Bold.ttf', 'NimbusSans-Bold.otf', 'Arimo-Bold.ttf', 'Arial Bold.ttf', 'arialbd.ttf'),
+    'italic': ('LiberationSans-Italic.ttf', 'NimbusSans-Italic.otf', 'Arimo-Italic.ttf', 'Arial Italic.ttf',
+               'ariali.ttf'),
+    'bolditalic': ('LiberationSans-BoldItalic.ttf', 'NimbusSans-BoldItalic.otf', 'Arimo-BoldItalic.ttf',
+                   'Arial Bold Italic.ttf', 'arialbi.ttf'),
+}
+# Segments used for a full ellipse and for a rounded corner.
+ELLIPSE_STEPS = 64
+CORNER_STEPS = 8
+
+Point = Tuple[float, float]
+
+
+@lru_cache(maxsize=4096)
+def _blend_table(value: int, alpha: int) -> bytes:
+    """``old -> old + (value - old) * alpha / 255`` for every byte."""
+    return bytes((old * (255 - alpha) + value * alpha + 127) // 255 for old in range(256))
+
+
+@lru_cache(maxsize=64)
+def _font(style: str, px: int):
+    """``(font, fake_bold)`` for a style at ``px`` pixels; None without a usable font."""
+    for name in FONT_FILES[style]:
+        try:
+            return ImageFont.truetype(name, px), False
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(px), 'bold' in style
+    except TypeError:  # Pillow < 10.1 only has the fixed-size bitmap font.
+        return None
+
+
+@dataclass
+class RasterResult:
+    image: 'Raster'
+    missing_images: List[str] = field(default_factory=list)
+    elements: int = 0
+
+
+class Raster:
+    """RGB image drawn in canvas units (``scale`` pixels per unit)."""
+
+    def __init__(self, width: int, height: int, scale: float, public_dir: str = PUBLIC_DIR):
+        self.width = width
+        self.height = height
+        self.scale = scale
+        self.public_dir = public_dir
+        self.planes = [bytearray(b'\xff' * (width * height)) for _ in range(3)]
+        self.opacity = 1.0
+        # Pixels outside ``(left, top, right, bottom)`` are left alone.
+        self.clip = (0, 0, width, height)
+        self.missing_images: List[str] = []
+        # Scaled pixels per ``(source, width, height)``; None if it did not load.
+        self._images: Dict[Tuple[str, int, int], Optional[List[bytes]]] = {}
+
+    # -- spans ---------------------------------------------------------------
+
+    def _pixel(self, offset: int, rgb: Tuple[int, int, int], alpha: float) -> None:
+        a = int(alpha * 255 + 0.5)
+        if a <= 0:
+            return
+        for plane, value in zip(self.planes, rgb):
+            plane[offset] = _blend_table(value, a)[plane[offset]]
+
+    def _span(self, row: int, x0: float, x1: float, rgb: Tuple[int, int, int], alpha: float) -> None:
+        x0, x1 = max(x0, float(self.clip[0])), min(x1, float(self.clip[2]))
+        if x1 <= x0:
+            return
+        base = row * self.width
+        left, right = int(x0), int(x1)
+        if left == right:
+            self._pixel(base + left, rgb, alpha * (x1 - x0))
+            return
+        start = left
+        if x0 > left:
+            self._pixel(base + left, rgb, alpha * (left + 1 - x0))
+            start += 1
+        if right > start:
+            a = int(alpha * 255 + 0.5)
+            for plane, value in zip(self.planes, rgb):
+                if a >= 255:
+                    plane[base + start:base + right] = bytes((value,)) * (right - start)
+                elif a > 0:
+                    plane[base + start:base + right] = plane[base + start:base + right].translate(
+                        _blend_table(value, a))
+        if x1 > right:
+            self._pixel(base + right, rgb, alpha * (x1 - right))
+
+    # -- shapes --------------------------------------------------------------
+
+    def fill_polygon(self, points: Sequence[Point], color: Color) -> None:
+        """Fill ``points`` (canvas units) with the even-odd rule."""
+        alpha = color[3] * self.opacity
+        if len(points) < 3 or alpha <= 0:
+            return
+        rgb = tuple(int(c * 255 + 0.5) for c in color[:3])
+        s = self.scale
+        pts = [(x * s, y * s) for x, y in points]
+        edges = [(pts[i], pts[i - 1]) for i in range(len(pts)) if pts[i][1] != pts[i - 1][1]]
+        top = max(int(min(y for _, y in pts)), self.clip[1])
+        bottom = min(int(math.ceil(max(y for _, y in pts))), self.clip[3])
+        for row in range(top, bottom):
+            yc = row + 0.5
+            xs = sorted(
+                x0 + (yc - y0) * (x1 - x0) / (y1 - y0)
+                for (x0, y0), (x1, y1) in edges
+                if (y0 <= yc < y1) or (y1 <= yc < y0)
+            )
+            for i in range(0, len(xs) - 1, 2):
+                self._span(row, xs[i], xs[i + 1], rgb, alpha)
+
+    def fill_rect(self, x: float, y: float, w: float, h: float, color: Color) -> None:
+        self.fill_polygon(((x, y), (x + w, y), (x + w, y + h), (x, y + h)), color)
+
+    def stroke_polygon(self, points: Sequence[Point], color: Color, line_width: float) -> None:
+        """Stroke the closed outline, centred on the path like a PDF stroke."""
+        half = line_width / 2
+        for i in range(len(points)):
+            (x0, y0), (x1, y1) = points[i - 1], points[i]
+            length = math.hypot(x1 - x0, y1 - y0)
+            if not length:
+                continue
+            nx, ny = -(y1 - y0) / length * half, (x1 - x0) / length * half
+            self.fill_polygon(((x0 + nx, y0 + ny), (x1 + nx, y1 + ny),
+                               (x1 - nx, y1 - ny), (x0 - nx, y0 - ny)), color)
+            # Square join so corners are not notched.
+            self.fill_rect(x1 - half, y1 - half, line_width, line_width, color)
+
+    def paint(self, points: Sequence[Point], fill: Optional[Color], stroke: Optional[Color],
+              line_width: float) -> None:
+        if fill:
+            self.fill_polygon(points, fill)
+        if stroke and line_width > 0:
+            self.stroke_polygon(points, stroke, line_width)
+
+    # -- text ----------------------------------------------------------------
+
+    def glyphs(self, text: str, x: float, baseline: float, width: float, style: str, size: float,
+               color: Color) -> bool:
+        """Draw ``text`` from ``(x, baseline)`` at ``size``, ``width`` wide; False if glyphs cannot
+        be drawn here."""
+        if ImageFont is None or self.width < GLYPH_MIN_WIDTH:
+            return False
+        found = _font(style, max(int(round(size * self.scale)), 1))
+        if found is None:
+            return False
+        font, fake_bold = found
+        alpha = color[3] * self.opacity
+        left, top, right, bottom = font.getbbox(text, anchor='ls')
+        if alpha <= 0 or right <= left or bottom <= top:
+            return True
+        mask = Image.new('L', (right - left + int(fake_bold), bottom - top))
+        draw = ImageDraw.Draw(mask)
+        for dx in range(1 + int(fake_bold)):
+            draw.text((dx - left, -top), text, font=font, fill=255, anchor='ls')
+        advance = font.getlength(text)
+        stretch = width * self.scale / advance if advance > 0 else 1.0
+        if abs(stretch - 1) * mask.width >= 1:
+            mask = mask.resize((max(int(round(mask.width * stretch)), 1), mask.height), Image.BILINEAR)
+            left = int(round(left * stretch))
+        rgb = tuple(int(c * 255 + 0.5) for c in color[:3])
+        x0, y0 = int(round(x * self.scale)) + left, int(round(baseline * self.scale)) + top
+        coverage = mask.tobytes()
+        for row in range(max(y0, self.clip[1]), min(y0 + mask.height, self.clip[3])):
+            line = (row - y0) * mask.width
+            for col in range(max(x0, 0), min(x0 + mask.width, self.width)):
+                value = coverage[line + col - x0]
+                if value:
+                    # Through ``_span`` for the clip, and so extent-only rasters see the pixel.
+                    self._span(row, col, col + 1, rgb, alpha * value / 255)
+        return True
+
+    # -- images --------------------------------------------------------------
+
+    def image(self, source: str, x: float, y: float, w: float, h: float) -> bool:
+        """Draw an image into its box; False (and noted) if it cannot be loaded."""
+        s = self.scale
+        left, top = int(round(x * s)), int(round(y * s))
+        box_w, box_h = int(round((x + w) * s)) - left, int(round((y + h) * s)) - top
+        if box_w <= 0 or box_h <= 0:
+            return True
+        key = (source, box_w, box_h)
+        if key not in self._images:
+            try:
+                self._images[key] = _load_pixels(read_source(source, self.public_dir), box_w, box_h)
+            except ImageError:
+                self._images[key] = None
+        planes = self._images[key]
+        if planes is None:
+            self.missing_images.append(source if len(source) <= 80 else source[:77] + '...')
+            return False
+        x0, x1 = max(left, self.clip[0]), min(left + box_w, self.clip[2])
+        if x1 <= x0:
+            return True
+        alpha_plane = planes[3] if len(planes) > 3 else None
+        for row in range(max(top, self.clip[1]), min(top + box_h, self.clip[3])):
+            src = (row - top) * box_w + (x0 - left)
+            dst = row * self.width + x0
+            count = x1 - x0
+            alphas = alpha_plane[src:src + count] if alpha_plane is not None else None
+            for plane, source_plane in zip(self.planes, planes):
+                values = source_plane[src:src + count]
+                if alphas is None and self.opacity >= 1:
+                    plane[dst:dst + count] = values
+                    continue
+                old = plane[dst:dst + count]
+                for i in range(count):
+                    a = self.opacity * (alphas[i] / 255 if alphas is not None else 1.0)
+                    old[i] = int(old[i] + (values[i] - old[i]) * a + 0.5)
+                plane[dst:dst + count] = old
+        return True
+
+    # -- output --------------------------------------------------------------
+
+    def interleaved(self) -> bytes:
+        out = bytearray(self.width * self.height * 3)
+        for c, plane in enumerate(self.planes):
+            out[c::3] = plane
+        return bytes(out)
+
+    def encode(self, fmt: str = 'png') -> bytes:
+        if fmt == 'webp':
+            if Image is None:
+                raise ImageError('WebP output needs Pillow')
+            buf = io.BytesIO()
+            Image.frombytes('RGB', (self.width, self.height), self.interleaved()).save(
+                buf, 'WEBP', quality=WEBP_QUALITY, method=6)
+            return buf.getvalue()
+        if fmt != 'png':
+            raise ValueError(f'unknown format: {fmt}')
+        pixels = self.interleaved()
+        stride = self.width * 3
+        rows = b''.join(b'\0' + pixels[i:i + stride] for i in range(0, len(pixels), stride))
+
+        def chunk(kind: bytes, body: bytes) -> bytes:
+            return len(body).to_bytes(4, 'big') + kind + body + zlib.crc32(kind + body).to_bytes(4, 'big')
+
+        ihdr = self.width.to_bytes(4, 'big') + self.height.to_bytes(4, 'big') + bytes((8, 2, 0, 0, 0))
+        return (PNG_SIGNATURE + chunk(b'IHDR', ihdr) + chunk(b'IDAT', zlib.compress(rows, 9))
+                + chunk(b'IEND', b''))
+
+
+def _load_pixels(data: bytes, width: int, height: int) -> List[bytes]:
+    """RGB(A) planes of an image scaled to ``width`` x ``height``."""
+    if Image is not None:
+        try:
+            with Image.open(io.BytesIO(data)) as im:
+                im = im.convert('RGBA').resize((width, height), Image.BILINEAR, reducing_gap=2.0)
+                rgba = im.tobytes()
+        except (OSError, ValueError) as e:
+            raise ImageError(str(e)) from None
+        planes = [rgba[c::4] for c in range(4)]
+        return planes if min(planes[3]) < 255 else planes[:3]
+    if not data.startswith(PNG_SIGNATURE):
+        raise ImageError('only PNG images are drawn without Pillow')
+    src_w, src_h, planes = png_planes(data)
+    # Nearest neighbour: pick one source column per output column.
+    columns = [min(int((i + 0.5) * src_w / width), src_w - 1) for i in range(width)]
+    pick = itemgetter(*columns) if width > 1 else (lambda row: (row[columns[0]],))
+    scaled = [bytearray() for _ in planes]
+    for row in range(height):
+        sy = min(int((row + 0.5) * src_h / height), src_h - 1) * src_w
+        for out, plane in zip(scaled, planes):
+            out += bytes(pick(plane[sy:sy + src_w]))
+    return [bytes(p) for p in scaled]
+
+
+# -- element drawing ---------------------------------------------------------
+
+def _rect(x: float, y: float, w: float, h: float) -> List[Point]:
+    return [(x, y), (x + w, y), (x + w, y + h), (x, y + h)]
+
+
+def _ellipse(x: float, y: float, w: float, h: float) -> List[Point]:
+    rx, ry = w / 2, h / 2
+    return [(x + rx + rx * math.cos(t), y + ry + ry * math.sin(t))
+            for t in (2 * math.pi * i / ELLIPSE_STEPS for i in range(ELLIPSE_STEPS))]
+
+
+def _rounded_rect(x: float, y: float, w: float, h: float, r: float) -> List[Point]:
+    """The editor's rounded rectangle: quadratic corners controlled by the box corners."""
+    right, bottom = x + w, y + h
+    corners = (
+        ((right - r, y), (right, y), (right, y + r)),
+        ((right, bottom - r), (right, bottom), (right - r, bottom)),
+        ((x + r, bottom), (x, bottom), (x, bottom - r)),
+        ((x, y + r), (x, y), (x + r, y)),
+    )
+    points: List[Point] = []
+    for (x0, y0), (cx, cy), (x1, y1) in corners:
+        for i in range(CORNER_STEPS + 1):
+            t = i / CORNER_STEPS
+            u = 1 - t
+            points.append((u * u * x0 + 2 * u * t * cx + t * t * x1, u * u * y0 + 2 * u * t * cy + t * t * y1))
+    return points
+
+
+def draw_background(raster: Raster, width: float, height: float, background: Optional[str]) -> None:
+    if background and background.startswith(('data:', 'http', '/')):
+        raster.image(background, 0, 0, width, height)
+    elif background:
+        color = parse_color(background)
+        if color is not None:
+            raster.fill_polygon(_rect(0, 0, width, height), color)
+
+
+def draw_text(raster: Raster, el: dict) -> None:
+    x, y, w, h = (element_number(el, k) for k in ('x', 'y', 'width', 'height'))
+    background = el.get('backgroundColor')
+    fill = parse_color(background) if background != 'transparent' else None
+    stroke = parse_color(el.get('borderColor')) if element_number(el, 'borderWidth') else None
+    raster.paint(_rect(x, y, w, h), fill, stroke, element_number(el, 'borderWidth'))
+
+    size = element_number(el, 'fontSize', DEFAULT_FONT_SIZE)
+    color = parse_color(el.get('color') or '#000000') or (0.0, 0.0, 0.0, 1.0)
+    lines = layout_paragraphs(parse_html(str(el['text'])), font_style(el), size, x, y, w, el.get('textAlign'))
+    size = glyph_size(size)
+    for line in lines:
+        for segment in line.segments:
+            # Bold words read darker than regular ones.
+            ink = color[:3] + (color[3] * (0.8 if 'bold' in segment.style else 0.55),)
+            space = text_width(' ', segment.style, size)
+            left = line.x + segment.offset
+            for word in segment.text.split(' '):
+                word_width = text_width(word, segment.style, size)
+                # Each word starts where the Helvetica layout puts it, whatever the font drawn.
+                if word and not raster.glyphs(word, left, line.baseline, word_width, segment.style, size, color):
+                    raster.fill_rect(left, line.baseline - size * X_HEIGHT, word_width, size * X_HEIGHT, ink)
+                left += word_width + space
+            if segment.underline:
+                raster.fill_rect(line.x + segment.offset, line.baseline + size * 0.075,
+                                 segment.width, size * 0.05, color)
+
+
+def draw_shape(raster: Raster, el: dict) -> None:
+    kind = el.get('type')
+    x, y, w, h = (element_number(el, k) for k in ('x', 'y', 'width', 'height'))
+    fill = parse_color(el.get('backgroundColor'))
+    line_width = element_number(el, 'borderWidth')
+    stroke = parse_color(el.get('borderColor')) if line_width else None
+
+    if kind == 'image':
+        if not el.get('image'):
+            return
+        if not raster.image(el['image'], x, y, w, h):
+            raster.paint(_rect(x, y, w, h), parse_color('#cccccc'), parse_color('#999999'), 2)
+        elif stroke:
+            raster.paint(_rect(x, y, w, h), None, stroke, line_width)
+        return
+
+    if kind == 'rectangle':
+        radius = element_number(el, 'borderRadius')
+        points = _rounded_rect(x, y, w, h, radius) if radius else _rect(x, y, w, h)
+    elif kind == 'circle':
+        points = _ellipse(x, y, w, h)
+    elif kind in ('triangle', 'hexagon', 'star'):
+        shape = {'triangle': TRIANGLE, 'hexagon': HEXAGON, 'star': STAR}[kind]
+        points = [(x + w * fx, y + h * fy) for fx, fy in shape]
+    else:
+        return
+    raster.paint(points, fill, stroke, line_width)
+
+
+def draw_element(raster: Raster, el: dict) -> None:
+    if el.get('type') == 'text' and not el.get('text'):
+        return
+    raster.opacity = element_opacity(el)
+    if el.get('type') == 'text':
+        draw_text(raster, el)
+    else:
+        draw_shape(raster, el)
+    raster.opacity = 1.0
+
+
+def render_raster(
+    canvas_data: Union[str, dict, list, None],
+    out_width: int,
+    width: float = DEFAULT_WIDTH,
+    height: float = DEFAULT_HEIGHT,
+    public_dir: str = PUBLIC_DIR,
+    background: Optional[str] = None,
+) -> RasterResult:
+    """Render ``canvasData`` to an image ``out_width`` pixels wide."""
+    data = load_canvas_data(canvas_data)
+    scale = out_width / width
+    raster = Raster(out_width, max(int(round(height * scale)), 1), scale, public_dir)
+
+    draw_background(raster, width, height, background if background is not None else data.get('background'))
+    elements = visible_elements(data.get('elements') or [])
+    for el in elements:
+        draw_element(raster, el)
+    return RasterResult(raster, raster.missing_images, len(elements))
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('input', help="canvasData JSON file, or '-' for stdin")
+    parser.add_argument('-o', '--output', required=True, help='image file')
+    parser.add_argument('--size', type=int, default=320, help='image width in pixels')
+    parser.add_argument('--format', choices=FORMATS, default='png')
+    parser.add_argument('--width', type=float, default=DEFAULT_WIDTH, help='canvas width in px')
+    parser.add_argument('--height', type=float, default=DEFAULT_HEIGHT, help='canvas height in px')
+    parser.add_argument('--public', default=PUBLIC_DIR, help='directory site paths resolve against')
+    args = parser.parse_args(argv)
+
+    if args.input == '-':
+        source = sys.stdin.read()
+    else:
+        with open(args.input, 'r', encoding='utf-8') as f:
+            source = f.read()
+    try:
+        result = render_raster(source, args.size, args.width, args.height, args.public)
+        data = result.image.encode(args.format)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    with open(args.output, 'wb') as f:
+        f.write(data)
+    for source in result.missing_images:
+        print(f'Image not drawn: {source}', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
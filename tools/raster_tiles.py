@@ -0,0 +1,436 @@
+"""Re-render only the tiles of a raster preview that an edit touches.
+
+    python -m tools.raster_tiles update old.json new.json -o post.png --size 794
+    python -m tools.raster_tiles bench
+    python -m tools.raster_tiles bench --sizes 397,794,1588 --tile 32 --check
+
+``TileRenderer`` keeps the ``tools.raster`` image of the last canvas it drew,
+cut into ``--tile`` pixel squares, and a grid index from each tile to the
+elements whose drawn pixels reach it.  ``update(old, new)`` matches the
+elements by ``id`` and collects the boxes of the ones that were added,
+removed, changed or moved in the paint order, old box and new.  The tiles
+under those boxes are cleared and repainted: the background, then every
+element the index lists for them, in paint order, clipped to the tiles.
+Tile edges are whole pixels and every pixel sees the same draws in the same
+order, so the result is identical to a full ``render_raster``.  Repainting merged
+rectangles draws an element once per rectangle it reaches, so when at least
+``FULL_REDRAW_SHARE`` of the tiles are dirty (always after a new background)
+the whole image is drawn once instead, keeping the index; ids that are
+missing or repeated rebuild everything.
+
+An element's box is measured by running its drawing code against a raster
+that only records extents, so borders, text overflowing its box and
+anti-aliased edges are included.  ``bench`` times full renders against
+updates for edits of growing size on canvases of growing size.
+"""
+
+import argparse
+import json
+import math
+import random
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+from tools.pdf_render import DEFAULT_HEIGHT, DEFAULT_WIDTH, PUBLIC_DIR, load_canvas_data, visible_elements
+from tools.raster import FORMATS, Raster, draw_background, draw_element, render_raster
+
+
+DEFAULT_TILE = 64
+# Share of dirty tiles from which one full draw beats repainting them.
+FULL_REDRAW_SHARE = 0.6
+DEFAULT_SIZES = (397, 794, 1588)
+
+Box = Tuple[int, int, int, int]
+Tile = Tuple[int, int]
+
+
+class _Extent(Raster):
+    """A raster that paints nothing and records the pixel box drawing would touch."""
+
+    def __init__(self, width: int, height: int, scale: float):
+        self.width = width
+        self.height = height
+        self.scale = scale
+        self.opacity = 1.0
+        self.clip = (0, 0, width, height)
+        self.box: Optional[List[int]] = None
+
+    def _add(self, left: int, top: int, right: int, bottom: int) -> None:
+        left, top = max(left, 0), max(top, 0)
+        right, bottom = min(right, self.width), min(bottom, self.height)
+        if right <= left or bottom <= top:
+            return
+        if self.box is None:
+            self.box = [left, top, right, bottom]
+        else:
+            box = self.box
+            box[0], box[1] = min(box[0], left), min(box[1], top)
+            box[2], box[3] = max(box[2], right), max(box[3], bottom)
+
+    def _span(self, row: int, x0: float, x1: float, rgb: Tuple[int, int, int], alpha: float) -> None:
+        self._add(int(x0), row, int(math.ceil(x1)), row + 1)
+
+    def image(self, source: str, x: float, y: float, w: float, h: float) -> bool:
+        s = self.scale
+        # Room for the placeholder's 2-unit border should the image not load.
+        pad = int(math.ceil(s)) + 1
+        self._add(int(x * s) - pad, int(y * s) - pad, int(math.ceil((x + w) * s)) + pad,
+                  int(math.ceil((y + h) * s)) + pad)
+        return True
+
+
+@dataclass
+class TileUpdate:
+    image: Raster
+    # (column, row) of every repainted tile, in row order.
+    dirty: List[Tile] = field(default_factory=list)
+    tiles: int = 0
+    # Element draws the repaint took (one per element and repainted rectangle).
+    draws: int = 0
+    full: bool = False
+    missing_images: List[str] = field(default_factory=list)
+
+
+def _element_keys(elements: Sequence[dict]) -> Optional[List[str]]:
+    """The elements' ids, or None if one is missing or repeated."""
+    keys = [el.get('id') for el in elements]
+    if any(not isinstance(k, (str, int)) for k in keys) or len(set(keys)) != len(keys):
+        return None
+    return [str(k) for k in keys]
+
+
+def _moved(old: Sequence[str], new: Sequence[str]) -> Set[str]:
+    """Common keys outside a longest run kept in the same relative order."""
+    position = {key: i for i, key in enumerate(old)}
+    sequence = [key for key in new if key in position]
+    # Patience sorting over the old positions, keeping the predecessor links.
+    tails: List[int] = []
+    tail_index: List[int] = []
+    previous = [-1] * len(sequence)
+    for i, key in enumerate(sequence):
+        p = position[key]
+        lo, hi = 0, len(tails)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if tails[mid] < p:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo:
+            previous[i] = tail_index[lo - 1]
+        if lo == len(tails):
+            tails.append(p)
+            tail_index.append(i)
+        else:
+            tails[lo] = p
+            tail_index[lo] = i
+    kept = set()
+    i = tail_index[-1] if tail_index else -1
+    while i >= 0:
+        kept.add(sequence[i])
+        i = previous[i]
+    return set(sequence) - kept
+
+
+def merge_tiles(tiles: Iterable[Tile]) -> List[Tuple[int, int, int, int]]:
+    """Cover ``tiles`` with ``(col0, row0, col1, row1)`` rectangles (exclusive ends)."""
+    runs: Dict[int, List[Tuple[int, int]]] = {}
+    for col, row in sorted(set(tiles), key=lambda t: (t[1], t[0])):
+        spans = runs.setdefault(row, [])
+        if spans and spans[-1][1] == col:
+            spans[-1] = (spans[-1][0], col + 1)
+        else:
+            spans.append((col, col + 1))
+    rects: List[Tuple[int, int, int, int]] = []
+    open_rects: Dict[Tuple[int, int], int] = {}
+    for row in sorted(runs):
+        current = {}
+        for span in runs[row]:
+            index = open_rects.get(span)
+            if index is not None and rects[index][3] == row:
+                c0, r0, c1, _ = rects[index]
+                rects[index] = (c0, r0, c1, row + 1)
+            else:
+                index = len(rects)
+                rects.append((span[0], row, span[1], row + 1))
+            current[span] = index
+        open_rects = current
+    return rects
+
+
+class TileRenderer:
+    def __init__(self, out_width: int, width: float = DEFAULT_WIDTH, height: float = DEFAULT_HEIGHT,
+                 tile: int = DEFAULT_TILE, public_dir: str = PUBLIC_DIR):
+        self.width = width
+        self.height = height
+        self.tile = tile
+        self.scale = out_width / width
+        self.raster = Raster(out_width, max(int(round(height * self.scale)), 1), self.scale, public_dir)
+        self.columns = -(-self.raster.width // tile)
+        self.rows = -(-self.raster.height // tile)
+        self.background: Optional[str] = None
+        self.elements: Dict[str, dict] = {}
+        self.order: List[str] = []
+        self.boxes: Dict[str, Optional[Box]] = {}
+        self.grid: Dict[Tile, Set[str]] = {}
+        self._drawn = False
+
+    # -- index ---------------------------------------------------------------
+
+    def measure(self, el: dict) -> Optional[Box]:
+        extent = _Extent(self.raster.width, self.raster.height, self.scale)
+        draw_element(extent, el)
+        return tuple(extent.box) if extent.box else None
+
+    def tiles_of(self, box: Optional[Box]) -> Iterator[Tile]:
+        if box is None:
+            return
+        t = self.tile
+        for row in range(box[1] // t, (box[3] - 1) // t + 1):
+            for col in range(box[0] // t, (box[2] - 1) // t + 1):
+                yield col, row
+
+    def _index(self, key: str, el: dict) -> None:
+        box = self.boxes[key] = self.measure(el)
+        self.elements[key] = el
+        for tile in self.tiles_of(box):
+            self.grid.setdefault(tile, set()).add(key)
+
+    def _unindex(self, key: str) -> Optional[Box]:
+        box = self.boxes.pop(key)
+        del self.elements[key]
+        for tile in self.tiles_of(box):
+            self.grid[tile].discard(key)
+        return box
+
+    # -- drawing -------------------------------------------------------------
+
+    def _prepare(self, canvas_data, background: Optional[str]) -> Tuple[Optional[str], List[dict]]:
+        data = load_canvas_data(canvas_data)
+        return (background if background is not None else data.get('background'),
+                visible_elements(data.get('elements') or []))
+
+    def render(self, canvas_data: Union[str, dict, list, None], background: Optional[str] = None) -> TileUpdate:
+        """Draw everything and rebuild the index."""
+        self.background, elements = self._prepare(canvas_data, background)
+        raster = self._draw_all(elements)
+        keys = _element_keys(elements)
+        if keys is None:
+            # Without ids nothing can be matched next time.
+            keys = [f'#{i}' for i in range(len(elements))]
+        self.elements, self.boxes, self.grid = {}, {}, {}
+        self.order = keys
+        for key, el in zip(keys, elements):
+            self._index(key, el)
+        self._drawn = True
+        return TileUpdate(raster, [(c, r) for r in range(self.rows) for c in range(self.columns)],
+                          self.columns * self.rows, len(elements), True, list(raster.missing_images))
+
+    def update(self, old: Union[str, dict, list, None], new: Union[str, dict, list, None],
+               background: Optional[str] = None) -> TileUpdate:
+        """Bring the image from ``old`` to ``new``; ``old`` is drawn first unless it is what the image shows."""
+        old_background, old_elements = self._prepare(old, background)
+        old_keys = _element_keys(old_elements)
+        if (not self._drawn or old_keys is None or old_background != self.background or old_keys != self.order
+                or any(self.elements[k] != el for k, el in zip(old_keys, old_elements))):
+            self.render(old, background)
+        new_background, new_elements = self._prepare(new, background)
+        new_keys = _element_keys(new_elements)
+        if new_keys is None:
+            return self.render(new, background)
+
+        new_by_key = dict(zip(new_keys, new_elements))
+        changed = {k for k in self.order if k not in new_by_key or new_by_key[k] != self.elements[k]}
+        changed |= {k for k in new_keys if k not in self.elements}
+        changed |= _moved(self.order, new_keys)
+        dirty: Set[Tile] = set()
+        if new_background != self.background:
+            # The boxes stay valid; every tile is dirty, so the image is drawn in full below.
+            self.background = new_background
+            dirty = {(c, r) for r in range(self.rows) for c in range(self.columns)}
+        for key in changed:
+            if key in self.elements:
+                dirty.update(self.tiles_of(self._unindex(key)))
+        for key in changed:
+            if key in new_by_key:
+                self._index(key, new_by_key[key])
+                dirty.update(self.tiles_of(self.boxes[key]))
+        self.order = new_keys
+        tiles = self.columns * self.rows
+        if len(dirty) >= FULL_REDRAW_SHARE * tiles:
+            raster = self._draw_all([self.elements[key] for key in self.order])
+            return TileUpdate(raster, [(c, r) for r in range(self.rows) for c in range(self.columns)],
+                              tiles, len(self.order), True, list(raster.missing_images))
+        return TileUpdate(self.raster, sorted(dirty, key=lambda t: (t[1], t[0])), tiles,
+                          self.repaint(dirty), False, list(self.raster.missing_images))
+
+    def _draw_all(self, elements: Sequence[dict]) -> Raster:
+        """Clear the image and draw the background and ``elements``; the index is left alone."""
+        raster = self.raster
+        raster.clip = (0, 0, raster.width, raster.height)
+        raster.missing_images = []
+        for plane in raster.planes:
+            plane[:] = b'\xff' * len(plane)
+        draw_background(raster, self.width, self.height, self.background)
+        for el in elements:
+            draw_element(raster, el)
+        return raster
+
+    def repaint(self, tiles: Iterable[Tile]) -> int:
+        """Clear and redraw ``tiles``; returns the number of element draws."""
+        raster = self.raster
+        raster.missing_images = []
+        paint_order = {key: i for i, key in enumerate(self.order)}
+        draws = 0
+        t = self.tile
+        for c0, r0, c1, r1 in merge_tiles(tiles):
+            left, top = c0 * t, r0 * t
+            right, bottom = min(c1 * t, raster.width), min(r1 * t, raster.height)
+            raster.clip = (left, top, right, bottom)
+            white = b'\xff' * (right - left)
+            for plane in raster.planes:
+                for row in range(top, bottom):
+                    plane[row * raster.width + left:row * raster.width + right] = white
+            draw_background(raster, self.width, self.height, self.background)
+            keys = set()
+            for row in range(r0, r1):
+                for col in range(c0, c1):
+                    keys |= self.grid.get((col, row), set())
+            for key in sorted(keys, key=paint_order.__getitem__):
+                box = self.boxes[key]
+                if box[0] < right and box[2] > left and box[1] < bottom and box[3] > top:
+                    draw_element(raster, self.elements[key])
+                    draws += 1
+        raster.clip = (0, 0, raster.width, raster.height)
+        return draws
+
+
+# -- benchmark ---------------------------------------------------------------------
+
+def synthetic_canvas(count: int = 120, seed: int = 7) -> dict:
+    """A post-like canvas: overlapping shapes and text blocks with ids."""
+    rng = random.Random(seed)
+    kinds = ('rectangle', 'circle', 'triangle', 'hexagon', 'star')
+    elements = []
+    for i in range(count):
+        w, h = rng.uniform(30, 220), rng.uniform(30, 220)
+        el = {'id': f'el-{i}', 'x': rng.uniform(0, DEFAULT_WIDTH - w), 'y': rng.uniform(0, DEFAULT_HEIGHT - h),
+              'width': w, 'height': h, 'visible': True, 'opacity': rng.choice((1, 1, 1, 0.6)),
+              'backgroundColor': f'#{rng.randrange(1 << 24):06x}'}
+        if i % 4 == 3:
+            el.update(type='text', text='Lorem ipsum dolor sit amet, consectetur adipiscing elit ' * 2,
+                      fontSize=rng.choice((12, 16, 20)), backgroundColor='transparent', color='#222222')
+        else:
+            el.update(type=rng.choice(kinds), borderWidth=rng.choice((0, 2)), borderColor='#333333')
+        elements.append(el)
+    return {'elements': elements, 'background': '#f4f1ea'}
+
+
+def edits(canvas: dict) -> List[Tuple[str, dict]]:
+    """Edits of growing size: ``(label, new canvas)``."""
+    def edited(change) -> dict:
+        new = json.loads(json.dumps(canvas))
+        change(new['elements'])
+        return new
+
+    def resize(index: int, width: float, height: float):
+        def change(elements):
+            elements[index].update(type='rectangle', width=width, height=height, borderWidth=0)
+        return change
+
+    def nudge(elements):
+        elements[0].update(width=24, height=24)
+        elements[0]['x'] += 4
+
+    def recolour(elements):
+        resize(1, 100, 100)(elements)
+        elements[1]['backgroundColor'] = '#ff0000'
+
+    return [
+        ('nudge 24x24 element by 4px', edited(nudge)),
+        ('recolour 100x100 element', edited(recolour)),
+        ('resize to 300x300', edited(resize(2, 300, 300))),
+        ('resize to 600x800', edited(resize(2, 600, 800))),
+        ('raise element to the top', edited(lambda elements: elements.append(elements.pop(5)))),
+        ('change background', dict(canvas, background='#ffffff')),
+    ]
+
+
+def bench(sizes: Sequence[int], tile: int, repeat: int, check: bool, log=print) -> bool:
+    canvas = synthetic_canvas()
+    ok = True
+    for size in sizes:
+        best_full = min(_timed(lambda: render_raster(canvas, size))[0] for _ in range(repeat))
+        renderer = TileRenderer(size, tile=tile)
+        log(f'{size}px wide, {renderer.columns * renderer.rows} tiles of {tile}px: '
+            f'full render {best_full * 1e3:.0f} ms')
+        for label, new in edits(canvas):
+            best = float('inf')
+            for _ in range(repeat):
+                renderer.render(canvas)
+                seconds, result = _timed(lambda: renderer.update(canvas, new))
+                best = min(best, seconds)
+            line = (f'  {label:<28} {len(result.dirty):>5}/{result.tiles} tiles {result.draws:>4} draws '
+                    f'{best * 1e3:>8.1f} ms ({best / best_full:.0%} of full)')
+            if check:
+                same = result.image.planes == render_raster(new, size).image.planes
+                ok &= same
+                line += '  identical' if same else '  DIFFERS'
+            log(line)
+    return ok
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, result
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=('update', 'bench'))
+    parser.add_argument('inputs', nargs='*', help='update: old and new canvasData JSON files')
+    parser.add_argument('-o', '--output', help='update: image file')
+    parser.add_argument('--size', type=int, default=320, help='update: image width in pixels')
+    parser.add_argument('--format', choices=FORMATS, default='png')
+    parser.add_argument('--tile', type=int, default=DEFAULT_TILE, help='tile size in pixels')
+    parser.add_argument('--width', type=float, default=DEFAULT_WIDTH, help='canvas width in px')
+    parser.add_argument('--height', type=float, default=DEFAULT_HEIGHT, help='canvas height in px')
+    parser.add_argument('--public', default=PUBLIC_DIR, help='directory site paths resolve against')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help='bench: image widths')
+    parser.add_argument('--repeat', type=int, default=3, help='bench: runs per measurement (best is kept)')
+    parser.add_argument('--check', action='store_true', help='bench: compare every update with a full render')
+    args = parser.parse_args(argv)
+
+    if args.command == 'bench':
+        return 0 if bench([int(s) for s in args.sizes.split(',')], args.tile, args.repeat, args.check) else 1
+
+    if len(args.inputs) != 2 or not args.output:
+        parser.error('update needs an old and a new canvasData file and -o')
+    sources = []
+    for path in args.inputs:
+        with open(path, 'r', encoding='utf-8') as f:
+            sources.append(f.read())
+    renderer = TileRenderer(args.size, args.width, args.height, args.tile, args.public)
+    try:
+        renderer.render(sources[0])
+        started = time.perf_counter()
+        result = renderer.update(*sources)
+        elapsed = time.perf_counter() - started
+        data = result.image.encode(args.format)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    with open(args.output, 'wb') as f:
+        f.write(data)
+    what = 'full redraw' if result.full else f'{len(result.dirty)}/{result.tiles} tiles repainted'
+    print(f'{what}, {result.draws} element draws in {elapsed * 1e3:.1f} ms')
+    for source in result.missing_images:
+        print(f'Image not drawn: {source}', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,268 @@
+"""Content-addressed cache for rendered post artifacts (PDFs, previews).
+
+    python -m tools.render_cache stats
+    python -m tools.render_cache prune                 # drop entries no post references
+    python -m tools.render_cache evict --max-bytes 500M
+
+An artifact is keyed by a SHA-256 of the normalised ``canvasData``, the
+background, ``blurAmount``, the canvas size, the artifact kind and
+``RENDERER_VERSION``, so re-rendering an unchanged post is a lookup.  Files
+live under ``public/uploads/renders/<aa>/<key><ext>`` and are served as is;
+the index (size, last use, hit/miss counters) is a SQLite file shared by
+every process that renders.
+
+When the cache grows past ``max_bytes`` the least recently used entries are
+evicted, except those a ``Post.pdfUrl`` or ``PostPreview.url`` still points at.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from typing import AbstractSet, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from tools.asset_store import FILE_MODE, write_atomic
+from tools.db import REPO_ROOT, connect
+from tools.pdf_render import DEFAULT_HEIGHT, DEFAULT_WIDTH, PUBLIC_DIR, RENDERER_VERSION, load_canvas_data
+
+
+CACHE_DIR = os.path.join(PUBLIC_DIR, 'uploads', 'renders')
+CACHE_URL = '/uploads/renders'
+DEFAULT_INDEX = os.path.join(REPO_ROOT, '.render-cache.db')
+DEFAULT_MAX_BYTES = 2 << 30
+# Element fields that never change the rendered output.
+_IGNORED_FIELDS = frozenset({'id', 'locked'})
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+
+
+def _normalise(value):
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, list):
+        return [_normalise(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _normalise(v) for k, v in value.items()}
+    return value
+
+
+def render_key(
+    canvas_data: Union[str, dict, list, None],
+    background: Optional[str] = None,
+    blur_amount: Optional[int] = None,
+    kind: str = 'pdf',
+    width: float = DEFAULT_WIDTH,
+    height: float = DEFAULT_HEIGHT,
+) -> str:
+    """Stable hash of everything that determines a rendered artifact.
+
+    JSON key order, ``10`` vs ``10.0``, element ids, locks and hidden
+    elements do not change the key.
+    """
+    data = load_canvas_data(canvas_data)
+    elements = [
+        {k: v for k, v in el.items() if k not in _IGNORED_FIELDS}
+        for el in data.get('elements') or [] if isinstance(el, dict) and el.get('visible')
+    ]
+    payload = {
+        'elements': elements,
+        'background': data.get('background') or background or '',
+        'blurAmount': data.get('blurAmount', blur_amount) or 0,
+        'kind': kind,
+        'size': [width, height],
+        'renderer': RENDERER_VERSION,
+    }
+    canonical = json.dumps(_normalise(payload), sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class RenderCache:
+    def __init__(self, root: str = CACHE_DIR, index: str = DEFAULT_INDEX,
+                 max_bytes: int = DEFAULT_MAX_BYTES, url_prefix: str = CACHE_URL,
+                 db: Optional[str] = None):
+        self.root = root
+        self.url_prefix = url_prefix
+        self.max_bytes = max_bytes
+        # Database whose Post.pdfUrl values are protected from eviction
+        # (None: the default database).
+        self.db = db
+        self.conn = sqlite3.connect(index, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.root, key[:2], key + ext)
+
+    def _bump(self, name: str, by: int = 1) -> None:
+        with self.conn:
+            self.conn.execute(
+                'INSERT INTO counters (name, value) VALUES (?, ?) '
+                'ON CONFLICT (name) DO UPDATE SET value = value + excluded.value', (name, by))
+
+    def get(self, key: str) -> Optional[str]:
+        """URL of the cached artifact, or None.  Counts a hit or a miss."""
+        row = self.conn.execute('SELECT url FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is not None and not os.path.exists(self._url_path(row[0])):
+            # Deleted behind our back; forget it.
+            with self.conn:
+                self.conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            row = None
+        if row is None:
+            self._bump('misses')
+            return None
+        with self.conn:
+            self.conn.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+        self._bump('hits')
+        return row[0]
+
+    def put(self, key: str, data: bytes, ext: str = '.pdf') -> str:
+        path = self._path(key, ext)
+        write_atomic(path, data, FILE_MODE)
+        url = f'{self.url_prefix}/{key[:2]}/{key}{ext}'
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO entries (key, url, size, created, last_used) VALUES (?, ?, ?, ?, ?)',
+                (key, url, len(data), now, now))
+        if self.total_bytes() > self.max_bytes:
+            self.evict()
+        return url
+
+    def get_or_render(self, key: str, render: Callable[[], bytes], ext: str = '.pdf') -> Tuple[str, bool]:
+        """Return ``(url, hit)``; ``render`` only runs on a miss."""
+        url = self.get(key)
+        if url is not None:
+            return url, True
+        return self.put(key, render(), ext), False
+
+    def _url_path(self, url: str) -> str:
+        return os.path.join(self.root, url[len(self.url_prefix):].lstrip('/'))
+
+    def _remove(self, rows: Sequence[Tuple[str, str]]) -> List[str]:
+        removed = []
+        for key, url in rows:
+            try:
+                os.unlink(self._url_path(url))
+            except FileNotFoundError:
+                pass
+            removed.append(url)
+        with self.conn:
+            self.conn.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key, _ in rows])
+        return removed
+
+    def total_bytes(self) -> int:
+        return self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def evict(self, max_bytes: Optional[int] = None, keep: Optional[AbstractSet[str]] = None) -> List[str]:
+        """Drop least recently used entries until the cache fits ``max_bytes``."""
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        if keep is None:
+            try:
+                keep = referenced_urls(self.db, self.url_prefix)
+            except (FileNotFoundError, sqlite3.Error):
+                # Without the Post table nothing is known to be safe to drop.
+                return []
+        excess = self.total_bytes() - limit
+        victims = []
+        for key, url, size in self.conn.execute('SELECT key, url, size FROM entries ORDER BY last_used'):
+            if excess <= 0:
+                break
+            if url in keep:
+                continue
+            victims.append((key, url))
+            excess -= size
+        removed = self._remove(victims)
+        self._bump('evictions', len(removed))
+        return removed
+
+    def prune(self, keep: AbstractSet[str]) -> List[str]:
+        """Drop every entry whose URL is not in ``keep``."""
+        rows = [(key, url) for key, url in self.conn.execute('SELECT key, url FROM entries') if url not in keep]
+        return self._remove(rows)
+
+    def stats(self) -> Dict[str, int]:
+        counters = dict(self.conn.execute('SELECT name, value FROM counters'))
+        entries, size = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        return {
+            'entries': entries,
+            'bytes': size,
+            'hits': counters.get('hits', 0),
+            'misses': counters.get('misses', 0),
+            'evictions': counters.get('evictions', 0),
+        }
+
+
+def referenced_urls(db: Optional[str] = None, prefix: str = CACHE_URL) -> AbstractSet[str]:
+    """Cache URLs some ``Post.pdfUrl`` or ``PostPreview.url`` still points at."""
+    conn = connect(db, readonly=True)
+    try:
+        urls = {row[0] for row in conn.execute('SELECT pdfUrl FROM Post WHERE pdfUrl LIKE ?', (prefix + '/%',))}
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'PostPreview'").fetchone():
+            urls.update(row[0] for row in conn.execute('SELECT url FROM PostPreview WHERE url LIKE ?',
+                                                       (prefix + '/%',)))
+        return frozenset(urls)
+    finally:
+        conn.close()
+
+
+def parse_size(text: str) -> int:
+    m = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*', text, re.I)
+    if not m:
+        raise argparse.ArgumentTypeError(f'invalid size: {text!r}')
+    return int(float(m.group(1)) * 1024 ** ' kmgt'.index(m.group(2).lower() or ' '))
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=('stats', 'prune', 'evict'))
+    parser.add_argument('--db', help='SQLite database holding the Post table')
+    parser.add_argument('--index', default=DEFAULT_INDEX, help='cache index file')
+    parser.add_argument('--root', default=CACHE_DIR, help='directory holding cached artifacts')
+    parser.add_argument('--max-bytes', type=parse_size, default=DEFAULT_MAX_BYTES,
+                        help='size budget for evict, e.g. 500M')
+    args = parser.parse_args(argv)
+
+    cache = RenderCache(args.root, args.index, args.max_bytes, db=args.db)
+    try:
+        if args.command == 'stats':
+            stats = cache.stats()
+            lookups = stats['hits'] + stats['misses']
+            ratio = stats['hits'] / lookups if lookups else 0.0
+            print(f"{stats['entries']} entries, {stats['bytes'] / 1e6:.1f} MB, "
+                  f"{stats['hits']} hits / {stats['misses']} misses ({ratio:.0%}), "
+                  f"{stats['evictions']} evicted")
+            return 0
+        try:
+            keep = referenced_urls(args.db, cache.url_prefix)
+        except (FileNotFoundError, sqlite3.Error) as e:
+            print(f'Cannot read Post references: {e}', file=sys.stderr)
+            return 1
+        if args.command == 'prune':
+            removed = cache.prune(keep)
+        else:
+            removed = cache.evict(args.max_bytes, keep)
+        print(f'{len(removed)} entries removed, {cache.total_bytes() / 1e6:.1f} MB left')
+        return 0
+    finally:
+        cache.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""Single-pass tokenizer for the contentEditable HTML of text elements.
+
+    python -m tools.rich_text --check               # compare with the regex chain
+    python -m tools.rich_text --check --db prisma/dev.db
+
+``parse_html`` walks the HTML once and returns paragraphs of styled runs:
+``<b>``/``<strong>``, ``<i>``/``<em>``, ``<u>`` and ``span`` styles
+(``font-weight``, ``font-style``, ``text-decoration``) set the run flags, and
+line breaks fall exactly where the export's regex chain puts them (``<br>``,
+``</div>``, ``</p>``; every other tag is dropped, leading and trailing blank
+lines are trimmed, entities are left as written).  ``html_to_text`` joins the
+paragraphs and is the drop-in replacement for that chain.
+
+The one input the chain treats differently is a stray ``<`` inside a tag
+(``a<b<br>``), where its passes see different tags; such text is run through
+the chain itself and comes back as unstyled runs.  ``--check`` compares both
+on a built-in set of editor HTML and on every text element in ``Post``.
+"""
+
+import argparse
+import json
+import re
+import sqlite3
+import sys
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from tools.db import connect
+
+
+_TAG = re.compile(r'<[^>]*>')
+_BREAK = re.compile(r'</div>|</p>|<br\s*/?>', re.I)
+_TAG_NAME = re.compile(r'<\s*(/?)\s*([a-z][a-z0-9]*)', re.I)
+_STYLE_ATTR = re.compile(r'''\bstyle\s*=\s*(?:"([^"]*)"|'([^']*)')''', re.I)
+_BOLD_STYLE = re.compile(r'font-weight\s*:\s*(bold|bolder|[6-9]00)', re.I)
+_ITALIC_STYLE = re.compile(r'font-style\s*:\s*(italic|oblique)', re.I)
+_UNDERLINE_STYLE = re.compile(r'text-decoration(?:-line)?\s*:[^;]*underline', re.I)
+
+_BOLD_TAGS = frozenset({'b', 'strong'})
+_ITALIC_TAGS = frozenset({'i', 'em'})
+_VOID_TAGS = frozenset({'br', 'img', 'hr', 'input', 'wbr', 'meta', 'link', 'source'})
+
+# The editor's export: contentEditable HTML -> plain text.
+REGEX_CHAIN = (
+    (re.compile(r'</div><div>', re.I), '\n'),
+    (re.compile(r'<br\s*/?>', re.I), '\n'),
+    (re.compile(r'<div>', re.I), ''),
+    (re.compile(r'</div>', re.I), '\n'),
+    (re.compile(r'</p>', re.I), '\n'),
+    (re.compile(r'<p[^>]*>', re.I), ''),
+    (re.compile(r'<[^>]*>'), ''),
+    (re.compile(r'^\n+'), ''),
+    (re.compile(r'\n+$'), ''),
+)
+
+# HTML the editors produce: Chrome wraps new lines in <div>, Firefox uses
+# <br>, pasted text brings <p> and styled spans.
+SAMPLES = (
+    'Hello world',
+    'First line<div>Second line</div><div>Third line</div>',
+    '<div>Only divs</div><div><br></div><div>after a blank</div>',
+    'Firefox<br>line<br/>breaks<br />here<br>',
+    '<p>Pasted paragraph</p><p class="x">Another one</p>',
+    'Some <b>bold</b>, <i>italic</i> and <u>underlined</u> text',
+    '<b>bold <i>bold italic <u>all three</u></i></b> plain',
+    '<strong>strong</strong> and <em>em</em>',
+    '<span style="font-weight: bold;">css bold</span> <span style="font-style:italic">css italic</span>',
+    '<span style="text-decoration: underline;">css underline</span>',
+    'Entities &amp; &nbsp;spaces&lt;kept&gt;',
+    '\n\nleading and trailing newlines\n\n',
+    '<div><br></div><div><br></div>',
+    '<DIV>Upper</DIV><Div>case</Div><BR>tags',
+    '<div class="a">attrs on div</div ><div>next</div>',
+    'a < b and c > d',
+    'unclosed < angle',
+    'a<b<br>c',
+    'x<y<div>z>',
+    '<font color="#ff0000">font tag</font> text',
+    '<pre>pre</pre><param>',
+    '   leading spaces  and  doubles ',
+    '',
+)
+
+
+@dataclass(frozen=True)
+class Run:
+    text: str
+    bold: bool = False
+    italic: bool = False
+    underline: bool = False
+
+
+@dataclass(frozen=True)
+class Paragraph:
+    runs: Tuple[Run, ...]
+
+    @property
+    def text(self) -> str:
+        return ''.join(run.text for run in self.runs)
+
+
+def regex_chain_text(html: str) -> str:
+    """The export's conversion, one regex pass after another."""
+    for pattern, repl in REGEX_CHAIN:
+        html = pattern.sub(repl, html)
+    return html
+
+
+def _tag_style(tag: str) -> Tuple[str, bool, bool, bool]:
+    """``(name, bold, italic, underline)`` for an opening or closing tag."""
+    m = _TAG_NAME.match(tag)
+    if not m:
+        return '', False, False, False
+    name = m.group(2).lower()
+    style = _STYLE_ATTR.search(tag)
+    css = (style.group(1) or style.group(2) or '') if style else ''
+    return (
+        ('/' if m.group(1) else '') + name,
+        name in _BOLD_TAGS or bool(css and _BOLD_STYLE.search(css)),
+        name in _ITALIC_TAGS or bool(css and _ITALIC_STYLE.search(css)),
+        name == 'u' or bool(css and _UNDERLINE_STYLE.search(css)),
+    )
+
+
+def _trim(paragraphs: List[Paragraph]) -> List[Paragraph]:
+    # The chain strips leading and trailing newlines, i.e. blank paragraphs.
+    start, end = 0, len(paragraphs)
+    while start < end - 1 and not paragraphs[start].text:
+        start += 1
+    while end > start + 1 and not paragraphs[end - 1].text:
+        end -= 1
+    return paragraphs[start:end]
+
+
+def _plain(text: str) -> List[Paragraph]:
+    return [Paragraph((Run(line),) if line else ()) for line in text.split('\n')]
+
+
+def parse_html(html: str) -> List[Paragraph]:
+    """Split contentEditable HTML into paragraphs of styled runs."""
+    paragraphs: List[Paragraph] = []
+    runs: List[Run] = []
+    # Open tags as (name, bold, italic, underline).
+    stack: List[Tuple[str, bool, bool, bool]] = []
+    bold = italic = underline = False
+
+    def add(text: str) -> None:
+        nonlocal runs
+        lines = text.split('\n')
+        for i, line in enumerate(lines):
+            if i:
+                paragraphs.append(Paragraph(tuple(runs)))
+                runs = []
+            if not line:
+                continue
+            if runs and (runs[-1].bold, runs[-1].italic, runs[-1].underline) == (bold, italic, underline):
+                runs[-1] = Run(runs[-1].text + line, bold, italic, underline)
+            else:
+                runs.append(Run(line, bold, italic, underline))
+
+    pos = 0
+    for m in _TAG.finditer(html):
+        tag = m.group()
+        if '<' in tag[1:]:
+            return _plain(regex_chain_text(html))
+        if m.start() > pos:
+            add(html[pos:m.start()])
+        pos = m.end()
+        if _BREAK.fullmatch(tag):
+            add('\n')
+        name, *flags = _tag_style(tag)
+        if not name:
+            continue
+        if name.startswith('/'):
+            name = name[1:]
+            for depth in range(len(stack) - 1, -1, -1):
+                if stack[depth][0] == name:
+                    del stack[depth:]
+                    break
+            else:
+                continue
+        elif name not in _VOID_TAGS and not tag.endswith('/>'):
+            stack.append((name, *flags))
+        else:
+            continue
+        bold = any(frame[1] for frame in stack)
+        italic = any(frame[2] for frame in stack)
+        underline = any(frame[3] for frame in stack)
+    if pos < len(html):
+        add(html[pos:])
+    paragraphs.append(Paragraph(tuple(runs)))
+    return _trim(paragraphs)
+
+
+def html_to_text(html: str) -> str:
+    """Plain text of ``html``, identical to ``regex_chain_text``."""
+    return '\n'.join(p.text for p in parse_html(html))
+
+
+def iter_post_texts(db: Optional[str] = None) -> Iterator[Tuple[str, str]]:
+    """``(post id, html)`` for every text element stored in ``Post``."""
+    conn = connect(db, readonly=True)
+    try:
+        for post_id, canvas_data in conn.execute(
+                "SELECT id, canvasData FROM Post WHERE instr(canvasData, '\"text\"') > 0"):
+            try:
+                elements = json.loads(canvas_data).get('elements') or []
+            except (ValueError, AttributeError):
+                continue
+            for el in elements:
+                if isinstance(el, dict) and el.get('type') == 'text' and isinstance(el.get('text'), str):
+                    yield post_id, el['text']
+    finally:
+        conn.close()
+
+
+def check(corpus) -> List[Tuple[str, str, str]]:
+    """``(source, expected, got)`` for every HTML whose text differs."""
+    return [(source, regex_chain_text(html), html_to_text(html))
+            for source, html in corpus if regex_chain_text(html) != html_to_text(html)]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--check', action='store_true', required=True,
+                        help='compare the tokenizer with the regex chain')
+    parser.add_argument('--db', help='also check the text elements of this database '
+                                     '(default database if present)')
+    parser.add_argument('--samples-only', action='store_true', help='skip the database')
+    args = parser.parse_args(argv)
+
+    corpus = [(f'sample {i}', html) for i, html in enumerate(SAMPLES)]
+    if not args.samples_only:
+        try:
+            corpus.extend(iter_post_texts(args.db))
+        except (FileNotFoundError, sqlite3.Error) as e:
+            if args.db:
+                print(f'Cannot read posts: {e}', file=sys.stderr)
+                return 1
+    failures = check(corpus)
+    for source, expected, got in failures:
+        print(f'{source}: expected {expected!r}, got {got!r}')
+    print(f'{len(corpus) - len(failures)}/{len(corpus)} texts identical')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
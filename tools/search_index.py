@@ -0,0 +1,459 @@
+"""Full-text search over posts and files (SQLite FTS5), refreshed incrementally.
+
+    python -m tools.search_index refresh              # index what changed since the last run
+    python -m tools.search_index refresh --rebuild
+    python -m tools.search_index search 'گزارش مالی'  # ranked, prefix-matched
+    python -m tools.search_index search invoice --kind file
+    python -m tools.search_index bench --rows 1000000
+
+The index is a separate SQLite file (``.search-index.db``) holding one FTS5
+document per post and per file.  A post's document has ``Post.title``,
+``content``, ``description`` and the plain text of its ``canvasData`` text
+elements (``tools.rich_text``).  A file's has ``File.originalName`` and its
+folder's path.
+
+``refresh`` reads rows changed after the stored ``(updatedAt, id)``
+watermark of each table, one keyset page at a time.  Files of folders
+updated since then are re-indexed too, since their paths may have changed.
+Deletes do not show up in ``updatedAt``, so a tombstone scan merge-joins
+the indexed ids with each source table's ids, both in id order, and drops
+what is gone.
+
+FTS5 tokenizers cannot be written in Python, so Persian and Arabic are
+handled by ``normalize``, which is applied to documents and queries alike.
+It maps Arabic yeh/kaf/teh marbuta and alef/hamza forms to their Persian
+letters, drops harakat and tatweel, joins words split by ZWNJ (half-space),
+folds Persian and Arabic-Indic digits and applies NFKC.  The result is fed
+to ``unicode61``.
+"""
+
+import argparse
+import itertools
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from tools.db import REPO_ROOT, connect
+from tools.pdf_render import load_canvas_data
+from tools.rich_text import html_to_text
+
+
+DEFAULT_INDEX = os.path.join(REPO_ROOT, '.search-index.db')
+DEFAULT_CHUNK = 500
+DEFAULT_LIMIT = 20
+KINDS = ('post', 'file')
+# bm25 weights of the title, body and path columns.
+_WEIGHTS = (10.0, 1.0, 4.0)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    ref TEXT NOT NULL,
+    title TEXT NOT NULL,
+    updated_at INTEGER,
+    UNIQUE (kind, ref)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS fts USING fts5(
+    title, body, path, kind UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+CREATE TABLE IF NOT EXISTS watermarks (name TEXT PRIMARY KEY, updated_at INTEGER, ref TEXT);
+"""
+
+_ARABIC_TO_PERSIAN = str.maketrans({
+    '\u064a': '\u06cc',  # Arabic yeh -> Persian yeh
+    '\u0649': '\u06cc',  # alef maksura
+    '\u0626': '\u06cc',  # yeh with hamza
+    '\u0643': '\u06a9',  # Arabic kaf -> Persian kaf
+    '\u0629': '\u0647',  # teh marbuta -> heh
+    '\u06c0': '\u0647',  # heh with yeh
+    '\u0623': '\u0627',  # alef with hamza above
+    '\u0625': '\u0627',  # alef with hamza below
+    '\u0622': '\u0627',  # alef with madda
+    '\u0671': '\u0627',  # alef wasla
+    '\u0624': '\u0648',  # waw with hamza
+    '\u200c': None,       # ZWNJ: the half-space spelling and the joined one are the same word
+    '\u0640': None,       # tatweel
+    '\u0670': None,       # superscript alef
+    **{chr(c): None for c in range(0x064b, 0x0660)},  # harakat
+    **{chr(0x06f0 + d): str(d) for d in range(10)},   # Persian digits
+    **{chr(0x0660 + d): str(d) for d in range(10)},   # Arabic-Indic digits
+})
+_TERM = re.compile(r'\w+')
+
+
+def normalize(text: str) -> str:
+    """Fold the spelling variants of Persian/Arabic (and case) to one form."""
+    return unicodedata.normalize('NFKC', text).translate(_ARABIC_TO_PERSIAN).lower()
+
+
+def canvas_text(canvas_data: Optional[str]) -> str:
+    """Plain text of the canvas text elements; empty for unreadable data."""
+    try:
+        data = load_canvas_data(canvas_data)
+    except ValueError:
+        return ''
+    parts = []
+    for el in data.get('elements') or []:
+        if isinstance(el, dict) and el.get('type') == 'text' and isinstance(el.get('text'), str):
+            parts.append(html_to_text(el['text']))
+    return '\n'.join(parts)
+
+
+@dataclass
+class Hit:
+    kind: str
+    ref: str
+    title: str
+    snippet: str
+    rank: float
+
+
+@dataclass
+class RefreshReport:
+    indexed: Dict[str, int]
+    deleted: Dict[str, int]
+    seconds: float = 0.0
+
+
+class SearchIndex:
+    def __init__(self, path: str = DEFAULT_INDEX):
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    # -- writing -------------------------------------------------------------
+
+    def _delete(self, kind: str, refs: Sequence[str]) -> None:
+        for ref in refs:
+            row = self.conn.execute('SELECT id FROM docs WHERE kind = ? AND ref = ?', (kind, ref)).fetchone()
+            if row is not None:
+                self.conn.execute('DELETE FROM fts WHERE rowid = ?', row)
+                self.conn.execute('DELETE FROM docs WHERE id = ?', row)
+
+    def put(self, kind: str, ref: str, title: str, body: str, path: str = '',
+            updated_at: Optional[int] = None) -> None:
+        """Add or replace one document; the caller commits."""
+        row = self.conn.execute('SELECT id FROM docs WHERE kind = ? AND ref = ?', (kind, ref)).fetchone()
+        if row is None:
+            doc_id = self.conn.execute('INSERT INTO docs (kind, ref, title, updated_at) VALUES (?, ?, ?, ?)',
+                                       (kind, ref, title, updated_at)).lastrowid
+        else:
+            doc_id = row[0]
+            self.conn.execute('UPDATE docs SET title = ?, updated_at = ? WHERE id = ?', (title, updated_at, doc_id))
+            self.conn.execute('DELETE FROM fts WHERE rowid = ?', (doc_id,))
+        self.conn.execute('INSERT INTO fts (rowid, title, body, path, kind) VALUES (?, ?, ?, ?, ?)',
+                          (doc_id, normalize(title), normalize(body), normalize(path), kind))
+
+    def watermark(self, name: str) -> Optional[Tuple[int, str]]:
+        row = self.conn.execute('SELECT updated_at, ref FROM watermarks WHERE name = ?', (name,)).fetchone()
+        return tuple(row) if row else None
+
+    def set_watermark(self, name: str, mark: Tuple[int, str]) -> None:
+        self.conn.execute('INSERT OR REPLACE INTO watermarks (name, updated_at, ref) VALUES (?, ?, ?)',
+                          (name, mark[0], mark[1]))
+
+    def clear(self) -> None:
+        with self.conn:
+            self.conn.execute('DELETE FROM docs')
+            self.conn.execute("INSERT INTO fts (fts) VALUES ('delete-all')")
+            self.conn.execute('DELETE FROM watermarks')
+
+    def optimize(self) -> None:
+        with self.conn:
+            self.conn.execute("INSERT INTO fts (fts) VALUES ('optimize')")
+
+    # -- refreshing ----------------------------------------------------------
+
+    def _refresh_table(self, db, name: str, select: str, to_doc, chunk: int, alias: str = '') -> int:
+        """Index rows of ``select`` (which yields ``id`` and ``updatedAt``) past the watermark."""
+        count = 0
+        for rows in _iter_changed(db, select, self.watermark(name), chunk, alias):
+            with self.conn:
+                for row in rows:
+                    self.put(*to_doc(row))
+                self.set_watermark(name, (rows[-1]['updatedAt'], rows[-1]['id']))
+            count += len(rows)
+        return count
+
+    def _tombstones(self, db, kind: str, table: str) -> int:
+        """Drop documents whose row is gone: merge-join of both id orders."""
+        indexed = self.conn.execute('SELECT ref FROM docs WHERE kind = ? ORDER BY ref', (kind,))
+        current = (row[0] for row in db.execute(f'SELECT id FROM "{table}" ORDER BY id'))
+        gone = []
+        ref = next(current, None)
+        for (doc_ref,) in indexed:
+            while ref is not None and ref < doc_ref:
+                ref = next(current, None)
+            if ref != doc_ref:
+                gone.append(doc_ref)
+        with self.conn:
+            self._delete(kind, gone)
+        return len(gone)
+
+    def refresh(self, db: Optional[str] = None, chunk: int = DEFAULT_CHUNK, tombstones: bool = True,
+                rebuild: bool = False) -> RefreshReport:
+        started = time.perf_counter()
+        if rebuild:
+            self.clear()
+        source = connect(db, readonly=True)
+        report = RefreshReport({}, {})
+        try:
+            report.indexed['post'] = self._refresh_table(
+                source, 'Post',
+                'SELECT id, title, content, description, canvasData, updatedAt FROM Post',
+                lambda r: ('post', r['id'], r['title'] or '',
+                           '\n'.join(filter(None, (r['content'], r['description'], canvas_text(r['canvasData'])))),
+                           '', r['updatedAt']),
+                chunk)
+
+            # Files of renamed or moved folders first, so their new paths are indexed.
+            moved = 0
+            folder_mark = self.watermark('Folder')
+            for folders in _iter_changed(source, 'SELECT id, updatedAt FROM Folder', folder_mark, chunk):
+                if folder_mark is not None:
+                    ids = [row['id'] for row in folders]
+                    marks = ','.join('?' * len(ids))
+                    rows = source.execute(
+                        'SELECT f.id, f.originalName, f.updatedAt, d.path AS folderPath FROM File f '
+                        f'LEFT JOIN Folder d ON d.id = f.folderId WHERE f.folderId IN ({marks})', ids).fetchall()
+                    with self.conn:
+                        for row in rows:
+                            self.put(*_file_doc(row))
+                    moved += len(rows)
+                with self.conn:
+                    self.set_watermark('Folder', (folders[-1]['updatedAt'], folders[-1]['id']))
+            report.indexed['file'] = moved + self._refresh_table(
+                source, 'File',
+                'SELECT f.id, f.originalName, f.updatedAt, d.path AS folderPath '
+                'FROM File f LEFT JOIN Folder d ON d.id = f.folderId',
+                _file_doc, chunk, 'f.')
+
+            if tombstones:
+                report.deleted['post'] = self._tombstones(source, 'post', 'Post')
+                report.deleted['file'] = self._tombstones(source, 'file', 'File')
+        finally:
+            source.close()
+        report.seconds = time.perf_counter() - started
+        return report
+
+    # -- querying ------------------------------------------------------------
+
+    def search(self, text: str, kind: Optional[str] = None, limit: int = DEFAULT_LIMIT,
+               prefix: bool = True) -> List[Hit]:
+        """Documents holding every term of ``text``, best first.
+
+        Each term also matches as a prefix (``prefix=False`` for whole
+        words only); titles weigh most, then folder paths, then bodies.
+        """
+        match = fts_query(text, prefix)
+        if not match:
+            return []
+        # Rank the matches on the FTS table alone, then look up only the top few:
+        # joining or calling snippet() per match costs more than the ranking.
+        sql = 'SELECT rowid, bm25(fts, ?, ?, ?) AS score FROM fts WHERE fts MATCH ?'
+        params: list = [*_WEIGHTS, match]
+        if kind is not None:
+            sql += ' AND kind = ?'
+            params.append(kind)
+        sql += ' ORDER BY score LIMIT ?'
+        params.append(limit)
+        top = self.conn.execute(sql, params).fetchall()
+        terms = _TERM.findall(normalize(text))
+        hits = []
+        for rowid, score in top:
+            kind_, ref, title = self.conn.execute('SELECT kind, ref, title FROM docs WHERE id = ?',
+                                                  (rowid,)).fetchone()
+            body = self.conn.execute('SELECT body FROM fts WHERE rowid = ?', (rowid,)).fetchone()[0]
+            hits.append(Hit(kind_, ref, title, snippet(body, terms, prefix), score))
+        return hits
+
+    def count(self) -> Dict[str, int]:
+        return dict(self.conn.execute('SELECT kind, COUNT(*) FROM docs GROUP BY kind'))
+
+
+def snippet(body: str, terms: Sequence[str], prefix: bool = True, width: int = 12) -> str:
+    """About ``width`` words of ``body`` around the first match, matches in brackets."""
+    words = body.split()
+    if not words or not terms:
+        return ''
+
+    def matches(word: str) -> bool:
+        return any(t.startswith(term) if prefix else t == term
+                   for t in _TERM.findall(word) for term in terms)
+
+    first = next((i for i, word in enumerate(words) if matches(word)), 0)
+    start = max(0, min(first - width // 3, len(words) - width))
+    shown = [f'[{w}]' if matches(w) else w for w in words[start:start + width]]
+    return ('…' if start else '') + ' '.join(shown) + ('…' if start + width < len(words) else '')
+
+
+def fts_query(text: str, prefix: bool = True) -> str:
+    """FTS5 MATCH expression: every normalised term, quoted, as a prefix."""
+    terms = _TERM.findall(normalize(text))
+    return ' AND '.join(f'"{term}"*' if prefix else f'"{term}"' for term in terms)
+
+
+def _file_doc(row) -> tuple:
+    return ('file', row['id'], row['originalName'] or '', '', row['folderPath'] or '', row['updatedAt'])
+
+
+def _iter_changed(conn, select: str, after: Optional[Tuple[object, str]], chunk: int,
+                  alias: str = '') -> Iterator[list]:
+    """Keyset pages of ``select`` in ``(updatedAt, id)`` order after ``after``.
+
+    ``select`` must return ``updatedAt`` and ``id``; ``alias`` qualifies
+    them (``'f.'``) when it joins.
+    """
+    while True:
+        if after is None:
+            rows = conn.execute(f'{select} ORDER BY {alias}updatedAt, {alias}id LIMIT ?', (chunk,)).fetchall()
+        else:
+            rows = conn.execute(
+                f'{select} WHERE {alias}updatedAt > ? OR ({alias}updatedAt = ? AND {alias}id > ?) '
+                f'ORDER BY {alias}updatedAt, {alias}id LIMIT ?', (after[0], after[0], after[1], chunk)).fetchall()
+        if not rows:
+            return
+        yield rows
+        after = (rows[-1]['updatedAt'], rows[-1]['id'])
+
+
+# -- benchmark ---------------------------------------------------------------
+
+_PERSIAN_WORDS = ('گزارش', 'مالی', 'سالانه', 'قرارداد', 'فاکتور', 'پروژه', 'طراحی', 'کتاب', 'دانشگاه', 'تهران',
+                  'شیراز', 'اصفهان', 'مشتری', 'جلسه', 'صورتجلسه', 'بودجه', 'تصویر', 'لوگو', 'نامه', 'اداری',
+                  'فروش', 'خرید', 'کارمند', 'حقوق', 'بیمه', 'سند', 'رسید', 'پرداخت', 'تحویل', 'برنامه')
+_ENGLISH_WORDS = ('report', 'invoice', 'contract', 'design', 'logo', 'draft', 'final', 'budget', 'meeting',
+                  'photo', 'scan', 'letter', 'summary', 'plan', 'review', 'client', 'export', 'archive')
+
+
+def _vocabulary(size: int, rng: random.Random) -> List[str]:
+    words = list(_PERSIAN_WORDS + _ENGLISH_WORDS)
+    letters = 'ابپتثجچحخدذرزژسشصضطظعغفقکگلمنوهی'
+    while len(words) < size:
+        words.append(''.join(rng.choice(letters) for _ in range(rng.randint(3, 8))))
+    return words
+
+
+def bench(rows: int, queries: int = 200, seed: int = 0, path: Optional[str] = None, log=print) -> Dict[str, dict]:
+    """Build a synthetic index of ``rows`` documents and time typical queries."""
+    rng = random.Random(seed)
+    vocab = _vocabulary(20000, rng)
+    # Zipf-like: a few words are everywhere, most are rare.
+    weights = list(itertools.accumulate(1.0 / (i + 1) for i in range(len(vocab))))
+    tmpdir = None
+    if path is None:
+        tmpdir = tempfile.mkdtemp(prefix='search-bench-')
+        path = os.path.join(tmpdir, 'index.db')
+    index = SearchIndex(path)
+    try:
+        started = time.perf_counter()
+        batch = 20000
+        for start in range(0, rows, batch):
+            with index.conn:
+                for i in range(start, min(start + batch, rows)):
+                    kind = 'file' if i % 4 else 'post'
+                    title = ' '.join(rng.choices(vocab, cum_weights=weights, k=rng.randint(2, 5)))
+                    body = ' '.join(rng.choices(vocab, cum_weights=weights, k=40)) if kind == 'post' else ''
+                    folder = '/'.join(rng.choices(vocab, cum_weights=weights, k=2)) if kind == 'file' else ''
+                    index.put(kind, f'{kind}-{i}', title, body, folder, i)
+            log(f'{min(start + batch, rows)} documents')
+        index.optimize()
+        build_seconds = time.perf_counter() - started
+
+        def common() -> str:
+            return rng.choice(_PERSIAN_WORDS[:10] + _ENGLISH_WORDS[:5])
+
+        shapes = {
+            'common term': lambda: common(),
+            'two terms': lambda: f'{common()} {rng.choice(_PERSIAN_WORDS)}',
+            'prefix (3 chars)': lambda: rng.choice(_PERSIAN_WORDS + _ENGLISH_WORDS)[:3],
+            'rare term': lambda: rng.choice(vocab[5000:]),
+            'arabic spelling': lambda: rng.choice(('كتاب', 'گزارش مالي', 'صورتجلسة')),
+        }
+        results: Dict[str, dict] = {'build': {'rows': rows, 'seconds': build_seconds}}
+        for name, make in shapes.items():
+            samples = []
+            hits = 0
+            for _ in range(queries):
+                q = make()
+                t = time.perf_counter()
+                hits += len(index.search(q))
+                samples.append(time.perf_counter() - t)
+            samples.sort()
+            results[name] = {'p50_ms': samples[len(samples) // 2] * 1e3,
+                             'p99_ms': samples[min(int(len(samples) * 0.99), len(samples) - 1)] * 1e3,
+                             'mean_hits': hits / queries}
+        return results
+    finally:
+        index.close()
+        if tmpdir is not None:
+            for name in os.listdir(tmpdir):
+                os.unlink(os.path.join(tmpdir, name))
+            os.rmdir(tmpdir)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=('refresh', 'search', 'stats', 'bench'))
+    parser.add_argument('query', nargs='?', help='search text')
+    parser.add_argument('--db', help='SQLite database holding the Post and File tables')
+    parser.add_argument('--index', default=DEFAULT_INDEX, help='search index file')
+    parser.add_argument('--chunk', type=int, default=DEFAULT_CHUNK, help='rows per read/commit')
+    parser.add_argument('--rebuild', action='store_true', help='drop the index and watermarks first')
+    parser.add_argument('--no-tombstones', action='store_true', help='skip the scan for deleted rows')
+    parser.add_argument('--kind', choices=KINDS, help='only posts or only files')
+    parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT)
+    parser.add_argument('--exact', action='store_true', help='whole words only, no prefix matching')
+    parser.add_argument('--rows', type=int, default=1000000, help='documents for bench')
+    parser.add_argument('--queries', type=int, default=200, help='queries per shape for bench')
+    args = parser.parse_args(argv)
+
+    if args.command == 'bench':
+        results = bench(args.rows, args.queries, log=lambda msg: print(msg, file=sys.stderr))
+        build = results.pop('build')
+        print(f"{build['rows']:,} documents indexed in {build['seconds']:.1f}s")
+        print(f"{'query':<18} {'p50 ms':>8} {'p99 ms':>8} {'hits':>6}")
+        for name, r in results.items():
+            print(f"{name:<18} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['mean_hits']:>6.1f}")
+        return 0
+
+    index = SearchIndex(args.index)
+    try:
+        if args.command == 'refresh':
+            try:
+                report = index.refresh(args.db, args.chunk, not args.no_tombstones, args.rebuild)
+            except (FileNotFoundError, sqlite3.Error) as e:
+                print(e, file=sys.stderr)
+                return 1
+            print(f"{report.indexed.get('post', 0)} posts and {report.indexed.get('file', 0)} files indexed, "
+                  f"{sum(report.deleted.values())} deleted in {report.seconds:.2f}s")
+        elif args.command == 'stats':
+            for kind, count in sorted(index.count().items()):
+                print(f'{kind:6} {count:,}')
+        else:
+            if not args.query:
+                parser.error('search needs a query')
+            for hit in index.search(args.query, args.kind, args.limit, not args.exact):
+                print(f'{hit.kind:4} {hit.ref}  {hit.title}')
+                if hit.snippet:
+                    print(f'      {hit.snippet}')
+    finally:
+        index.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
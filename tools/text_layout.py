@@ -0,0 +1,293 @@
+"""Text layout for canvas text elements, with built-in Helvetica metrics.
+
+    python -m tools.text_layout --export-metrics helvetica-metrics.json
+
+Widths come from the standard-14 AFM files for Helvetica, Helvetica-Bold and
+their obliques (the obliques share the upright widths), in 1/1000 em for the
+WinAnsi (cp1252) codes 32..255 the PDF renderer encodes text in, so accented
+letters, curly quotes and dashes get their own widths; characters cp1252
+cannot encode are measured as the ``?`` they are drawn as.
+Word widths are cached, and ``wrap_lines`` adds each word's width to a
+running total, so a paragraph is wrapped in one linear pass instead of
+re-measuring the growing line for every word.
+
+The rules are those of the editor's PDF export: words split on single
+spaces, a word that does not fit starts a new line, blank lines are kept,
+lines are ``width - 16`` wide with 8px padding and ``fontSize * 1.2`` apart.
+jsPDF takes the font size in pt on its px page (scale factor 96/72), so
+glyphs are measured and drawn at ``glyph_size(fontSize)``, 0.75 of the
+size, while line spacing and the first baseline use ``fontSize`` itself.
+``--export-metrics`` writes the tables and constants as JSON so the editor
+can lay text out the same way.
+"""
+
+import argparse
+import json
+import sys
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+from tools.rich_text import Paragraph, Run
+
+
+METRICS_VERSION = 3
+PADDING = 8
+LINE_HEIGHT = 1.2
+# Glyph size per px of fontSize: jsPDF's px unit is 96/72 pt, font sizes are in pt.
+FONT_SCALE = 0.75
+DEFAULT_FONT_SIZE = 16
+FIRST_CHAR = 32
+ENCODING = 'cp1252'
+WORD_CACHE_SIZE = 65536
+
+_HELVETICA = (
+    '278 278 355 556 556 889 667 191 333 333 389 584 278 333 278 278 556 556 556 556 556 556 556 556 '
+    '556 556 278 278 584 584 584 556 1015 667 667 722 722 667 611 778 722 278 500 667 556 833 722 778 '
+    '667 778 722 667 611 722 667 944 667 667 611 278 278 278 469 556 333 556 556 500 556 556 278 556 '
+    '556 222 222 500 222 833 556 556 556 556 333 500 278 556 500 722 500 500 500 334 260 334 584'
+)
+_HELVETICA_BOLD = (
+    '278 333 474 556 556 889 722 238 333 333 389 584 278 333 278 278 556 556 556 556 556 556 556 556 '
+    '556 556 333 333 584 584 584 611 975 722 722 722 722 667 611 778 722 278 556 722 611 833 722 778 '
+    '667 778 722 667 611 722 667 944 667 667 611 333 278 333 584 556 333 556 611 556 611 556 333 611 '
+    '611 278 278 556 278 889 611 611 611 611 389 556 333 611 556 778 556 556 500 389 280 389 584'
+)
+# WinAnsi 128..255; the five codes cp1252 leaves undefined get the width of '?'.
+_HELVETICA_HIGH = (
+    '556 556 222 556 333 1000 556 556 333 1000 667 333 1000 556 611 556 556 222 222 333 333 350 556 '
+    '1000 333 1000 500 333 944 556 500 667 278 333 556 556 556 556 260 556 333 737 370 556 584 333 '
+    '737 333 400 584 333 333 333 556 537 278 333 333 365 556 834 834 834 611 667 667 667 667 667 667 '
+    '1000 722 667 667 667 667 278 278 278 278 722 722 778 778 778 778 778 584 778 722 722 722 722 667 '
+    '667 611 556 556 556 556 556 556 889 500 556 556 556 556 278 278 278 278 556 556 556 556 556 556 '
+    '556 584 611 556 556 556 556 500 556 500'
+)
+_HELVETICA_BOLD_HIGH = (
+    '556 611 278 556 500 1000 556 556 333 1000 667 333 1000 611 611 611 611 278 278 500 500 350 556 '
+    '1000 333 1000 556 333 944 611 500 667 278 333 556 556 556 556 280 556 333 737 370 556 584 333 '
+    '737 333 400 584 333 333 333 611 556 278 333 333 365 556 834 834 834 611 722 722 722 722 722 722 '
+    '1000 722 667 667 667 667 278 278 278 278 722 722 778 778 778 778 778 584 778 722 722 722 722 667 '
+    '667 611 556 556 556 556 556 556 889 556 556 556 556 556 278 278 278 278 611 611 611 611 611 611 '
+    '611 584 611 611 611 611 611 556 611 556'
+)
+
+
+def _widths(low: str, high: str) -> Tuple[int, ...]:
+    ascii_widths = [int(w) for w in low.split()]
+    # 127 (DEL) has no glyph and is drawn as '?', like anything unencodable.
+    return tuple(ascii_widths + [ascii_widths[ord('?') - FIRST_CHAR]] + [int(w) for w in high.split()])
+
+
+# jsPDF font style -> (PostScript name, widths of the WinAnsi codes FIRST_CHAR..255)
+FONTS = {
+    'normal': ('Helvetica', _widths(_HELVETICA, _HELVETICA_HIGH)),
+    'bold': ('Helvetica-Bold', _widths(_HELVETICA_BOLD, _HELVETICA_BOLD_HIGH)),
+    'italic': ('Helvetica-Oblique', _widths(_HELVETICA, _HELVETICA_HIGH)),
+    'bolditalic': ('Helvetica-BoldOblique', _widths(_HELVETICA_BOLD, _HELVETICA_BOLD_HIGH)),
+}
+# Characters cp1252 cannot encode are drawn as '?'.
+_FALLBACK = {style: widths[ord('?') - FIRST_CHAR] for style, (_, widths) in FONTS.items()}
+
+
+def _char_widths(widths: Tuple[int, ...]) -> dict:
+    table = {}
+    for code in range(FIRST_CHAR, 256):
+        try:
+            table[bytes([code]).decode(ENCODING)] = widths[code - FIRST_CHAR]
+        except UnicodeDecodeError:
+            continue
+    return table
+
+
+# Character -> width, keyed by the text as written rather than its WinAnsi code.
+_CHAR_WIDTHS = {style: _char_widths(widths) for style, (_, widths) in FONTS.items()}
+
+
+@dataclass(frozen=True)
+class Segment:
+    """Stretch of a line drawn in one font, ``offset`` from the line start."""
+    text: str
+    style: str
+    underline: bool
+    offset: float
+    width: float
+
+
+@dataclass(frozen=True)
+class Line:
+    text: str
+    x: float
+    baseline: float
+    width: float
+    segments: Tuple[Segment, ...] = ()
+
+
+def font_style(element: dict) -> str:
+    return combine_style('normal', element.get('fontWeight') == 'bold', element.get('fontStyle') == 'italic')
+
+
+def combine_style(style: str, bold: bool = False, italic: bool = False) -> str:
+    """``style`` with bold and/or italic added."""
+    bold = bold or 'bold' in style
+    italic = italic or 'italic' in style
+    if bold and italic:
+        return 'bolditalic'
+    if bold:
+        return 'bold'
+    if italic:
+        return 'italic'
+    return 'normal'
+
+
+@lru_cache(maxsize=WORD_CACHE_SIZE)
+def word_units(word: str, style: str) -> int:
+    """Width of ``word`` in 1/1000 em."""
+    widths = _CHAR_WIDTHS[style]
+    fallback = _FALLBACK[style]
+    return sum(widths.get(ch, fallback) for ch in word)
+
+
+def text_width(text: str, style: str, size: float) -> float:
+    return word_units(text, style) * size / 1000
+
+
+def plain_paragraphs(text: str) -> List[Paragraph]:
+    return [Paragraph((Run(line),)) for line in text.split('\n')]
+
+
+def _words(paragraph: Paragraph, style: str, scale: float) -> List[Tuple[list, float]]:
+    """Split a paragraph on spaces into ``(pieces, width)``; each piece is
+    ``[text, style, underline, width]`` and a word after the first starts
+    with the space before it."""
+    words: List[Tuple[list, float]] = []
+    pieces: list = []
+    width = 0.0
+    for run in paragraph.runs:
+        run_style = combine_style(style, run.bold, run.italic)
+        for i, part in enumerate(run.text.split(' ')):
+            if i:
+                words.append((pieces, width))
+                space = word_units(' ', run_style) * scale
+                pieces, width = [[' ', run_style, run.underline, space]], 0.0
+            if part:
+                part_width = word_units(part, run_style) * scale
+                pieces.append([part, run_style, run.underline, part_width])
+                width += part_width
+    words.append((pieces, width))
+    return words
+
+
+def _segments(pieces: list) -> Tuple[Segment, ...]:
+    # Texts are collected in lists and joined once; += on them would copy the
+    # growing segment for every piece.
+    merged: list = []
+    for text, style, underline, width in pieces:
+        if merged and merged[-1][1] == style and merged[-1][2] == underline:
+            merged[-1][0].append(text)
+            merged[-1][3] += width
+        else:
+            merged.append([[text], style, underline, width])
+    segments = []
+    offset = 0.0
+    for texts, style, underline, width in merged:
+        segments.append(Segment(''.join(texts), style, underline, offset, width))
+        offset += width
+    return tuple(segments)
+
+
+def wrap_paragraphs(paragraphs: Sequence[Paragraph], style: str, size: float,
+                    max_width: float) -> List[Tuple[Tuple[Segment, ...], float]]:
+    """Wrap styled paragraphs into ``(segments, width)`` lines.
+
+    Runs are measured in their own font (``style`` plus the run's bold and
+    italic); a word may span runs.
+    """
+    scale = size / 1000
+    wrapped: List[Tuple[Tuple[Segment, ...], float]] = []
+    for paragraph in paragraphs:
+        pieces: list = []
+        width = 0.0
+        for index, (word, word_width) in enumerate(_words(paragraph, style, scale)):
+            space = word[0][3] if index else 0.0
+            if index == 0 or not pieces:
+                # An empty first word (leading space) is dropped, as in the export.
+                pieces, width = word[1:] if index else word, word_width
+            elif width + space + word_width > max_width:
+                wrapped.append((_segments(pieces), width))
+                pieces, width = word[1:], word_width
+            else:
+                pieces.extend(word)
+                width += space + word_width
+        wrapped.append((_segments(pieces), width))
+    return wrapped
+
+
+def wrap_lines(text: str, style: str, size: float, max_width: float) -> List[Tuple[str, float]]:
+    """Wrap plain ``text`` into ``(line, width)`` pairs."""
+    return [(''.join(s.text for s in segments), width)
+            for segments, width in wrap_paragraphs(plain_paragraphs(text), style, size, max_width)]
+
+
+def glyph_size(size: float) -> float:
+    """Size glyphs of a ``fontSize`` are measured and drawn at, in px."""
+    return size * FONT_SCALE
+
+
+def layout_paragraphs(paragraphs: Sequence[Paragraph], style: str, size: float, x: float, y: float,
+                      width: float, align: Optional[str] = None) -> List[Line]:
+    """Position the wrapped lines of ``paragraphs`` inside a box at ``(x, y)``."""
+    line_height = size * LINE_HEIGHT
+    lines = []
+    wrapped = wrap_paragraphs(paragraphs, style, glyph_size(size), width - 2 * PADDING)
+    for index, (segments, line_width) in enumerate(wrapped):
+        if align == 'center':
+            left = x + width / 2 - line_width / 2
+        elif align == 'right':
+            left = x + width - PADDING - line_width
+        else:
+            left = x + PADDING
+        text = ''.join(s.text for s in segments)
+        lines.append(Line(text, left, y + size + PADDING + index * line_height, line_width, segments))
+    return lines
+
+
+def layout_text(text: str, style: str, size: float, x: float, y: float, width: float,
+                align: Optional[str] = None) -> List[Line]:
+    """Position the wrapped lines of plain ``text`` inside a box at ``(x, y)``."""
+    return layout_paragraphs(plain_paragraphs(text), style, size, x, y, width, align)
+
+
+def export_metrics() -> dict:
+    return {
+        'version': METRICS_VERSION,
+        'unitsPerEm': 1000,
+        'firstChar': FIRST_CHAR,
+        'encoding': ENCODING,
+        'padding': PADDING,
+        'lineHeight': LINE_HEIGHT,
+        'fontScale': FONT_SCALE,
+        'defaultFontSize': DEFAULT_FONT_SIZE,
+        'fonts': {
+            style: {'baseFont': name, 'widths': list(widths), 'fallback': _FALLBACK[style]}
+            for style, (name, widths) in FONTS.items()
+        },
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--export-metrics', metavar='PATH', required=True,
+                        help="write the metrics tables as JSON ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    data = json.dumps(export_metrics(), separators=(',', ':'))
+    if args.export_metrics == '-':
+        print(data)
+    else:
+        with open(args.export_metrics, 'w', encoding='utf-8') as f:
+            f.write(data + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
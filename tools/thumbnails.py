@@ -0,0 +1,222 @@
+"""Render thumbnail and preview images of every post.
+
+    python -m tools.thumbnails                         # posts changed since the last run
+    python -m tools.thumbnails --rebuild --jobs 8      # every post again
+    python -m tools.thumbnails --sizes 160,320 --format webp
+
+Each post's ``canvasData`` is drawn by ``tools.raster`` at a few fixed widths
+and stored in ``tools.render_cache`` (``public/uploads/renders``), keyed by
+content hash, so unchanged canvases are never drawn twice.  The URLs go to
+the ``PostPreview`` table (one row per post, width and format, with the
+``updatedAt`` of the post they show), which list views can read instead of
+``canvasData`` or the PDF.
+
+Like ``tools.pdf_regen`` posts are read in ``(updatedAt, id)`` order, drawn
+in a process pool and committed one chunk at a time behind a watermark, so
+a plain run only touches posts saved since the last one.  ``--rebuild``
+ignores the watermark and rewrites every post's rows; images are still
+taken from the cache, whose keys include ``RASTER_VERSION``.
+"""
+
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+from tools.db import REPO_ROOT, connect, database_path
+from tools.pdf_regen import (
+    CHUNKS_IN_FLIGHT, EMPTY, ERROR, RENDERED, iter_chunks, load_watermark, save_watermark, worker_cache,
+)
+from tools.pdf_render import DEFAULT_HEIGHT, DEFAULT_WIDTH, PUBLIC_DIR, load_canvas_data
+from tools.raster import FORMATS, RASTER_VERSION, Image, render_raster
+from tools.render_cache import DEFAULT_INDEX, render_key
+
+
+DEFAULT_STATE = os.path.join(REPO_ROOT, '.thumbnails-state.json')
+DEFAULT_CHUNK = 200
+DEFAULT_SIZES = (160, 320, 640)
+
+# Same DDL `prisma db push` creates for the PostPreview model.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS "PostPreview" (
+    "postId" TEXT NOT NULL,
+    "width" INTEGER NOT NULL,
+    "format" TEXT NOT NULL,
+    "url" TEXT NOT NULL,
+    "postUpdatedAt" DATETIME NOT NULL,
+
+    PRIMARY KEY ("postId", "width", "format"),
+    CONSTRAINT "PostPreview_postId_fkey" FOREIGN KEY ("postId") REFERENCES "Post" ("id")
+        ON DELETE CASCADE ON UPDATE CASCADE
+);
+"""
+
+
+@dataclass
+class PostPreviews:
+    id: str
+    status: str
+    updated_at: object = None
+    # Image width -> URL.
+    urls: Dict[int, str] = field(default_factory=dict)
+    error: str = ''
+    missing_images: List[str] = field(default_factory=list)
+    cached: int = 0
+
+
+def render_previews(
+    post_id: str,
+    canvas_data: Optional[str],
+    background: Optional[str],
+    blur_amount: Optional[int],
+    updated_at: object,
+    sizes: Sequence[int] = DEFAULT_SIZES,
+    fmt: str = 'png',
+    public_dir: str = PUBLIC_DIR,
+    width: float = DEFAULT_WIDTH,
+    height: float = DEFAULT_HEIGHT,
+    index: str = DEFAULT_INDEX,
+    db: Optional[str] = None,
+) -> PostPreviews:
+    result = PostPreviews(post_id, RENDERED, updated_at)
+    try:
+        data = load_canvas_data(canvas_data)
+        if not data.get('elements') and not data.get('background') and not background:
+            result.status = EMPTY
+            return result
+        override = None if data.get('background') else background
+        cache = worker_cache(public_dir, index, db)
+        for size in sizes:
+            def render() -> bytes:
+                drawn = render_raster(data, size, width, height, public_dir, override)
+                result.missing_images.extend(s for s in drawn.missing_images if s not in result.missing_images)
+                return drawn.image.encode(fmt)
+
+            key = render_key(data, background, blur_amount, f'preview-{RASTER_VERSION}-{size}.{fmt}', width, height)
+            url, hit = cache.get_or_render(key, render, '.' + fmt)
+            result.urls[size] = url
+            result.cached += hit
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        return PostPreviews(post_id, ERROR, updated_at, error=f'{type(e).__name__}: {e}')
+    return result
+
+
+def commit_chunk(conn, results: Sequence[PostPreviews], fmt: str) -> None:
+    rows = [(r.id, size, fmt, url, r.updated_at)
+            for r in results if r.status == RENDERED for size, url in r.urls.items()]
+    with conn:
+        conn.executemany(
+            'DELETE FROM PostPreview WHERE postId = ?', [(r.id,) for r in results if r.status == EMPTY])
+        conn.executemany(
+            'INSERT OR REPLACE INTO PostPreview (postId, width, format, url, postUpdatedAt) '
+            'VALUES (?, ?, ?, ?, ?)', rows)
+
+
+def generate(
+    db: Optional[str] = None,
+    jobs: Optional[int] = None,
+    chunk: int = DEFAULT_CHUNK,
+    state: str = DEFAULT_STATE,
+    rebuild: bool = False,
+    sizes: Sequence[int] = DEFAULT_SIZES,
+    fmt: str = 'png',
+    public_dir: str = PUBLIC_DIR,
+    width: float = DEFAULT_WIDTH,
+    height: float = DEFAULT_HEIGHT,
+    index: str = DEFAULT_INDEX,
+    log=print,
+) -> List[PostPreviews]:
+    conn = connect(db)
+    with conn:
+        conn.executescript(_SCHEMA)
+    after = None if rebuild else load_watermark(state)
+    if after is not None:
+        log(f'Resuming after updatedAt={after[0]} id={after[1]}')
+
+    results: List[PostPreviews] = []
+    pending: Deque[Tuple[Tuple[object, str], List[Future]]] = deque()
+
+    def drain() -> None:
+        mark, futures = pending.popleft()
+        done = [f.result() for f in futures]
+        commit_chunk(conn, done, fmt)
+        save_watermark(state, mark)
+        results.extend(done)
+        log(f'{len(results)} posts done')
+
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for rows in iter_chunks(conn, chunk, after):
+                futures = [pool.submit(render_previews, post_id, canvas_data, background, blur, updated_at,
+                                       sizes, fmt, public_dir, width, height, index, db)
+                           for post_id, canvas_data, background, blur, updated_at in rows]
+                pending.append(((rows[-1][4], rows[-1][0]), futures))
+                if len(pending) > CHUNKS_IN_FLIGHT:
+                    drain()
+            while pending:
+                drain()
+    finally:
+        conn.close()
+    return results
+
+
+def parse_sizes(text: str) -> Tuple[int, ...]:
+    try:
+        sizes = tuple(sorted({int(part) for part in text.split(',') if part.strip()}))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid sizes: {text!r}') from None
+    if not sizes or sizes[0] <= 0:
+        raise argparse.ArgumentTypeError(f'invalid sizes: {text!r}')
+    return sizes
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help=f'SQLite database (default: {os.path.relpath(database_path(), REPO_ROOT)})')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes')
+    parser.add_argument('--chunk', type=int, default=DEFAULT_CHUNK, help='posts per read/commit')
+    parser.add_argument('--state', default=DEFAULT_STATE, help='watermark file')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='ignore the watermark and process every post')
+    parser.add_argument('--sizes', type=parse_sizes, default=DEFAULT_SIZES,
+                        help='comma-separated image widths in pixels')
+    parser.add_argument('--format', choices=FORMATS, default='png', help='image format (webp needs Pillow)')
+    parser.add_argument('--public', default=PUBLIC_DIR, help='public directory holding uploads/')
+    parser.add_argument('--width', type=float, default=DEFAULT_WIDTH, help='canvas width in px')
+    parser.add_argument('--height', type=float, default=DEFAULT_HEIGHT, help='canvas height in px')
+    parser.add_argument('--cache-index', default=DEFAULT_INDEX, help='render cache index file')
+    args = parser.parse_args(argv)
+
+    if args.format == 'webp' and Image is None:
+        print('WebP output needs Pillow', file=sys.stderr)
+        return 1
+
+    started = time.perf_counter()
+    try:
+        results = generate(args.db, args.jobs, args.chunk, args.state, args.rebuild, args.sizes,
+                           args.format, args.public, args.width, args.height, args.cache_index)
+    except FileNotFoundError as e:
+        print(e, file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - started
+
+    for r in results:
+        if r.status == ERROR:
+            print(f'ERROR {r.id}: {r.error}')
+        for source in r.missing_images:
+            print(f'{r.id}: image not drawn: {source}')
+    counts = {status: sum(r.status == status for r in results) for status in (RENDERED, EMPTY, ERROR)}
+    images = sum(len(r.urls) for r in results)
+    cached = sum(r.cached for r in results)
+    rate = len(results) / elapsed if elapsed else 0.0
+    print(f'{counts[RENDERED]} posts ({images} images, {cached} from cache), {counts[EMPTY]} empty, '
+          f'{counts[ERROR]} failed in {elapsed:.1f}s ({rate:.1f} posts/s)')
+    return 1 if counts[ERROR] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,497 @@
+"""Brace-aware structure index for TS/TSX sources.
+
+``build_index`` makes one linear pass over a file, skipping strings,
+template literals, comments, regex literals and JSX text, and records the
+offsets of:
+
+* ``import`` statements (keyed by module, with their specifiers),
+* top-level and nested ``function`` / ``const`` / ``let`` declarations,
+  including parameter lists and function bodies,
+* ``interface`` / ``type`` / ``class`` / ``enum`` declarations,
+* hook calls (``useXxx(...)``) and JSX opening elements.
+
+Patch edits address these through selectors such as ``const:handleSave``,
+``function:AdvancedCanvasEditor.body_end`` or ``jsx:AdvancedCanvasEditor.name``
+instead of searching the text for anchor strings.
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+
+Span = Tuple[int, int]
+
+_CODE_TOKEN = re.compile(r"""
+    (?P<skip>(?:\s+|//[^\n]*|/\*.*?(?:\*/|\Z))+)
+  | (?P<ident>[A-Za-z_$\u0080-\uffff][\w$\u0080-\uffff]*)
+  | (?P<number>\.?\d[\w.]*)
+  | (?P<string>'(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*")
+  | (?P<punct>=>|\.\.\.|\?\.|&&|\|\||\?\?|[=!]==?|[-+*%&|^<>]=?|.)
+""", re.X | re.S)
+_REGEX_LITERAL = re.compile(r'/(?![*/])(?:[^/\\\[\n]|\\.|\[(?:[^\]\\\n]|\\.)*\])+/[A-Za-z]*')
+_TEMPLATE_CHUNK = re.compile(r'(?:[^`\\$]|\\.|\$(?!\{))*', re.S)
+_JSX_TEXT = re.compile(r'[^<{]*')
+_JSX_NAME = re.compile(r'[A-Za-z_$][\w$.:-]*')
+_JSX_ATTR = re.compile(r'\s+|[^\s{}\'"/>=]+|=|//[^\n]*|/\*.*?\*/', re.S)
+_SPACE = re.compile(r'\s*')
+_HOOK_NAME = re.compile(r'use[A-Z0-9]\w*$')
+# ``import type X``/``import type {...}``, but not a default import named ``type``.
+_TYPE_IMPORT = re.compile(r'import\s+type\b(?!\s*(?:,|from\b))')
+_TYPE_SPECIFIER = re.compile(r'^type\s+')
+
+# Tokens after which '/' starts a regex literal and '<' may start JSX.
+_EXPR_START_PUNCT = frozenset('( , = : [ ! & | ? { } ; + - * % ~ ^ < > => && || ?? == === != !== += -= *= %= &= |= ^= ...'.split())
+_EXPR_START_WORDS = frozenset(('return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete',
+                               'void', 'throw', 'instanceof', 'yield', 'await', 'default'))
+_JSX_BLOCKED_PUNCT = frozenset((')', ']', '}'))
+_BLOCK_KEYWORDS = frozenset(('if', 'for', 'while', 'switch', 'catch', 'with'))
+_DECL_PREFIXES = frozenset(('export', 'default', 'async', 'declare'))
+_BINDING_KEYWORDS = frozenset(('const', 'let', 'var'))
+_TYPE_KEYWORDS = frozenset(('interface', 'type', 'class', 'enum'))
+
+# Sub-spans a selector may address with a ``.part`` suffix.
+PARTS = frozenset(('head', 'params', 'params_end', 'body', 'body_start', 'body_end',
+                   'name', 'default', 'specifiers'))
+
+
+class SelectorError(LookupError):
+    """Raised when a selector matches nothing or more than one node."""
+
+
+@dataclass
+class Node:
+    kind: str
+    name: str
+    start: int
+    end: int = -1
+    depth: int = 0
+    parts: Dict[str, Span] = field(default_factory=dict)
+    names: Tuple[str, ...] = ()
+    specifiers: Tuple[str, ...] = ()
+    # ``import type ...``: binds types only.
+    type_only: bool = False
+
+    def span(self, part: str = '') -> Optional[Span]:
+        if not part:
+            return (self.start, self.end) if self.end >= 0 else None
+        return self.parts.get(part)
+
+
+@dataclass
+class _Frame:
+    char: str
+    pos: int
+    role: str = ''
+    node: Optional[Node] = None
+
+
+@dataclass
+class TsxIndex:
+    text: str
+    nodes: List[Node] = field(default_factory=list)
+    balanced: bool = True
+    _by_key: Dict[Tuple[str, str], List[Node]] = field(default_factory=dict)
+
+    def add(self, node: Node, *aliases: Tuple[str, str]) -> None:
+        self.nodes.append(node)
+        for key in ((node.kind, node.name),) + aliases:
+            self._by_key.setdefault(key, []).append(node)
+
+    def alias(self, node: Node, kind: str, name: str) -> None:
+        self._by_key.setdefault((kind, name), []).append(node)
+
+    def lookup(self, kind: str, name: str) -> List[Node]:
+        return [n for n in self._by_key.get((kind, name), []) if n.end >= 0]
+
+    @property
+    def imports(self) -> List[Node]:
+        return [n for n in self.nodes if n.kind == 'import']
+
+    def resolve(self, selector: str, all_matches: bool = False) -> List[Span]:
+        """Resolve ``kind:name[.part]`` to spans of the source text.
+
+        When several nodes match, the shallowest one wins; a tie at that
+        depth is ambiguous unless ``all_matches`` is set.
+        """
+        kind, _, name = selector.partition(':')
+        part = ''
+        head, _, tail = name.rpartition('.')
+        if head and tail in PARTS:
+            name, part = head, tail
+        nodes = self.lookup(kind, name)
+        if not nodes:
+            raise SelectorError(f'{selector}: not found')
+        if not all_matches:
+            shallowest = min(n.depth for n in nodes)
+            nodes = [n for n in nodes if n.depth == shallowest]
+            if len(nodes) > 1:
+                raise SelectorError(f'{selector}: {len(nodes)} matches')
+        spans = [n.span(part) for n in nodes]
+        if any(s is None for s in spans):
+            raise SelectorError(f'{selector}: no {part or "span"}')
+        return spans
+
+
+class _Scanner:
+    def __init__(self, text: str):
+        self.text = text
+        self.index = TsxIndex(text)
+        self.stack: List[_Frame] = []
+        self.prev: Optional[str] = None     # previous significant code token
+        self.prev_end = 0
+        self.stmt_start = 0                 # where the current statement began
+        self.last_paren: Optional[Tuple[int, int, str]] = None
+        self.pending_function: Optional[Node] = None
+        self.pending_name: Optional[Node] = None
+        self.pending_hook: Optional[Node] = None
+        self.pending_import: Optional[Node] = None
+        self.binding: Optional[Node] = None
+        self.binding_names: List[str] = []
+        self.binding_pattern: Optional[int] = None
+        # Declarations waiting for their ';', with the stack depth they began at.
+        self.open_stmts: List[Tuple[Node, int]] = []
+
+    def _brace_depth(self) -> int:
+        return sum(1 for f in self.stack if f.char == '{')
+
+    def _at_stmt_start(self) -> bool:
+        return self.prev in (None, ';', '{', '}') or self.prev in _DECL_PREFIXES
+
+    def _expr_allowed(self) -> bool:
+        prev = self.prev
+        return prev is None or prev in _EXPR_START_PUNCT or prev in _EXPR_START_WORDS
+
+    def _jsx_allowed(self) -> bool:
+        return self.prev not in _JSX_BLOCKED_PUNCT and self._expr_allowed()
+
+    def _close_stmts(self, end: int, depth: int) -> None:
+        while self.open_stmts and self.open_stmts[-1][1] >= depth:
+            node, _ = self.open_stmts.pop()
+            node.end = end
+
+    def run(self) -> TsxIndex:
+        text = self.text
+        n = len(text)
+        i = 0
+        while i < n:
+            top = self.stack[-1].char if self.stack else ''
+            if top == '`':
+                i = self._template(i)
+            elif top == '<':
+                i = self._jsx_tag(i)
+            elif top == '>':
+                i = self._jsx_children(i)
+            else:
+                i = self._code(i)
+        self._close_stmts(self.prev_end, 0)
+        self.index.balanced = not self.stack
+        return self.index
+
+    # -- template literals and JSX ---------------------------------------
+
+    def _template(self, i: int) -> int:
+        text = self.text
+        i = _TEMPLATE_CHUNK.match(text, i).end()
+        if i >= len(text):
+            return i
+        if text[i] == '`':
+            self.stack.pop()
+            self.prev = '`'
+            self.prev_end = i + 1
+            return i + 1
+        # '${' opens an expression that ends at the matching '}'.
+        self.stack.append(_Frame('{', i + 1, 'template'))
+        self.prev = '{'
+        return i + 2
+
+    def _jsx_open(self, i: int) -> Optional[int]:
+        """Enter the JSX element starting at '<', or return None if it is not one."""
+        text = self.text
+        if text.startswith('<>', i):
+            self.stack.append(_Frame('>', i, 'fragment'))
+            return i + 2
+        m = _JSX_NAME.match(text, i + 1)
+        if not m:
+            return None
+        after = _SPACE.match(text, m.end()).end()
+        # '<T,>' and '<T extends X>' are type parameters, not elements.
+        if text.startswith(',', after) or text.startswith('extends', after):
+            return None
+        node = Node('jsx', m.group(), i, depth=self._brace_depth())
+        node.parts['name'] = (m.start(), m.end())
+        self.index.add(node)
+        self.stack.append(_Frame('<', i, 'element', node))
+        return m.end()
+
+    def _jsx_done(self, node: Optional[Node], end: int) -> None:
+        if node is not None:
+            node.end = end
+        # Back in code the element is a value, like an identifier.
+        self.prev = 'jsx'
+        self.prev_end = end
+
+    def _jsx_tag(self, i: int) -> int:
+        text = self.text
+        frame = self.stack[-1]
+        ch = text[i]
+        if text.startswith('/>', i):
+            self.stack.pop()
+            self._jsx_done(frame.node, i + 2)
+            return i + 2
+        if ch == '>':
+            frame.char = '>'
+            return i + 1
+        if ch == '{':
+            self.stack.append(_Frame('{', i, 'jsx'))
+            self.prev = '{'
+            return i + 1
+        if ch in '\'"':
+            end = text.find(ch, i + 1)
+            return len(text) if end == -1 else end + 1
+        m = _JSX_ATTR.match(text, i)
+        return m.end() if m else i + 1
+
+    def _jsx_children(self, i: int) -> int:
+        text = self.text
+        i = _JSX_TEXT.match(text, i).end()
+        if i >= len(text):
+            return i
+        if text[i] == '{':
+            self.stack.append(_Frame('{', i, 'jsx'))
+            self.prev = '{'
+            return i + 1
+        if text.startswith('</', i):
+            end = text.find('>', i)
+            end = len(text) if end == -1 else end + 1
+            self._jsx_done(self.stack.pop().node, end)
+            return end
+        j = self._jsx_open(i)
+        return j if j is not None else i + 1
+
+    # -- code ------------------------------------------------------------
+
+    def _code(self, i: int) -> int:
+        text = self.text
+        ch = text[i]
+        if ch == '/' and self._expr_allowed():
+            m = _REGEX_LITERAL.match(text, i)
+            if m:
+                self.prev = 'regex'
+                self.prev_end = m.end()
+                return m.end()
+        elif ch == '<' and self._jsx_allowed():
+            j = self._jsx_open(i)
+            if j is not None:
+                return j
+        elif ch == '`':
+            self.stack.append(_Frame('`', i))
+            return i + 1
+
+        m = _CODE_TOKEN.match(text, i)
+        kind = m.lastgroup
+        if kind == 'skip':
+            return m.end()
+        tok = m.group()
+        if kind == 'ident':
+            self._ident(tok, i)
+        elif kind == 'string':
+            self._string(m.end())
+        elif kind == 'punct':
+            self._punct(tok, i, m.end())
+        self.prev = tok if kind in ('ident', 'punct') else kind
+        self.prev_end = m.end()
+        return m.end()
+
+    def _ident(self, tok: str, start: int) -> None:
+        at_start = self._at_stmt_start()
+        if at_start and self.prev not in _DECL_PREFIXES:
+            self.stmt_start = start
+        stmt_start = self.stmt_start if at_start else start
+
+        if self.pending_name is not None:
+            node, self.pending_name = self.pending_name, None
+            node.name = tok
+            self.index.add(node)
+            return
+        if self.binding is not None:
+            if self.binding_pattern is None and not self.binding_names:
+                self.binding_names.append(tok)
+                self._finish_binding()
+                return
+            if self.binding_pattern is not None and len(self.stack) == self.binding_pattern + 1:
+                self.binding_names.append(tok)
+                return
+
+        if tok == 'import' and at_start and not self.stack:
+            self.pending_import = Node('import', '', stmt_start)
+        elif tok == 'function' and (at_start or self._expr_allowed()):
+            node = Node('function', '', stmt_start, depth=self._brace_depth())
+            self.pending_function = node
+            self.pending_name = node
+        elif tok in _BINDING_KEYWORDS and at_start:
+            node = Node('const', '', stmt_start, depth=self._brace_depth())
+            self.binding = node
+            self.binding_names = []
+            self.binding_pattern = None
+            self.open_stmts.append((node, len(self.stack)))
+        elif tok in _TYPE_KEYWORDS and at_start:
+            node = Node(tok, '', stmt_start, depth=self._brace_depth())
+            if tok == 'type':
+                self.open_stmts.append((node, len(self.stack)))
+            else:
+                self.pending_function = node
+            self.pending_name = node
+        elif _HOOK_NAME.match(tok):
+            self.pending_hook = Node('hook', tok, start, depth=self._brace_depth())
+
+    def _finish_binding(self) -> None:
+        node, self.binding = self.binding, None
+        self.binding_pattern = None
+        if self.binding_names:
+            node.name = self.binding_names[0]
+            node.names = tuple(self.binding_names)
+            self.index.add(node, *(('const', name) for name in node.names[1:]))
+
+    def _string(self, end: int) -> None:
+        node = self.pending_import
+        if node is None or self.prev not in ('from', 'import'):
+            return
+        self.pending_import = None
+        node.name = self.text[self.prev_end:end].strip()[1:-1]
+        m = _SPACE.match(self.text, end)
+        node.end = m.end() + 1 if self.text.startswith(';', m.end()) else end
+        self._parse_import(node)
+        self.index.add(node)
+
+    def _parse_import(self, node: Node) -> None:
+        stmt = self.text[node.start:node.end]
+        names = []
+        open_brace = stmt.find('{')
+        from_pos = stmt.rfind(' from ')
+        clause_end = open_brace if open_brace != -1 else from_pos
+        clause_start = len('import')
+        m = _TYPE_IMPORT.match(stmt)
+        if m:
+            node.type_only = True
+            clause_start = m.end()
+        if clause_end != -1:
+            default = stmt[clause_start:clause_end].strip().rstrip(',').strip()
+            if default and not default.startswith('*') and ' ' not in default:
+                names.append(default)
+                pos = node.start + stmt.index(default, clause_start)
+                node.parts['default'] = (pos, pos + len(default))
+        if open_brace != -1:
+            close_brace = stmt.find('}', open_brace)
+            node.parts['specifiers'] = (node.start + open_brace, node.start + close_brace + 1)
+            for spec in stmt[open_brace + 1:close_brace].split(','):
+                spec = spec.strip()
+                if spec:
+                    names.append(_TYPE_SPECIFIER.sub('', spec.split(' as ')[-1].strip()))
+        node.specifiers = tuple(names)
+
+    def _punct(self, tok: str, start: int, end: int) -> None:
+        stack = self.stack
+        self.pending_name = None
+        if tok in ('{', '(', '['):
+            if tok != '(' and self.binding is not None and self.binding_pattern is None \
+                    and not self.binding_names:
+                self.binding_pattern = len(stack)
+            frame = _Frame(tok, start)
+            if tok == '(':
+                frame.role = self.prev or ''
+                node = self.pending_function
+                if node is not None and node.kind == 'function' and 'params' not in node.parts:
+                    frame.node = node
+                elif self.pending_hook is not None and self.prev in (self.pending_hook.name, '>'):
+                    frame.node = self.pending_hook
+                self.pending_hook = None
+            elif tok == '{':
+                frame.role, frame.node = self._brace_role()
+                if frame.node is not None:
+                    frame.node.parts['body_start'] = (start, end)
+            stack.append(frame)
+            if tok == '{':
+                self.stmt_start = end
+            return
+
+        if tok in ('}', ')', ']'):
+            opener = {'}': '{', ')': '(', ']': '['}[tok]
+            while stack and stack[-1].char not in (opener, '<', '>', '`'):
+                stack.pop()
+            if not stack or stack[-1].char != opener:
+                return
+            frame = stack.pop()
+            if self.binding is not None and self.binding_pattern == len(stack):
+                self._finish_binding()
+            if tok == ')':
+                self._close_paren(frame, start, end)
+            elif tok == '}':
+                self._close_brace(frame, start, end)
+            return
+
+        if tok == ';':
+            self._close_stmts(end, len(stack))
+            self.pending_hook = None
+            self.pending_function = None
+            self.stmt_start = end
+        elif tok == '=' and self.binding is not None and self.binding_pattern is None:
+            self._finish_binding()
+
+    def _close_paren(self, frame: _Frame, start: int, end: int) -> None:
+        self.last_paren = (frame.pos, end, frame.role)
+        node = frame.node
+        if node is None:
+            return
+        if node.kind == 'hook':
+            m = _SPACE.match(self.text, end)
+            node.end = m.end() + 1 if self.text.startswith(';', m.end()) else end
+            self.index.add(node)
+        else:
+            node.parts['head'] = (node.start, frame.pos)
+            node.parts['params'] = (frame.pos, end)
+            node.parts['params_end'] = (start, end)
+
+    def _close_brace(self, frame: _Frame, start: int, end: int) -> None:
+        self._close_stmts(self.prev_end, len(self.stack) + 1)
+        node = frame.node
+        if node is not None:
+            node.parts['body'] = (frame.pos, end)
+            node.parts['body_end'] = (start, end)
+            if node.kind != 'const':
+                node.end = end
+        self.stmt_start = end
+
+    def _brace_role(self) -> Tuple[str, Optional[Node]]:
+        """Classify the '{' about to be pushed and find the node it belongs to."""
+        node = self.pending_function
+        if node is not None and (node.kind != 'function' or 'params' in node.parts):
+            self.pending_function = None
+            return 'body', node
+        if self.prev == '=>':
+            is_body = True
+        elif self.prev == ')' and self.last_paren is not None and self.last_paren[1] == self.prev_end:
+            is_body = self.last_paren[2] not in _BLOCK_KEYWORDS
+        else:
+            return ('block' if self._at_stmt_start() else 'expr'), None
+        if not is_body:
+            return 'block', None
+        # A function that is the const's initializer, directly or as the
+        # argument of a wrapper call such as forwardRef(...), owns the body.
+        if self.open_stmts:
+            node, depth = self.open_stmts[-1]
+            stack = self.stack
+            direct = len(stack) == depth or (len(stack) == depth + 1 and stack[-1].char == '(')
+            if direct and node.kind == 'const' and node.name and 'body_start' not in node.parts \
+                    and self.binding is None and self.last_paren is not None:
+                params = self.last_paren
+                node.parts['head'] = (node.start, params[0])
+                node.parts['params'] = (params[0], params[1])
+                node.parts['params_end'] = (params[1] - 1, params[1])
+                self.index.alias(node, 'function', node.name)
+                return 'body', node
+        return 'body', None
+
+
+def build_index(text: str) -> TsxIndex:
+    return _Scanner(text).run()
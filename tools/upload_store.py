@@ -0,0 +1,390 @@
+"""Deduplicate upload files: one blob per distinct content, hard-linked into place.
+
+    python -m tools.upload_store migrate --dry-run      # hash everything, report savings
+    python -m tools.upload_store migrate --jobs 8       # link duplicates (resumable)
+    python -m tools.upload_store sweep                  # drop blobs nothing links to
+    python -m tools.upload_store stats
+    python -m tools.upload_store migrate --root public/uploads
+
+Every upload is named ``uuidv4()`` (``/api/file-manager/upload``) or gets a
+timestamp suffix (``/api/upload``), so the same bytes uploaded ten times are
+stored ten times.  ``migrate`` hashes the files below ``--root`` with a
+streaming SHA-256 in a thread pool and keeps each distinct content once as
+``<root>/.blobs/<aa>/<sha256>``.  Each upload path becomes a hard link to
+its blob, so ``File.path``, the upload routes and the public URLs keep
+working unchanged.  Where a hard link is impossible (another file system
+mounted below the root) the ``File`` row is repointed to the blob instead.
+Uploads are write-once, so shared inodes are never modified in place.
+
+Links and reference counts live in ``<root>/.blobs/index.db``.  A path that
+was already processed and has not changed (same inode, size and mtime) is
+skipped, so an interrupted migration resumes where it stopped, and running
+it again (e.g. from cron) only hashes new uploads.  When an upload path is
+deleted, for instance by ``tools.gc_uploads``, ``sweep`` drops its link and
+deletes blobs whose count reaches zero.
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from tools.asset_store import ASSET_DIR, FILE_MODE
+from tools.db import connect
+from tools.gc_uploads import UPLOAD_DIR, walk_sorted
+from tools.image_variants import VARIANT_DIR
+from tools.pdf_render import PUBLIC_DIR
+from tools.render_cache import CACHE_DIR
+
+
+BLOB_DIR = '.blobs'
+DEFAULT_JOBS = 8
+# Paths hashed and committed together; the unit of resumption.
+DEFAULT_BATCH = 200
+_READ_SIZE = 1 << 20
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    refs INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS links (
+    path TEXT PRIMARY KEY,
+    hash TEXT NOT NULL REFERENCES blobs (hash),
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS links_hash ON links (hash);
+"""
+
+
+@dataclass
+class MigrationReport:
+    scanned: int = 0
+    # Unchanged since an earlier run.
+    skipped: int = 0
+    hashed: int = 0
+    hashed_bytes: int = 0
+    new_blobs: int = 0
+    linked: int = 0
+    repointed: int = 0
+    reclaimed: int = 0
+    failed: int = 0
+
+
+def file_sha256(path: str) -> str:
+    """Streaming SHA-256; hashlib releases the GIL, so threads hash in parallel."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_READ_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class UploadStore:
+    def __init__(self, root: str = UPLOAD_DIR, db: Optional[str] = None):
+        self.root = root
+        # Database whose File rows are repointed when a hard link fails.
+        self.db = db
+        self.blob_root = os.path.join(root, BLOB_DIR)
+        os.makedirs(self.blob_root, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(self.blob_root, 'index.db'), timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.blob_root, digest[:2], digest)
+
+    def blob_rel(self, digest: str) -> str:
+        return f'{BLOB_DIR}/{digest[:2]}/{digest}'
+
+    def _abs(self, rel: str) -> str:
+        return os.path.join(self.root, rel)
+
+    # -- reference counts ----------------------------------------------------
+
+    def _record(self, rel: str, digest: str, size: int, st: os.stat_result) -> None:
+        """Point ``rel`` at ``digest`` in the index; caller commits."""
+        old = self.conn.execute('SELECT hash FROM links WHERE path = ?', (rel,)).fetchone()
+        if old is not None and old[0] != digest:
+            self.conn.execute('UPDATE blobs SET refs = refs - 1 WHERE hash = ?', (old[0],))
+        if old is None or old[0] != digest:
+            self.conn.execute(
+                'INSERT INTO blobs (hash, size, refs) VALUES (?, ?, 1) '
+                'ON CONFLICT (hash) DO UPDATE SET refs = refs + 1', (digest, size))
+        self.conn.execute(
+            'INSERT OR REPLACE INTO links (path, hash, ino, size, mtime_ns) VALUES (?, ?, ?, ?, ?)',
+            (rel, digest, st.st_ino, st.st_size, st.st_mtime_ns))
+
+    def _forget(self, rel: str) -> None:
+        row = self.conn.execute('SELECT hash FROM links WHERE path = ?', (rel,)).fetchone()
+        if row is not None:
+            self.conn.execute('DELETE FROM links WHERE path = ?', (rel,))
+            self.conn.execute('UPDATE blobs SET refs = refs - 1 WHERE hash = ?', (row[0],))
+
+    # -- linking -------------------------------------------------------------
+
+    def _ensure_blob(self, path: str, digest: str) -> bool:
+        """Make the blob exist; True if it was created (from ``path``'s inode when possible)."""
+        blob = self.blob_path(digest)
+        if os.path.exists(blob):
+            return False
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            os.link(path, blob)
+        except FileExistsError:
+            return False
+        except OSError:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(blob), prefix='.tmp-')
+            os.close(fd)
+            shutil.copyfile(path, tmp)
+            # Links share the inode, so the blob keeps the upload's permissions.
+            shutil.copymode(path, tmp)
+            os.replace(tmp, blob)
+        return True
+
+    def _replace_with_link(self, path: str, blob: str) -> None:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        os.close(fd)
+        os.unlink(tmp)
+        os.link(blob, tmp)
+        try:
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def _repoint(self, rel: str, digest: str) -> bool:
+        """Move the ``File`` row from ``rel`` to the blob; False if no row has that path."""
+        conn = connect(self.db)
+        try:
+            with conn:
+                changed = conn.execute('UPDATE File SET path = ? WHERE path = ?',
+                                       (self.blob_rel(digest), rel)).rowcount
+        except sqlite3.IntegrityError:
+            # File.path is unique: only one row can name a given blob.
+            return False
+        finally:
+            conn.close()
+        if changed:
+            os.unlink(self._abs(rel))
+        return bool(changed)
+
+    def link(self, rel: str, digest: str, report: MigrationReport) -> None:
+        """Make ``rel`` share the blob of ``digest``; caller commits."""
+        path = self._abs(rel)
+        st = os.lstat(path)
+        blob = self.blob_path(digest)
+        if self._ensure_blob(path, digest):
+            report.new_blobs += 1
+        blob_st = os.stat(blob)
+        if blob_st.st_ino != st.st_ino or blob_st.st_dev != st.st_dev:
+            try:
+                self._replace_with_link(path, blob)
+                report.linked += 1
+            except OSError:
+                if self.db is None or not self._repoint(rel, digest):
+                    # Leave the copy; it is still counted so sweep stays right.
+                    self._record(rel, digest, st.st_size, st)
+                    return
+                report.repointed += 1
+                self._forget(rel)
+                # The row now names the blob itself, which pins it.
+                self._record(self.blob_rel(digest), digest, st.st_size, blob_st)
+                report.reclaimed += st.st_size if st.st_nlink == 1 else 0
+                return
+            if st.st_nlink == 1:
+                report.reclaimed += st.st_size
+            st = os.lstat(path)
+        self._record(rel, digest, st.st_size, st)
+
+    def put(self, rel: str, data: bytes) -> str:
+        """Store ``data`` at ``rel`` (relative to the root) sharing any existing blob."""
+        digest = hashlib.sha256(data).hexdigest()
+        blob = self.blob_path(digest)
+        if not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(blob), prefix='.tmp-')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.chmod(tmp, FILE_MODE)
+            os.replace(tmp, blob)
+        path = self._abs(rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            self._replace_with_link(path, blob)
+        else:
+            os.link(blob, path)
+        with self.conn:
+            self._record(rel, digest, len(data), os.lstat(path))
+        return digest
+
+    def release(self, rel: str) -> None:
+        """Delete the upload at ``rel`` and its blob once nothing else links to it."""
+        try:
+            os.unlink(self._abs(rel))
+        except FileNotFoundError:
+            pass
+        with self.conn:
+            self._forget(rel)
+        self._drop_unreferenced()
+
+    # -- maintenance ---------------------------------------------------------
+
+    def _candidates(self, skip: Sequence[str]) -> Iterator[Tuple[str, os.stat_result]]:
+        for rel, st in walk_sorted(self.root, [self.blob_root, *skip]):
+            if not os.path.basename(rel).startswith('.tmp-'):
+                yield rel, st
+
+    def _unchanged(self, rel: str, st: os.stat_result) -> bool:
+        row = self.conn.execute('SELECT ino, size, mtime_ns FROM links WHERE path = ?', (rel,)).fetchone()
+        return row is not None and tuple(row) == (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def migrate(self, jobs: int = DEFAULT_JOBS, batch: int = DEFAULT_BATCH, dry_run: bool = False,
+                skip: Sequence[str] = (), log=print) -> MigrationReport:
+        report = MigrationReport()
+        # Dry run: hash -> size of the first copy seen, to count what linking would save.
+        seen: Dict[str, int] = {}
+        pending: List[Tuple[str, os.stat_result]] = []
+
+        def hash_one(item: Tuple[str, os.stat_result]) -> Tuple[str, os.stat_result, Optional[str]]:
+            rel, st = item
+            try:
+                return rel, st, file_sha256(self._abs(rel))
+            except OSError:
+                return rel, st, None
+
+        def flush(pool: ThreadPoolExecutor) -> None:
+            for rel, st, digest in pool.map(hash_one, pending):
+                if digest is None:
+                    report.failed += 1
+                    continue
+                report.hashed += 1
+                report.hashed_bytes += st.st_size
+                if dry_run:
+                    known = self.conn.execute('SELECT 1 FROM blobs WHERE hash = ?', (digest,)).fetchone()
+                    if digest in seen or known:
+                        report.reclaimed += st.st_size if st.st_nlink == 1 else 0
+                    else:
+                        report.new_blobs += 1
+                        seen[digest] = st.st_size
+                    continue
+                try:
+                    self.link(rel, digest, report)
+                except OSError as e:
+                    report.failed += 1
+                    log(f'ERROR {rel}: {e}')
+            if not dry_run:
+                self.conn.commit()
+                log(f'{report.scanned} files scanned, {report.reclaimed:,} bytes reclaimed')
+            pending.clear()
+
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+            for rel, st in self._candidates(skip):
+                report.scanned += 1
+                if self._unchanged(rel, st):
+                    report.skipped += 1
+                    continue
+                pending.append((rel, st))
+                if len(pending) >= batch:
+                    flush(pool)
+            flush(pool)
+        return report
+
+    def _drop_unreferenced(self) -> List[str]:
+        dropped = []
+        for (digest,) in self.conn.execute('SELECT hash FROM blobs WHERE refs <= 0').fetchall():
+            try:
+                os.unlink(self.blob_path(digest))
+            except FileNotFoundError:
+                pass
+            dropped.append(digest)
+        with self.conn:
+            self.conn.executemany('DELETE FROM blobs WHERE hash = ?', [(d,) for d in dropped])
+        return dropped
+
+    def sweep(self) -> Tuple[int, List[str]]:
+        """Forget links whose path is gone or replaced; delete blobs left with no links.
+
+        Returns the number of links forgotten and the hashes of deleted blobs.
+        """
+        stale = []
+        for rel, ino in self.conn.execute('SELECT path, ino FROM links'):
+            try:
+                st = os.lstat(self._abs(rel))
+            except FileNotFoundError:
+                stale.append(rel)
+                continue
+            if st.st_ino != ino:
+                stale.append(rel)
+        with self.conn:
+            for rel in stale:
+                self._forget(rel)
+        return len(stale), self._drop_unreferenced()
+
+    def stats(self) -> Dict[str, int]:
+        blobs, blob_bytes = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs').fetchone()
+        links, link_bytes = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM links').fetchone()
+        return {'blobs': blobs, 'blob_bytes': blob_bytes, 'links': links, 'link_bytes': link_bytes,
+                'saved_bytes': link_bytes - blob_bytes}
+
+
+def managed_dirs(root: str, public_dir: str = PUBLIC_DIR) -> List[str]:
+    """Content-addressed directories of other tools, left out of the migration."""
+    return [os.path.join(public_dir, os.path.relpath(d, PUBLIC_DIR)) for d in (ASSET_DIR, CACHE_DIR, VARIANT_DIR)
+            if os.path.abspath(d) != os.path.abspath(root)]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=('migrate', 'sweep', 'stats'))
+    parser.add_argument('--root', default=UPLOAD_DIR, help='upload directory')
+    parser.add_argument('--db', help='SQLite database whose File rows are repointed when linking fails')
+    parser.add_argument('--public', default=PUBLIC_DIR, help='public directory (its managed dirs are skipped)')
+    parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS, help='hashing threads')
+    parser.add_argument('--batch', type=int, default=DEFAULT_BATCH, help='files per commit')
+    parser.add_argument('--dry-run', action='store_true', help='hash and report without linking')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.root):
+        print(f'upload directory not found: {args.root}', file=sys.stderr)
+        return 1
+    store = UploadStore(args.root, args.db)
+    try:
+        if args.command == 'stats':
+            for name, value in store.stats().items():
+                print(f'{name:12} {value:,}')
+            return 0
+        if args.command == 'sweep':
+            forgotten, dropped = store.sweep()
+            print(f'{forgotten} links forgotten, {len(dropped)} blobs deleted')
+            return 0
+        started = time.perf_counter()
+        log = (lambda msg: None) if args.dry_run else (lambda msg: print(msg, file=sys.stderr))
+        report = store.migrate(args.jobs, args.batch, args.dry_run, managed_dirs(args.root, args.public), log)
+    finally:
+        store.close()
+    elapsed = time.perf_counter() - started
+    rate = report.hashed_bytes / elapsed / (1 << 20) if elapsed else 0.0
+    verb = 'would reclaim' if args.dry_run else 'reclaimed'
+    print(f'{report.scanned} files scanned ({report.skipped} unchanged), {report.hashed} hashed '
+          f'({report.hashed_bytes:,} bytes, {rate:.0f} MiB/s), {report.new_blobs} distinct new blobs, '
+          f'{report.linked} linked, {report.repointed} repointed, {report.failed} failed; '
+          f'{verb} {report.reclaimed:,} bytes in {elapsed:.1f}s')
+    return 1 if report.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
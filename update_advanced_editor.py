@@ -1,378 +1,17 @@
 import os
+import sys
 
-file_path = r'c:\Users\zaher\Downloads\adminsite\src\components\canvas-editor\AdvancedCanvasEditor.tsx'
+from tools.patch_engine import patch_file
+from tools.patch_sets import ADVANCED_EDITOR
 
-with open(file_path, 'r', encoding='utf-8') as f:
-    content = f.read()
+file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src', 'components', 'canvas-editor', 'AdvancedCanvasEditor.tsx')
+if len(sys.argv) > 1:
+    file_path = sys.argv[1]
 
-# 1. Add imports
-if "import { jsPDF } from 'jspdf';" in content:
-    content = content.replace(
-        "import { jsPDF } from 'jspdf';",
-        "import { jsPDF } from 'jspdf';\nimport { useImperativeHandle, forwardRef } from 'react';"
-    )
-else:
-    # Fallback if import not found exactly as expected
-    content = "import { useImperativeHandle, forwardRef } from 'react';\n" + content
+# To patch every app tree at once use: python -m tools.patch_batch <patch-set>
 
-# 2. Add interface
-if "export interface AdvancedCanvasEditorRef {" not in content:
-    content = content.replace(
-        "interface AdvancedCanvasEditorProps {",
-        "export interface AdvancedCanvasEditorRef {\n  getPDFBlob: () => Promise<Blob>;\n}\n\ninterface AdvancedCanvasEditorProps {"
-    )
+result = patch_file(file_path, ADVANCED_EDITOR)
+for name in result.missing:
+    print(f"Anchor not found: {name}")
 
-# 3. Wrap component
-if "export default function AdvancedCanvasEditor({" in content:
-    content = content.replace(
-        "export default function AdvancedCanvasEditor({",
-        "const AdvancedCanvasEditor = forwardRef<AdvancedCanvasEditorRef, AdvancedCanvasEditorProps>(({"
-    )
-    
-    # Find the end of props destructuring to add ref
-    # This is tricky with regex, let's assume standard formatting
-    # We need to find where the props end.
-    # It usually looks like:
-    # ...
-    # onCancel: () => void;
-    # }
-    # 
-    # export default function AdvancedCanvasEditor({
-    #   initialData = [],
-    #   ...
-    #   onCancel
-    # }: AdvancedCanvasEditorProps) {
-    
-    # Actually, the previous replacement changed the start.
-    # Now we need to find where the function body starts to add `ref` and `useImperativeHandle`.
-    
-    # Let's look for the closing parenthesis of the props object
-    # It might be `}: AdvancedCanvasEditorProps) {`
-    
-    # Wait, the original code was:
-    # export default function AdvancedCanvasEditor({
-    #   initialData = [],
-    #   background: initialBackground = '',
-    #   blurAmount: initialBlurAmount = 0,
-    #   onSave,
-    #   onCancel
-    # }: AdvancedCanvasEditorProps) {
-    
-    # My replacement made it:
-    # const AdvancedCanvasEditor = forwardRef<AdvancedCanvasEditorRef, AdvancedCanvasEditorProps>(({
-    #   initialData = [],
-    #   ...
-    # }: AdvancedCanvasEditorProps) {
-    
-    # I need to change `}: AdvancedCanvasEditorProps) {` to `}: AdvancedCanvasEditorProps, ref) => {`
-    content = content.replace(
-        "}: AdvancedCanvasEditorProps) {",
-        "}: AdvancedCanvasEditorProps, ref) => {"
-    )
-
-# 4. Add useImperativeHandle
-# We need to insert it at the beginning of the function body.
-# We can look for the first hook usage or just insert after the opening brace.
-# But we just changed the opening brace line.
-# Let's insert it after `const [elements, setElements] = useState<CanvasElement[]>(initialData);`
-# or similar.
-
-# Let's find a good anchor.
-anchor = "const [elements, setElements] = useState<CanvasElement[]>(initialData);"
-if anchor in content:
-    # We need to duplicate the PDF generation logic.
-    # Since it's complex, I'll just call a shared function if I could, but I can't easily refactor.
-    # So I will copy the logic from handleExportToPDF, but modify it to return blob.
-    
-    # First, let's read handleExportToPDF content to copy it.
-    # I'll assume I can just copy the logic I saw in read_file.
-    
-    pdf_logic = """
-    useImperativeHandle(ref, () => ({
-      getPDFBlob: async () => {
-        return new Promise<Blob>(async (resolve, reject) => {
-          try {
-            const pdf = new jsPDF({
-              orientation: canvasWidth > canvasHeight ? 'landscape' : 'portrait',
-              unit: 'px',
-              format: [canvasWidth, canvasHeight]
-            });
-
-            const tempCanvas = document.createElement('canvas');
-            tempCanvas.width = canvasWidth;
-            tempCanvas.height = canvasHeight;
-            const ctx = tempCanvas.getContext('2d');
-
-            if (!ctx) throw new Error('Failed to get canvas context');
-
-            // Draw background
-            if (background) {
-              if (background.startsWith('#') || background.startsWith('rgb')) {
-                ctx.fillStyle = background;
-                ctx.fillRect(0, 0, canvasWidth, canvasHeight);
-              } else if (background.startsWith('data:') || background.startsWith('http')) {
-                const bgImg = new Image();
-                bgImg.crossOrigin = 'anonymous';
-                bgImg.src = background;
-                await new Promise((resolveImg) => {
-                  bgImg.onload = () => {
-                    ctx.drawImage(bgImg, 0, 0, canvasWidth, canvasHeight);
-                    resolveImg(true);
-                  };
-                  bgImg.onerror = () => {
-                    ctx.fillStyle = '#ffffff';
-                    ctx.fillRect(0, 0, canvasWidth, canvasHeight);
-                    resolveImg(false);
-                  };
-                });
-              }
-            } else {
-              ctx.fillStyle = '#ffffff';
-              ctx.fillRect(0, 0, canvasWidth, canvasHeight);
-            }
-
-            const sortedElements = [...elements].sort((a, b) => (a.zIndex || 0) - (b.zIndex || 0));
-            const allElements = sortedElements.filter(element => element.visible);
-
-            for (let i = 0; i < allElements.length; i++) {
-              const element = allElements[i];
-              const opacity = (element.opacity || 100) / 100;
-
-              if (element.type === 'text') {
-                if (!element.text) continue;
-                
-                if (element.backgroundColor && element.backgroundColor !== 'transparent') {
-                  const [r, g, b] = hexToRgb(element.backgroundColor);
-                  pdf.setFillColor(r, g, b);
-                  pdf.setGState(new (pdf as any).GState({ opacity }));
-                  pdf.rect(element.x, element.y, element.width, element.height, 'F');
-                }
-
-                if (element.borderColor && element.borderWidth) {
-                  const [r, g, b] = hexToRgb(element.borderColor);
-                  pdf.setDrawColor(r, g, b);
-                  pdf.setLineWidth(element.borderWidth);
-                  pdf.setGState(new (pdf as any).GState({ opacity }));
-                  pdf.rect(element.x, element.y, element.width, element.height, 'S');
-                }
-
-                const fontSize = element.fontSize || 16;
-                pdf.setFontSize(fontSize);
-                
-                const textColor = element.color || '#000000';
-                const [r, g, b] = hexToRgb(textColor);
-                pdf.setTextColor(r, g, b);
-                pdf.setGState(new (pdf as any).GState({ opacity }));
-                
-                let fontStyle = 'normal';
-                if (element.fontWeight === 'bold' && element.fontStyle === 'italic') {
-                  fontStyle = 'bolditalic';
-                } else if (element.fontWeight === 'bold') {
-                  fontStyle = 'bold';
-                } else if (element.fontStyle === 'italic') {
-                  fontStyle = 'italic';
-                }
-                pdf.setFont('helvetica', fontStyle);
-
-                let cleanText = element.text || '';
-                cleanText = cleanText
-                  .replace(/<\/div><div>/gi, '\\n')
-                  .replace(/<br\s*\/?>/gi, '\\n')
-                  .replace(/<div>/gi, '')
-                  .replace(/<\/div>/gi, '\\n')
-                  .replace(/<\/p>/gi, '\\n')
-                  .replace(/<p[^>]*>/gi, '')
-                  .replace(/<[^>]*>/g, '')
-                  .replace(/^\\n+/, '')
-                  .replace(/\\n+$/, '');
-                
-                const lines = cleanText.split('\\n');
-                const lineHeight = fontSize * 1.2;
-                const wrappedLines: string[] = [];
-                const maxWidth = element.width - 16;
-                
-                lines.forEach(line => {
-                  if (!line) {
-                    wrappedLines.push('');
-                    return;
-                  }
-                  const words = line.split(' ');
-                  let currentLine = '';
-                  words.forEach((word, index) => {
-                    const testLine = currentLine ? `${currentLine} ${word}` : word;
-                    const textWidth = pdf.getTextWidth(testLine);
-                    if (textWidth > maxWidth && currentLine) {
-                      wrappedLines.push(currentLine);
-                      currentLine = word;
-                    } else {
-                      currentLine = testLine;
-                    }
-                    if (index === words.length - 1) {
-                      wrappedLines.push(currentLine);
-                    }
-                  });
-                });
-                
-                wrappedLines.forEach((line, index) => {
-                  const y = element.y + fontSize + 8 + (index * lineHeight);
-                  let x = element.x + 8;
-                  if (element.textAlign === 'center') {
-                    x = element.x + element.width / 2;
-                    pdf.text(line, x, y, { align: 'center' });
-                  } else if (element.textAlign === 'right') {
-                    x = element.x + element.width - 8;
-                    pdf.text(line, x, y, { align: 'right' });
-                  } else {
-                    pdf.text(line, x, y);
-                  }
-                });
-                continue;
-              }
-
-              // Non-text elements
-              const tempCanvas = document.createElement('canvas');
-              tempCanvas.width = canvasWidth;
-              tempCanvas.height = canvasHeight;
-              const ctx = tempCanvas.getContext('2d');
-              if (!ctx) continue;
-
-              ctx.globalAlpha = opacity;
-
-              if (element.type === 'rectangle') {
-                if (element.backgroundColor) {
-                  ctx.fillStyle = element.backgroundColor;
-                  if (element.borderRadius) {
-                     // Simplified rect for blob generation to save space/complexity in this script
-                     // Ideally we duplicate the full logic, but for now let's trust simple fillRect/strokeRect
-                     // or copy the path logic if critical.
-                     // Let's copy the path logic for rounded rects as it was in the original file.
-                    const radius = element.borderRadius;
-                    ctx.beginPath();
-                    ctx.moveTo(element.x + radius, element.y);
-                    ctx.lineTo(element.x + element.width - radius, element.y);
-                    ctx.quadraticCurveTo(element.x + element.width, element.y, element.x + element.width, element.y + radius);
-                    ctx.lineTo(element.x + element.width, element.y + element.height - radius);
-                    ctx.quadraticCurveTo(element.x + element.width, element.y + element.height, element.x + element.width - radius, element.y + element.height);
-                    ctx.lineTo(element.x + radius, element.y + element.height);
-                    ctx.quadraticCurveTo(element.x, element.y + element.height, element.x, element.y + element.height - radius);
-                    ctx.lineTo(element.x, element.y + radius);
-                    ctx.quadraticCurveTo(element.x, element.y, element.x + radius, element.y);
-                    ctx.closePath();
-                    ctx.fill();
-                  } else {
-                    ctx.fillRect(element.x, element.y, element.width, element.height);
-                  }
-                }
-                if (element.borderColor && element.borderWidth) {
-                  ctx.strokeStyle = element.borderColor;
-                  ctx.lineWidth = element.borderWidth;
-                  if (element.borderRadius) {
-                     // Same path logic for stroke
-                    const radius = element.borderRadius;
-                    ctx.beginPath();
-                    ctx.moveTo(element.x + radius, element.y);
-                    ctx.lineTo(element.x + element.width - radius, element.y);
-                    ctx.quadraticCurveTo(element.x + element.width, element.y, element.x + element.width, element.y + radius);
-                    ctx.lineTo(element.x + element.width, element.y + element.height - radius);
-                    ctx.quadraticCurveTo(element.x + element.width, element.y + element.height, element.x + element.width - radius, element.y + element.height);
-                    ctx.lineTo(element.x + radius, element.y + element.height);
-                    ctx.quadraticCurveTo(element.x, element.y + element.height, element.x, element.y + element.height - radius);
-                    ctx.lineTo(element.x, element.y + radius);
-                    ctx.quadraticCurveTo(element.x, element.y, element.x + radius, element.y);
-                    ctx.closePath();
-                    ctx.stroke();
-                  } else {
-                    ctx.strokeRect(element.x, element.y, element.width, element.height);
-                  }
-                }
-              }
-              else if (element.type === 'circle') {
-                ctx.beginPath();
-                ctx.ellipse(element.x + element.width / 2, element.y + element.height / 2, element.width / 2, element.height / 2, 0, 0, 2 * Math.PI);
-                if (element.backgroundColor) { ctx.fillStyle = element.backgroundColor; ctx.fill(); }
-                if (element.borderColor && element.borderWidth) { ctx.strokeStyle = element.borderColor; ctx.lineWidth = element.borderWidth; ctx.stroke(); }
-              }
-              else if (element.type === 'triangle') {
-                ctx.beginPath();
-                ctx.moveTo(element.x + element.width / 2, element.y);
-                ctx.lineTo(element.x + element.width, element.y + element.height);
-                ctx.lineTo(element.x, element.y + element.height);
-                ctx.closePath();
-                if (element.backgroundColor) { ctx.fillStyle = element.backgroundColor; ctx.fill(); }
-                if (element.borderColor && element.borderWidth) { ctx.strokeStyle = element.borderColor; ctx.lineWidth = element.borderWidth; ctx.stroke(); }
-              }
-              // ... (skip other shapes for brevity in this script, or add them if needed)
-              // For now, let's assume basic shapes are enough or user uses images.
-              // Actually, let's include image logic as it's important.
-              else if (element.type === 'image' && element.image) {
-                const img = new Image();
-                img.crossOrigin = 'anonymous';
-                img.src = element.image;
-                await new Promise((resolveImg) => {
-                  img.onload = () => {
-                    ctx.drawImage(img, element.x, element.y, element.width, element.height);
-                    if (element.borderColor && element.borderWidth) {
-                      ctx.strokeStyle = element.borderColor;
-                      ctx.lineWidth = element.borderWidth;
-                      ctx.strokeRect(element.x, element.y, element.width, element.height);
-                    }
-                    resolveImg(true);
-                  };
-                  img.onerror = () => resolveImg(false);
-                });
-              }
-
-              ctx.globalAlpha = 1;
-              const elementCanvas = tempCanvas.toDataURL('image/png');
-              pdf.addImage(elementCanvas, 'PNG', 0, 0, canvasWidth, canvasHeight);
-            }
-
-            const blob = pdf.output('blob');
-            resolve(blob);
-          } catch (error) {
-            reject(error);
-          }
-        });
-      }
-    }));
-    """
-    
-    content = content.replace(anchor, anchor + "\n" + pdf_logic)
-
-# 5. Close the parenthesis for forwardRef
-# We need to find the end of the file or the component.
-# The component ends with `}`.
-# And we need to add `);` after it.
-# But `export default AdvancedCanvasEditor;` is at the end.
-# So we can replace `export default AdvancedCanvasEditor;` with `export default AdvancedCanvasEditor;` (no change needed there if we wrapped correctly).
-# Wait, I changed `export default function ...` to `const AdvancedCanvasEditor = ...`.
-# So I need to make sure I close the `forwardRef` call.
-# The function body ends with a `}`.
-# I need to find the last `}` of the function and append `);`.
-
-# This is hard to do reliably with simple string replacement on a large file without parsing.
-# However, since I know the structure:
-# ...
-#   return (
-#     ...
-#   );
-# }
-#
-# I can look for the last `}` before `export default`.
-# But wait, `export default` was part of the function declaration in the original file.
-# `export default function AdvancedCanvasEditor`
-# So there is no `export default AdvancedCanvasEditor;` at the end?
-# Let's check the file content again.
-# I read lines 1-50. It starts with `export default function AdvancedCanvasEditor`.
-# So there is NO `export default AdvancedCanvasEditor;` at the bottom.
-# So I need to add `export default AdvancedCanvasEditor;` at the end of the file, AND close the `forwardRef`.
-
-# Let's append `);` and `export default AdvancedCanvasEditor;` at the very end of the file, assuming the file ends with `}`.
-content = content.strip()
-if content.endswith("}"):
-    content = content[:-1] + "});\n\nexport default AdvancedCanvasEditor;"
-
-with open(file_path, 'w', encoding='utf-8') as f:
-    f.write(content)
-
-print("Successfully updated AdvancedCanvasEditor.tsx")
+print(f"AdvancedCanvasEditor.tsx: {result.status}")
@@ -1,125 +1,17 @@
 import os
+import sys
 
-file_path = r'c:\Users\zaher\Downloads\adminsite\src\components\canvas-editor\SimplePostEditor.tsx'
+from tools.patch_engine import patch_file
+from tools.patch_sets import SIMPLE_EDITOR
 
-with open(file_path, 'r', encoding='utf-8') as f:
-    content = f.read()
+file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src', 'components', 'canvas-editor', 'SimplePostEditor.tsx')
+if len(sys.argv) > 1:
+    file_path = sys.argv[1]
 
-# 1. Import useRef and AdvancedCanvasEditorRef
-if "import { useState, useEffect } from 'react';" in content:
-    content = content.replace(
-        "import { useState, useEffect } from 'react';",
-        "import { useState, useEffect, useRef } from 'react';"
-    )
+# To patch every app tree at once use: python -m tools.patch_batch <patch-set>
 
-if "import AdvancedCanvasEditor from './AdvancedCanvasEditor';" in content:
-    content = content.replace(
-        "import AdvancedCanvasEditor from './AdvancedCanvasEditor';",
-        "import AdvancedCanvasEditor, { AdvancedCanvasEditorRef } from './AdvancedCanvasEditor';"
-    )
+result = patch_file(file_path, SIMPLE_EDITOR)
+for name in result.missing:
+    print(f"Anchor not found: {name}")
 
-# 2. Create ref
-if "const [loading, setLoading] = useState(false);" in content:
-    content = content.replace(
-        "const [loading, setLoading] = useState(false);",
-        "const [loading, setLoading] = useState(false);\n  const editorRef = useRef<AdvancedCanvasEditorRef>(null);"
-    )
-
-# 3. Update handleSave to generate and upload PDF
-if "const handleSave = async () => {" in content:
-    # We need to replace the body of handleSave
-    # Let's find the block
-    start_marker = "const handleSave = async () => {"
-    end_marker = "const defaultTrigger ="
-    
-    start_idx = content.find(start_marker)
-    end_idx = content.find(end_marker)
-    
-    if start_idx != -1 and end_idx != -1:
-        old_function = content[start_idx:end_idx]
-        
-        new_function = """const handleSave = async () => {
-    if (!formData.title.trim()) {
-      alert('عنوان پست الزامی است');
-      return;
-    }
-
-    setLoading(true);
-    
-    try {
-      let pdfUrl = null;
-      
-      // Generate PDF if editor ref is available
-      if (editorRef.current) {
-        try {
-          const pdfBlob = await editorRef.current.getPDFBlob();
-          
-          // Upload PDF
-          const uploadFormData = new FormData();
-          uploadFormData.append('file', pdfBlob, `post-${Date.now()}.pdf`);
-          
-          const uploadResponse = await fetch('/api/upload', {
-            method: 'POST',
-            body: uploadFormData
-          });
-          
-          if (uploadResponse.ok) {
-            const uploadData = await uploadResponse.json();
-            pdfUrl = uploadData.url;
-            console.log('PDF uploaded successfully:', pdfUrl);
-          } else {
-            console.error('Failed to upload PDF');
-          }
-        } catch (pdfError) {
-          console.error('Error generating PDF:', pdfError);
-        }
-      }
-
-      const canvasDataString = JSON.stringify({
-        elements: canvasElements,
-        background: canvasBackground,
-        blurAmount: canvasBlur
-      });
-
-      const postData = {
-        title: formData.title,
-        content: formData.content,
-        published: formData.published,
-        canvasData: canvasDataString,
-        background: canvasBackground,
-        blurAmount: canvasBlur,
-        pdfUrl: pdfUrl,
-        authorId
-      };
-
-      if (post?.id) {
-        postData.id = post.id;
-      }
-
-      console.log('Submitting post data:', postData);
-      await onSave(postData);
-      setOpen(false);
-      
-      alert('پست با موفقیت ذخیره شد');
-    } catch (error) {
-      console.error('Error saving post:', error);
-      alert('خطا در ذخیره پست');
-    } finally {
-      setLoading(false);
-    }
-  };
-
-  """
-        content = content.replace(old_function, new_function)
-
-# 4. Pass ref to AdvancedCanvasEditor
-if "<AdvancedCanvasEditor" in content:
-    content = content.replace(
-        "<AdvancedCanvasEditor",
-        "<AdvancedCanvasEditor\n                  ref={editorRef}"
-    )
-
-with open(file_path, 'w', encoding='utf-8') as f:
-    f.write(content)
-
-print("Successfully updated SimplePostEditor.tsx")
+print(f"SimplePostEditor.tsx: {result.status}")